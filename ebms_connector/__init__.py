@@ -1,2 +1,9 @@
 from . import models
 from . import controllers
+from . import wizard
+from . import cli
+
+
+def post_init_hook(env):
+    """Compteurs du tableau de bord pour les pièces déjà présentes dans la base."""
+    env['ebms.status.counter']._rebuild()
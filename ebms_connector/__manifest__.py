@@ -1,6 +1,6 @@
 {
     'name': 'EBMS Connector',
-    'version': '1.0',
+    'version': '1.2',
     'category': 'Accounting',
     'summary': 'Connecteur EBMS pour l\'intégration des factures avec le système EBMS du Burundi',
     'description': """
@@ -37,19 +37,31 @@ Documentation complète et exemples d’utilisation dans le README du module.
 """,
     'author': 'EBMS Connector Team',
     'website': 'https://www.ebms-connector.com',
-    'depends': ['account'],
+    'depends': ['account', 'stock'],
     'data': [
         
         'security/ir.model.access.csv',
+        'data/ebms_cron.xml',
         'views/res_config_settings_views.xml',
         'views/invoice_view.xml',
+        'views/res_partner_views.xml',
         'views/stock_move_view.xml',
         'views/stock_picking_move_link.xml',
+        'views/ebms_backfill_views.xml',
+        'views/ebms_inventory_views.xml',
+        'views/ebms_queue_views.xml',
+        'views/ebms_dashboard_views.xml',
+        'views/ebms_latency_views.xml',
+        'views/ebms_error_triage_views.xml',
+        'views/ebms_tracing_views.xml',
+        'wizard/ebms_cancel_wizard_views.xml',
+        'wizard/ebms_audit_export_wizard_views.xml',
     ],
     # 'demo': [
     #     'data/demo_data.xml',
     # ],
     'assets': {},
+    'post_init_hook': 'post_init_hook',
     'installable': True,
     'auto_install': False,
     'application': True,
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+
+from . import ebms_generate
+from . import ebms_json_bench
+from . import ebms_gzip_bench
+from . import ebms_relay
@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+"""
+Commande `odoo-bin ebms_generate` : jeu de données EBMS volumineux pour benchmarks.
+
+    odoo-bin ebms_generate -c odoo.conf -d base --invoices 200000 --stock-moves 50000 --seed 42
+"""
+import logging
+import optparse
+
+import odoo
+from odoo.cli import Command
+
+from ..tools import ebms_dataset
+
+_logger = logging.getLogger(__name__)
+
+
+class EBMSGenerate(Command):
+    """Génère des factures, avoirs et mouvements de stock EBMS en masse"""
+    name = 'ebms_generate'
+
+    def run(self, cmdargs):
+        parser = odoo.tools.config.parser
+        parser.prog = 'odoo-bin ebms_generate'
+        group = optparse.OptionGroup(parser, 'Génération EBMS')
+        group.add_option('--invoices', dest='ebms_invoices', type='int', default=1000,
+                         help='Nombre de factures et avoirs à générer')
+        group.add_option('--stock-moves', dest='ebms_stock_moves', type='int', default=0,
+                         help='Nombre de mouvements de stock à générer')
+        group.add_option('--partners', dest='ebms_partners', type='int', default=100,
+                         help='Nombre de clients')
+        group.add_option('--products', dest='ebms_products', type='int', default=20,
+                         help='Nombre d\'articles')
+        group.add_option('--seed', dest='ebms_seed', type='int', default=42,
+                         help='Graine : mêmes paramètres et même graine, mêmes données')
+        group.add_option('--credit-note-ratio', dest='ebms_credit_note_ratio', type='float', default=0.1,
+                         help='Part d\'avoirs (FA)')
+        group.add_option('--cash-ratio', dest='ebms_cash_ratio', type='float', default=0.3,
+                         help='Part de factures au comptant (RC)')
+        group.add_option('--tin-ratio', dest='ebms_tin_ratio', type='float', default=0.6,
+                         help='Part de clients avec NIF')
+        group.add_option('--sent-ratio', dest='ebms_sent_ratio', type='float', default=0.0,
+                         help='Part de factures déjà envoyées à EBMS')
+        group.add_option('--date-from', dest='ebms_date_from', help='Première date de facture (AAAA-MM-JJ)')
+        group.add_option('--date-to', dest='ebms_date_to', help='Dernière date de facture (AAAA-MM-JJ)')
+        group.add_option('--chunk-size', dest='ebms_chunk_size', type='int', default=ebms_dataset.DEFAULT_CHUNK_SIZE,
+                         help='Taille des paquets d\'insertion (un commit par paquet)')
+        parser.add_option_group(group)
+        opt = odoo.tools.config.parse_config(cmdargs)
+        dbname = odoo.tools.config['db_name']
+        if not dbname or ',' in dbname:
+            parser.error('Indiquer une seule base avec -d.')
+
+        registry = odoo.registry(dbname)
+        with registry.cursor() as cr:
+            env = odoo.api.Environment(cr, odoo.SUPERUSER_ID, {})
+            result = ebms_dataset.generate(
+                env,
+                invoices=opt.ebms_invoices,
+                stock_moves=opt.ebms_stock_moves,
+                partners=opt.ebms_partners,
+                products=opt.ebms_products,
+                seed=opt.ebms_seed,
+                credit_note_ratio=opt.ebms_credit_note_ratio,
+                cash_ratio=opt.ebms_cash_ratio,
+                tin_ratio=opt.ebms_tin_ratio,
+                sent_ratio=opt.ebms_sent_ratio,
+                date_from=opt.ebms_date_from,
+                date_to=opt.ebms_date_to,
+                chunk_size=opt.ebms_chunk_size,
+                commit=True,
+            )
+        _logger.info('Génération EBMS : %s factures, %s mouvements de stock en %.1fs.',
+                     len(result['invoice_ids']), len(result['stock_move_ids']), result['seconds'])
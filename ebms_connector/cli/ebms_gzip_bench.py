@@ -0,0 +1,98 @@
+# -*- coding: utf-8 -*-
+"""
+Commande `odoo-bin ebms_gzip_bench` : gain de la compression gzip des requêtes addInvoice.
+
+    odoo-bin ebms_gzip_bench --lines 10,100,500,2000 --bandwidth 256 --rtt 150
+    odoo-bin ebms_gzip_bench --lines 500 --url http://localhost:8069/ebms/demo/addInvoice
+
+Pour chaque taille de facture synthétique (voir ebms_json_bench) : octets envoyés avec et
+sans gzip, temps de compression, et durée estimée de l'envoi sur une liaison de
+`--bandwidth` kbit/s avec `--rtt` ms d'aller-retour. Avec --url, chaque variante est aussi
+postée `--rounds` fois vers ce serveur (le faux endpoint /ebms/demo/addInvoice accepte le
+gzip) et la médiane des durées mesurées est affichée. Aucune base n'est nécessaire.
+"""
+import gzip
+import optparse
+import random
+import statistics
+import sys
+import time
+
+import requests
+
+from odoo.cli import Command
+
+from ..models import ebms_json
+from ..models.ebms_client import GZIP_LEVEL
+from .ebms_json_bench import build_exchange
+
+
+def link_seconds(size, bandwidth_kbps, rtt_ms):
+    """Durée d'envoi de `size` octets sur la liaison : un aller-retour plus le temps de transmission."""
+    return rtt_ms / 1000 + size * 8 / (bandwidth_kbps * 1000)
+
+
+def measure(url, body, compressed, rounds):
+    """Médiane (secondes) de `rounds` envois de `body` vers `url`."""
+    headers = {'Content-Type': 'application/json', 'Accept-Encoding': 'gzip'}
+    if compressed:
+        headers['Content-Encoding'] = 'gzip'
+    durations = []
+    with requests.Session() as session:
+        for _r in range(rounds):
+            started = time.perf_counter()
+            session.post(url, data=body, headers=headers, timeout=60).raise_for_status()
+            durations.append(time.perf_counter() - started)
+    return statistics.median(durations)
+
+
+def run(sizes=(10, 100, 500, 2000), bandwidth_kbps=256, rtt_ms=150, url=None, rounds=5, seed=42):
+    """Une ligne de résultats par taille de facture (nombre de lignes)."""
+    rng = random.Random(seed)
+    rows = []
+    for lines in sizes:
+        payload = build_exchange(rng, lines)[0]
+        body = ebms_json.canonical(payload)
+        started = time.perf_counter()
+        compressed = gzip.compress(body, compresslevel=GZIP_LEVEL)
+        row = {
+            'lines': lines,
+            'raw_bytes': len(body),
+            'gzip_bytes': len(compressed),
+            'compress_ms': (time.perf_counter() - started) * 1000,
+            'raw_link_ms': link_seconds(len(body), bandwidth_kbps, rtt_ms) * 1000,
+        }
+        row['gzip_link_ms'] = link_seconds(len(compressed), bandwidth_kbps, rtt_ms) * 1000 + row['compress_ms']
+        if url:
+            row['raw_measured_ms'] = measure(url, body, False, rounds) * 1000
+            row['gzip_measured_ms'] = measure(url, compressed, True, rounds) * 1000
+        rows.append(row)
+    return rows
+
+
+class EBMSGzipBench(Command):
+    """Mesure le gain de la compression gzip des requêtes EBMS selon la taille des factures"""
+    name = 'ebms_gzip_bench'
+
+    def run(self, cmdargs):
+        parser = optparse.OptionParser(prog='odoo-bin ebms_gzip_bench')
+        parser.add_option('--lines', default='10,100,500,2000', help='Tailles de facture (lignes), séparées par des virgules')
+        parser.add_option('--bandwidth', type='float', default=256, help='Débit montant de la liaison (kbit/s)')
+        parser.add_option('--rtt', type='float', default=150, help='Aller-retour de la liaison (ms)')
+        parser.add_option('--url', help='Serveur à appeler réellement (ex. faux endpoint /ebms/demo/addInvoice)')
+        parser.add_option('--rounds', type='int', default=5, help='Envois par variante avec --url (la médiane est retenue)')
+        parser.add_option('--seed', type='int', default=42, help='Graine des factures synthétiques')
+        opt, _args = parser.parse_args(cmdargs)
+        sizes = [int(size) for size in opt.lines.split(',') if size.strip()]
+        rows = run(sizes=sizes, bandwidth_kbps=opt.bandwidth, rtt_ms=opt.rtt, url=opt.url, rounds=opt.rounds, seed=opt.seed)
+        sys.stdout.write('Liaison : %s kbit/s, aller-retour %s ms ; gzip niveau %s\n' % (opt.bandwidth, opt.rtt, GZIP_LEVEL))
+        sys.stdout.write('%7s %11s %11s %7s %10s %12s %12s' % (
+            'lignes', 'octets', 'gzip', 'ratio', 'compr. ms', 'liaison ms', 'gzip ms'))
+        sys.stdout.write(' %12s %12s\n' % ('mesuré ms', 'mesuré gzip') if opt.url else '\n')
+        for row in rows:
+            sys.stdout.write('%7d %11d %11d %6.1fx %10.2f %12.0f %12.0f' % (
+                row['lines'], row['raw_bytes'], row['gzip_bytes'], row['raw_bytes'] / row['gzip_bytes'],
+                row['compress_ms'], row['raw_link_ms'], row['gzip_link_ms']))
+            if opt.url:
+                sys.stdout.write(' %12.1f %12.1f' % (row['raw_measured_ms'], row['gzip_measured_ms']))
+            sys.stdout.write('\n')
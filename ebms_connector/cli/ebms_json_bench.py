@@ -0,0 +1,115 @@
+# -*- coding: utf-8 -*-
+"""
+Commande `odoo-bin ebms_json_bench` : coût de l'encodage JSON par échange EBMS.
+
+    odoo-bin ebms_json_bench --invoices 200 --lines 500 --rounds 5 --seed 42
+
+Compare, sur des factures synthétiques de grande taille (payload addInvoice et résultat
+OBR), le chemin historique — json= de requests, puis json.dumps pour le stockage, pour le
+fil de discussion et pour la vérification de signature après ré-analyse — à l'encodage
+unique d'ebms_json. Aucune base n'est nécessaire.
+"""
+import json
+import optparse
+import random
+import sys
+import time
+
+from odoo.cli import Command
+
+from ..models import ebms_json
+
+DESIGNATIONS = ['Sucre Mumirwa 50 kg', 'Ciment Buceco 50 kg', 'Huile de palme 20 L', 'Savon « Nyota »',
+                'Bière Primus 72 cl', 'Riz Imbo 25 kg', 'Tôle ondulée 3 m', 'Café arabica lavé']
+
+
+def build_exchange(rng, lines):
+    """Payload addInvoice et réponse OBR d'une facture de `lines` lignes."""
+    items = []
+    for i in range(lines):
+        quantity = rng.randint(1, 40)
+        price = round(rng.uniform(500, 250000), 2)
+        ct = round(quantity * price, 2)
+        items.append({
+            'item_designation': '%s — lot %s' % (rng.choice(DESIGNATIONS), i),
+            'item_quantity': quantity,
+            'item_price': price,
+            'item_ct': ct,
+            'item_tl': 0,
+            'item_vat': round(ct * 0.18, 2),
+            'item_total_amount': round(ct * 1.18, 2),
+        })
+    number = rng.randint(1, 10 ** 6)
+    payload = {
+        'tp_type': '2', 'tp_name': 'Société Générale de Commerce du Burundi', 'tp_TIN': '4000000000',
+        'tp_address_commune': 'Mukaza', 'tp_address_quartier': 'Rohero', 'vat_taxpayer': '1',
+        'invoice_number': 'INV/2024/%06d' % number, 'invoice_date': '2024-03-01 10:00:00',
+        'invoice_type': 'FN', 'invoice_currency': 'BIF',
+        'invoice_identifier': '4000000000/ws400000000000/20240301100000/%06d' % number,
+        'customer_name': 'Établissements Ndayishimiye', 'customer_TIN': '4000123456',
+        'invoice_total_amount': round(sum(item['item_total_amount'] for item in items), 2),
+        'lines': items,
+    }
+    result = {
+        'success': True,
+        'reference': payload['invoice_identifier'],
+        'electronic_signature': 'x' * 344,
+        'result_data': {'invoice_registered_number': str(number), 'invoice_registered_date': '2024-03-01 10:00:02',
+                        'invoice': payload},
+        'msg': 'Facture enregistrée avec succès',
+    }
+    return payload, result
+
+
+def legacy_exchange(payload, result):
+    body = json.dumps(payload, allow_nan=False).encode('utf-8')  # json= de requests
+    json.dumps(result, ensure_ascii=False, default=str)  # fil de discussion
+    stored = json.dumps(result, ensure_ascii=False)  # ebms_result_data
+    signed = json.dumps(json.loads(stored), sort_keys=True, separators=(',', ':')).encode('utf-8')
+    return body, signed
+
+
+def canonical_exchange(payload, result):
+    body = ebms_json.canonical(payload)
+    stored = ebms_json.canonical_text(result)
+    signed = ebms_json.signed_bytes(stored)
+    return body, signed
+
+
+def run(invoices=200, lines=500, rounds=5, seed=42):
+    """Meilleur temps par facture (secondes) de chaque chemin, sur `rounds` passages."""
+    rng = random.Random(seed)
+    exchanges = [build_exchange(rng, lines) for _i in range(invoices)]
+    for payload, result in exchanges[:10]:
+        if legacy_exchange(payload, result)[1] != canonical_exchange(payload, result)[1]:
+            raise AssertionError('Octets signés différents entre les deux chemins')
+    timings = {}
+    for name, path in (('historique', legacy_exchange), ('ebms_json', canonical_exchange)):
+        best = None
+        for _r in range(rounds):
+            started = time.perf_counter()
+            for payload, result in exchanges:
+                path(payload, result)
+            elapsed = (time.perf_counter() - started) / invoices
+            best = elapsed if best is None else min(best, elapsed)
+        timings[name] = best
+    return timings
+
+
+class EBMSJsonBench(Command):
+    """Mesure l'encodage JSON des échanges EBMS (historique contre ebms_json)"""
+    name = 'ebms_json_bench'
+
+    def run(self, cmdargs):
+        parser = optparse.OptionParser(prog='odoo-bin ebms_json_bench')
+        parser.add_option('--invoices', type='int', default=200, help='Nombre de factures')
+        parser.add_option('--lines', type='int', default=500, help='Lignes par facture')
+        parser.add_option('--rounds', type='int', default=5, help='Passages (le meilleur est retenu)')
+        parser.add_option('--seed', type='int', default=42, help='Graine des factures synthétiques')
+        opt, _args = parser.parse_args(cmdargs)
+        timings = run(invoices=opt.invoices, lines=opt.lines, rounds=opt.rounds, seed=opt.seed)
+        backend = 'orjson' if ebms_json.orjson else 'json (bibliothèque standard)'
+        sys.stdout.write('Encodage : %s ; %s factures de %s lignes\n' % (backend, opt.invoices, opt.lines))
+        for name, seconds in timings.items():
+            sys.stdout.write('  %-12s %8.2f ms/facture\n' % (name, seconds * 1000))
+        sys.stdout.write('  gain         x%.1f\n' % (timings['historique'] / timings['ebms_json']))
@@ -0,0 +1,51 @@
+# -*- coding: utf-8 -*-
+"""
+Commande `odoo-bin ebms_relay` : relais EBMS d'agence (voir tools/ebms_relay.py).
+
+    EBMS_RELAY_PASSWORD=... odoo-bin ebms_relay --store /var/lib/ebms/relay.sqlite \\
+        --listen 127.0.0.1:8099 --obr-url https://ebms.obr.gov.bi:9443 --username wsl400000000000
+
+Le relais n'a besoin d'aucune base Odoo. Les identifiants sont ceux de l'OBR : le relais les
+utilise pour se connecter à l'OBR et pour authentifier l'Odoo de l'agence.
+"""
+import logging
+import optparse
+import os
+import sys
+
+from odoo.cli import Command
+
+from ..tools import ebms_relay
+
+
+class EBMSRelay(Command):
+    """Relais EBMS d'agence : file durable locale, transmise à l'OBR au retour de la liaison"""
+    name = 'ebms_relay'
+
+    def run(self, cmdargs):
+        parser = optparse.OptionParser(prog='odoo-bin ebms_relay')
+        parser.add_option('--store', default='ebms_relay.sqlite', help='Fichier SQLite de la file')
+        parser.add_option('--listen', default='127.0.0.1:8099', help='Adresse d\'écoute (hôte:port)')
+        parser.add_option('--obr-url', help='Adresse de l\'OBR (ex. https://ebms.obr.gov.bi:9443)')
+        parser.add_option('--login-path', default=ebms_relay.LOGIN_PATH, help='Chemin du login OBR')
+        parser.add_option('--username', help='Nom d\'utilisateur EBMS')
+        parser.add_option('--password', help='Mot de passe EBMS (de préférence via EBMS_RELAY_PASSWORD)')
+        parser.add_option('--workers', type='int', default=4, help='Envois simultanés vers l\'OBR (1 : ordre strict)')
+        parser.add_option('--batch-size', type='int', default=ebms_relay.DEFAULT_BATCH_SIZE, help='Soumissions par lot')
+        parser.add_option('--retention-days', type='int', default=ebms_relay.DEFAULT_RETENTION_DAYS,
+                          help='Conservation des accusés (jours)')
+        parser.add_option('--max-attempts', type='int', default=ebms_relay.DEFAULT_MAX_ATTEMPTS,
+                          help='Essais en erreur OBR (5xx, 408, 429) avant abandon d\'une soumission')
+        opt, _args = parser.parse_args(cmdargs)
+        password = opt.password or os.environ.get('EBMS_RELAY_PASSWORD')
+        if not (opt.obr_url and opt.username and password):
+            parser.error('--obr-url, --username et le mot de passe sont obligatoires.')
+        logging.basicConfig(level=logging.INFO, stream=sys.stderr,
+                            format='%(asctime)s %(levelname)s %(name)s: %(message)s')
+        try:
+            ebms_relay.serve(opt.store, opt.listen, opt.obr_url, opt.username, password,
+                             login_path=opt.login_path, max_workers=opt.workers,
+                             batch_size=opt.batch_size, retention_days=opt.retention_days,
+                             max_attempts=opt.max_attempts)
+        except KeyboardInterrupt:
+            pass
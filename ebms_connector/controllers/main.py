@@ -1,8 +1,13 @@
-from odoo import http
+from odoo import fields, http
 from odoo.http import request
+import gzip
 import json
 import logging
 
+from odoo.addons.ebms_connector.models.ebms_client import GZIP_MIN_BYTES
+from odoo.addons.ebms_connector.models.ebms_logging import log_exchange
+from odoo.addons.ebms_connector.models.ebms_tracing import HEADER as TRACE_HEADER
+
 _logger = logging.getLogger(__name__)
 
 
@@ -15,10 +20,14 @@ class EBMSController(http.Controller):
         """
         Webhook pour recevoir les notifications de statut depuis EBMS
         Optionnel - pour les retours de statut asynchrones
+        Le traitement est tracé sous l'identifiant de corrélation reçu dans l'en-tête
+        X-Correlation-ID, à défaut sous celui de la facture.
         """
         try:
+            started_at, started = fields.Datetime.now(), time.monotonic()
             data = request.jsonrequest
-            _logger.info('Webhook EBMS reçu: %s', data)
+            trace_id = request.httprequest.headers.get(TRACE_HEADER)
+            log_exchange('/ebms/webhook', 200, payload=data, trace_id=trace_id)
             
             # Traitement du webhook EBMS
             if data.get('invoice_reference'):
@@ -29,12 +38,16 @@ class EBMSController(http.Controller):
                 if invoice:
                     # Mise à jour du statut selon la réponse EBMS
                     if data.get('status') == 'validated':
-                        invoice.ebms_status = 'sent'
+                        invoice.write({'ebms_status': 'sent', 'ebms_verified_at': fields.Datetime.now()})
                         invoice.message_post(body='Facture validée par EBMS via webhook')
                     elif data.get('status') == 'rejected':
                         invoice.ebms_status = 'error'
                         invoice.ebms_error_message = data.get('error_message', 'Rejetée par EBMS')
                         invoice.message_post(body=f'Facture rejetée par EBMS: {data.get("error_message")}')
+                    request.env['ebms.trace.span'].sudo()._record_span(
+                        invoice, 'webhook', started_at, time.monotonic() - started,
+                        status='error' if data.get('status') == 'rejected' else 'ok',
+                        detail=data.get('status'), trace_id=trace_id)
             
             return {'status': 'success', 'message': 'Webhook traité'}
             
@@ -45,16 +58,24 @@ class EBMSController(http.Controller):
     @http.route('/ebms/test', type='http', auth='user', methods=['GET'])
     def ebms_test(self, **kwargs):
         """
-        Endpoint de test pour vérifier la connectivité EBMS
+        Endpoint de test pour vérifier la connectivité EBMS : dernier contrôle de disponibilité
+        de l'OBR pour la société courante (?probe=1 pour contrôler immédiatement).
         """
         try:
-            # Test de connectivité basique
-            return request.render('ebms_connector.test_page', {
-                'title': 'Test EBMS Connector',
-                'status': 'Module EBMS Connector opérationnel',
+            Health = request.env['ebms.health.probe']
+            if kwargs.get('probe'):
+                Health._probe_all()
+            probe = Health._for_company(request.env.company)
+            return request.make_json_response({
+                'status': probe.status or 'unknown',
+                'reachable': probe.reachable,
+                'login_ok': probe.login_ok,
+                'latency_ms': probe.latency_ms,
+                'checked_at': fields.Datetime.to_string(probe.checked_at) if probe.checked_at else None,
+                'last_error': probe.last_error or None,
             })
         except Exception as e:
-            return f'Erreur: {str(e)}'
+            return request.make_json_response({'status': 'error', 'message': str(e)}, status=500)
 
     @http.route('/ebms/demo/send_invoice', type='json', auth='none', methods=['POST'], csrf=False)
     def ebms_demo_send_invoice(self, **kwargs):
@@ -70,31 +91,57 @@ class EBMSController(http.Controller):
                     invoice_data = json.loads(request.httprequest.data)
                 except Exception:
                     invoice_data = {}
-            _logger.info('DEMO EBMS API a reçu: %s', invoice_data)
-
-            amount_total = invoice_data.get('amount_total', 0)
-            _logger.info('DEMO EBMS API: Montant total reçu = %s', amount_total)
-
-            # Scénario 1: Succès
-            if amount_total and amount_total < 1000000:
-                response_data = {
-                    'success': True,
-                    'reference': f'OBR_DEMO_{int(time.time())}',
-                    'electronic_signature': 'U0lHTkFUVVJFX0RFTU9fVkFMSURFXzEyMzQ1Njc4OTA=', # Signature base64 simulée
-                    'msg': 'Facture reçue avec succès par le système de démo.'
-                }
-                return response_data
-
-            # Scénario 2: Erreur métier
-            else:
-                error_msg = 'TEST_FINAL_ERREUR_V5: Le montant est invalide ou non fourni.'
-                if amount_total >= 1000000:
-                    error_msg = 'TEST_FINAL_ERREUR_V5: Le montant est trop élevé.'
-                
-                _logger.warning('DEMO EBMS API: Scénario d\'erreur déclenché. Message: %s', error_msg)
-                return {'success': False, 'msg': error_msg}
+            return self._demo_invoice_result(invoice_data)
 
         except Exception as e:
             _logger.error('Erreur dans le contrôleur de démo EBMS: %s', str(e))
             # Scénario 3: Erreur technique
             return {'success': False, 'msg': f'Erreur technique interne du serveur de démo: {e}'}
+
+    def _demo_invoice_result(self, invoice_data):
+        """Réponse simulée : succès ou erreur selon le montant de la facture."""
+        _logger.debug('DEMO EBMS API a reçu: %s', invoice_data)
+
+        amount_total = invoice_data.get('amount_total', 0)
+        _logger.debug('DEMO EBMS API: Montant total reçu = %s', amount_total)
+
+        # Scénario 1: Succès
+        if amount_total and amount_total < 1000000:
+            response_data = {
+                'success': True,
+                'reference': f'OBR_DEMO_{int(time.time())}',
+                'electronic_signature': 'U0lHTkFUVVJFX0RFTU9fVkFMSURFXzEyMzQ1Njc4OTA=', # Signature base64 simulée
+                'msg': 'Facture reçue avec succès par le système de démo.'
+            }
+            return response_data
+
+        # Scénario 2: Erreur métier
+        else:
+            error_msg = 'TEST_FINAL_ERREUR_V5: Le montant est invalide ou non fourni.'
+            if amount_total >= 1000000:
+                error_msg = 'TEST_FINAL_ERREUR_V5: Le montant est trop élevé.'
+
+            _logger.warning('DEMO EBMS API: Scénario d\'erreur déclenché. Message: %s', error_msg)
+            return {'success': False, 'msg': error_msg}
+
+    @http.route('/ebms/demo/addInvoice', type='http', auth='none', methods=['POST'], csrf=False)
+    def ebms_demo_add_invoice(self, **kwargs):
+        """
+        Variante HTTP du faux endpoint, au format de l'addInvoice de l'OBR : corps JSON brut,
+        éventuellement compressé (Content-Encoding: gzip). La réponse est compressée si le client
+        l'accepte (Accept-Encoding) et qu'elle atteint GZIP_MIN_BYTES.
+        """
+        httprequest = request.httprequest
+        data = httprequest.get_data()
+        try:
+            if httprequest.headers.get('Content-Encoding') == 'gzip':
+                data = gzip.decompress(data)
+            invoice_data = json.loads(data or b'{}')
+        except (OSError, ValueError) as e:
+            return request.make_json_response({'success': False, 'msg': 'Corps illisible : %s' % e}, status=400)
+        body = json.dumps(self._demo_invoice_result(invoice_data)).encode('utf-8')
+        headers = [('Content-Type', 'application/json')]
+        if 'gzip' in httprequest.headers.get('Accept-Encoding', '') and len(body) >= GZIP_MIN_BYTES:
+            body = gzip.compress(body)
+            headers.append(('Content-Encoding', 'gzip'))
+        return request.make_response(body, headers=headers)
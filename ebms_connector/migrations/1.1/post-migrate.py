@@ -0,0 +1,23 @@
+# -*- coding: utf-8 -*-
+"""
+1.1 : l'état EBMS quitte account_move et stock_move pour account_move_ebms et
+stock_move_ebms. Les données sont recopiées en masse, les anciennes colonnes supprimées,
+et la taille et le temps de parcours des tables sont journalisés avant et après.
+"""
+from odoo import api, SUPERUSER_ID
+
+from odoo.addons.ebms_connector.models.ebms_state import move_to_side_table
+
+
+def migrate(cr, version):
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    move_to_side_table(env, 'account.move', """
+        m.move_type IN ('out_invoice', 'out_refund')
+        OR COALESCE(m.ebms_status, 'draft') != 'draft'
+        OR m.ebms_reference IS NOT NULL
+    """)
+    move_to_side_table(env, 'stock.move', """
+        COALESCE(m.ebms_stock_status, 'draft') != 'draft'
+        OR m.ebms_stock_reference IS NOT NULL
+    """)
+    env['ebms.status.counter']._rebuild()
@@ -0,0 +1,12 @@
+# -*- coding: utf-8 -*-
+"""1.2 : signature des erreurs déjà enregistrées (voir pre-migrate)."""
+from odoo import api, SUPERUSER_ID
+
+
+def migrate(cr, version):
+    env = api.Environment(cr, SUPERUSER_ID, {})
+    for model, message_field in (('account.move.ebms', 'ebms_error_message'),
+                                 ('stock.move.ebms', 'ebms_stock_error_message')):
+        states = env[model].search([(message_field, '!=', False)])
+        env.add_to_compute(states._fields['ebms_error_signature'], states)
+        states.flush_recordset(['ebms_error_signature'])
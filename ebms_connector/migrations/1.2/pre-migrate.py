@@ -0,0 +1,18 @@
+# -*- coding: utf-8 -*-
+"""
+1.2 : signature d'erreur et mise de côté sur les tables d'état EBMS. Les colonnes sont
+créées ici, vides, pour que la mise à jour ne calcule pas la signature de toutes les
+lignes d'état ; post-migrate ne la calcule que pour celles qui ont un message d'erreur.
+Depuis une 1.0, les tables d'état n'existent pas encore : l'ORM les crée ensuite, colonnes comprises.
+"""
+from odoo.tools.sql import column_exists, create_column, table_exists
+
+
+def migrate(cr, version):
+    for table in ('account_move_ebms', 'stock_move_ebms'):
+        if not table_exists(cr, table):
+            continue
+        if not column_exists(cr, table, 'ebms_error_signature'):
+            create_column(cr, table, 'ebms_error_signature', 'varchar')
+        if not column_exists(cr, table, 'ebms_parked'):
+            create_column(cr, table, 'ebms_parked', 'boolean')
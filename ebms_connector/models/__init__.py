@@ -1,5 +1,20 @@
+from . import ebms_state
 from . import account_invoice_inherit
 from . import res_company_inherit
+from . import res_partner_inherit
 from . import res_config_settings
 from . import stock_move_ebms
+from . import ebms_dashboard
+from . import ebms_latency
 from . import ebms_utils
+from . import ebms_client
+from . import ebms_signature
+from . import ebms_warmup
+from . import ebms_dispatcher
+from . import ebms_audit_export
+from . import ebms_backfill
+from . import ebms_inventory
+from . import ebms_queue
+from . import ebms_error_triage
+from . import ebms_tracing
+from . import ebms_health
@@ -1,20 +1,32 @@
 from odoo import models, fields, api, _
 from odoo.exceptions import UserError, ValidationError
 import requests
-import json
 import logging
-from datetime import datetime
+from datetime import datetime, timedelta
 import base64
-from cryptography.hazmat.primitives import hashes, serialization
-from cryptography.hazmat.primitives.asymmetric import padding
-from cryptography.hazmat.backends import default_backend
-from cryptography.exceptions import InvalidSignature
+import binascii
+import time
+
+from . import ebms_invoice_cache, ebms_json, ebms_signature
+from .ebms_logging import log_exchange
+from .ebms_client import get_client
+from .ebms_health import STATUSES
+from ..tools.ebms_relay import ACKS_LIMIT as RELAY_ACKS_LIMIT, ACKS_PATH as RELAY_ACKS_PATH
+from .ebms_tracing import HEADER as TRACE_HEADER, SpanLog, new_trace_id
+from .ebms_dispatcher import dispatch_by_company, persist_tokens, prepare_dispatch, run_dispatch
 
 _logger = logging.getLogger(__name__)
 
+# Une réservation d'envoi ('sending') plus ancienne est considérée abandonnée.
+STALE_SENDING_MINUTES = 10
+DEFAULT_BACKFILL_IDENTIFIER_TEMPLATE = '{tin}/{system_id}/{timestamp}/{name}'
+
 
 class AccountMoveInherit(models.Model):
-    _inherit = 'account.move'
+    _inherit = ['account.move', 'ebms.state.mixin']
+    _ebms_state_model = 'account.move.ebms'
+    _ebms_status_field = 'ebms_status'
+    _ebms_counter_key_fields = ('state', 'move_type', 'invoice_date', 'date', 'company_id')
 
     def _get_invoice_type(self):
         """
@@ -56,34 +68,56 @@ class AccountMoveInherit(models.Model):
                     return '2'  # Compte bancaire
         return '1' if not self.invoice_payment_term_id else '3'
 
-    def action_get_ebms_invoice(self, invoice_identifier=None):
+    def action_get_ebms_invoice(self, invoice_identifier=None, refresh=False):
         """
         Récupère les détails d'une facture EBMS via l'API getInvoice (conforme doc OBR).
         Si invoice_identifier n'est pas fourni, prend la référence EBMS de la facture courante.
+        Une réponse récente est servie depuis le cache getInvoice (voir ebms_invoice_cache),
+        sans appel à l'OBR ni nouveau message ; refresh=True force l'appel.
+        La consultation est tracée sous l'identifiant de corrélation de la facture.
         """
         self.ensure_one()
         url = self.env['ir.config_parameter'].sudo().get_param('ebms.getinvoice_url')
-        token = self.env['ir.config_parameter'].sudo().get_param('ebms.api_token')
+        token = self.company_id._get_ebms_credentials()['token']
         if not url or not token:
             raise UserError(_('Paramètres API EBMS manquants (getinvoice_url ou token).'))
         if not invoice_identifier:
             invoice_identifier = self.ebms_reference
         if not invoice_identifier:
             raise UserError(_('Aucune référence EBMS disponible pour cette facture.'))
+        trace_id = self._ebms_ensure_trace()[self.id]
+        started_at, started = fields.Datetime.now(), time.monotonic()
+        if not refresh:
+            cached = ebms_invoice_cache.get_invoice(self.env, invoice_identifier)
+            if cached is not None:
+                self.env['ebms.trace.span']._record_span(self, 'get_invoice', started_at, time.monotonic() - started,
+                                                         detail=_('Servie par le cache'))
+                return cached
+        if self._ebms_obr_down():
+            raise UserError(self.env['ebms.health.probe']._down_message(self.company_id))
         headers = {
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
+            TRACE_HEADER: trace_id,
         }
         payload = {
             'invoice_identifier': invoice_identifier,
         }
         try:
             response = requests.post(url, json=payload, headers=headers, timeout=30)
+            log_exchange(url, response.status_code, time.monotonic() - started, payload=payload,
+                         error=None if response.status_code == 200 else response.text,
+                         ids=self.ids, company_id=self.company_id.id, trace_id=trace_id)
             if response.status_code == 200:
                 resp_json = response.json()
                 if resp_json.get('success'):
+                    self.env['ebms.trace.span']._record_span(self, 'get_invoice', started_at, time.monotonic() - started,
+                                                             detail='HTTP 200')
+                    ebms_invoice_cache.put_invoice(self.env, invoice_identifier, resp_json)
+                    if invoice_identifier in (self.ebms_reference, self.ebms_invoice_identifier):
+                        self.ebms_verified_at = fields.Datetime.now()
                     # Facultatif : stocker les détails récupérés ou les afficher
-                    self.message_post(body=_('Détails EBMS récupérés: %s') % json.dumps(resp_json, ensure_ascii=False))
+                    self.message_post(body=_('Détails EBMS récupérés: %s') % ebms_json.canonical_text(resp_json))
                     return resp_json
                 else:
                     msg = resp_json.get('msg', 'Erreur lors de la récupération EBMS.')
@@ -99,31 +133,117 @@ class AccountMoveInherit(models.Model):
             self.message_post(body=_('Exception récupération EBMS: %s') % str(e))
             raise UserError(_('Exception récupération EBMS: %s') % str(e))
 
+    def action_refresh_ebms_invoice(self):
+        """Relit la facture auprès de l'OBR sans passer par le cache getInvoice."""
+        return self.action_get_ebms_invoice(refresh=True)
+
     def write(self, vals):
         res = super().write(vals)
         if 'ebms_status' in vals:
-            _logger.info(f"[DIAG EBMS] Changement de statut EBMS pour factures {self.ids} -> {vals['ebms_status']}")
+            _logger.debug('Statut EBMS des factures %s -> %s', self.ids, vals['ebms_status'])
         return res
 
-    ebms_status = fields.Selection([
-        ('draft', 'Brouillon'),
-        ('sent', 'Envoyé à EBMS'),
-        ('error', 'Erreur d\'envoi')
-    ], string='Statut EBMS', default='draft', required=True, help="Statut de l'envoi vers EBMS")
-    ebms_reference = fields.Char(string='Référence EBMS', help='Référence EBMS fournie par l’OBR')
-    ebms_signature = fields.Text(string='Signature électronique EBMS', help='Signature électronique reçue pour vérification')
-    ebms_error_message = fields.Text(string='Message d\'erreur EBMS', help='Détails de l\'erreur EBMS')
-    ebms_sent_date = fields.Datetime(string='Date d\'envoi EBMS', help='Date et heure d\'envoi vers EBMS')
-    ebms_result_data = fields.Text(string='Données de résultat EBMS', help='Données JSON complètes de l\'objet "result" retourné par EBMS')
+    def _ebms_state_needed(self):
+        return self.filtered(lambda m: m.move_type in ('out_invoice', 'out_refund'))
 
-    def action_send_ebms(self):
-        """
-        Envoi la facture à l’API EBMS du Burundi (conforme spécification OBR).
-        - Prépare les données selon le format attendu
-        - Appelle l’API avec authentification Bearer
-        - Gère l’accusé de réception et la signature électronique
-        - Met à jour le statut, la référence, la date, la signature, les erreurs
-        """
+    def _ebms_counter_key(self):
+        if self.state != 'posted' or self.move_type not in ('out_invoice', 'out_refund'):
+            return None
+        return self.company_id.id, self.invoice_date or self.date
+
+    # État EBMS stocké dans account_move_ebms (voir ebms_state), exposé sous les noms historiques.
+    ebms_state_ids = fields.One2many('account.move.ebms', 'move_id', string='État EBMS', copy=False)
+    ebms_status = fields.Selection(related='ebms_state_ids.ebms_status', readonly=False)
+    ebms_reference = fields.Char(related='ebms_state_ids.ebms_reference', readonly=False)
+    ebms_signature = fields.Text(related='ebms_state_ids.ebms_signature', readonly=False)
+    ebms_error_message = fields.Text(related='ebms_state_ids.ebms_error_message', readonly=False)
+    ebms_sent_date = fields.Datetime(related='ebms_state_ids.ebms_sent_date', readonly=False)
+    ebms_result_data = fields.Text(related='ebms_state_ids.ebms_result_data', readonly=False)
+    ebms_invoice_identifier = fields.Char(related='ebms_state_ids.ebms_invoice_identifier', readonly=False)
+    ebms_cn_motif = fields.Char(related='ebms_state_ids.ebms_cn_motif', readonly=False)
+    ebms_cancelled_invoice_ref = fields.Char(related='ebms_state_ids.ebms_cancelled_invoice_ref', readonly=False)
+    ebms_replaced_invoice_id = fields.Many2one(related='ebms_state_ids.ebms_replaced_invoice_id')
+    ebms_replacement_id = fields.Many2one(related='ebms_state_ids.ebms_replacement_id')
+    ebms_posted_at = fields.Datetime(related='ebms_state_ids.ebms_posted_at')
+    ebms_first_attempt_at = fields.Datetime(related='ebms_state_ids.ebms_first_attempt_at')
+    ebms_attempts = fields.Integer(related='ebms_state_ids.ebms_attempts')
+    ebms_acknowledged_at = fields.Datetime(related='ebms_state_ids.ebms_acknowledged_at')
+    ebms_verified_at = fields.Datetime(related='ebms_state_ids.ebms_verified_at')
+    ebms_error_signature = fields.Char(related='ebms_state_ids.ebms_error_signature')
+    ebms_parked = fields.Boolean(related='ebms_state_ids.ebms_parked')
+    ebms_trace_id = fields.Char(related='ebms_state_ids.ebms_trace_id', readonly=False)
+    ebms_trace_span_ids = fields.One2many('ebms.trace.span', 'move_id', string='Traçage EBMS', readonly=True)
+    ebms_obr_status = fields.Selection(STATUSES, string='Disponibilité OBR', compute='_compute_ebms_obr_status')
+    ebms_queue_position = fields.Integer(string='Position dans la file EBMS', compute='_compute_ebms_queue_info')
+    ebms_queue_eta = fields.Datetime(string='Envoi EBMS estimé', compute='_compute_ebms_queue_info')
+
+    def _compute_ebms_queue_info(self):
+        items = self.env['ebms.queue.item'].sudo().search([
+            ('res_model', '=', 'account.move'),
+            ('res_id', 'in', self.ids),
+            ('state', '=', 'pending'),
+        ])
+        info = items._position_and_eta()
+        by_move = {item.res_id: info.get(item.id) for item in items}
+        for move in self:
+            position, eta = by_move.get(move.id) or (0, False)
+            move.ebms_queue_position = position
+            move.ebms_queue_eta = eta
+
+    @api.depends('company_id')
+    def _compute_ebms_obr_status(self):
+        Health = self.env['ebms.health.probe']
+        status = {company.id: Health._for_company(company).status or 'unknown' for company in self.company_id}
+        for move in self:
+            move.ebms_obr_status = status.get(move.company_id.id, 'unknown')
+
+    def _ebms_obr_down(self):
+        """Factures dont l'OBR est connu injoignable (voir ebms_health) : inutile d'attendre le délai d'expiration."""
+        down = self.env['ebms.health.probe']._down_companies(self.company_id)
+        return self.filtered(lambda m: m.company_id in down)
+
+    def _post(self, soft=True):
+        posted = super()._post(soft=soft)
+        invoices = posted.filtered(lambda m: m.move_type in ('out_invoice', 'out_refund'))
+        if invoices:
+            now = fields.Datetime.now()
+            invoices.write({'ebms_posted_at': now})
+            invoices._ebms_ensure_trace()
+            self.env['ebms.trace.span']._record_span(invoices, 'post', now, 0.0)
+        if self.env['ir.config_parameter'].sudo().get_param('ebms.auto_send'):
+            to_queue = posted.filtered(lambda m: m.move_type in ('out_invoice', 'out_refund') and m.ebms_status == 'draft')
+            self.env['ebms.queue.item'].sudo()._enqueue(to_queue)
+        return posted
+
+    def action_enqueue_ebms(self):
+        """Met les factures sélectionnées en file d'envoi EBMS (traitement par le cron)."""
+        to_queue = self.filtered(
+            lambda m: m.state == 'posted'
+            and m.move_type in ('out_invoice', 'out_refund')
+            and m.ebms_status in ('draft', 'error')
+        )
+        lane = self.env.context.get('ebms_lane')
+        items = self.env['ebms.queue.item'].sudo()._enqueue(to_queue, lane=lane)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('File EBMS'),
+                'message': _('%s facture(s) mise(s) en file d\'envoi EBMS.') % len(items),
+                'type': 'info',
+                'sticky': False,
+            }
+        }
+
+    def _ebms_is_sent(self):
+        self.ensure_one()
+        return self.ebms_status == 'sent'
+
+    def _ebms_last_error(self):
+        self.ensure_one()
+        return self.ebms_error_message
+
+    def _ebms_check_sendable(self):
         for record in self:
             if record.move_type not in ['out_invoice', 'out_refund', 'fa', 'rc']:
                 raise UserError(_('Seules les factures clients (FN, FA, RC) peuvent être envoyées vers EBMS.'))
@@ -131,63 +251,282 @@ class AccountMoveInherit(models.Model):
                 raise UserError(_('La facture doit être validée avant l\'envoi vers EBMS.'))
             if record.ebms_status == 'sent':
                 raise UserError(_('Cette facture a déjà été envoyée vers EBMS.'))
+            if record.ebms_status == 'cancelled':
+                raise UserError(_('Cette facture a été annulée côté EBMS et ne peut plus être envoyée.'))
 
-            try:
-                # Logique "intelligente" pour choisir la source des données
-                url = self.env['ir.config_parameter'].sudo().get_param('ebms.api_url')
-                if url and '/ebms/demo/' in url:
-                    ebms_data = record._prepare_ebms_data_demo()
-                else:
-                    ebms_data = record._prepare_ebms_data_burundi()
-                
-                result = record._send_to_ebms_api_burundi(ebms_data)
-                # Log brut de la réponse pour audit
-                try:
-                    log_msg = f"[EBMS API Response] {json.dumps(result, ensure_ascii=False)}"
-                except (TypeError, ValueError):
-                    log_msg = f"[EBMS API Response] {str(result)}"
-                record.message_post(body=log_msg)
-                
-                if result.get('success'):
-                    # Correction pour mode demo : récupérer la référence et la signature même si elles sont dans result_data
-                    def _first_non_empty(*args):
-                        for v in args:
-                            if v:
-                                return v
-                        return ''
-                    ref = _first_non_empty(result.get('reference'), result.get('result_data', {}).get('reference', '') if result.get('result_data') else '')
-                    sig = _first_non_empty(result.get('electronic_signature'), result.get('result_data', {}).get('electronic_signature', '') if result.get('result_data') else '')
-                    record.write({
-                        'ebms_status': 'sent',
-                        'ebms_reference': ref,
-                        'ebms_error_message': False,
-                        'ebms_sent_date': fields.Datetime.now(),
-                        'ebms_signature': sig,
-                        'ebms_result_data': json.dumps(result, ensure_ascii=False) if isinstance(result, (dict, list)) else str(result),
-                    })
-
-                    message = _('Facture envoyée avec succès vers EBMS. Référence: %s') % ref
-                    record.message_post(body=message)
-                else:
-                    record.write({
-                        'ebms_status': 'error',
-                        'ebms_error_message': result.get('msg', 'Erreur inconnue lors de l’envoi EBMS.')
-                    })
-                    error_message = _('Erreur lors de l’envoi EBMS : %s') % result.get('msg', 'Erreur inconnue')
-                    record.message_post(body=error_message)
-                    raise UserError(error_message)
-            
-            except UserError:
-                raise # On laisse passer les UserError métier
-            
-            except Exception as e:
-                record.write({
-                    'ebms_status': 'error',
-                    'ebms_error_message': str(e)
-                })
-                error_msg = _('Une erreur technique est survenue lors de l’envoi vers EBMS : %s') % str(e)
-                record.message_post(body=error_msg)
-                raise UserError(error_msg)
+    def action_send_ebms(self):
+        """
+        Envoi la facture à l’API EBMS du Burundi (conforme spécification OBR).
+        - Prépare les données selon le format attendu
+        - Appelle l’API avec authentification Bearer, hors de toute transaction (voir _ebms_submit)
+        - Gère l’accusé de réception et la signature électronique
+        - Met à jour le statut, la référence, la date, la signature, les erreurs
+        Si l'OBR est connu injoignable, les factures sont mises en file d'envoi sans attendre.
+        """
+        self._ebms_check_sendable()
+        down = self._ebms_obr_down()
+        if down:
+            self.env['ebms.queue.item'].sudo()._enqueue(down)
+        outcomes = (self - down)._ebms_submit() if self - down else {}
+        failed = {move_id: msg for move_id, (ok, msg) in outcomes.items() if not ok}
+        if len(self) == 1:
+            if failed:
+                raise UserError(_('Erreur lors de l’envoi EBMS : %s') % failed[self.id])
+            if not down:
+                return True
+        message = _('%(ok)s facture(s) envoyée(s), %(ko)s en erreur.', ok=len(outcomes) - len(failed), ko=len(failed))
+        if down:
+            message = '%s %s' % (
+                self.env['ebms.health.probe']._down_message(down[0].company_id),
+                _('%s facture(s) mise(s) en file d\'envoi EBMS.') % len(down),
+            ) + ('' if len(self) == 1 else ' ' + message)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Envoi EBMS'),
+                'message': message,
+                'type': 'warning' if failed or down else 'success',
+                'sticky': bool(failed),
+            }
+        }
+
+    def _ebms_submit(self):
+        """
+        Envoi en trois phases, pour ne jamais garder de verrou sur l'état EBMS pendant l'appel OBR :
+        1. réservation : dans une transaction courte, verrouillage sans attente des factures,
+           passage en 'sending', construction des payloads, commit ;
+        2. appel OBR sans transaction ouverte ni accès ORM ;
+        3. enregistrement de l'accusé dans une nouvelle transaction courte.
+        Chaque phase est tracée sous l'identifiant de corrélation de la facture ; les spans sont
+        écrits avec les résultats, en phase 3.
+        Une facture que la phase 1 ne peut pas verrouiller est soit tenue par la transaction
+        appelante (créée ou modifiée sans commit : validation avec envoi automatique, tests),
+        et elle est alors envoyée dans cette transaction plutôt que de s'attendre soi-même ;
+        soit tenue par un autre worker, qui est en train de l'envoyer : elle est écartée
+        (« envoi déjà en cours ») sans appel OBR.
+        Retourne {id: (succès, message)}.
+        """
+        url = self.env['ir.config_parameter'].sudo().get_param('ebms.api_url')
+        if not url:
+            raise UserError(_('Paramètre API EBMS manquant (url).'))
+        self._ebms_state()
+        self.env.flush_all()
+        registry = self.env.registry
+        spans = SpanLog()
+        with registry.cursor() as cr:
+            moves = self.env(cr=cr)['account.move'].browse(self.ids)
+            started_at, started = fields.Datetime.now(), time.monotonic()
+            claimed, outcomes = moves._ebms_claim()
+            trace_ids = {move.id: move.ebms_trace_id for move in claimed}
+            claim_duration = time.monotonic() - started
+            for move in claimed:
+                spans.add(move.id, trace_ids[move.id], 'claim', started_at, claim_duration)
+            dispatch_keys = claimed._ebms_dispatch_keys()
+            jobs = prepare_dispatch(claimed.sorted('id'), lambda move: spans.timed(
+                move.id, trace_ids[move.id], 'build_payload', move._ebms_build_payload, url),
+                lambda move: dispatch_keys[move.id])
+            claimed_ids = set(claimed.ids)
+
+        unclaimed = self.filtered(lambda m: m.id not in claimed_ids and m.id not in outcomes)
+        own = unclaimed._ebms_held_by_current_transaction()
+        for move in unclaimed - own:
+            outcomes[move.id] = (False, _('Envoi EBMS déjà en cours.'))
+
+        results = run_dispatch(jobs, url, trace_ids) if jobs else {}
+
+        with registry.cursor() as cr:
+            env = self.env(cr=cr)
+            persist_tokens(env, jobs)
+            for move_id, (payload, result) in results.items():
+                spans.add_call(move_id, trace_ids[move_id], 'obr_call', result)
+                outcomes[move_id] = spans.timed(move_id, trace_ids[move_id], 'persist',
+                                                env['account.move'].browse(move_id)._ebms_apply_send_result, payload, result, url)
+            spans.write(env)
+        self.invalidate_recordset()
+        if own:
+            _logger.info('Factures %s non committées par la transaction appelante : envoi EBMS en ligne.', own.ids)
+            sent = own._ebms_send_batch()
+            outcomes.update({move.id: (move in sent or move.ebms_status == 'sent', move.ebms_error_message) for move in own})
+        return outcomes
+
+    def _ebms_held_by_current_transaction(self):
+        """
+        Factures dont l'état EBMS est tenu par la transaction courante : lignes créées ou
+        modifiées sans commit, que la transaction courte de la phase 1 ne peut ni voir ni
+        verrouiller. Une ligne verrouillée par une autre transaction n'est pas retenue.
+        """
+        if not self:
+            return self
+        self.env.cr.execute("""
+            SELECT move_id FROM account_move_ebms WHERE move_id IN %s FOR UPDATE SKIP LOCKED
+        """, (tuple(self.ids),))
+        held = {row[0] for row in self.env.cr.fetchall()}
+        return self.filtered(lambda m: m.id in held)
+
+    def _ebms_claim(self):
+        """
+        Phase 1 : verrouille l'état EBMS des factures (SKIP LOCKED, la ligne account_move reste
+        libre) et réserve celles qui peuvent être envoyées.
+        Une réservation 'sending' abandonnée (worker tué) est reprise après STALE_SENDING_MINUTES.
+        L'invoice_identifier est figé ici pour qu'un nouvel essai réutilise le même identifiant,
+        de même que l'identifiant de corrélation de la soumission.
+        Retourne (factures réservées, {id: (succès, message)} pour les autres factures verrouillées).
+        Les factures absentes des deux (état non committé ou verrouillé par une autre transaction)
+        sont laissées à l'appelant.
+        """
+        if not self:
+            return self, {}
+        self.env.cr.execute("""
+            SELECT move_id FROM account_move_ebms WHERE move_id IN %s FOR UPDATE SKIP LOCKED
+        """, (tuple(self.ids),))
+        locked = {row[0] for row in self.env.cr.fetchall()}
+        stale = fields.Datetime.now() - timedelta(minutes=STALE_SENDING_MINUTES)
+        claimed = self.browse()
+        outcomes = {}
+        for move in self.filtered(lambda m: m.id in locked):
+            if move.ebms_status in ('draft', 'error') or (move.ebms_status == 'sending' and move.ebms_state_ids.write_date < stale):
+                claimed |= move
+            elif move.ebms_status == 'sent':
+                outcomes[move.id] = (True, _('Facture déjà envoyée vers EBMS.'))
+            else:
+                outcomes[move.id] = (False, _('Envoi EBMS déjà en cours ou facture annulée.'))
+        claimed._ebms_record_attempt()
+        for move in claimed:
+            vals = {'ebms_status': 'sending'}
+            if not move.ebms_invoice_identifier:
+                vals['ebms_invoice_identifier'] = move._ebms_new_invoice_identifier()
+            if not move.ebms_trace_id:
+                vals['ebms_trace_id'] = new_trace_id()
+            move.write(vals)
+        return claimed, outcomes
+
+    def _ebms_dispatch_keys(self):
+        """
+        Clés d'ordre d'envoi du lot (voir ebms_dispatcher), {id: clé}.
+        Un avoir ou une facture de remplacement prend la clé de la facture d'origine : dans un
+        même lot, il part après elle, et n'est pas envoyé si elle échoue. Les autres factures
+        sont indépendantes. Avec ebms.ordered_sequence, toutes les factures d'un même système
+        (device) partent dans l'ordre de création.
+        """
+        if self.env['ir.config_parameter'].sudo().get_param('ebms.ordered_sequence'):
+            systems = {company.id: company._get_ebms_credentials()['system_id'] for company in self.company_id}
+            return {move.id: (move.company_id.id, systems[move.company_id.id]) for move in self}
+        by_identifier = {move.ebms_invoice_identifier: move.id for move in self if move.ebms_invoice_identifier}
+        keys = {}
+        for move in self:
+            original = move.ebms_replaced_invoice_id or move.reversed_entry_id
+            if not original and move.ebms_cancelled_invoice_ref:
+                keys[move.id] = by_identifier.get(move.ebms_cancelled_invoice_ref, move.ebms_cancelled_invoice_ref)
+            else:
+                keys[move.id] = (original or move).id
+        return keys
+
+    def _ebms_build_payload(self, url):
+        """Payload d'addInvoice : format minimal pour le serveur de démo, format OBR sinon."""
+        self.ensure_one()
+        if url and '/ebms/demo/' in url:
+            return self._prepare_ebms_data_demo()
+        return self._prepare_ebms_data_burundi()
+
+    def _ebms_apply_send_result(self, payload, result, url):
+        """
+        Phase 3 : enregistre le résultat normalisé du client pour une facture.
+        Retourne (succès, message).
+        """
+        self.ensure_one()
+        if result['success'] and result['data'].get('relay'):
+            return self._ebms_apply_relay_receipt(payload, result['data'])
+        if result['success']:
+            result = self._ebms_parse_send_response(result['data'], url)
+        # Log brut de la réponse pour audit ; le même texte canonique est stocké et sert à la signature.
+        result_json = ebms_json.canonical_text(result)
+        self.message_post(body=f"[EBMS API Response] {result_json}")
+        if result['success']:
+            self.write({
+                'ebms_status': 'sent',
+                'ebms_reference': result['reference'],
+                'ebms_invoice_identifier': payload.get('invoice_identifier') or self.ebms_invoice_identifier,
+                'ebms_error_message': False,
+                'ebms_sent_date': fields.Datetime.now(),
+                'ebms_acknowledged_at': fields.Datetime.now(),
+                'ebms_signature': result['electronic_signature'],
+                'ebms_result_data': result_json,
+            })
+            self.message_post(body=_('Facture envoyée avec succès vers EBMS. Référence: %s') % result['reference'])
+            return True, result['reference']
+        msg = result['msg'] or _('Erreur inconnue lors de l’envoi EBMS.')
+        self.write({
+            'ebms_status': 'error',
+            'ebms_error_message': msg,
+        })
+        self.message_post(body=_('Erreur lors de l’envoi EBMS : %s') % msg)
+        return False, msg
+
+    def _ebms_apply_relay_receipt(self, payload, resp_json):
+        """
+        Soumission mise en file par le relais d'agence (voir ebms_relay) : la facture attend
+        l'accusé de l'OBR, relu par _cron_ebms_relay_acks.
+        """
+        self.ensure_one()
+        self.write({
+            'ebms_status': 'relayed',
+            'ebms_invoice_identifier': payload.get('invoice_identifier') or self.ebms_invoice_identifier,
+            'ebms_error_message': False,
+        })
+        msg = _('Facture confiée au relais EBMS (file n° %s) : elle sera transmise à l\'OBR dès que la liaison le permettra.') \
+            % resp_json['relay'].get('id')
+        self.message_post(body=msg)
+        return True, msg
+
+    @api.model
+    def _cron_ebms_relay_acks(self):
+        """
+        Relit les accusés OBR reçus par le relais d'agence (ebms.relay_url) depuis le dernier
+        numéro traité (ebms.relay_ack_cursor) et les applique aux factures confiées au relais.
+        Un relais sert un seul compte OBR, celui des paramètres système : aucune société ne peut
+        avoir ses propres identifiants (voir res.company._check_ebms_relay_credentials), et
+        toutes les sociétés partagent donc le client global.
+        """
+        params = self.env['ir.config_parameter'].sudo()
+        relay_url = params.get_param('ebms.relay_url')
+        if not relay_url:
+            return
+        if self.env['res.company'].sudo().search_count([('ebms_api_username', '!=', False)]):
+            _logger.warning('Relais EBMS ignoré : des sociétés ont leurs propres identifiants EBMS, '
+                            'alors qu\'un relais ne sert que le compte des paramètres système.')
+            return
+        api_url = params.get_param('ebms.api_url')
+        client = get_client(self.env, self.env.company)
+        cursor = int(params.get_param('ebms.relay_ack_cursor') or 0)
+        while True:
+            result = client.post(relay_url.rstrip('/') + RELAY_ACKS_PATH, {'after': cursor, 'limit': RELAY_ACKS_LIMIT})
+            client.persist_token(self.env)
+            if not result['success']:
+                _logger.warning('Accusés du relais EBMS illisibles : %s', result['msg'])
+                return
+            acks = result['data'].get('acks') or []
+            if not acks:
+                return
+            moves = self.sudo().search([
+                ('ebms_status', '=', 'relayed'),
+                ('ebms_invoice_identifier', 'in', [ack['identifier'] for ack in acks]),
+            ])
+            by_identifier = {move.ebms_invoice_identifier: move for move in moves}
+            for ack in acks:
+                move = by_identifier.get(ack['identifier'])
+                if not move:
+                    continue
+                response = ack['response']
+                move._ebms_apply_send_result({'invoice_identifier': ack['identifier']}, {
+                    'success': ack['status'] == 200 and bool(response.get('success')),
+                    'data': response,
+                    'msg': response.get('msg', ''),
+                }, api_url)
+            cursor = acks[-1]['seq']
+            params.set_param('ebms.relay_ack_cursor', cursor)
+            if len(acks) < RELAY_ACKS_LIMIT:
+                return
 
     def _prepare_ebms_data(self):
         return self._prepare_ebms_data_burundi()
@@ -198,10 +537,8 @@ class AccountMoveInherit(models.Model):
         """
         self.ensure_one()
         
-        # Génération de l'identifiant de facture unique
-        system_id = self.env['ir.config_parameter'].sudo().get_param('ebms.system_id', 'ws00000000000000')
-        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-        invoice_identifier = f"{self.company_id.vat or ''}/{system_id}/{timestamp}/{self.name}"
+        # Identifiant de facture unique, figé dès la réservation de l'envoi
+        invoice_identifier = self.ebms_invoice_identifier or self._ebms_new_invoice_identifier()
 
         invoice_lines = []
         for line in self.invoice_line_ids.filtered(lambda l: not l.display_type):
@@ -218,38 +555,25 @@ class AccountMoveInherit(models.Model):
                 'item_vat': line.price_total - line.price_subtotal,
                 'item_total_amount': line.price_total,
             })
+        # En-tête contribuable et bloc client précalculés (res.company / res.partner)
+        partner = self.partner_id
         data = {
-            'tp_type': '2' if self.company_id.partner_id.company_type == 'company' else '1',
-            'tp_name': self.company_id.name,
-            'tp_TIN': self.company_id.vat,
-            'tp_trade_number': self.company_id.company_registry or '',
-            'tp_postal_number': self.company_id.partner_id.zip or '',
-            'tp_phone_number': self.company_id.partner_id.phone or '',
-            'tp_address_province': self.company_id.partner_id.state_id.name or '',
-            'tp_address_commune': self.company_id.partner_id.city or '',
-            'tp_address_quartier': self.company_id.partner_id.street2 or '',
-            'tp_address_avenue': '',
-            'tp_address_rue': self.company_id.partner_id.street or '',
-            'tp_address_number': '',
-            'vat_taxpayer': '1' if self.company_id.vat else '0',
-            'ct_taxpayer': '1',
-            'tl_taxpayer': '0',
-            'tp_fiscal_center': self.company_id.x_fiscal_center or '',
-            'tp_activity_sector': self.company_id.x_activity_sector or '',
-            'tp_legal_form': self.company_id.x_legal_form or '',
+            **self.company_id.ebms_taxpayer_data,
             'invoice_number': self.name,
             'invoice_date': self.invoice_date.strftime('%Y-%m-%d %H:%M:%S'),
             'invoice_type': self._get_ebms_invoice_type(),
             'invoice_currency': self.currency_id.name,
             'invoice_identifier': invoice_identifier,
             'payment_type': self._get_payment_type(),
-            'customer_name': self.partner_id.name,
-            'customer_TIN': self.partner_id.vat or '',
-            'customer_address': self._format_partner_address(),
-            'vat_customer_payer': '1' if self.partner_id.vat else '0',
+            'customer_name': partner.name,
+            'customer_TIN': partner.ebms_tin,
+            'customer_address': partner.ebms_address,
+            'vat_customer_payer': '1' if partner.ebms_vat_payer else '0',
             'lines': invoice_lines,
             'invoice_total_amount': self.amount_total,
         }
+        if self.ebms_cancelled_invoice_ref:
+            data['cancelled_invoice_ref'] = self.ebms_cancelled_invoice_ref
         if 'invoice_items' in data:
             data['lines'] = data.pop('invoice_items')
         if 'invoice_items' in data:
@@ -264,7 +588,7 @@ class AccountMoveInherit(models.Model):
         Ne contient que les champs nécessaires pour que le contrôleur de démo fonctionne.
         """
         self.ensure_one()
-        _logger.info('Préparation des données de DÉMO pour la facture %s avec un montant de %s', self.name, self.amount_total)
+        _logger.debug('Préparation des données de DÉMO pour la facture %s avec un montant de %s', self.name, self.amount_total)
         invoice_lines = []
         for line in self.invoice_line_ids:
             invoice_lines.append({
@@ -298,19 +622,11 @@ class AccountMoveInherit(models.Model):
             raise UserError(_("Signature EBMS INVALIDE. La signature ou les données de résultat sont manquantes pour la vérification."))
 
         try:
-            public_key = serialization.load_pem_public_key(
-                public_key_pem.encode('utf-8'),
-                backend=default_backend()
-            )
+            public_key = ebms_signature.load_public_key(public_key_pem)
 
-            # Normalisation du JSON pour la signature
-            import binascii
-            message_dict = json.loads(self.ebms_result_data)
-            message_bytes = json.dumps(
-                message_dict,
-                sort_keys=True,
-                separators=(',', ':')
-            ).encode('utf-8')
+            # ebms_result_data est stocké sous forme canonique : les octets signés s'en déduisent
+            # directement ; les données enregistrées avant la 1.2 sont ré-encodées.
+            message_bytes = ebms_json.signed_bytes(self.ebms_result_data)
 
             # La signature reçue est en Base64, il faut la décoder.
             try:
@@ -321,15 +637,18 @@ class AccountMoveInherit(models.Model):
                 raise UserError(error_msg)
 
             # L'API OBR signe le HASH du message, pas le message lui-même.
-            public_key.verify(
-                signature_bytes,
-                message_bytes,
-                padding.PKCS1v15(),
-                hashes.SHA256()
-            )
+            valid = ebms_signature.verify(public_key, signature_bytes, message_bytes)
+            if not valid:
+                legacy_bytes = ebms_json.legacy_signed_bytes(self.ebms_result_data)
+                valid = legacy_bytes != message_bytes and ebms_signature.verify(public_key, signature_bytes, legacy_bytes)
+            if not valid:
+                _logger.error("Erreur de validation de signature: La signature ne correspond pas.")
+                error_msg = _("Signature EBMS INVALIDE. La signature ne correspond pas aux données de la facture.")
+                self.message_post(body=error_msg)
+                raise UserError(error_msg)
 
-            # Si `verify` ne lève pas d'exception, la signature est valide.
             message = _("La signature électronique EBMS est VALIDE.")
+            self.ebms_verified_at = fields.Datetime.now()
             self.message_post(body=message)
             return {
                 'type': 'ir.actions.client',
@@ -342,11 +661,8 @@ class AccountMoveInherit(models.Model):
                 }
             }
 
-        except (InvalidSignature, binascii.Error):
-            _logger.error("Erreur de validation de signature: La signature ne correspond pas.")
-            error_msg = _("Signature EBMS INVALIDE. La signature ne correspond pas aux données de la facture.")
-            self.message_post(body=error_msg)
-            raise UserError(error_msg)
+        except UserError:
+            raise
         except Exception as e:
             _logger.error("Erreur technique de vérification de signature: %s", str(e))
             error_msg = _("Erreur technique lors de la vérification: %s") % str(e)
@@ -371,103 +687,289 @@ class AccountMoveInherit(models.Model):
         Retourne un dict avec success, reference, electronic_signature, msg, etc.
         """
         url = self.env['ir.config_parameter'].sudo().get_param('ebms.api_url')
-        token = self.env['ir.config_parameter'].sudo().get_param('ebms.api_token')
+        token = self.company_id._get_ebms_credentials()['token']
         if not url:
             return {'success': False, 'msg': 'Paramètre API EBMS manquant (url).'}
         # Si pas de token, ou token manifestement expiré, tente un login automatique
         if not token or len(token) < 10:
             from .ebms_utils import ebms_login
-            token = ebms_login(self.env)
+            token = ebms_login(self.env, company=self.company_id)
         headers = {
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
         }
+        started = time.monotonic()
+        response = None
         try:
             response = requests.post(url, headers=headers, json=ebms_data, timeout=30)
-            _logger.info('EBMS DEMO: Réponse brute HTTP = %s', response.text)
             # Si le token est expiré côté serveur (erreur 401 ou message explicite), on tente un refresh + retry (une seule fois)
             if response.status_code == 401:
                 _logger.warning('Token EBMS expiré ou invalide, tentative de rafraîchissement...')
                 from .ebms_utils import ebms_login
-                new_token = ebms_login(self.env)
-                self.env['ir.config_parameter'].sudo().set_param('ebms.api_token', new_token)
+                new_token = ebms_login(self.env, company=self.company_id)
+                self.company_id._set_ebms_token(new_token)
                 headers['Authorization'] = f'Bearer {new_token}'
                 response = requests.post(url, headers=headers, json=ebms_data, timeout=30)
-                _logger.info('EBMS RETRY: Réponse brute HTTP = %s', response.text)
             response.raise_for_status()
             resp_json = response.json()
-            _logger.info('EBMS DEMO: Réponse JSON décodée = %s', resp_json)
-            _logger.info('EBMS API Response: %s', resp_json)
-
-            # Patch pour compatibilité demo : succès si 'success' ou (demo et 'result')
-            is_demo_success = (url and '/ebms/demo/' in url and resp_json.get('result'))
-            if resp_json.get('success') or is_demo_success:
-                result_data = resp_json.get('result', {})
-                # Recherche tolérante de la référence
-                ref = (
-                    resp_json.get('reference') or
-                    resp_json.get('ref') or
-                    resp_json.get('invoice_reference') or
-                    result_data.get('reference') or
-                    result_data.get('ref') or
-                    result_data.get('invoice_reference') or
-                    result_data.get('invoice_registered_number', '')
-                )
-                return {
-                    'success': True,
-                    'reference': ref,
-                    'electronic_signature': resp_json.get('electronic_signature', ''),
-                    'result_data': result_data, # Garder l'objet result complet pour la signature
-                    'msg': resp_json.get('msg', 'Succès'),
-                }
-            else:
-                return {
-                    'success': False,
-                    'msg': resp_json.get('msg', 'Erreur inconnue renvoyée par EBMS.'),
-                }
+            result = self._ebms_parse_send_response(resp_json, url)
+            log_exchange(url, response.status_code, time.monotonic() - started, payload=ebms_data, response=resp_json,
+                         error=None if result['success'] else result['msg'], ids=self.ids, company_id=self.company_id.id)
+            return result
         except Exception as e:
-            _logger.error('Erreur lors de l’appel API EBMS : %s', str(e))
-            return {'success': False, 'msg': str(e)}
+            log_exchange(url, getattr(response, 'status_code', None), time.monotonic() - started, payload=ebms_data,
+                         response=getattr(response, 'text', None), error=str(e), ids=self.ids, company_id=self.company_id.id)
+            return {'success': False, 'msg': '%s: %s' % (type(e).__name__, e)}
 
-    def action_cancel_ebms(self):
+    @api.model
+    def _ebms_parse_send_response(self, resp_json, url):
         """
-        Annule une facture côté EBMS (conforme doc OBR).
-        Appelle l’endpoint d’annulation, gère la réponse et notifie l’utilisateur.
+        Normalise la réponse JSON d'addInvoice en dict success/reference/electronic_signature/result_data/msg.
         """
+        # Patch pour compatibilité demo : succès si 'success' ou (demo et 'result')
+        is_demo_success = (url and '/ebms/demo/' in url and resp_json.get('result'))
+        if resp_json.get('success') or is_demo_success:
+            result_data = resp_json.get('result', {})
+            # Recherche tolérante de la référence
+            ref = (
+                resp_json.get('reference') or
+                resp_json.get('ref') or
+                resp_json.get('invoice_reference') or
+                result_data.get('reference') or
+                result_data.get('ref') or
+                result_data.get('invoice_reference') or
+                result_data.get('invoice_registered_number', '')
+            )
+            return {
+                'success': True,
+                'reference': ref,
+                'electronic_signature': resp_json.get('electronic_signature', ''),
+                'result_data': result_data, # Garder l'objet result complet pour la signature
+                'msg': resp_json.get('msg', 'Succès'),
+            }
+        return {
+            'success': False,
+            'msg': resp_json.get('msg', 'Erreur inconnue renvoyée par EBMS.'),
+        }
+
+    def _ebms_send_batch(self):
+        """
+        Envoie un lot de factures en parallèle via le client EBMS partagé, dans la transaction
+        courante (factures tout juste créées, non encore committées).
+        Contrairement à action_send_ebms, une erreur sur une facture n'interrompt pas le lot :
+        chaque facture reçoit son statut. Retourne les factures envoyées avec succès.
+        """
+        url = self.env['ir.config_parameter'].sudo().get_param('ebms.api_url')
+        if not url:
+            raise UserError(_('Paramètre API EBMS manquant (url).'))
+        to_send = self.filtered(
+            lambda m: m.state == 'posted'
+            and m.move_type in ('out_invoice', 'out_refund')
+            and m.ebms_status in ('draft', 'error')
+        )
+        if not to_send:
+            return to_send
+        to_send._ebms_record_attempt()
+        trace_ids = to_send._ebms_ensure_trace()
+        spans = SpanLog()
+        build_payload = lambda move: spans.timed(move.id, trace_ids[move.id], 'build_payload', move._ebms_build_payload, url)
+        dispatch_keys = to_send._ebms_dispatch_keys()
+        sent = self.browse()
+        for move, payload, result in dispatch_by_company(to_send.sorted('id'), url, build_payload, trace_ids,
+                                                         lambda move: dispatch_keys[move.id]):
+            spans.add_call(move.id, trace_ids[move.id], 'obr_call', result)
+            ok, _msg = spans.timed(move.id, trace_ids[move.id], 'persist', move._ebms_apply_send_result, payload, result, url)
+            if ok:
+                sent |= move
+        spans.write(self.env)
+        return sent
+
+    def _ebms_record_attempt(self):
+        """Compte une tentative d'envoi et date la première, en une requête pour le lot."""
+        states = self._ebms_state()
+        states.flush_recordset()
+        self.env.cr.execute("""
+            UPDATE account_move_ebms
+               SET ebms_attempts = COALESCE(ebms_attempts, 0) + 1,
+                   ebms_first_attempt_at = COALESCE(ebms_first_attempt_at, now() at time zone 'UTC')
+             WHERE id IN %s
+        """, (tuple(states.ids),))
+        states.invalidate_recordset(['ebms_attempts', 'ebms_first_attempt_at'])
+
+    def _ebms_ensure_trace(self):
+        """
+        Identifiant de corrélation de la soumission en cours (voir ebms_tracing), attribué en une
+        requête aux factures qui n'en ont pas encore. Retourne {id: identifiant}.
+        """
+        if self.filtered(lambda m: not m.ebms_trace_id):
+            states = self._ebms_state()
+            states.flush_recordset(['ebms_trace_id'])
+            # Même forme que new_trace_id() : 32 caractères hexadécimaux.
+            self.env.cr.execute("""
+                UPDATE account_move_ebms
+                   SET ebms_trace_id = md5(random()::text || clock_timestamp()::text || id::text)
+                 WHERE id IN %s AND ebms_trace_id IS NULL
+            """, (tuple(states.ids),))
+            states.invalidate_recordset(['ebms_trace_id'])
+            self.invalidate_recordset(['ebms_trace_id'])
+        return {move.id: move.ebms_trace_id for move in self}
+
+    def _ebms_new_invoice_identifier(self):
+        """Nouvel invoice_identifier OBR : TIN/système/horodatage/numéro."""
         self.ensure_one()
+        system_id = self.company_id._get_ebms_credentials()['system_id'] or 'ws00000000000000'
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return f"{self.company_id.vat or ''}/{system_id}/{timestamp}/{self.name}"
+
+    def _get_ebms_invoice_identifier(self):
+        """Identifiant OBR de la facture (invoice_identifier envoyé), à défaut la référence EBMS."""
+        self.ensure_one()
+        return self.ebms_invoice_identifier or self.ebms_reference
+
+    def _ebms_backfill_identifier(self):
+        """
+        invoice_identifier présumé d'une facture envoyée sans accusé local.
+        Le modèle est configurable (ebms.backfill_identifier_template). L'horodatage est celui
+        de l'envoi s'il est connu ; sinon, pour les factures envoyées avant le suivi de la date
+        d'envoi, la date de création de la facture, à défaut sa date de facture (minuit).
+        Retourne False si rien ne permet de reconstituer l'identifiant.
+        """
+        self.ensure_one()
+        if self.ebms_invoice_identifier:
+            return self.ebms_invoice_identifier
+        moment = self.ebms_sent_date or self.create_date or (
+            self.invoice_date and datetime.combine(self.invoice_date, datetime.min.time()))
+        if not moment or not self.name or self.name == '/':
+            return False
+        template = self.env['ir.config_parameter'].sudo().get_param(
+            'ebms.backfill_identifier_template', DEFAULT_BACKFILL_IDENTIFIER_TEMPLATE)
+        return template.format(
+            tin=self.company_id.vat or '',
+            system_id=self.company_id._get_ebms_credentials()['system_id'] or '',
+            timestamp=moment.strftime('%Y%m%d%H%M%S'),
+            name=self.name,
+        )
+
+    def action_open_ebms_cancel_wizard(self):
+        """Ouvre l'assistant d'annulation EBMS (motif, remplacement) pour les factures sélectionnées."""
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Annuler EBMS'),
+            'res_model': 'ebms.cancel.wizard',
+            'view_mode': 'form',
+            'target': 'new',
+            'context': {'active_model': 'account.move', 'active_ids': self.ids},
+        }
+
+    def action_cancel_ebms(self, cn_motif=None):
+        """
+        Annule les factures côté EBMS (cancelInvoice, conforme doc OBR).
+        Envoie invoice_identifier et cn_motif ; les appels sont parallélisés pour un lot.
+        Retourne une notification récapitulative au lieu d'une notification par facture.
+        """
+        cn_motif = cn_motif or self.env.context.get('ebms_cn_motif') or _('Annulation demandée depuis Odoo')
+        down = self.filtered(lambda m: m.ebms_status == 'sent')._ebms_obr_down()
+        if down:
+            raise UserError(self.env['ebms.health.probe']._down_message(down[0].company_id))
+        cancelled = self._ebms_cancel_batch(cn_motif)
+        failed = self.filtered(lambda m: m.ebms_status == 'sent') - cancelled
+        if failed:
+            message = _('%(ok)s facture(s) annulée(s) côté EBMS, %(ko)s en erreur.', ok=len(cancelled), ko=len(failed))
+        else:
+            message = _('%s facture(s) annulée(s) avec succès côté EBMS.') % len(cancelled)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Annulation EBMS'),
+                'message': message,
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+            }
+        }
+
+    def _ebms_cancel_batch(self, cn_motif):
+        """
+        Jambe « annulation » du pipeline : appelle cancelInvoice pour chaque facture encore
+        envoyée (ebms_status = 'sent'). Les factures déjà annulées sont ignorées, ce qui permet
+        de relancer le pipeline après un échec partiel sans ré-annuler.
+        Retourne les factures annulées lors de cet appel.
+        """
+        to_cancel = self.filtered(lambda m: m.ebms_status == 'sent')
+        if not to_cancel:
+            return to_cancel
         url = self.env['ir.config_parameter'].sudo().get_param('ebms.cancel_url')
-        token = self.env['ir.config_parameter'].sudo().get_param('ebms.api_token')
-        if not url or not token:
+        if not url:
             raise UserError(_('Paramètres API EBMS manquants (url ou token).'))
-        headers = {
-            'Authorization': f'Bearer {token}',
-            'Content-Type': 'application/json',
-        }
-        payload = {
-            'invoice_number': self.name,  # Ou autre identifiant selon la doc OBR
-            # TODO: Ajouter d’autres champs requis si besoin
+        build_payload = lambda move: {
+            'invoice_identifier': move._get_ebms_invoice_identifier(),
+            'cn_motif': cn_motif,
         }
-        try:
-            response = requests.post(url, headers=headers, json=payload, timeout=30)
-            response.raise_for_status()
-            resp_json = response.json()
-            self.message_post(body=f"[EBMS Cancel Response] {resp_json}")
-            if resp_json.get('success'):
-                self.ebms_status = 'draft'  # Ou autre statut selon la logique métier
-                self.ebms_error_message = False
-                message = _('Facture annulée avec succès côté EBMS.')
-                self.message_post(body=message)
-                self.env.user.notify_success(message)
+        trace_ids = to_cancel._ebms_ensure_trace()
+        spans = SpanLog()
+        dispatch_keys = to_cancel._ebms_dispatch_keys()
+        cancelled = self.browse()
+        for move, _payload, result in dispatch_by_company(to_cancel.sorted('id'), url, build_payload, trace_ids,
+                                                          lambda move: dispatch_keys[move.id]):
+            spans.add_call(move.id, trace_ids[move.id], 'cancel', result)
+            move.message_post(body=_('[EBMS Cancel Response] %s') % (result['data'] or result['msg']))
+            if result['success']:
+                move.write({
+                    'ebms_status': 'cancelled',
+                    'ebms_cn_motif': cn_motif,
+                    'ebms_error_message': False,
+                })
+                ebms_invoice_cache.invalidate(self.env, move.ebms_reference, move.ebms_invoice_identifier)
+                move.message_post(body=_('Facture annulée avec succès côté EBMS. Motif : %s') % cn_motif)
+                cancelled |= move
             else:
-                self.ebms_error_message = resp_json.get('msg', 'Erreur inconnue lors de l’annulation EBMS.')
-                message = _('Erreur lors de l’annulation EBMS : %s') % resp_json.get('msg', 'Erreur inconnue')
-                self.message_post(body=message)
-                self.env.user.notify_danger(message)
-        except Exception as e:
-            self.ebms_error_message = str(e)
-            error_msg = _('Exception annulation EBMS : %s') % e
-            self.message_post(body=error_msg)
-            self.env.user.notify_danger(error_msg)
+                move.ebms_error_message = result['msg'] or _('Erreur inconnue lors de l’annulation EBMS.')
+                move.message_post(body=_('Erreur lors de l’annulation EBMS : %s') % move.ebms_error_message)
+        spans.write(self.env)
+        return cancelled
+
+    def _ebms_create_replacements(self, reverse_original=True, post=True):
+        """
+        Jambe « remplacement » du pipeline : pour chaque facture annulée côté EBMS sans
+        remplaçante, crée une copie portant cancelled_invoice_ref. Si post est vrai, la copie
+        est validée ; sinon elle reste en brouillon pour correction avant envoi.
+        L'original peut être extourné en comptabilité ; l'avoir d'extourne est marqué
+        'cancelled' car l'annulation EBMS en tient déjà lieu côté OBR.
+        Retourne les factures de remplacement créées.
+        """
+        replacements = self.browse()
+        for move in self.filtered(lambda m: m.ebms_status == 'cancelled' and not m.ebms_replacement_id):
+            replacement = move.copy({
+                'invoice_date': move.invoice_date,
+                'ebms_cancelled_invoice_ref': move._get_ebms_invoice_identifier(),
+                'ebms_replaced_invoice_id': move.id,
+            })
+            move.ebms_replacement_id = replacement
+            if reverse_original and move.state == 'posted':
+                reversal = move._reverse_moves(
+                    [{'ref': _('Annulation EBMS de %s') % move.name, 'ebms_status': 'cancelled'}],
+                    cancel=move.payment_state == 'not_paid',
+                )
+                reversal.message_post(body=_('Avoir d’extourne de la facture annulée côté EBMS %s : non transmis à l’OBR.') % move.name)
+            if post:
+                replacement.action_post()
+            move.message_post(body=_('Facture de remplacement créée : %s') % replacement.display_name)
+            replacements |= replacement
+        return replacements
+
+    def _ebms_cancel_and_replace(self, cn_motif, reverse_original=True, post_replacements=True):
+        """
+        Pipeline complet annuler-et-remplacer. Chaque jambe ne traite que les factures qui en
+        ont besoin : une relance après échec partiel reprend là où le pipeline s'est arrêté.
+        Retourne (annulées, remplaçantes créées, remplaçantes envoyées).
+        """
+        cancelled = self._ebms_cancel_batch(cn_motif)
+        created = self._ebms_create_replacements(reverse_original=reverse_original, post=post_replacements)
+        sent = self.browse()
+        if post_replacements:
+            pending = self.mapped('ebms_replacement_id').filtered(lambda m: m.state == 'posted')
+            sent = pending._ebms_send_batch()
+        return cancelled, created, sent
 
     def action_check_nif_ebms(self):
         """
@@ -476,9 +978,11 @@ class AccountMoveInherit(models.Model):
         """
         self.ensure_one()
         url = self.env['ir.config_parameter'].sudo().get_param('ebms.nif_check_url')
-        token = self.env['ir.config_parameter'].sudo().get_param('ebms.api_token')
+        token = self.company_id._get_ebms_credentials()['token']
         if not url or not token:
             raise UserError(_('Paramètres API EBMS manquants (url ou token).'))
+        if self._ebms_obr_down():
+            raise UserError(self.env['ebms.health.probe']._down_message(self.company_id))
         headers = {
             'Authorization': f'Bearer {token}',
             'Content-Type': 'application/json',
@@ -487,10 +991,17 @@ class AccountMoveInherit(models.Model):
             'nif': self.partner_id.vat or '',
         }
         try:
+            started = time.monotonic()
             response = requests.post(url, headers=headers, json=payload, timeout=30)
+            log_exchange(url, response.status_code, time.monotonic() - started, payload=payload,
+                         ids=self.ids, company_id=self.company_id.id)
             response.raise_for_status()
             resp_json = response.json()
             self.message_post(body=f"[EBMS NIF Check Response] {resp_json}")
+            self.partner_id.sudo().write({
+                'ebms_tin_check': 'valid' if resp_json.get('valid', False) else 'invalid',
+                'ebms_tin_checked_at': fields.Datetime.now(),
+            })
             if resp_json.get('valid', False):
                 message = _('NIF client valide selon EBMS.')
                 self.message_post(body=message)
@@ -513,6 +1024,7 @@ class AccountMoveInherit(models.Model):
                 'ebms_error_message': False,
                 'ebms_sent_date': False,
                 'ebms_result_data': False,
+                'ebms_trace_id': False,
             })
             record.message_post(body=_('Statut EBMS remis à brouillon'))
 
@@ -558,19 +1070,8 @@ class AccountMoveInherit(models.Model):
         return ebms_data
 
     def _format_partner_address(self):
-        """Formate l'adresse du partenaire"""
-        address_parts = []
-        if self.partner_id.street:
-            address_parts.append(self.partner_id.street)
-        if self.partner_id.street2:
-            address_parts.append(self.partner_id.street2)
-        if self.partner_id.city:
-            address_parts.append(self.partner_id.city)
-        if self.partner_id.state_id:
-            address_parts.append(self.partner_id.state_id.name)
-        if self.partner_id.country_id:
-            address_parts.append(self.partner_id.country_id.name)
-        return ', '.join(address_parts)
+        """Formate l'adresse du partenaire (précalculée sur res.partner)"""
+        return self.partner_id.ebms_address or ''
 
     def _format_company_address(self):
         """Formate l'adresse de la société"""
@@ -651,7 +1152,8 @@ class AccountMoveInherit(models.Model):
                 'ebms_status': 'draft',
                 'ebms_reference': False,
                 'ebms_error_message': False,
-                'ebms_sent_date': False
+                'ebms_sent_date': False,
+                'ebms_trace_id': False,
             })
             record.message_post(body=_('Statut EBMS remis à brouillon'))
             
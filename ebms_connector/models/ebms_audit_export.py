@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Export en flux de la piste d'audit EBMS (factures et mouvements de stock).
+
+Les lignes sont lues avec un curseur serveur PostgreSQL (curseur nommé) par
+paquets de taille fixe et écrites directement dans un fichier : la mémoire
+consommée ne dépend pas de la période exportée, y compris avec les blobs
+ebms_result_data. Seule exception : une pièce jointe stockée en base, dont le
+contenu est chargé en une fois et donc limité (MAX_DB_EXPORT_BYTES).
+"""
+import csv
+import gzip
+import hashlib
+import io
+import json
+import logging
+import os
+import tempfile
+import uuid
+
+from odoo import _
+from odoo.exceptions import UserError
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 2000
+# Avec le stockage des pièces jointes en base, l'export est chargé en mémoire : taille bornée.
+MAX_DB_EXPORT_BYTES = 50 * 1024 * 1024
+
+INVOICE_COLUMNS = [
+    'model', 'id', 'company_id', 'name', 'move_type', 'date', 'partner_name', 'amount_total',
+    'ebms_status', 'ebms_reference', 'ebms_invoice_identifier', 'ebms_signature',
+    'ebms_sent_date', 'ebms_error_message', 'ebms_result_data',
+]
+STOCK_COLUMNS = [
+    'model', 'id', 'company_id', 'name', 'ebms_movement_type', 'date', 'item_code', 'item_quantity',
+    'ebms_stock_status', 'ebms_stock_reference', 'ebms_stock_sent_date', 'ebms_stock_error_message',
+]
+COLUMNS = list(dict.fromkeys(INVOICE_COLUMNS + STOCK_COLUMNS))
+
+_INVOICE_QUERY = """
+    SELECT 'account.move', m.id, m.company_id, m.name, m.move_type, m.invoice_date, p.name, m.amount_total,
+           e.ebms_status, e.ebms_reference, e.ebms_invoice_identifier, e.ebms_signature,
+           e.ebms_sent_date, e.ebms_error_message, e.ebms_result_data
+      FROM account_move m
+      JOIN account_move_ebms e ON e.move_id = m.id
+      LEFT JOIN res_partner p ON p.id = m.partner_id
+     WHERE m.move_type IN ('out_invoice', 'out_refund')
+       AND m.invoice_date >= %(date_from)s AND m.invoice_date <= %(date_to)s
+       AND e.ebms_status IN %(states)s
+       AND m.company_id IN %(company_ids)s
+     ORDER BY m.id
+"""
+
+_STOCK_QUERY = """
+    SELECT 'stock.move', sm.id, sm.company_id, sm.name, sm.ebms_movement_type, sm.date, pp.default_code,
+           sm.product_uom_qty, COALESCE(e.ebms_stock_status, 'draft'), e.ebms_stock_reference, e.ebms_stock_sent_date,
+           e.ebms_stock_error_message
+      FROM stock_move sm
+      LEFT JOIN stock_move_ebms e ON e.move_id = sm.id
+      LEFT JOIN product_product pp ON pp.id = sm.product_id
+     WHERE sm.date >= %(date_from)s AND sm.date < %(date_to)s::date + 1
+       AND COALESCE(e.ebms_stock_status, 'draft') IN %(states)s
+       AND sm.company_id IN %(company_ids)s
+     ORDER BY sm.id
+"""
+
+
+def iter_rows(env, date_from, date_to, company_ids, states=('sent', 'cancelled'),
+              include_stock=True, chunk_size=DEFAULT_CHUNK_SIZE):
+    """
+    Génère les lignes d'audit sous forme de dicts, paquet par paquet.
+    Le curseur nommé partage la transaction de env.cr : on vide d'abord le cache ORM
+    pour que les écritures en attente soient visibles.
+    """
+    env.flush_all()
+    params = {
+        'date_from': date_from,
+        'date_to': date_to,
+        'states': tuple(states),
+        'company_ids': tuple(company_ids),
+    }
+    queries = [(_INVOICE_QUERY, INVOICE_COLUMNS)]
+    if include_stock:
+        queries.append((_STOCK_QUERY, STOCK_COLUMNS))
+    for query, columns in queries:
+        cursor = env.cr._cnx.cursor(name='ebms_audit_%s' % uuid.uuid4().hex)
+        try:
+            cursor.itersize = chunk_size
+            cursor.execute(query, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield dict(zip(columns, row))
+        finally:
+            cursor.close()
+
+
+def _json_default(value):
+    return value.isoformat() if hasattr(value, 'isoformat') else str(value)
+
+
+def write_jsonl(rows, binary_file):
+    """Écrit une ligne JSON par enregistrement ; ebms_result_data est ré-imbriqué comme objet."""
+    count = 0
+    for row in rows:
+        result_data = row.get('ebms_result_data')
+        if result_data:
+            try:
+                row['ebms_result_data'] = json.loads(result_data)
+            except ValueError:
+                pass
+        binary_file.write(json.dumps(row, ensure_ascii=False, default=_json_default).encode('utf-8'))
+        binary_file.write(b'\n')
+        count += 1
+    return count
+
+
+def write_csv(rows, binary_file):
+    """Écrit un CSV UTF-8 avec l'union des colonnes factures et stock."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=COLUMNS, extrasaction='ignore')
+    writer.writeheader()
+    count = 0
+    for row in rows:
+        writer.writerow({key: _json_default(value) if value is not None else '' for key, value in row.items()})
+        count += 1
+        binary_file.write(buffer.getvalue().encode('utf-8'))
+        buffer.seek(0)
+        buffer.truncate()
+    if not count:
+        binary_file.write(buffer.getvalue().encode('utf-8'))
+    return count
+
+
+WRITERS = {
+    'jsonl': write_jsonl,
+    'csv': write_csv,
+}
+
+
+class _HashingWriter:
+    """Fichier binaire en écriture qui calcule le sha1 et la taille au fil de l'eau."""
+
+    def __init__(self, raw):
+        self.raw = raw
+        self.sha1 = hashlib.sha1()
+        self.size = 0
+
+    def write(self, data):
+        self.sha1.update(data)
+        self.size += len(data)
+        return self.raw.write(data)
+
+    def flush(self):
+        return self.raw.flush()
+
+
+def export_to_file(env, path, fmt='jsonl', compress=False, **filters):
+    """Exporte la piste d'audit vers un fichier du serveur. Retourne le nombre de lignes."""
+    with open(path, 'wb') as raw:
+        sink = gzip.GzipFile(fileobj=raw, mode='wb') if compress else raw
+        try:
+            return WRITERS[fmt](iter_rows(env, **filters), sink)
+        finally:
+            if compress:
+                sink.close()
+
+
+def export_to_attachment(env, name, fmt='jsonl', compress=False, **filters):
+    """
+    Exporte la piste d'audit dans une pièce jointe. Avec le stockage fichier (par défaut),
+    le flux est écrit directement dans le filestore, à l'emplacement que l'ORM donnerait au
+    même contenu (empreinte sha1 calculée au fil de l'eau), et le fichier est signalé au
+    ramasse-miettes des pièces jointes comme par _file_write. Avec le stockage en base, le
+    contenu doit être chargé en une fois : il est limité à MAX_DB_EXPORT_BYTES.
+    Retourne (pièce jointe, nombre de lignes).
+    """
+    Attachment = env['ir.attachment'].sudo()
+    mimetype = 'application/gzip' if compress else ('text/csv' if fmt == 'csv' else 'application/x-ndjson')
+    filestore = Attachment._filestore()
+    os.makedirs(filestore, exist_ok=True)
+    fd, tmp_path = tempfile.mkstemp(prefix='ebms_audit_', dir=filestore)
+    try:
+        with os.fdopen(fd, 'wb') as raw:
+            hashing = _HashingWriter(raw)
+            sink = gzip.GzipFile(fileobj=hashing, mode='wb') if compress else hashing
+            try:
+                count = WRITERS[fmt](iter_rows(env, **filters), sink)
+            finally:
+                if compress:
+                    sink.close()
+        if Attachment._storage() != 'file':
+            if hashing.size > MAX_DB_EXPORT_BYTES:
+                raise UserError(_('Export trop volumineux pour le stockage des pièces jointes en base '
+                                  '(%s octets, maximum %s) : réduisez la période ou utilisez la commande '
+                                  'd\'export vers un fichier.') % (hashing.size, MAX_DB_EXPORT_BYTES))
+            with open(tmp_path, 'rb') as f:
+                attachment = Attachment.create({'name': name, 'raw': f.read(), 'mimetype': mimetype})
+            return attachment, count
+        checksum = hashing.sha1.hexdigest()
+        fname = '%s/%s' % (checksum[:2], checksum)
+        full_path = Attachment._full_path(fname)
+        os.makedirs(os.path.dirname(full_path), exist_ok=True)
+        if not os.path.exists(full_path):
+            os.replace(tmp_path, full_path)
+        Attachment._mark_for_gc(fname)
+        attachment = Attachment.create({
+            'name': name,
+            'type': 'binary',
+            'mimetype': mimetype,
+            'store_fname': fname,
+            'checksum': checksum,
+            'file_size': hashing.size,
+        })
+        return attachment, count
+    finally:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
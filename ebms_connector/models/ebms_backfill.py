@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from . import ebms_json
+from .ebms_invoice_cache import lookup_invoices
+from .ebms_tracing import SpanLog
+
+_logger = logging.getLogger(__name__)
+
+
+class EBMSBackfillJob(models.Model):
+    _name = 'ebms.backfill.job'
+    _description = 'Import historique EBMS (getInvoice)'
+    _order = 'id desc'
+
+    name = fields.Char(string='Nom', required=True, default=lambda self: _('Import historique EBMS'))
+    company_id = fields.Many2one('res.company', string='Société', required=True, default=lambda self: self.env.company)
+    date_from = fields.Date(string='Du', required=True)
+    date_to = fields.Date(string='Au', required=True)
+    state = fields.Selection([
+        ('draft', 'Brouillon'),
+        ('running', 'En cours'),
+        ('paused', 'En pause'),
+        ('done', 'Terminé'),
+    ], string='État', default='draft', required=True)
+    chunk_size = fields.Integer(string='Taille des paquets', default=200, required=True)
+    last_move_id = fields.Integer(string='Point de reprise', default=0, readonly=True,
+                                  help="Identifiant de la dernière facture traitée ; le job reprend après celle-ci.")
+    processed_count = fields.Integer(string='Factures traitées', readonly=True)
+    matched_count = fields.Integer(string='Accusés importés', readonly=True)
+    missing_count = fields.Integer(string='Inconnues de l\'OBR', readonly=True)
+    unresolved_count = fields.Integer(string='Non rapprochables', readonly=True)
+    unresolved_move_ids = fields.Many2many('account.move', 'ebms_backfill_job_unresolved_move_rel', 'job_id', 'move_id',
+                                           string='Factures non rapprochables', readonly=True,
+                                           help="Factures sans identifiant OBR ni date (envoi, création ou "
+                                                "facture) : leur invoice_identifier ne peut pas être reconstitué.")
+    error_count = fields.Integer(string='Erreurs', readonly=True)
+    last_error = fields.Text(string='Dernière erreur', readonly=True)
+    last_run = fields.Datetime(string='Dernière exécution', readonly=True)
+
+    def action_start(self):
+        if self.env['ir.config_parameter'].sudo().get_param('ebms.getinvoice_url') in (False, None, ''):
+            raise UserError(_('Paramètres API EBMS manquants (getinvoice_url ou token).'))
+        self.filtered(lambda j: j.state in ('draft', 'paused')).write({'state': 'running'})
+
+    def action_pause(self):
+        self.filtered(lambda j: j.state == 'running').write({'state': 'paused'})
+
+    def action_run_now(self):
+        for job in self.filtered(lambda j: j.state == 'running'):
+            job._run(time_budget=self._get_time_budget())
+
+    @api.model
+    def _get_time_budget(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param('ebms.backfill_time_budget', 240))
+
+    @api.model
+    def _cron_run_backfill(self):
+        """Traite les jobs en cours dans la limite du budget de temps, paquet par paquet."""
+        deadline = time.monotonic() + self._get_time_budget()
+        for job in self.search([('state', '=', 'running')], order='id'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            job._run(time_budget=remaining)
+
+    def _commit(self):
+        # Un point de reprise par paquet : un arrêt du worker ne perd qu'un paquet.
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    def _pending_domain(self):
+        self.ensure_one()
+        return [
+            ('company_id', '=', self.company_id.id),
+            ('move_type', 'in', ('out_invoice', 'out_refund')),
+            ('state', '=', 'posted'),
+            ('invoice_date', '>=', self.date_from),
+            ('invoice_date', '<=', self.date_to),
+            ('ebms_reference', 'in', (False, '')),
+            ('id', '>', self.last_move_id),
+        ]
+
+    def _run(self, time_budget):
+        self.ensure_one()
+        deadline = time.monotonic() + time_budget
+        Move = self.env['account.move']
+        Queue = self.env['ebms.queue.item']
+        while self.state == 'running' and time.monotonic() < deadline:
+            if Queue._has_urgent_work():
+                # Les envois en attente (reçus, factures, stock) passent avant le rattrapage.
+                break
+            moves = Move.search(self._pending_domain(), order='id', limit=self.chunk_size)
+            if not moves:
+                self.write({'state': 'done', 'last_run': fields.Datetime.now()})
+                self._commit()
+                break
+            self._process_chunk(moves)
+            self._commit()
+
+    def _process_chunk(self, moves):
+        """
+        Interroge getInvoice pour un paquet de factures avec la concurrence bornée du client,
+        enregistre les accusés trouvés et avance le point de reprise. Les factures dont
+        l'identifiant ne peut pas être reconstitué ne sont pas interrogées mais signalées
+        (unresolved_move_ids). En cas d'erreur technique ou de requête refusée (4xx), le point
+        de reprise s'arrête juste avant la première facture en échec pour la retenter.
+        Chaque interrogation est tracée (étape « rapprochement ») sous l'identifiant de
+        corrélation de la facture.
+        """
+        self.ensure_one()
+        identifiers = {move.id: move._ebms_backfill_identifier() for move in moves}
+        resolvable = moves.filtered(lambda m: identifiers[m.id])
+        trace_ids = resolvable._ebms_ensure_trace()
+        # Toujours relu auprès de l'OBR (un accusé peut être arrivé depuis), en alimentant le cache.
+        by_identifier = lookup_invoices(self.env, [identifiers[move.id] for move in resolvable], self.company_id,
+                                        refresh=True, trace_ids={
+                                            identifiers[move.id]: trace_ids[move.id] for move in resolvable})
+        spans = SpanLog()
+
+        checkpoint = self.last_move_id
+        processed = matched = missing = errors = 0
+        unresolved = self.env['account.move']
+        last_error = False
+        for move in moves:
+            identifier = identifiers[move.id]
+            if not identifier:
+                # Aucune date utilisable : pas d'identifiant à interroger, la facture est signalée.
+                unresolved |= move
+                processed += 1
+                checkpoint = move.id
+                continue
+            result = by_identifier[identifier]
+            spans.add_call(move.id, trace_ids[move.id], 'reconcile', result)
+            if result['status_code'] is None or result['status_code'] >= 400:
+                # Réseau, session, requête refusée ou serveur : la facture sera réinterrogée.
+                errors += 1
+                last_error = result['msg']
+                break
+            if result['success']:
+                vals = self._acknowledgement_vals(identifier, result['data'])
+                move.write(vals)
+                matched += 1
+            else:
+                missing += 1
+            processed += 1
+            checkpoint = move.id
+        spans.write(self.env)
+        self.write({
+            'last_move_id': checkpoint,
+            'processed_count': self.processed_count + processed,
+            'matched_count': self.matched_count + matched,
+            'missing_count': self.missing_count + missing,
+            'unresolved_count': self.unresolved_count + len(unresolved),
+            'unresolved_move_ids': [(4, move_id) for move_id in unresolved.ids],
+            'error_count': self.error_count + errors,
+            'last_error': last_error or self.last_error,
+            'last_run': fields.Datetime.now(),
+        })
+        if errors and not processed:
+            # Rien n'a avancé : on met le job en pause plutôt que de boucler sur l'erreur.
+            self.state = 'paused'
+            _logger.warning('Import historique EBMS %s mis en pause : %s', self.id, last_error)
+
+    @api.model
+    def _acknowledgement_vals(self, identifier, resp_json):
+        """Valeurs d'accusé de réception à partir de la réponse getInvoice."""
+        result = resp_json.get('result') or {}
+        invoices = result.get('invoices') if isinstance(result, dict) else None
+        invoice = invoices[0] if invoices else result
+        reference = (
+            invoice.get('invoice_registered_number')
+            or invoice.get('reference')
+            or resp_json.get('reference')
+            or identifier
+        )
+        sent_date = invoice.get('invoice_registered_date')
+        try:
+            sent_date = fields.Datetime.to_datetime(sent_date) if sent_date else fields.Datetime.now()
+        except ValueError:
+            sent_date = fields.Datetime.now()
+        return {
+            'ebms_status': 'sent',
+            'ebms_reference': reference,
+            'ebms_invoice_identifier': identifier,
+            'ebms_signature': invoice.get('electronic_signature') or resp_json.get('electronic_signature') or False,
+            'ebms_result_data': ebms_json.canonical_text(invoice),
+            'ebms_sent_date': sent_date,
+            'ebms_error_message': False,
+            'ebms_verified_at': fields.Datetime.now(),
+        }
+
@@ -0,0 +1,402 @@
+# -*- coding: utf-8 -*-
+"""
+Client HTTP partagé vers l'API EBMS de l'OBR.
+
+Le client ne touche jamais à l'ORM : il reçoit une configuration déjà lue
+(URL de login, identifiants, token) et ne manipule que des dictionnaires.
+Il peut donc être utilisé depuis plusieurs threads pour paralléliser les
+appels réseau, l'écriture des résultats restant faite par l'appelant dans
+son propre environnement Odoo.
+
+Compression : les requêtes vers les endpoints listés dans ebms.gzip_endpoints (fragments
+d'URL, ex. « addInvoice ») sont envoyées en gzip (Content-Encoding: gzip) dès que le corps
+atteint ebms.gzip_min_bytes octets. Les réponses compressées sont acceptées et décodées
+par requests. Un serveur qui refuse le gzip (415) reçoit la requête non compressée, et
+l'endpoint n'est plus compressé par ce client.
+"""
+import gzip
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from . import ebms_json, ebms_logging
+from .ebms_logging import log_exchange
+from .ebms_tracing import HEADER as TRACE_HEADER
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_TIMEOUT = 30
+# Contrôle de disponibilité (voir ebms_health) : une réponse lente vaut une panne.
+PROBE_TIMEOUT = 5
+DEFAULT_MAX_WORKERS = 4
+# En dessous, l'en-tête gzip et le temps de compression coûtent plus qu'ils ne font gagner.
+GZIP_MIN_BYTES = 1024
+GZIP_LEVEL = 6
+# Après un échec d'authentification, on échoue vite pendant ce délai au lieu de re-tenter le login à chaque appel.
+LOGIN_RETRY_DELAY = 60
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class _Session(requests.Session):
+    """Session dont les corps json= sont encodés une fois, sous forme canonique (voir ebms_json)."""
+
+    def request(self, method, url, data=None, json=None, **kwargs):
+        if json is not None and data is None:
+            data, json = ebms_json.canonical(json), None
+        return super().request(method, url, data=data, json=json, **kwargs)
+
+
+def held_result(key, failed):
+    """Résultat normalisé d'un payload non envoyé parce qu'un envoi précédent de même clé a échoué."""
+    return {
+        'success': False,
+        'status_code': None,
+        'data': {},
+        'msg': 'Non envoyé : l\'envoi précédent de même clé (%s) a échoué. %s' % (key, failed['msg']),
+        'held': True,
+        'started_at': datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0),
+        'duration': 0.0,
+    }
+
+
+class EBMSClient:
+    """
+    Session HTTP réutilisable (pool de connexions keep-alive) avec gestion du
+    token Bearer : un 401 déclenche un seul re-login, partagé entre threads.
+    """
+
+    def __init__(self, company_id=0, max_workers=DEFAULT_MAX_WORKERS, timeout=DEFAULT_TIMEOUT):
+        self.company_id = company_id
+        self.max_workers = max(1, int(max_workers))
+        self.timeout = timeout
+        self.login_url = None
+        self.username = None
+        self.password = None
+        self.token = None
+        self.token_refreshed = False
+        self.warmed = False
+        self._login_error = None
+        self._login_failed_at = 0.0
+        self._token_lock = threading.Lock()
+        self.gzip_endpoints = ()
+        self.gzip_min_bytes = GZIP_MIN_BYTES
+        self._gzip_refused = set()
+        self.session = self._new_session()
+
+    def _new_session(self):
+        session = _Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=self.max_workers)
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def reset_connections(self):
+        """Repart d'un pool vide (après un fork : les sockets du parent ne sont pas partageables)."""
+        self.session = self._new_session()
+        self._token_lock = threading.Lock()
+
+    def configure(self, login_url=None, username=None, password=None, token=None,
+                  gzip_endpoints=None, gzip_min_bytes=None):
+        """Met à jour les identifiants ; le token local n'est remplacé que s'il a changé côté base."""
+        self.gzip_endpoints = tuple(part.strip() for part in (gzip_endpoints or '').split(',') if part.strip())
+        self.gzip_min_bytes = GZIP_MIN_BYTES if gzip_min_bytes in (None, False, '') else int(gzip_min_bytes)
+        with self._token_lock:
+            if (login_url, username, password) != (self.login_url, self.username, self.password):
+                self._login_failed_at = 0.0
+            self.login_url = login_url
+            self.username = username
+            self.password = password
+            if token and token != self.token and not self.token_refreshed:
+                self.token = token
+        return self
+
+    def login(self, expired_token=None):
+        """
+        Obtient un nouveau token via /login/.
+        Si un autre thread a déjà renouvelé le token expiré, on réutilise le sien.
+        """
+        with self._token_lock:
+            if expired_token is not None and self.token and self.token != expired_token:
+                return self.token
+            if time.monotonic() - self._login_failed_at < LOGIN_RETRY_DELAY:
+                raise EBMSClientError(self._login_error)
+            try:
+                token = self._request_token()
+            except EBMSClientError as e:
+                self._login_error = str(e)
+                self._login_failed_at = time.monotonic()
+                raise
+            self._login_failed_at = 0.0
+            self.token = token
+            self.token_refreshed = True
+            _logger.info('Nouveau token EBMS obtenu par le client partagé.')
+            return token
+
+    def _request_token(self):
+        if not (self.login_url and self.username and self.password):
+            raise EBMSClientError('Paramètres EBMS manquants (login_url, username ou password).')
+        started = time.monotonic()
+        try:
+            response = self.session.post(
+                self.login_url,
+                json={'username': self.username, 'password': self.password},
+                headers={'Content-Type': 'application/json'},
+                timeout=self.timeout,
+            )
+        except requests.RequestException as e:
+            log_exchange(self.login_url, None, time.monotonic() - started, error=str(e), company_id=self.company_id)
+            raise EBMSClientError('Exception lors du login EBMS: %s' % e)
+        latency = time.monotonic() - started
+        if response.status_code != 200:
+            log_exchange(self.login_url, response.status_code, latency, response=response.text, error='HTTP', company_id=self.company_id)
+            raise EBMSClientError('Erreur HTTP login EBMS: %s' % response.text)
+        resp_json = response.json()
+        token = resp_json.get('success') and resp_json.get('result', {}).get('token')
+        if not token:
+            msg = resp_json.get('msg', 'Erreur lors de l\'authentification EBMS.')
+            log_exchange(self.login_url, response.status_code, latency, error=msg, company_id=self.company_id)
+            raise EBMSClientError('Erreur login EBMS: %s' % msg)
+        # La réponse contient le token : jamais de corps dans le journal.
+        log_exchange(self.login_url, response.status_code, latency, company_id=self.company_id)
+        return token
+
+    def _headers(self, token, trace_id=None, compressed=False):
+        headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json',
+        }
+        if trace_id:
+            headers[TRACE_HEADER] = trace_id
+        if compressed:
+            headers['Content-Encoding'] = 'gzip'
+        return headers
+
+    def _gzip_body(self, url, payload):
+        """Corps gzip du payload si l'endpoint est configuré pour la compression et le corps assez gros, sinon None."""
+        if url in self._gzip_refused or not any(part in url for part in self.gzip_endpoints):
+            return None
+        body = ebms_json.canonical(payload)
+        if len(body) < self.gzip_min_bytes:
+            return None
+        return gzip.compress(body, compresslevel=GZIP_LEVEL)
+
+    def _send(self, url, payload, token, trace_id, body):
+        if body is None or url in self._gzip_refused:
+            return self.session.post(url, json=payload, headers=self._headers(token, trace_id), timeout=self.timeout)
+        response = self.session.post(url, data=body, headers=self._headers(token, trace_id, compressed=True),
+                                     timeout=self.timeout)
+        if response.status_code == 415:
+            _logger.warning('Le serveur EBMS refuse les requêtes gzip sur %s ; envoi non compressé.', url)
+            self._gzip_refused.add(url)
+            return self.session.post(url, json=payload, headers=self._headers(token, trace_id), timeout=self.timeout)
+        return response
+
+    def post(self, url, payload, trace_id=None):
+        """
+        Envoie un payload JSON et retourne un dict normalisé :
+        {'success': bool, 'status_code': int, 'data': dict, 'msg': str, 'started_at': datetime UTC,
+        'duration': secondes}.
+        Ne lève jamais d'exception : les erreurs réseau sont retournées dans 'msg'.
+        Chaque appel produit un seul enregistrement dans le journal des échanges ; trace_id est
+        envoyé dans l'en-tête X-Correlation-ID et repris dans le journal.
+        """
+        started_at = datetime.now(timezone.utc).replace(tzinfo=None, microsecond=0)
+        started = time.monotonic()
+        body = None
+        try:
+            gzip_body = self._gzip_body(url, payload)
+            token = self.token
+            if not token or len(token) < 10:
+                token = self.login(expired_token=token)
+            response = self._send(url, payload, token, trace_id, gzip_body)
+            if response.status_code == 401:
+                _logger.warning('Token EBMS expiré ou invalide, tentative de rafraîchissement...')
+                token = self.login(expired_token=token)
+                response = self._send(url, payload, token, trace_id, gzip_body)
+            if response.status_code != 200:
+                body = response.text
+                result = {
+                    'success': False,
+                    'status_code': response.status_code,
+                    'data': {},
+                    'msg': f'Erreur HTTP {response.status_code}: {response.text}',
+                }
+            else:
+                body = resp_json = response.json()
+                result = {
+                    'success': bool(resp_json.get('success')),
+                    'status_code': response.status_code,
+                    'data': resp_json,
+                    'msg': resp_json.get('msg', ''),
+                }
+        except Exception as e:
+            # Le nom de l'exception est gardé : il sert de signature dans le tri des erreurs
+            result = {'success': False, 'status_code': None, 'data': {}, 'msg': '%s: %s' % (type(e).__name__, e)}
+        result['started_at'] = started_at
+        result['duration'] = time.monotonic() - started
+        log_exchange(
+            url, result['status_code'], result['duration'], payload=payload, response=body,
+            error=None if result['success'] else (result['msg'] or 'refusé'), company_id=self.company_id,
+            trace_id=trace_id,
+        )
+        return result
+
+    def warm_up(self):
+        """
+        Préchauffe le client : login si aucun token valide n'est connu, puis ouverture
+        d'une connexion keep-alive (poignée de main TLS) vers le serveur de login.
+        Retourne True si le client est prêt ; ne lève jamais d'exception.
+        """
+        try:
+            if not self.token or len(self.token) < 10:
+                self.login()
+            if self.login_url:
+                # Réponse sans corps : la connexion retourne aussitôt dans le pool.
+                self.session.head(self.login_url, timeout=self.timeout, allow_redirects=False)
+            self.warmed = True
+            return True
+        except Exception as e:
+            _logger.warning('Préchauffage du client EBMS (société %s) impossible : %s', self.company_id, e)
+            return False
+
+    def probe(self, timeout=PROBE_TIMEOUT):
+        """
+        Contrôle de disponibilité : requête HEAD sur le serveur de login, puis login si aucun
+        token valide n'est connu. Retourne {'reachable': bool, 'login_ok': bool,
+        'latency': secondes ou None, 'error': str ou False} ; ne lève jamais d'exception.
+        """
+        result = {'reachable': False, 'login_ok': False, 'latency': None, 'error': False}
+        started = time.monotonic()
+        try:
+            if not self.login_url:
+                raise EBMSClientError('URL de login EBMS manquante (ebms.login_url).')
+            response = self.session.head(self.login_url, timeout=timeout, allow_redirects=False)
+            result['latency'] = time.monotonic() - started
+            result['reachable'] = response.status_code < 500
+            if not result['reachable']:
+                result['error'] = 'Erreur HTTP %s' % response.status_code
+                return result
+            if not self.token or len(self.token) < 10:
+                self.login()
+            result['login_ok'] = True
+        except Exception as e:
+            result['error'] = '%s: %s' % (type(e).__name__, e)
+        return result
+
+    def post_many(self, url, payloads, trace_ids=None, keys=None):
+        """
+        Envoie plusieurs payloads en parallèle ; les résultats gardent l'ordre des payloads.
+        trace_ids, s'il est donné, porte l'identifiant de corrélation de chaque payload.
+        keys, s'il est donné, porte la clé d'ordre de chaque payload (None : sans contrainte).
+        Les payloads d'une même clé partent l'un après l'autre, dans l'ordre de la liste, et
+        les clés différentes en parallèle. Après un échec, les suivants de la même clé ne sont
+        pas envoyés (voir held_result) : l'OBR les refuserait.
+        """
+        payloads = list(payloads)
+        trace_ids = list(trace_ids) if trace_ids is not None else [None] * len(payloads)
+        if keys is None:
+            chains = [[index] for index in range(len(payloads))]
+        else:
+            by_key = {}
+            chains = []
+            for index, key in enumerate(keys):
+                if key is None:
+                    chains.append([index])
+                elif key in by_key:
+                    by_key[key].append(index)
+                else:
+                    chains.append(by_key.setdefault(key, [index]))
+        results = [None] * len(payloads)
+
+        def send_chain(chain):
+            failed = None
+            for index in chain:
+                if failed is not None:
+                    results[index] = held_result(keys[index], failed)
+                    continue
+                results[index] = self.post(url, payloads[index], trace_ids[index])
+                if not results[index]['success']:
+                    failed = results[index]
+
+        if len(chains) <= 1 or self.max_workers == 1:
+            for chain in chains:
+                send_chain(chain)
+        else:
+            # Les chaînes les plus longues d'abord : ce sont elles qui bornent la durée du lot.
+            with ThreadPoolExecutor(max_workers=min(self.max_workers, len(chains))) as executor:
+                list(executor.map(send_chain, sorted(chains, key=len, reverse=True)))
+        return results
+
+    def persist_token(self, env):
+        """
+        Enregistre le token renouvelé pendant les appels, le cas échéant :
+        sur la société propriétaire des identifiants, sinon dans ebms.api_token.
+        """
+        with self._token_lock:
+            if not self.token_refreshed:
+                return False
+            if self.company_id:
+                env['res.company'].sudo().browse(self.company_id).ebms_api_token = self.token
+            else:
+                env['ir.config_parameter'].sudo().set_param('ebms.api_token', self.token)
+            self.token_refreshed = False
+            return True
+
+
+def _reset_after_fork():
+    """
+    Dans un worker forké, garde les tokens mais abandonne les connexions héritées du parent ;
+    les clients préchauffés rouvrent leur connexion en arrière-plan.
+    """
+    global _clients_lock
+    _clients_lock = threading.Lock()
+    warmed = []
+    for client in _clients.values():
+        client.reset_connections()
+        if client.warmed:
+            warmed.append(client)
+    if warmed:
+        threading.Thread(target=lambda: [client.warm_up() for client in warmed],
+                         name='ebms-warmup', daemon=True).start()
+
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reset_after_fork)
+
+
+class EBMSClientError(Exception):
+    """Erreur de configuration ou d'authentification du client EBMS."""
+
+
+def get_client(env, company=None):
+    """
+    Retourne le client EBMS partagé de la société (ou des paramètres globaux si la société
+    n'a pas ses propres identifiants). Un client, donc un token et un pool de connexions,
+    par base, par jeu d'identifiants et par worker.
+    """
+    company = company or env.company
+    credentials = company._get_ebms_credentials()
+    params = env['ir.config_parameter'].sudo()
+    max_workers = int(params.get_param('ebms.max_workers', DEFAULT_MAX_WORKERS) or DEFAULT_MAX_WORKERS)
+    ebms_logging.configure(body_sample_rate=params.get_param('ebms.log_body_sample_rate') or 0)
+    key = (env.cr.dbname, credentials['key'])
+    with _clients_lock:
+        client = _clients.get(key)
+        if client is None or client.max_workers != max_workers:
+            client = _clients[key] = EBMSClient(company_id=credentials['key'], max_workers=max_workers)
+    return client.configure(
+        login_url=params.get_param('ebms.login_url'),
+        username=credentials['username'],
+        password=credentials['password'],
+        token=credentials['token'],
+        gzip_endpoints=params.get_param('ebms.gzip_endpoints'),
+        gzip_min_bytes=params.get_param('ebms.gzip_min_bytes'),
+    )
@@ -0,0 +1,221 @@
+# -*- coding: utf-8 -*-
+"""
+Tableau de bord EBMS : factures et mouvements par société, jour et statut EBMS.
+
+Les compteurs sont tenus à jour à chaque transition (création, changement de statut ou
+de clé, suppression : voir ebms.state.mixin), sous forme de deltas insérés, jamais mis à
+jour : deux transactions concurrentes n'entrent pas en conflit sur une même ligne de
+compteur. Le cron de compactage fusionne les deltas ; le tableau de bord agrège donc au
+plus quelques lignes par (société, jour, statut), quel que soit l'historique.
+"""
+import logging
+from collections import Counter
+from datetime import datetime, timedelta
+
+from odoo import api, fields, models, tools, _
+from odoo.osv import expression
+
+_logger = logging.getLogger(__name__)
+
+STATUSES = [
+    ('draft', 'Brouillon'),
+    ('sending', 'Envoi en cours'),
+    ('relayed', 'Confiée au relais'),
+    ('sent', 'Envoyé à EBMS'),
+    ('error', 'Erreur d\'envoi'),
+    ('cancelled', 'Annulée EBMS'),
+]
+UNACKNOWLEDGED = ('draft', 'sending', 'relayed', 'error')
+DEFAULT_OVERDUE_HOURS = 48
+RES_MODELS = [('account.move', 'Factures'), ('stock.move', 'Mouvements de stock')]
+
+# Recalcul complet : mêmes règles que les _ebms_counter_key de account.move et stock.move.
+_REBUILD_QUERY = """
+    INSERT INTO ebms_status_counter (company_id, res_model, day, status, count)
+    SELECT m.company_id, 'account.move', COALESCE(m.invoice_date, m.date), COALESCE(e.ebms_status, 'draft'), count(*)
+      FROM account_move m
+      LEFT JOIN account_move_ebms e ON e.move_id = m.id
+     WHERE m.state = 'posted' AND m.move_type IN ('out_invoice', 'out_refund')
+     GROUP BY m.company_id, COALESCE(m.invoice_date, m.date), COALESCE(e.ebms_status, 'draft')
+    UNION ALL
+    SELECT sm.company_id, 'stock.move', sm.date::date, COALESCE(e.ebms_stock_status, 'draft'), count(*)
+      FROM stock_move sm
+      LEFT JOIN stock_move_ebms e ON e.move_id = sm.id
+     WHERE sm.state != 'cancel' AND sm.date IS NOT NULL
+     GROUP BY sm.company_id, sm.date::date, COALESCE(e.ebms_stock_status, 'draft')
+"""
+
+
+class EBMSStatusCounter(models.Model):
+    _name = 'ebms.status.counter'
+    _description = 'Compteur de statuts EBMS'
+    _log_access = False
+
+    company_id = fields.Many2one('res.company', string='Société', required=True, ondelete='cascade')
+    res_model = fields.Selection(RES_MODELS, string='Modèle', required=True)
+    day = fields.Date(string='Jour', required=True)
+    status = fields.Selection(STATUSES, string='Statut EBMS', required=True)
+    count = fields.Integer(string='Nombre', required=True)
+
+    def init(self):
+        self.env.cr.execute("""
+            CREATE INDEX IF NOT EXISTS ebms_status_counter_key_idx
+                ON ebms_status_counter (company_id, day, res_model, status)
+        """)
+        # Pas de recalcul ici (init() tourne à chaque mise à jour) : les compteurs sont
+        # construits à l'installation (post_init_hook), par la migration 1.1 ou à la demande
+        # (bouton « Recalculer »).
+
+    @api.model
+    def _add_difference(self, before, after):
+        """Insère les deltas after - before ({(société, modèle, jour, statut): nombre})."""
+        deltas = Counter(after)
+        deltas.subtract(before)
+        deltas = {key: count for key, count in deltas.items() if count}
+        if not deltas:
+            return
+        keys = list(deltas)
+        self.env.cr.execute("""
+            INSERT INTO ebms_status_counter (company_id, res_model, day, status, count)
+            SELECT * FROM unnest(%s::int4[], %s::varchar[], %s::date[], %s::varchar[], %s::int4[])
+        """, (
+            [key[0] for key in keys], [key[1] for key in keys], [key[2] for key in keys],
+            [key[3] for key in keys], [deltas[key] for key in keys],
+        ))
+        self._invalidate_counters()
+
+    @api.model
+    def _invalidate_counters(self):
+        self.invalidate_model()
+        self.env['ebms.status.dashboard'].invalidate_model()
+
+    @api.model
+    def _compact(self):
+        """Fusionne les deltas en une ligne par clé ; les clés à zéro disparaissent."""
+        self.env.cr.execute("""
+            WITH merged AS (
+                DELETE FROM ebms_status_counter RETURNING company_id, res_model, day, status, count
+            )
+            INSERT INTO ebms_status_counter (company_id, res_model, day, status, count)
+            SELECT company_id, res_model, day, status, sum(count)
+              FROM merged
+             GROUP BY company_id, res_model, day, status
+            HAVING sum(count) != 0
+        """)
+        merged = self.env.cr.rowcount
+        self._invalidate_counters()
+        return merged
+
+    @api.model
+    def _rebuild(self):
+        """
+        Recalcule tous les compteurs depuis les pièces (installation, migration 1.1, import SQL en masse,
+        contrôle). Les deltas de transactions concurrentes encore invisibles ne sont pas
+        supprimés, et leurs pièces ne sont pas lues : le total reste juste.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("DELETE FROM ebms_status_counter")
+        self.env.cr.execute(_REBUILD_QUERY)
+        _logger.info('Compteurs EBMS recalculés : %s lignes.', self.env.cr.rowcount)
+        self._invalidate_counters()
+
+    @api.model
+    def _totals(self):
+        """{(société, modèle, jour, statut): nombre}, deltas compris."""
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT company_id, res_model, day, status, sum(count)
+              FROM ebms_status_counter
+             GROUP BY company_id, res_model, day, status
+            HAVING sum(count) != 0
+        """)
+        return {tuple(row[:4]): row[4] for row in self.env.cr.fetchall()}
+
+    @api.model
+    def _cron_compact(self):
+        merged = self._compact()
+        _logger.info('Compteurs EBMS compactés : %s lignes.', merged)
+
+
+class EBMSStatusDashboard(models.Model):
+    _name = 'ebms.status.dashboard'
+    _description = 'Tableau de bord EBMS'
+    _auto = False
+    _order = 'day desc, company_id, res_model, status'
+
+    company_id = fields.Many2one('res.company', string='Société', readonly=True)
+    res_model = fields.Selection(RES_MODELS, string='Modèle', readonly=True)
+    day = fields.Date(string='Jour', readonly=True)
+    status = fields.Selection(STATUSES, string='Statut EBMS', readonly=True)
+    count = fields.Integer(string='Nombre', readonly=True)
+    overdue = fields.Boolean(string='Sans accusé depuis le délai', compute='_compute_overdue', search='_search_overdue',
+                             help='Pièces sans accusé OBR dont le jour entier est plus ancien que ebms.dashboard_overdue_hours (48 h par défaut).')
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE VIEW ebms_status_dashboard AS
+            SELECT min(id) AS id, company_id, res_model, day, status, sum(count)::int AS count
+              FROM ebms_status_counter
+             GROUP BY company_id, res_model, day, status
+            HAVING sum(count) != 0
+        """)
+
+    @api.model
+    def _overdue_before(self):
+        """Jour à partir duquel (exclu) une journée entière est plus ancienne que le délai."""
+        hours = int(self.env['ir.config_parameter'].sudo().get_param('ebms.dashboard_overdue_hours') or DEFAULT_OVERDUE_HOURS)
+        return (fields.Datetime.now() - timedelta(hours=hours)).date()
+
+    def _compute_overdue(self):
+        limit = self._overdue_before()
+        for row in self:
+            row.overdue = row.status in UNACKNOWLEDGED and row.day < limit
+
+    def _search_overdue(self, operator, value):
+        domain = [('status', 'in', UNACKNOWLEDGED), ('day', '<', self._overdue_before())]
+        if (operator == '=') == bool(value):
+            return domain
+        return ['!'] + expression.AND([domain])
+
+    def action_open_records(self):
+        """Ouvre les factures ou mouvements comptés dans les lignes sélectionnées."""
+        model = self[:1].res_model
+        rows = self.filtered(lambda r: r.res_model == model)
+        return {
+            'type': 'ir.actions.act_window',
+            'name': _('Pièces EBMS'),
+            'res_model': model,
+            'view_mode': 'tree,form',
+            'domain': expression.OR([row._records_domain() for row in rows]),
+            'context': {'create': False},
+        }
+
+    def _records_domain(self):
+        self.ensure_one()
+        if self.res_model == 'account.move':
+            # Même jour que la clé du compteur : date de facture, à défaut date comptable.
+            status_domain = [('ebms_status', '=', self.status)]
+            if self.status == 'draft':
+                status_domain = ['|', ('ebms_state_ids', '=', False)] + status_domain
+            return [
+                ('company_id', '=', self.company_id.id),
+                ('state', '=', 'posted'),
+                ('move_type', 'in', ('out_invoice', 'out_refund')),
+                '|', ('invoice_date', '=', self.day), '&', ('invoice_date', '=', False), ('date', '=', self.day),
+            ] + status_domain
+        start = datetime.combine(self.day, datetime.min.time())
+        status_domain = [('ebms_stock_status', '=', self.status)]
+        if self.status == 'draft':
+            status_domain = ['|', ('ebms_state_ids', '=', False)] + status_domain
+        return [
+            ('company_id', '=', self.company_id.id),
+            ('state', '!=', 'cancel'),
+            ('date', '>=', start),
+            ('date', '<', start + timedelta(days=1)),
+        ] + status_domain
+
+    @api.model
+    def action_rebuild(self):
+        self.env['ebms.status.counter'].sudo()._rebuild()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
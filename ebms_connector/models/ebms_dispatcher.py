@@ -0,0 +1,90 @@
+# -*- coding: utf-8 -*-
+"""
+Répartition des appels EBMS par société.
+
+Les payloads sont construits dans le thread appelant (accès ORM), puis les
+appels réseau de chaque société partent dans leur propre thread avec le
+client (token + pool de connexions) de cette société : le retard ou l'échec
+d'authentification d'une filiale ne bloque pas les autres.
+
+Au sein d'une société, l'ordre n'est garanti que par clé (dispatch_key) : un avoir après la
+facture qu'il annule, une sortie de stock après l'entrée du même article dans le même
+entrepôt. Les clés indépendantes partent en parallèle (voir EBMSClient.post_many).
+"""
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+from .ebms_client import get_client
+
+_logger = logging.getLogger(__name__)
+
+
+def prepare_dispatch(records, build_payload, dispatch_key=None):
+    """
+    Étape ORM : regroupe les enregistrements par société et construit les payloads.
+
+    :param records: recordset portant un champ company_id, dans l'ordre d'envoi voulu
+    :param build_payload: fonction record -> dict, appelée dans le thread courant
+    :param dispatch_key: fonction record -> clé d'ordre hashable (None : sans contrainte) ;
+        sans elle, tous les envois d'une société partent en parallèle
+    :return: liste de jobs (client, ids, payloads, clés), ne contenant plus aucun objet ORM
+    """
+    env = records.env
+    groups = OrderedDict()
+    for record in records:
+        groups.setdefault(record.company_id, []).append(record)
+    jobs = []
+    for company, company_records in groups.items():
+        client = get_client(env, company)
+        payloads = [build_payload(record) for record in company_records]
+        keys = [dispatch_key(record) for record in company_records] if dispatch_key else None
+        jobs.append((client, [record.id for record in company_records], payloads, keys))
+    return jobs
+
+
+def run_dispatch(jobs, url, trace_ids=None):
+    """
+    Étape réseau, sans ORM ni transaction : les appels de chaque société partent dans leur
+    propre thread. trace_ids ({id: identifiant de corrélation}) part dans l'en-tête de chaque appel.
+    Retourne {id: (payload, résultat normalisé du client)}.
+    """
+    trace_ids = trace_ids or {}
+    calls = [(client, payloads, [trace_ids.get(record_id) for record_id in ids], keys)
+             for client, ids, payloads, keys in jobs]
+    if len(calls) == 1:
+        client, payloads, job_trace_ids, keys = calls[0]
+        outcomes = [client.post_many(url, payloads, job_trace_ids, keys)]
+    else:
+        with ThreadPoolExecutor(max_workers=max(1, len(calls))) as executor:
+            futures = [executor.submit(client.post_many, url, payloads, job_trace_ids, keys)
+                       for client, payloads, job_trace_ids, keys in calls]
+            outcomes = [future.result() for future in futures]
+    by_id = {}
+    for (_client, ids, payloads, _keys), results in zip(jobs, outcomes):
+        for record_id, payload, result in zip(ids, payloads, results):
+            by_id[record_id] = (payload, result)
+    return by_id
+
+
+def persist_tokens(env, jobs):
+    """Enregistre les tokens renouvelés pendant run_dispatch."""
+    for client, _ids, _payloads, _keys in jobs:
+        client.persist_token(env)
+
+
+def dispatch_by_company(records, url, build_payload, trace_ids=None, dispatch_key=None):
+    """
+    Envoie un payload par enregistrement à `url`, en parallèle par société.
+
+    :param records: recordset portant un champ company_id
+    :param url: endpoint EBMS
+    :param build_payload: fonction record -> dict, appelée dans le thread courant
+    :param trace_ids: {id: identifiant de corrélation}, envoyé dans l'en-tête de chaque appel
+    :param dispatch_key: fonction record -> clé d'ordre (voir prepare_dispatch)
+    :return: liste de tuples (record, payload, résultat normalisé du client), dans l'ordre de `records`
+    """
+    jobs = prepare_dispatch(records, build_payload, dispatch_key)
+    by_id = run_dispatch(jobs, url, trace_ids) if jobs else {}
+    persist_tokens(records.env, jobs)
+    return [(record,) + by_id[record.id] for record in records]
@@ -0,0 +1,150 @@
+# -*- coding: utf-8 -*-
+"""
+Tri des erreurs EBMS : les pièces en erreur sont regroupées par signature (voir ebms_errors)
+dans une vue d'où l'on relance ou met de côté toutes les pièces d'un groupe en une fois.
+"""
+from odoo import fields, models, tools, _
+from odoo.tools import split_every
+
+RETRY_CHUNK = 500
+
+
+class EBMSErrorTriage(models.Model):
+    _name = 'ebms.error.triage'
+    _description = 'Tri des erreurs EBMS'
+    _auto = False
+    _order = 'count desc, last_seen desc'
+    _rec_name = 'signature'
+
+    # Pièces en erreur prises en compte : factures validées, mouvements non annulés
+    _MOVE_DOMAINS = {
+        'account.move': [('move_id.state', '=', 'posted')],
+        'stock.move': [('move_id.state', '!=', 'cancel')],
+    }
+
+    res_model = fields.Selection([
+        ('account.move', 'Factures'),
+        ('stock.move', 'Mouvements de stock'),
+    ], string='Type de pièce', readonly=True)
+    company_id = fields.Many2one('res.company', string='Société', readonly=True)
+    signature = fields.Char(string='Signature', readonly=True)
+    parked = fields.Boolean(string='Mis de côté', readonly=True)
+    count = fields.Integer(string='Pièces', readonly=True)
+    queued_count = fields.Integer(string='En file', readonly=True, help='Pièces du groupe déjà en file d\'envoi')
+    first_seen = fields.Datetime(string='Première erreur', readonly=True, group_operator='min')
+    last_seen = fields.Datetime(string='Dernière erreur', readonly=True, group_operator='max')
+    sample_message = fields.Text(string='Exemple de message', readonly=True)
+
+    def init(self):
+        # L'id est dérivé de la clé du groupe : il reste le même d'un affichage à l'autre,
+        # un bouton cliqué agit donc sur le groupe affiché même si d'autres erreurs sont arrivées.
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE VIEW ebms_error_triage AS
+            SELECT hashtext(concat_ws('|', g.res_model, g.company_id, g.signature, g.parked)) & 2147483647 AS id,
+                   g.*
+              FROM (
+                    SELECT 'account.move'::varchar AS res_model,
+                           m.company_id,
+                           e.ebms_error_signature AS signature,
+                           COALESCE(e.ebms_parked, false) AS parked,
+                           count(*) AS count,
+                           count(*) FILTER (WHERE EXISTS (
+                               SELECT 1 FROM ebms_queue_item q
+                                WHERE q.res_model = 'account.move' AND q.res_id = e.move_id
+                                  AND q.state IN ('pending', 'running'))) AS queued_count,
+                           min(e.write_date) AS first_seen,
+                           max(e.write_date) AS last_seen,
+                           (array_agg(e.ebms_error_message ORDER BY e.write_date DESC))[1] AS sample_message
+                      FROM account_move_ebms e
+                      JOIN account_move m ON m.id = e.move_id
+                     WHERE e.ebms_status = 'error' AND m.state = 'posted'
+                     GROUP BY m.company_id, e.ebms_error_signature, COALESCE(e.ebms_parked, false)
+                    UNION ALL
+                    SELECT 'stock.move'::varchar,
+                           m.company_id,
+                           e.ebms_error_signature,
+                           COALESCE(e.ebms_parked, false),
+                           count(*),
+                           count(*) FILTER (WHERE EXISTS (
+                               SELECT 1 FROM ebms_queue_item q
+                                WHERE q.res_model = 'stock.move' AND q.res_id = e.move_id
+                                  AND q.state IN ('pending', 'running'))),
+                           min(e.write_date),
+                           max(e.write_date),
+                           (array_agg(e.ebms_stock_error_message ORDER BY e.write_date DESC))[1]
+                      FROM stock_move_ebms e
+                      JOIN stock_move m ON m.id = e.move_id
+                     WHERE e.ebms_stock_status = 'error' AND m.state != 'cancel'
+                     GROUP BY m.company_id, e.ebms_error_signature, COALESCE(e.ebms_parked, false)
+                   ) g
+        """)
+
+    def _state_rows(self):
+        """Lignes d'état (account.move.ebms / stock.move.ebms) des pièces du groupe."""
+        self.ensure_one()
+        Model = self.env[self.res_model]
+        return self.env[Model._ebms_state_model].sudo().search([
+            (Model._ebms_status_field, '=', 'error'),
+            ('ebms_error_signature', '=', self.signature or False),
+            ('ebms_parked', '=', self.parked),
+            ('move_id.company_id', '=', self.company_id.id),
+        ] + self._MOVE_DOMAINS[self.res_model])
+
+    def action_open_records(self):
+        """Ouvre les pièces du groupe."""
+        self.ensure_one()
+        return {
+            'type': 'ir.actions.act_window',
+            'name': self.signature or _('Erreurs EBMS'),
+            'res_model': self.res_model,
+            'view_mode': 'tree,form',
+            'domain': [('id', 'in', self._state_rows().move_id.ids)],
+            'context': {'create': False},
+        }
+
+    def action_retry(self):
+        """
+        Remet en file d'envoi toutes les pièces des groupes sélectionnés, par paquets de
+        RETRY_CHUNK ; les éléments déjà en attente de nouvel essai sont avancés à maintenant.
+        """
+        Queue = self.env['ebms.queue.item']
+        now = fields.Datetime.now()
+        total = 0
+        for row in self:
+            states = row._state_rows()
+            states.filtered('ebms_parked').write({'ebms_parked': False})
+            for ids in split_every(RETRY_CHUNK, states.move_id.ids):
+                Queue._enqueue(self.env[row.res_model].browse(ids))
+                Queue.search([
+                    ('res_model', '=', row.res_model), ('res_id', 'in', list(ids)),
+                    ('state', '=', 'pending'), ('next_attempt_at', '>', now),
+                ]).write({'next_attempt_at': now})
+            total += len(states)
+        self.invalidate_model()
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Tri des erreurs EBMS'),
+                'message': _('%s pièce(s) remise(s) en file d\'envoi EBMS.') % total,
+                'type': 'info',
+                'sticky': False,
+                'next': {'type': 'ir.actions.client', 'tag': 'reload'},
+            }
+        }
+
+    def action_park(self):
+        """
+        Met de côté les pièces des groupes sélectionnés (erreur connue, à traiter hors EBMS) :
+        elles quittent la file d'envoi et ne comptent plus dans l'alerte de SLO.
+        """
+        Queue = self.env['ebms.queue.item'].sudo()
+        for row in self.filtered(lambda r: not r.parked):
+            states = row._state_rows()
+            for ids in split_every(RETRY_CHUNK, states.move_id.ids):
+                Queue.search([('res_model', '=', row.res_model), ('res_id', 'in', list(ids)),
+                              ('state', '=', 'pending')]).unlink()
+            states.write({'ebms_parked': True})
+        self.invalidate_model()
+        return {'type': 'ir.actions.client', 'tag': 'reload'}
@@ -0,0 +1,50 @@
+# -*- coding: utf-8 -*-
+"""
+Signatures d'erreur EBMS : les messages libres (refus OBR, codes HTTP, exceptions réseau)
+sont ramenés à une signature stable, qui regroupe les pièces dans le tri des erreurs
+(ebms.error.triage).
+"""
+import re
+
+# Préfixes ajoutés par le connecteur autour du message d'origine (erreurs ré-emballées en UserError)
+_WRAPPER_RE = re.compile(
+    r"^(?:Exception lors de l[’']envoi EBMS Stock|Erreur HTTP EBMS Stock|Erreur EBMS Stock|"
+    r"Erreur de connexion|Erreur inattendue)\s*:\s*")
+_HTTP_RE = re.compile(r'^Erreur HTTP (\d{3})\b')
+_EXCEPTION_RE = re.compile(r'^([A-Z][A-Za-z0-9_]*(?:Error|Exception|Timeout))\s*:')
+# Messages d'exceptions réseau enregistrés avant que le nom de la classe ne soit conservé
+_LEGACY_EXCEPTIONS = [
+    (re.compile(r'timed out|timeout', re.I), 'Timeout'),
+    (re.compile(r'Max retries exceeded|Connection (?:refused|reset|aborted)|Name or service not known', re.I),
+     'ConnectionError'),
+]
+# Pas de guillemets simples : ce sont aussi les apostrophes du français (« l'article »)
+_QUOTED_RE = re.compile(r'"[^"]*"|«[^»]*»')
+_VARIABLE_RE = re.compile(r'[\w/.:-]*\d[\w/.:-]*')
+SIGNATURE_SIZE = 120
+
+
+def error_signature(message):
+    """
+    Signature d'un message d'erreur EBMS, commune à toutes les pièces qui échouent pour la
+    même raison : 'HTTP 503', nom de l'exception ('ConnectTimeout'), ou modèle du message OBR
+    dont les valeurs variables (nombres, identifiants, textes cités) sont remplacées.
+    """
+    if not message:
+        return False
+    message = message.strip()
+    while _WRAPPER_RE.match(message):
+        message = _WRAPPER_RE.sub('', message, count=1)
+    match = _HTTP_RE.match(message)
+    if match:
+        return 'HTTP %s' % match.group(1)
+    match = _EXCEPTION_RE.match(message)
+    if match:
+        return match.group(1)
+    for pattern, name in _LEGACY_EXCEPTIONS:
+        if pattern.search(message):
+            return name
+    template = _QUOTED_RE.sub('"…"', message)
+    template = _VARIABLE_RE.sub('<n>', template)
+    template = ' '.join(template.split())
+    return template[:SIGNATURE_SIZE] or False
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+Disponibilité de l'OBR.
+
+Un cron contrôle régulièrement chaque jeu d'identifiants EBMS (identifiants globaux et
+sociétés ayant les leurs) : requête HEAD sur le serveur de login, puis login si aucun token
+n'est connu. Le résultat (joignable, login valide, latence, dernière erreur) est gardé dans
+ebms.health.probe, partagé par tous les workers.
+
+Quand le dernier contrôle, datant de moins de ebms.health_max_age secondes (300 par défaut),
+a échoué, les actions interactives n'attendent plus le délai d'expiration de 30 s :
+l'envoi met les factures en file d'envoi, l'annulation, la consultation et la vérification
+du NIF échouent aussitôt. La file d'envoi, elle, continue d'essayer avec son attente
+exponentielle. Sans contrôle récent, l'état est « inconnu » et rien n'est court-circuité.
+"""
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+
+from .ebms_client import get_client
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_MAX_AGE = 300
+STATUSES = [('up', 'Joignable'), ('down', 'Injoignable'), ('unknown', 'Inconnu')]
+
+
+class EBMSHealthProbe(models.Model):
+    _name = 'ebms.health.probe'
+    _description = 'Disponibilité de l\'OBR'
+    _order = 'key'
+
+    key = fields.Integer(string='Jeu d\'identifiants', required=True, readonly=True,
+                         help='0 : identifiants globaux ; sinon, société ayant ses propres identifiants.')
+    name = fields.Char(string='Identifiants', readonly=True)
+    reachable = fields.Boolean(string='OBR joignable', readonly=True)
+    login_ok = fields.Boolean(string='Login valide', readonly=True)
+    latency_ms = fields.Float(string='Latence (ms)', digits=(16, 1), readonly=True)
+    checked_at = fields.Datetime(string='Dernier contrôle', readonly=True)
+    last_ok_at = fields.Datetime(string='Dernier succès', readonly=True)
+    failures = fields.Integer(string='Échecs consécutifs', readonly=True)
+    last_error = fields.Char(string='Dernière erreur', readonly=True)
+    status = fields.Selection(STATUSES, string='État', compute='_compute_status')
+
+    _sql_constraints = [
+        ('key_uniq', 'unique(key)', 'Un seul état de disponibilité par jeu d\'identifiants.'),
+    ]
+
+    @api.model
+    def _max_age(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param('ebms.health_max_age') or DEFAULT_MAX_AGE)
+
+    @api.depends('checked_at', 'failures')
+    def _compute_status(self):
+        oldest = fields.Datetime.now() - timedelta(seconds=self._max_age())
+        for probe in self:
+            if not probe.checked_at or probe.checked_at < oldest:
+                probe.status = 'unknown'
+            else:
+                probe.status = 'down' if probe.failures else 'up'
+
+    @api.model
+    def _for_company(self, company):
+        """Dernier contrôle des identifiants utilisés par la société (enregistrement vide si aucun)."""
+        key = company._get_ebms_credentials()['key']
+        return self.sudo().search([('key', '=', key)], limit=1)
+
+    @api.model
+    def _down_companies(self, companies):
+        """Sociétés dont l'OBR est connu injoignable."""
+        return companies.filtered(lambda company: self._for_company(company).status == 'down')
+
+    @api.model
+    def _down_message(self, company):
+        probe = self._for_company(company)
+        return _('OBR injoignable (contrôle du %(date)s : %(error)s).',
+                 date=fields.Datetime.to_string(probe.checked_at), error=probe.last_error or _('erreur inconnue'))
+
+    @api.model
+    def _probe_all(self):
+        """Contrôle chaque jeu d'identifiants et enregistre le résultat. Retourne les contrôles."""
+        clients = {}
+        for company in self.env['res.company'].sudo().search([]):
+            client = get_client(self.env, company)
+            clients.setdefault(client.company_id, (client, company))
+        now = fields.Datetime.now()
+        probes = self.browse()
+        for key, (client, company) in clients.items():
+            result = client.probe()
+            client.persist_token(self.env)
+            probe = self.sudo().search([('key', '=', key)], limit=1) or self.sudo().create({'key': key})
+            ok = result['reachable'] and result['login_ok']
+            probe.write({
+                'name': company.name if key else _('Identifiants globaux'),
+                'reachable': result['reachable'],
+                'login_ok': result['login_ok'],
+                'latency_ms': round((result['latency'] or 0.0) * 1000, 1),
+                'checked_at': now,
+                'last_ok_at': now if ok else probe.last_ok_at,
+                'failures': 0 if ok else probe.failures + 1,
+                'last_error': False if ok else result['error'],
+            })
+            if not ok:
+                _logger.warning('OBR injoignable pour %s : %s', probe.name, result['error'])
+            probes |= probe
+        return probes
+
+    @api.model
+    def _cron_probe(self):
+        self._probe_all()
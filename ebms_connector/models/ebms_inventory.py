@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+from .ebms_client import get_client
+
+_logger = logging.getLogger(__name__)
+
+# Quantités en stock par article à la date d'inventaire : quants actuels des emplacements
+# internes du périmètre, moins les mouvements faits depuis cette date. Le résultat ne dépend
+# donc pas du moment où chaque paquet est calculé. Pagination par product_id (keyset).
+SNAPSHOT_QUERY = """
+    WITH scope AS (
+        SELECT id FROM stock_location
+         WHERE usage = 'internal' AND company_id = %(company_id)s AND parent_path LIKE %(path)s
+    ), onhand AS (
+        SELECT q.product_id, SUM(q.quantity) AS quantity
+          FROM stock_quant q
+         WHERE q.location_id IN (SELECT id FROM scope) AND q.product_id > %(after)s
+         GROUP BY q.product_id
+    ), since AS (
+        SELECT ml.product_id,
+               SUM(CASE WHEN ml.location_dest_id IN (SELECT id FROM scope) THEN ml.quantity_product_uom ELSE 0 END)
+             - SUM(CASE WHEN ml.location_id IN (SELECT id FROM scope) THEN ml.quantity_product_uom ELSE 0 END) AS quantity
+          FROM stock_move_line ml
+         WHERE ml.state = 'done' AND ml.date > %(date)s AND ml.product_id > %(after)s
+           AND (ml.location_id IN (SELECT id FROM scope) OR ml.location_dest_id IN (SELECT id FROM scope))
+         GROUP BY ml.product_id
+    )
+    SELECT product_id, COALESCE(onhand.quantity, 0) - COALESCE(since.quantity, 0) AS quantity
+      FROM onhand
+      FULL OUTER JOIN since USING (product_id)
+      JOIN product_product pp ON pp.id = product_id
+      JOIN product_template pt ON pt.id = pp.product_tmpl_id
+     WHERE pt.type = 'product'
+       AND COALESCE(onhand.quantity, 0) - COALESCE(since.quantity, 0) > 0
+     ORDER BY product_id
+     LIMIT %(limit)s
+"""
+
+
+class EBMSInventoryJob(models.Model):
+    _name = 'ebms.inventory.job'
+    _description = 'Inventaire EBMS (entrées EI)'
+    _order = 'id desc'
+
+    name = fields.Char(string='Nom', required=True, default=lambda self: _('Inventaire EBMS'))
+    company_id = fields.Many2one('res.company', string='Société', required=True, default=lambda self: self.env.company)
+    warehouse_id = fields.Many2one('stock.warehouse', string='Entrepôt',
+                                   domain="[('company_id', '=', company_id)]",
+                                   help="Vide : tous les emplacements internes de la société.")
+    inventory_date = fields.Datetime(string='Date d\'inventaire', required=True, default=fields.Datetime.now)
+    state = fields.Selection([
+        ('draft', 'Brouillon'),
+        ('running', 'En cours'),
+        ('paused', 'En pause'),
+        ('done', 'Terminé'),
+    ], string='État', default='draft', required=True)
+    chunk_size = fields.Integer(string='Taille des paquets', default=500, required=True)
+    last_product_id = fields.Integer(string='Point de reprise', default=0, readonly=True,
+                                     help="Identifiant du dernier article traité ; le job reprend après celui-ci.")
+    done_ahead_ids = fields.Json(string='Articles traités après le point de reprise', readonly=True, copy=False,
+                                 help="Articles déjà acceptés ou refusés par l'OBR au-delà d'un article en échec : "
+                                      "ils ne sont pas renvoyés à la reprise.")
+    processed_count = fields.Integer(string='Articles traités', readonly=True)
+    sent_count = fields.Integer(string='Entrées acceptées', readonly=True)
+    rejected_count = fields.Integer(string='Entrées refusées', readonly=True)
+    error_count = fields.Integer(string='Erreurs', readonly=True)
+    last_error = fields.Text(string='Dernière erreur', readonly=True)
+    last_run = fields.Datetime(string='Dernière exécution', readonly=True)
+
+    def action_start(self):
+        if self.env['ir.config_parameter'].sudo().get_param('ebms.stock_url') in (False, None, ''):
+            raise UserError(_('Paramètres EBMS manquants (device_id, stock_url ou token).'))
+        if any(job.inventory_date > fields.Datetime.now() for job in self):
+            raise UserError(_('La date d\'inventaire ne peut pas être dans le futur.'))
+        self.filtered(lambda j: j.state in ('draft', 'paused')).write({'state': 'running'})
+
+    def action_pause(self):
+        self.filtered(lambda j: j.state == 'running').write({'state': 'paused'})
+
+    def action_run_now(self):
+        for job in self.filtered(lambda j: j.state == 'running'):
+            job._run(time_budget=self._get_time_budget())
+
+    @api.model
+    def _get_time_budget(self):
+        return int(self.env['ir.config_parameter'].sudo().get_param('ebms.inventory_time_budget', 240))
+
+    @api.model
+    def _cron_run_inventory(self):
+        """Traite les inventaires en cours dans la limite du budget de temps, paquet par paquet."""
+        deadline = time.monotonic() + self._get_time_budget()
+        for job in self.search([('state', '=', 'running')], order='id'):
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            job._run(time_budget=remaining)
+
+    def _commit(self):
+        # Un point de reprise par paquet : un arrêt du worker ne renvoie au plus qu'un paquet.
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    def _run(self, time_budget):
+        self.ensure_one()
+        deadline = time.monotonic() + time_budget
+        Queue = self.env['ebms.queue.item']
+        while self.state == 'running' and time.monotonic() < deadline:
+            if Queue._has_urgent_work():
+                # Les envois en attente (reçus, factures, stock) passent avant l'inventaire.
+                break
+            quantities = self._snapshot(self.chunk_size)
+            if not quantities:
+                self.write({'state': 'done', 'last_run': fields.Datetime.now()})
+                self._commit()
+                break
+            self._process_chunk(quantities)
+            self._commit()
+
+    def _snapshot(self, limit):
+        """Prochain paquet d'articles après le point de reprise : [(product_id, quantité à la date d'inventaire)]."""
+        self.ensure_one()
+        self.env.flush_all()
+        path = '%s%%' % self.warehouse_id.view_location_id.parent_path if self.warehouse_id else '%'
+        self.env.cr.execute(SNAPSHOT_QUERY, {
+            'company_id': self.company_id.id,
+            'path': path,
+            'after': self.last_product_id,
+            'date': self.inventory_date,
+            'limit': limit,
+        })
+        return self.env.cr.fetchall()
+
+    def _cost_prices(self, product_ids):
+        """
+        Coût unitaire de chaque article à la date d'inventaire : valeur moyenne de ses couches de
+        valorisation jusqu'à cette date (module stock_account installé), sinon son coût standard
+        dans la société du job. Retourne {product_id: coût}.
+        """
+        costs = {}
+        if 'stock.valuation.layer' in self.env:
+            self.env.cr.execute("""
+                SELECT product_id, SUM(value) / NULLIF(SUM(quantity), 0)
+                  FROM stock_valuation_layer
+                 WHERE company_id = %s AND product_id IN %s AND create_date <= %s
+                 GROUP BY product_id
+            """, (self.company_id.id, tuple(product_ids), self.inventory_date))
+            costs = {product_id: abs(cost) for product_id, cost in self.env.cr.fetchall() if cost}
+        unvalued = [product_id for product_id in product_ids if product_id not in costs]
+        if unvalued:
+            products = self.env['product.product'].browse(unvalued).with_company(self.company_id)
+            costs.update({product['id']: product['standard_price'] for product in products.read(['standard_price'])})
+        return costs
+
+    def _payloads(self, quantities):
+        """Payloads AddStockMovement « EI » d'un paquet, avec les mêmes champs que les mouvements de stock."""
+        self.ensure_one()
+        device_id = self.env['ir.config_parameter'].sudo().get_param('ebms.device_id')
+        system_id = self.company_id.ebms_system_id or device_id
+        product_ids = [product_id for product_id, _quantity in quantities]
+        products = {product['id']: product for product in self.env['product.product'].browse(product_ids).read(
+            ['default_code', 'name', 'uom_id'])}
+        costs = self._cost_prices(product_ids)
+        description = _('Inventaire %s') % self.name
+        date = fields.Datetime.to_string(self.inventory_date)
+        return [{
+            "system_or_device_id": system_id,
+            "item_code": products[product_id]['default_code'] or '',
+            "item_designation": products[product_id]['name'] or '',
+            "item_quantity": str(quantity),
+            "item_measurement_unit": products[product_id]['uom_id'][1] if products[product_id]['uom_id'] else '',
+            "item_cost_price": str(costs.get(product_id, 0.0)),
+            "item_cost_price_currency": self.company_id.currency_id.name or 'BIF',
+            "item_movement_type": 'EI',
+            "item_movement_invoice_ref": '',
+            "item_movement_description": description,
+            "item_movement_date": date,
+        } for product_id, quantity in quantities]
+
+    def _process_chunk(self, quantities):
+        """
+        Envoie les entrées EI d'un paquet avec la concurrence bornée du client partagé, puis
+        avance le point de reprise. Un refus de l'OBR est compté et l'inventaire continue.
+        En cas d'erreur technique, le point de reprise s'arrête juste avant le premier article
+        en échec ; les articles suivants du paquet déjà traités par l'OBR sont notés dans
+        done_ahead_ids, et seuls les articles en échec sont renvoyés à la reprise.
+        """
+        self.ensure_one()
+        ahead = set(self.done_ahead_ids or [])
+        to_send = [row for row in quantities if row[0] not in ahead]
+        payloads = self._payloads(to_send) if to_send else []
+        results = {}
+        if payloads:
+            url = self.env['ir.config_parameter'].sudo().get_param('ebms.stock_url')
+            client = get_client(self.env, self.company_id)
+            results = dict(zip([row[0] for row in to_send], zip(payloads, client.post_many(url, payloads))))
+            client.persist_token(self.env)
+
+        checkpoint = self.last_product_id
+        blocked = False
+        processed = sent = rejected = errors = 0
+        last_error = False
+        for product_id, _quantity in quantities:
+            if product_id in results:
+                payload, result = results[product_id]
+                if result['status_code'] is None or result['status_code'] >= 500 or result['status_code'] == 401:
+                    errors += 1
+                    last_error = result['msg']
+                    blocked = True
+                    continue
+                if result['success']:
+                    sent += 1
+                else:
+                    rejected += 1
+                    last_error = '%s : %s' % (payload['item_code'] or payload['item_designation'], result['msg'])
+                processed += 1
+                ahead.add(product_id)
+            if not blocked:
+                checkpoint = product_id
+        self.write({
+            'last_product_id': checkpoint,
+            'done_ahead_ids': sorted(product_id for product_id in ahead if product_id > checkpoint),
+            'processed_count': self.processed_count + processed,
+            'sent_count': self.sent_count + sent,
+            'rejected_count': self.rejected_count + rejected,
+            'error_count': self.error_count + errors,
+            'last_error': last_error or self.last_error,
+            'last_run': fields.Datetime.now(),
+        })
+        if errors and not processed:
+            # Rien n'a avancé : on met le job en pause plutôt que de boucler sur l'erreur.
+            self.state = 'paused'
+            _logger.warning('Inventaire EBMS %s mis en pause : %s', self.id, last_error)
@@ -0,0 +1,151 @@
+# -*- coding: utf-8 -*-
+"""
+Cache des réponses getInvoice de l'OBR, par invoice_identifier.
+
+Le support consulte la même facture plusieurs fois pendant un appel client, et les outils
+de rapprochement interrogent les mêmes identifiants : chaque réponse positive est gardée
+ebms.getinvoice_cache_ttl secondes (300 par défaut), dans la limite de
+ebms.getinvoice_cache_size entrées (1000 par défaut, les moins récemment lues sortent
+en premier). Seules les réponses positives sont gardées : une facture que l'OBR ne connaît
+pas encore doit pouvoir être trouvée dès l'accusé suivant.
+
+Comme le client EBMS, le cache vit dans le worker, séparé par base. Une annulation EBMS
+retire la facture du cache ; une lecture avec refresh=True repasse toujours par l'OBR.
+"""
+import os
+import threading
+import time
+from collections import OrderedDict
+
+from . import ebms_json
+from .ebms_client import get_client
+
+DEFAULT_TTL = 300
+DEFAULT_SIZE = 1000
+
+
+class TTLCache:
+    """Cache LRU borné dont les entrées expirent après ttl secondes ; utilisable entre threads."""
+
+    def __init__(self, maxsize=DEFAULT_SIZE, ttl=DEFAULT_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def configure(self, maxsize, ttl):
+        with self._lock:
+            self.maxsize = max(0, int(maxsize))
+            self.ttl = max(0, int(ttl))
+            self._evict()
+        return self
+
+    def get(self, key):
+        """Valeur encore valide pour la clé, sinon None (l'entrée périmée est retirée)."""
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] > time.monotonic():
+                self._data.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._data[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, value):
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            self._evict()
+
+    def pop(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._data)
+
+    def _evict(self):
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def _reset_lock(self):
+        self._lock = threading.Lock()
+
+
+_invoices = TTLCache()
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_invoices._reset_lock)
+
+
+def _configure(env):
+    params = env['ir.config_parameter'].sudo()
+    _invoices.configure(
+        maxsize=params.get_param('ebms.getinvoice_cache_size') or DEFAULT_SIZE,
+        ttl=params.get_param('ebms.getinvoice_cache_ttl') or DEFAULT_TTL,
+    )
+
+
+def get_invoice(env, identifier):
+    """Réponse getInvoice en cache pour l'identifiant (copie, modifiable par l'appelant), ou None."""
+    _configure(env)
+    cached = _invoices.get((env.cr.dbname, identifier))
+    return ebms_json.loads(cached) if cached is not None else None
+
+
+def put_invoice(env, identifier, resp_json):
+    """Garde une réponse getInvoice positive."""
+    if identifier and resp_json.get('success'):
+        _configure(env)
+        _invoices.put((env.cr.dbname, identifier), ebms_json.canonical(resp_json))
+
+
+def invalidate(env, *identifiers):
+    for identifier in identifiers:
+        if identifier:
+            _invoices.pop((env.cr.dbname, identifier))
+
+
+def clear():
+    _invoices.clear()
+
+
+def stats():
+    return {'size': len(_invoices), 'hits': _invoices.hits, 'misses': _invoices.misses}
+
+
+def lookup_invoices(env, identifiers, company=None, refresh=False, trace_ids=None):
+    """
+    Vue OBR de plusieurs factures : {identifiant: résultat du client EBMS}. Les réponses en
+    cache sont servies sans appel (status_code 200, 'cached' vrai) ; les autres sont demandées
+    en parallèle à getInvoice, et les réponses positives mises en cache.
+    trace_ids ({identifiant: identifiant de corrélation}) part dans l'en-tête de chaque appel.
+    """
+    results = {}
+    missing = []
+    for identifier in dict.fromkeys(identifiers):
+        cached = None if refresh else get_invoice(env, identifier)
+        if cached is None:
+            missing.append(identifier)
+        else:
+            results[identifier] = {'success': True, 'status_code': 200, 'data': cached, 'msg': '', 'cached': True}
+    if missing:
+        url = env['ir.config_parameter'].sudo().get_param('ebms.getinvoice_url')
+        client = get_client(env, company)
+        fetched = client.post_many(url, [{'invoice_identifier': identifier} for identifier in missing],
+                                   [(trace_ids or {}).get(identifier) for identifier in missing])
+        client.persist_token(env)
+        for identifier, result in zip(missing, fetched):
+            if result['success']:
+                put_invoice(env, identifier, result['data'])
+            results[identifier] = result
+    return results
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""
+Encodage JSON des échanges EBMS.
+
+Chaque objet échangé avec l'OBR est encodé une seule fois, sous forme canonique (clés
+triées, sans espaces, UTF-8). Ce texte sert tel quel à l'envoi, au stockage
+(ebms_result_data) et au message du fil de discussion ; les octets vérifiés par la
+signature (même forme, non-ASCII échappé comme le fait json.dumps par défaut) s'en
+déduisent sans ré-analyser le JSON.
+
+orjson est utilisé s'il est installé : sur une facture de plusieurs centaines de lignes il
+encode plusieurs fois plus vite que la bibliothèque standard. Sa sortie est identique à
+celle de json.dumps(sort_keys=True, separators=(',', ':'), ensure_ascii=False), à l'écriture
+de certains flottants près ('1e16' au lieu de '1e+16') ; la vérification de signature
+retombe donc sur la forme de la bibliothèque standard si la forme rapide ne correspond pas.
+"""
+import json
+import re
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+SEPARATORS = (',', ':')
+# DEL (0x7f) compris : json.dumps(ensure_ascii=True) l'échappe aussi
+_NON_ASCII_RE = re.compile(r'[^\x00-\x7e]')
+
+
+def _default(value):
+    return str(value)
+
+
+def _std_canonical(value):
+    return json.dumps(value, sort_keys=True, separators=SEPARATORS, ensure_ascii=False, default=_default)
+
+
+if orjson is not None:
+    _ORJSON_OPTIONS = orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+
+    def canonical(value):
+        """Forme canonique (octets UTF-8) d'un objet JSON."""
+        try:
+            return orjson.dumps(value, option=_ORJSON_OPTIONS, default=_default)
+        except TypeError:
+            # Entier hors 64 bits, sous-classe non gérée... : la bibliothèque standard sait faire.
+            return _std_canonical(value).encode('utf-8')
+
+    def loads(data):
+        return orjson.loads(data)
+else:
+    def canonical(value):
+        """Forme canonique (octets UTF-8) d'un objet JSON."""
+        return _std_canonical(value).encode('utf-8')
+
+    def loads(data):
+        return json.loads(data)
+
+
+def canonical_text(value):
+    """Forme canonique sous forme de texte (stockage, messages)."""
+    if orjson is None:
+        return _std_canonical(value)
+    return canonical(value).decode('utf-8')
+
+
+def _escape(match):
+    code = ord(match.group())
+    if code > 0xFFFF:
+        code -= 0x10000
+        return '\\u%04x\\u%04x' % (0xD800 | (code >> 10), 0xDC00 | (code & 0x3FF))
+    return '\\u%04x' % code
+
+
+def signed_bytes(canonical_json):
+    """
+    Octets signés par l'OBR à partir d'un JSON déjà canonique : les caractères non-ASCII
+    et DEL (qui ne peuvent apparaître que dans des chaînes) sont échappés en \\uXXXX, comme
+    json.dumps(ensure_ascii=True).
+    """
+    if isinstance(canonical_json, bytes):
+        canonical_json = canonical_json.decode('utf-8')
+    return _NON_ASCII_RE.sub(_escape, canonical_json).encode('ascii')
+
+
+def legacy_signed_bytes(json_text):
+    """Octets signés recalculés depuis un JSON quelconque (ré-analyse et ré-encodage standard)."""
+    return json.dumps(json.loads(json_text), sort_keys=True, separators=SEPARATORS).encode('utf-8')
@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+Latence de bout en bout des factures EBMS : validation -> premier envoi -> accusé OBR
+-> vérification (jalons stockés dans account_move_ebms).
+
+Le rapport journalier (p50/p95/p99 du délai d'accusé, tentatives par facture) est une vue
+SQL agrégée par société et jour de validation ; le cron de contrôle signale les sociétés
+dont l'arriéré non acquitté dépasse le SLO (ebms.ack_slo_minutes).
+"""
+import logging
+from datetime import timedelta
+
+from odoo import api, fields, models, tools, _
+
+_logger = logging.getLogger(__name__)
+
+# L'OBR exige un envoi « en temps réel » : un quart d'heure sans accusé est déjà un retard.
+DEFAULT_ACK_SLO_MINUTES = 15
+ALERT_SUMMARY = 'SLO EBMS dépassé'
+
+
+class EBMSLatencyReport(models.Model):
+    _name = 'ebms.latency.report'
+    _description = 'Latence de soumission EBMS'
+    _auto = False
+    _order = 'day desc, company_id'
+
+    company_id = fields.Many2one('res.company', string='Société', readonly=True)
+    day = fields.Date(string='Jour de validation', readonly=True)
+    posted_count = fields.Integer(string='Factures validées', readonly=True)
+    acknowledged_count = fields.Integer(string='Acquittées', readonly=True)
+    pending_count = fields.Integer(string='Sans accusé', readonly=True)
+    verified_count = fields.Integer(string='Vérifiées', readonly=True)
+    ack_p50 = fields.Float(string='Accusé p50 (s)', readonly=True, group_operator=False)
+    ack_p95 = fields.Float(string='Accusé p95 (s)', readonly=True, group_operator=False)
+    ack_p99 = fields.Float(string='Accusé p99 (s)', readonly=True, group_operator=False)
+    ack_max = fields.Float(string='Accusé max (s)', readonly=True, group_operator='max')
+    first_attempt_p95 = fields.Float(string='Premier envoi p95 (s)', readonly=True, group_operator=False,
+                                     help='Délai entre validation et premier appel OBR')
+    attempts_avg = fields.Float(string='Tentatives par facture', readonly=True, group_operator=False)
+    attempts_max = fields.Integer(string='Tentatives max', readonly=True, group_operator='max')
+
+    def init(self):
+        tools.drop_view_if_exists(self.env.cr, self._table)
+        self.env.cr.execute("""
+            CREATE VIEW ebms_latency_report AS
+            SELECT min(e.id) AS id,
+                   m.company_id,
+                   e.ebms_posted_at::date AS day,
+                   count(*) AS posted_count,
+                   count(e.ebms_acknowledged_at) AS acknowledged_count,
+                   count(*) FILTER (WHERE e.ebms_acknowledged_at IS NULL AND e.ebms_status != 'cancelled') AS pending_count,
+                   count(e.ebms_verified_at) AS verified_count,
+                   percentile_cont(0.50) WITHIN GROUP (ORDER BY extract(epoch FROM e.ebms_acknowledged_at - e.ebms_posted_at)) AS ack_p50,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY extract(epoch FROM e.ebms_acknowledged_at - e.ebms_posted_at)) AS ack_p95,
+                   percentile_cont(0.99) WITHIN GROUP (ORDER BY extract(epoch FROM e.ebms_acknowledged_at - e.ebms_posted_at)) AS ack_p99,
+                   max(extract(epoch FROM e.ebms_acknowledged_at - e.ebms_posted_at)) AS ack_max,
+                   percentile_cont(0.95) WITHIN GROUP (ORDER BY extract(epoch FROM e.ebms_first_attempt_at - e.ebms_posted_at)) AS first_attempt_p95,
+                   avg(NULLIF(e.ebms_attempts, 0)) AS attempts_avg,
+                   max(e.ebms_attempts) AS attempts_max
+              FROM account_move_ebms e
+              JOIN account_move m ON m.id = e.move_id
+             WHERE e.ebms_posted_at IS NOT NULL
+               AND m.state = 'posted'
+             GROUP BY m.company_id, e.ebms_posted_at::date
+        """)
+
+    @api.model
+    def _ack_slo(self):
+        minutes = self.env['ir.config_parameter'].sudo().get_param('ebms.ack_slo_minutes')
+        return timedelta(minutes=int(minutes or DEFAULT_ACK_SLO_MINUTES))
+
+    @api.model
+    def _backlog_breaches(self):
+        """
+        Factures validées sans accusé depuis plus que le SLO (hors erreurs mises de côté), par société :
+        {company_id: (nombre, validée le plus tôt, id de la plus ancienne)}.
+        """
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT m.company_id, count(*), min(e.ebms_posted_at),
+                   (array_agg(m.id ORDER BY e.ebms_posted_at, m.id))[1]
+              FROM account_move_ebms e
+              JOIN account_move m ON m.id = e.move_id
+             WHERE e.ebms_status IN ('draft', 'sending', 'relayed', 'error')
+               AND e.ebms_parked IS NOT TRUE
+               AND e.ebms_posted_at < %s
+               AND m.state = 'posted'
+             GROUP BY m.company_id
+        """, (fields.Datetime.now() - self._ack_slo(),))
+        return {company_id: (count, oldest, move_id) for company_id, count, oldest, move_id in self.env.cr.fetchall()}
+
+    @api.model
+    def _cron_check_backlog_slo(self):
+        """Alerte (journal et activité sur la facture la plus ancienne) pour chaque société hors SLO."""
+        slo_minutes = int(self._ack_slo().total_seconds() // 60)
+        breaches = self._backlog_breaches()
+        for company_id, (count, oldest, move_id) in breaches.items():
+            age = fields.Datetime.now() - oldest
+            _logger.warning(
+                'SLO EBMS dépassé pour la société %s : %s facture(s) sans accusé depuis plus de %s min, la plus ancienne depuis %s.',
+                company_id, count, slo_minutes, age)
+            invoice = self.env['account.move'].browse(move_id)
+            if not invoice.activity_ids.filtered(lambda a: a.summary == ALERT_SUMMARY):
+                invoice.activity_schedule(
+                    'mail.mail_activity_data_warning',
+                    summary=ALERT_SUMMARY,
+                    note=_('%(count)s facture(s) validée(s) sans accusé OBR depuis plus de %(slo)s minutes ; '
+                           'la plus ancienne (celle-ci) attend depuis %(age)s.', count=count, slo=slo_minutes, age=age),
+                    user_id=invoice.invoice_user_id.id or self.env.uid,
+                )
+        return breaches
@@ -0,0 +1,158 @@
+# -*- coding: utf-8 -*-
+"""
+Journal structuré des échanges EBMS.
+
+Un seul enregistrement par échange, sur le logger dédié
+`odoo.addons.ebms_connector.exchange` : endpoint, statut HTTP, latence et
+identifiants métier. Le message n'est formaté que s'il est réellement émis,
+et les champs sont aussi fournis tels quels dans `record.ebms` pour les
+handlers structurés (JSON).
+
+Les corps de requête/réponse ne sont joints qu'aux échanges en erreur, à un
+échantillon des autres (ebms.log_body_sample_rate, entre 0 et 1) ou quand le
+logger est en DEBUG. Tokens, mots de passe et NIF sont masqués.
+"""
+import json
+import logging
+import random
+import re
+
+exchange_logger = logging.getLogger('odoo.addons.ebms_connector.exchange')
+
+MAX_BODY_LENGTH = 2000
+SECRET_KEYS = {'token', 'api_token', 'access_token', 'password', 'authorization', 'signature', 'electronic_signature'}
+# Identifiants métier repris du payload pour retrouver une facture ou un mouvement dans les logs.
+ID_KEYS = ('invoice_number', 'invoice_identifier', 'invoice_reference', 'item_code', 'reference')
+
+_settings = {'body_sample_rate': 0.0}
+
+_BEARER_RE = re.compile(r'(Bearer\s+)[A-Za-z0-9._~+/=-]+')
+_SECRET_VALUE_RE = re.compile(
+    r'("(?:%s)"\s*:\s*")[^"]*(")' % '|'.join(sorted(SECRET_KEYS)), re.IGNORECASE)
+_TIN_VALUE_RE = re.compile(r'("(?:[a-z_]*_)?(?:tin|nif)"\s*:\s*")([^"]*)(")', re.IGNORECASE)
+
+
+def configure(body_sample_rate=None):
+    """Réglages du processus, mis à jour depuis les paramètres système par get_client."""
+    if body_sample_rate is not None:
+        try:
+            _settings['body_sample_rate'] = min(max(float(body_sample_rate), 0.0), 1.0)
+        except (TypeError, ValueError):
+            _settings['body_sample_rate'] = 0.0
+
+
+def _is_tin_key(key):
+    key = key.lower()
+    return key in ('tin', 'nif', 'vat') or key.endswith('_tin') or key.endswith('_nif')
+
+
+def mask_tin(value):
+    """Garde les trois derniers caractères d'un NIF : assez pour recouper, pas pour identifier."""
+    value = str(value or '')
+    return '*' * max(len(value) - 3, 0) + value[-3:] if len(value) > 3 else '***'
+
+
+def redact(value):
+    """Copie de `value` (dict, liste, chaîne JSON ou texte) avec les secrets et NIF masqués."""
+    if isinstance(value, dict):
+        redacted = {}
+        for key, item in value.items():
+            if str(key).lower() in SECRET_KEYS:
+                redacted[key] = '***'
+            elif _is_tin_key(str(key)) and item:
+                redacted[key] = mask_tin(item)
+            elif key in ('invoice_identifier', 'cancelled_invoice_ref') and item:
+                redacted[key] = mask_identifier(item)
+            else:
+                redacted[key] = redact(item)
+        return redacted
+    if isinstance(value, (list, tuple)):
+        return [redact(item) for item in value]
+    if isinstance(value, (bytes, bytearray)):
+        value = value.decode('utf-8', 'replace')
+    if isinstance(value, str):
+        value = _BEARER_RE.sub(r'\1***', value)
+        value = _SECRET_VALUE_RE.sub(r'\1***\2', value)
+        return _TIN_VALUE_RE.sub(lambda m: m.group(1) + mask_tin(m.group(2)) + m.group(3), value)
+    return value
+
+
+def mask_identifier(identifier):
+    """invoice_identifier OBR (NIF/système/horodatage/numéro) avec le NIF masqué."""
+    tin, sep, rest = str(identifier).partition('/')
+    return mask_tin(tin) + sep + rest if sep else identifier
+
+
+def _body(value):
+    if isinstance(value, (dict, list, tuple)):
+        text = json.dumps(redact(value), ensure_ascii=False, default=str)
+    else:
+        text = str(redact(value))
+    return text if len(text) <= MAX_BODY_LENGTH else text[:MAX_BODY_LENGTH] + '…'
+
+
+class _LazyExchange:
+    """Formatage différé : rien n'est sérialisé si l'enregistrement est filtré."""
+
+    __slots__ = ('fields', 'request', 'response')
+
+    def __init__(self, fields, request, response):
+        self.fields = fields
+        self.request = request
+        self.response = response
+
+    def __str__(self):
+        parts = ['%s=%s' % (key, value) for key, value in self.fields.items() if value not in (None, '', [], {})]
+        if self.request is not None:
+            parts.append('request=%s' % _body(self.request))
+        if self.response is not None:
+            parts.append('response=%s' % _body(self.response))
+        return ' '.join(parts)
+
+
+def log_exchange(endpoint, status=None, latency=None, payload=None, response=None, error=None,
+                 ids=None, company_id=None, trace_id=None):
+    """
+    Journalise un échange avec l'OBR.
+
+    :param endpoint: URL ou nom court de l'endpoint
+    :param status: code HTTP (None si pas de réponse)
+    :param latency: durée de l'échange, en secondes
+    :param payload: corps envoyé (dict), utilisé pour les identifiants et l'échantillonnage
+    :param response: corps reçu (dict ou texte)
+    :param error: message d'erreur, le cas échéant
+    :param ids: identifiants Odoo concernés
+    :param trace_id: identifiant de corrélation de la soumission (voir ebms_tracing)
+    """
+    if not isinstance(status, int):
+        status = None
+    failed = bool(error) or status is None or status >= 400
+    level = logging.WARNING if failed else logging.INFO
+    if not exchange_logger.isEnabledFor(level):
+        return
+    fields = {
+        'endpoint': endpoint,
+        'status': status,
+        'latency_ms': round(latency * 1000) if latency is not None else None,
+        'company_id': company_id or None,
+        'ids': list(ids) if ids else None,
+        'trace_id': trace_id or None,
+        'error': redact(error) if error else None,
+    }
+    if isinstance(payload, dict):
+        fields.update({key: payload[key] for key in ID_KEYS if payload.get(key)})
+        if fields.get('invoice_identifier'):
+            fields['invoice_identifier'] = mask_identifier(fields['invoice_identifier'])
+    with_body = (
+        failed
+        or exchange_logger.isEnabledFor(logging.DEBUG)
+        or (_settings['body_sample_rate'] and random.random() < _settings['body_sample_rate'])
+    )
+    exchange_logger.log(
+        level, 'EBMS %s', _LazyExchange(
+            fields,
+            payload if with_body and payload is not None else None,
+            response if with_body and response is not None else None,
+        ),
+        extra={'ebms': fields},
+    )
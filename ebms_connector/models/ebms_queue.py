@@ -0,0 +1,322 @@
+# -*- coding: utf-8 -*-
+
+import logging
+import threading
+import time
+from datetime import timedelta
+
+from odoo import api, fields, models, _
+
+from .ebms_tracing import SpanLog
+
+_logger = logging.getLogger(__name__)
+
+LANES = [
+    ('interactive', 'Factures et reçus'),
+    ('stock', 'Mouvements de stock'),
+    ('credit_note', 'Avoirs'),
+    ('background', 'Arrière-plan (rattrapage, réconciliation)'),
+]
+# Poids de l'ordonnancement équitable pondéré et SLO de latence (secondes) par défaut,
+# surchargeables par ebms.lane_weight.<voie> et ebms.lane_slo.<voie>.
+DEFAULT_LANE_WEIGHTS = {'interactive': 8, 'stock': 4, 'credit_note': 2, 'background': 1}
+DEFAULT_LANE_SLOS = {'interactive': 60, 'stock': 900, 'credit_note': 900, 'background': 86400}
+
+
+def weighted_round_robin(queues, weights, limit):
+    """
+    Entrelace des files selon leurs poids (round-robin pondéré « lisse ») :
+    avec des poids 8/4/2/1, une voie de poids 8 est servie huit fois plus souvent
+    qu'une voie de poids 1, sans jamais affamer cette dernière.
+
+    :param queues: dict voie -> liste d'éléments, déjà triés par ancienneté
+    :param weights: dict voie -> poids (> 0)
+    :param limit: nombre maximal d'éléments retournés
+    """
+    queues = {lane: list(items) for lane, items in queues.items() if items}
+    credits = dict.fromkeys(queues, 0)
+    picked = []
+    while queues and len(picked) < limit:
+        total = sum(weights[lane] for lane in queues)
+        for lane in queues:
+            credits[lane] += weights[lane]
+        lane = max(queues, key=lambda l: credits[l])
+        credits[lane] -= total
+        picked.append(queues[lane].pop(0))
+        if not queues[lane]:
+            del queues[lane]
+            del credits[lane]
+    return picked
+
+
+class EBMSQueueItem(models.Model):
+    _name = 'ebms.queue.item'
+    _description = 'File d\'envoi EBMS'
+    _order = 'enqueued_at, id'
+
+    res_model = fields.Char(string='Modèle', required=True, index=True)
+    res_id = fields.Integer(string='Enregistrement', required=True, index=True)
+    company_id = fields.Many2one('res.company', string='Société', required=True, index=True)
+    lane = fields.Selection(LANES, string='Voie', required=True, index=True)
+    state = fields.Selection([
+        ('pending', 'En attente'),
+        ('running', 'En cours'),
+        ('done', 'Envoyé'),
+        ('error', 'Erreur'),
+    ], string='État', default='pending', required=True, index=True)
+    enqueued_at = fields.Datetime(string='Mis en file le', required=True, default=fields.Datetime.now)
+    next_attempt_at = fields.Datetime(string='Prochaine tentative', default=fields.Datetime.now, index=True)
+    started_at = fields.Datetime(string='Début du traitement')
+    done_at = fields.Datetime(string='Traité le')
+    attempts = fields.Integer(string='Tentatives')
+    error_message = fields.Text(string='Dernière erreur')
+
+    _sql_constraints = [
+        ('attempts_positive', 'CHECK(attempts >= 0)', 'Le nombre de tentatives doit être positif.'),
+    ]
+
+    def init(self):
+        # Un seul élément actif par enregistrement : ré-enfiler ne crée pas de doublon.
+        self.env.cr.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS ebms_queue_item_active_record_uniq
+                ON ebms_queue_item (res_model, res_id)
+             WHERE state IN ('pending', 'running')
+        """)
+
+    # ------------------------------------------------------------------
+    # Paramètres
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _lane_weights(self):
+        params = self.env['ir.config_parameter'].sudo()
+        return {
+            lane: max(1, int(params.get_param('ebms.lane_weight.%s' % lane, default) or default))
+            for lane, default in DEFAULT_LANE_WEIGHTS.items()
+        }
+
+    @api.model
+    def _lane_slos(self):
+        params = self.env['ir.config_parameter'].sudo()
+        return {
+            lane: int(params.get_param('ebms.lane_slo.%s' % lane, default) or default)
+            for lane, default in DEFAULT_LANE_SLOS.items()
+        }
+
+    @api.model
+    def _lane_for(self, record):
+        """Voie par défaut d'un enregistrement : avoirs à part, reçus et factures en interactif."""
+        if record._name == 'stock.move':
+            return 'stock'
+        if record._name == 'account.move' and record.move_type == 'out_refund':
+            return 'credit_note'
+        return 'interactive'
+
+    # ------------------------------------------------------------------
+    # Mise en file
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _enqueue(self, records, lane=None):
+        """
+        Met des enregistrements en file d'envoi. Ceux qui ont déjà un élément actif sont ignorés.
+        Déclenche le cron de traitement si une voie interactive est concernée.
+        """
+        if not records:
+            return self.browse()
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT res_id FROM ebms_queue_item
+             WHERE res_model = %s AND res_id IN %s AND state IN ('pending', 'running')
+        """, (records._name, tuple(records.ids)))
+        active = {row[0] for row in self.env.cr.fetchall()}
+        now = fields.Datetime.now()
+        items = self.create([{
+            'res_model': record._name,
+            'res_id': record.id,
+            'company_id': record.company_id.id,
+            'lane': lane or self._lane_for(record),
+            'enqueued_at': now,
+            'next_attempt_at': now,
+        } for record in records if record.id not in active])
+        if any(item.lane == 'interactive' for item in items):
+            cron = self.env.ref('ebms_connector.ir_cron_ebms_queue', raise_if_not_found=False)
+            if cron:
+                cron._trigger()
+        return items
+
+    # ------------------------------------------------------------------
+    # Ordonnancement
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _select_batch(self, limit):
+        """
+        Choisit les prochains éléments à traiter : d'abord ceux dont la voie a dépassé son SLO
+        (les plus en retard en premier), puis un entrelacement pondéré des voies.
+        Les candidats sont lus sans verrou ; seuls les éléments retenus sont ensuite verrouillés
+        (SKIP LOCKED), ceux déjà pris par un worker concurrent sont écartés du lot.
+        """
+        now = fields.Datetime.now()
+        slos = self._lane_slos()
+        weights = self._lane_weights()
+        self.flush_model(['state', 'lane', 'enqueued_at', 'next_attempt_at'])
+        queues = {}
+        for lane in weights:
+            self.env.cr.execute("""
+                SELECT id, enqueued_at FROM ebms_queue_item
+                 WHERE state = 'pending' AND lane = %s AND next_attempt_at <= %s
+                 ORDER BY enqueued_at, id
+                 LIMIT %s
+            """, (lane, now, limit))
+            queues[lane] = self.env.cr.fetchall()
+        overdue = sorted(
+            (row for lane, rows in queues.items() for row in rows
+             if (now - row[1]).total_seconds() > slos[lane]),
+            key=lambda row: row[1],
+        )
+        overdue_ids = {row[0] for row in overdue}
+        if overdue:
+            _logger.warning('File EBMS : %s élément(s) au-delà de leur SLO de latence.', len(overdue))
+        remaining = {lane: [row for row in rows if row[0] not in overdue_ids] for lane, rows in queues.items()}
+        picked = [row[0] for row in overdue[:limit] + weighted_round_robin(
+            remaining, weights, limit - min(len(overdue), limit))]
+        if not picked:
+            return self.browse()
+        self.env.cr.execute("""
+            SELECT id FROM ebms_queue_item
+             WHERE id IN %s AND state = 'pending'
+               FOR UPDATE SKIP LOCKED
+        """, (tuple(picked),))
+        locked = {row[0] for row in self.env.cr.fetchall()}
+        return self.browse([item_id for item_id in picked if item_id in locked])
+
+    @api.model
+    def _has_urgent_work(self):
+        """Vrai si des éléments non « arrière-plan » attendent : les tâches de fond doivent céder la place."""
+        self.env.cr.execute("""
+            SELECT 1 FROM ebms_queue_item
+             WHERE state = 'pending' AND lane != 'background' AND next_attempt_at <= %s
+             LIMIT 1
+        """, (fields.Datetime.now(),))
+        return bool(self.env.cr.fetchone())
+
+    # ------------------------------------------------------------------
+    # Traitement
+    # ------------------------------------------------------------------
+
+    def _commit(self):
+        if not getattr(threading.current_thread(), 'testing', False):
+            self.env.cr.commit()
+
+    @api.model
+    def _cron_process_queue(self):
+        """Vide la file par lots dans la limite du budget de temps du cron."""
+        params = self.env['ir.config_parameter'].sudo()
+        batch_size = int(params.get_param('ebms.queue_batch_size', 50))
+        deadline = time.monotonic() + int(params.get_param('ebms.queue_time_budget', 50))
+        while time.monotonic() < deadline:
+            batch = self._select_batch(batch_size)
+            if not batch:
+                break
+            batch._process()
+            self._commit()
+
+    def _process(self):
+        """
+        Envoie les éléments regroupés par modèle, puis met à jour leur état.
+        Le résultat vient de _ebms_submit : l'envoi des factures est enregistré dans une autre
+        transaction, que l'instantané de la transaction du cron ne voit pas.
+        L'attente en file des factures est tracée sous leur identifiant de corrélation.
+        """
+        now = fields.Datetime.now()
+        self.write({'state': 'running', 'started_at': now})
+        for res_model in set(self.mapped('res_model')):
+            items = self.filtered(lambda i: i.res_model == res_model)
+            records = self.env[res_model].browse(items.mapped('res_id')).exists()
+            if res_model == 'account.move':
+                spans = SpanLog()
+                trace_ids = {record.id: record.ebms_trace_id for record in records}
+                for item in items:
+                    spans.add(item.res_id, trace_ids.get(item.res_id), 'queue_wait', item.enqueued_at,
+                              (now - item.enqueued_at).total_seconds())
+                spans.write(self.env)
+            try:
+                with self.env.cr.savepoint():
+                    outcomes = records._ebms_submit() if records else {}
+            except Exception as e:
+                _logger.exception('Erreur lors du traitement de la file EBMS (%s)', res_model)
+                items._mark_failed(str(e))
+                continue
+            for item in items:
+                if item.res_id not in outcomes:
+                    item.write({'state': 'done', 'done_at': fields.Datetime.now(), 'error_message': _('Enregistrement supprimé')})
+                    continue
+                ok, message = outcomes[item.res_id]
+                if ok:
+                    item.write({'state': 'done', 'done_at': fields.Datetime.now(), 'attempts': item.attempts + 1, 'error_message': False})
+                else:
+                    item._mark_failed(message)
+
+    def _mark_failed(self, message):
+        """Erreur : nouvel essai avec attente exponentielle, jusqu'à ebms.queue_max_attempts."""
+        max_attempts = int(self.env['ir.config_parameter'].sudo().get_param('ebms.queue_max_attempts', 5))
+        now = fields.Datetime.now()
+        for item in self:
+            attempts = item.attempts + 1
+            item.write({
+                'state': 'pending' if attempts < max_attempts else 'error',
+                'attempts': attempts,
+                'error_message': message,
+                'next_attempt_at': now + timedelta(minutes=2 ** attempts),
+            })
+
+    # ------------------------------------------------------------------
+    # Position et estimation pour l'interface
+    # ------------------------------------------------------------------
+
+    @api.model
+    def _throughput(self):
+        """Débit observé (éléments/seconde) sur les 15 dernières minutes, au moins 0,1."""
+        since = fields.Datetime.now() - timedelta(minutes=15)
+        done = self.search_count([('state', '=', 'done'), ('done_at', '>=', since)])
+        return max(done / 900.0, 0.1)
+
+    def _position_and_eta(self):
+        """
+        Position estimée de chaque élément en attente : éléments plus anciens de sa voie,
+        plus la part des autres voies servie entre-temps selon les poids.
+        Retourne {id: (position, datetime estimée d'envoi)}.
+        """
+        pending = self.filtered(lambda i: i.state == 'pending')
+        if not pending:
+            return {}
+        weights = self._lane_weights()
+        self.env.flush_all()
+        self.env.cr.execute("""
+            SELECT lane, count(*) FROM ebms_queue_item WHERE state = 'pending' GROUP BY lane
+        """)
+        lane_counts = dict(self.env.cr.fetchall())
+        # Rang de chaque élément dans sa voie, en une requête pour tout le recordset.
+        self.env.cr.execute("""
+            SELECT id, ahead FROM (
+                SELECT id, row_number() OVER (PARTITION BY lane ORDER BY enqueued_at, id) - 1 AS ahead
+                  FROM ebms_queue_item
+                 WHERE state = 'pending' AND lane IN %s
+            ) ranked
+             WHERE id IN %s
+        """, (tuple(set(pending.mapped('lane'))), tuple(pending.ids)))
+        ahead = dict(self.env.cr.fetchall())
+        throughput = self._throughput()
+        now = fields.Datetime.now()
+        res = {}
+        for item in pending:
+            ahead_in_lane = ahead.get(item.id, 0)
+            rounds = (ahead_in_lane + 1) / weights[item.lane]
+            position = ahead_in_lane + 1 + sum(
+                min(count, int(rounds * weights[lane]))
+                for lane, count in lane_counts.items() if lane != item.lane
+            )
+            eta = max(now, item.next_attempt_at or now) + timedelta(seconds=position / throughput)
+            res[item.id] = (position, eta)
+        return res
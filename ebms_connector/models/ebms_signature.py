@@ -0,0 +1,32 @@
+# -*- coding: utf-8 -*-
+"""
+Vérification des signatures électroniques OBR.
+
+`cryptography` n'est importé qu'au premier usage : un worker qui ne touche jamais
+à EBMS ne paie pas son chargement. La clé publique PEM est analysée une seule fois
+par processus et gardée en cache tant que le paramètre ebms.public_key ne change pas.
+"""
+import functools
+
+
+@functools.lru_cache(maxsize=4)
+def load_public_key(public_key_pem):
+    """Charge (et met en cache) la clé publique PEM de l'OBR."""
+    from cryptography.hazmat.backends import default_backend
+    from cryptography.hazmat.primitives import serialization
+    return serialization.load_pem_public_key(public_key_pem.encode('utf-8'), backend=default_backend())
+
+
+def verify(public_key, signature_bytes, message_bytes):
+    """
+    Vérifie une signature RSA PKCS#1 v1.5 / SHA-256 (l'OBR signe le hash du message).
+    Retourne False si la signature ne correspond pas.
+    """
+    from cryptography.exceptions import InvalidSignature
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.asymmetric import padding
+    try:
+        public_key.verify(signature_bytes, message_bytes, padding.PKCS1v15(), hashes.SHA256())
+    except InvalidSignature:
+        return False
+    return True
@@ -0,0 +1,260 @@
+# -*- coding: utf-8 -*-
+"""
+État EBMS des factures et des mouvements de stock, stocké hors des tables account_move
+et stock_move.
+
+Ces deux tables sont parmi les plus sollicitées de la base : chaque lecture comptable,
+chaque parcours séquentiel et chaque VACUUM paient les colonnes qu'on leur ajoute. L'état
+EBMS (statut, référence, signature, réponse OBR...) vit donc dans une table étroite à
+part, une ligne par pièce (account_move_ebms, stock_move_ebms). Les noms de champs
+historiques restent disponibles sur account.move et stock.move sous forme de champs
+related ; ebms.state.mixin redirige leurs écritures vers la ligne d'état, sans toucher
+la ligne de la pièce.
+"""
+import logging
+import time
+from collections import Counter
+
+from odoo import api, fields, models
+from odoo.tools.sql import column_exists
+
+from .ebms_errors import error_signature
+
+_logger = logging.getLogger(__name__)
+
+
+class AccountMoveEBMS(models.Model):
+    _name = 'account.move.ebms'
+    _description = 'État EBMS d\'une facture'
+    _rec_name = 'move_id'
+
+    move_id = fields.Many2one('account.move', string='Facture', required=True, ondelete='cascade')
+    ebms_status = fields.Selection([
+        ('draft', 'Brouillon'),
+        ('sent', 'Envoyé à EBMS'),
+        ('sending', 'Envoi en cours'),
+        ('relayed', 'Confiée au relais'),
+        ('error', 'Erreur d\'envoi'),
+        ('cancelled', 'Annulée EBMS'),
+    ], string='Statut EBMS', default='draft', required=True, index=True, help="Statut de l'envoi vers EBMS")
+    ebms_reference = fields.Char(string='Référence EBMS', index=True, help='Référence EBMS fournie par l’OBR')
+    ebms_signature = fields.Text(string='Signature électronique EBMS', help='Signature électronique reçue pour vérification')
+    ebms_error_message = fields.Text(string='Message d\'erreur EBMS', help='Détails de l\'erreur EBMS')
+    ebms_sent_date = fields.Datetime(string='Date d\'envoi EBMS', help='Date et heure d\'envoi vers EBMS')
+    ebms_result_data = fields.Text(string='Données de résultat EBMS', help='Données JSON complètes de l\'objet "result" retourné par EBMS')
+    ebms_invoice_identifier = fields.Char(string='Identifiant facture EBMS', help='invoice_identifier envoyé à l’OBR (TIN/système/horodatage/numéro)')
+    ebms_cn_motif = fields.Char(string='Motif d\'annulation EBMS', help='cn_motif transmis à l’OBR lors de l\'annulation')
+    ebms_cancelled_invoice_ref = fields.Char(string='Réf. facture annulée EBMS', help='invoice_identifier de la facture annulée que celle-ci remplace (cancelled_invoice_ref)')
+    ebms_replaced_invoice_id = fields.Many2one('account.move', string='Facture EBMS remplacée', ondelete='set null')
+    ebms_replacement_id = fields.Many2one('account.move', string='Facture EBMS de remplacement', ondelete='set null')
+    # Jalons de soumission (rapport de latence, voir ebms_latency)
+    ebms_posted_at = fields.Datetime(string='Validée le', index=True, help='Dernière validation comptable de la facture')
+    ebms_first_attempt_at = fields.Datetime(string='Premier envoi EBMS le')
+    ebms_attempts = fields.Integer(string='Tentatives d\'envoi EBMS', default=0)
+    ebms_acknowledged_at = fields.Datetime(string='Accusé EBMS le', help='Réception de l\'accusé de réception OBR')
+    ebms_verified_at = fields.Datetime(string='Vérifiée EBMS le', help='Signature vérifiée ou facture confirmée par l\'OBR')
+    # Tri des erreurs (voir ebms_errors)
+    ebms_error_signature = fields.Char(string='Signature d\'erreur EBMS', compute='_compute_ebms_error_signature',
+                                       store=True, index=True)
+    ebms_parked = fields.Boolean(string='Erreur EBMS mise de côté', help='Erreur connue, exclue des relances et de l\'alerte de SLO')
+    # Traçage (voir ebms_tracing)
+    ebms_trace_id = fields.Char(string='Identifiant de corrélation EBMS', index=True, copy=False,
+                                help='Identifiant de la soumission en cours, envoyé à l\'OBR dans l\'en-tête X-Correlation-ID')
+
+    _sql_constraints = [
+        ('move_uniq', 'unique(move_id)', 'Une facture ne peut avoir qu\'un seul état EBMS.'),
+    ]
+
+    @api.depends('ebms_error_message')
+    def _compute_ebms_error_signature(self):
+        for state in self:
+            state.ebms_error_signature = error_signature(state.ebms_error_message)
+
+
+class StockMoveEBMS(models.Model):
+    _name = 'stock.move.ebms'
+    _description = 'État EBMS d\'un mouvement de stock'
+    _rec_name = 'move_id'
+
+    move_id = fields.Many2one('stock.move', string='Mouvement', required=True, ondelete='cascade')
+    ebms_stock_status = fields.Selection([
+        ('draft', 'Brouillon'),
+        ('sent', 'Envoyé à EBMS'),
+        ('error', 'Erreur d\'envoi')
+    ], string='Statut EBMS Stock', default='draft', required=True, index=True)
+    ebms_stock_reference = fields.Char(string='Référence EBMS Stock')
+    ebms_stock_error_message = fields.Text(string="Erreur EBMS Stock")
+    ebms_stock_sent_date = fields.Datetime(string="Date d'envoi EBMS Stock")
+    ebms_error_signature = fields.Char(string='Signature d\'erreur EBMS', compute='_compute_ebms_error_signature',
+                                       store=True, index=True)
+    ebms_parked = fields.Boolean(string='Erreur EBMS mise de côté', help='Erreur connue, exclue des relances')
+
+    _sql_constraints = [
+        ('move_uniq', 'unique(move_id)', 'Un mouvement ne peut avoir qu\'un seul état EBMS.'),
+    ]
+
+    @api.depends('ebms_stock_error_message')
+    def _compute_ebms_error_signature(self):
+        for state in self:
+            state.ebms_error_signature = error_signature(state.ebms_stock_error_message)
+
+
+class EBMSStateMixin(models.AbstractModel):
+    """
+    Accès à l'état EBMS déporté. Le modèle qui en hérite déclare ebms_state_ids (One2many
+    vers _ebms_state_model) et ses champs EBMS en related 'ebms_state_ids.<champ>'.
+    """
+    _name = 'ebms.state.mixin'
+    _description = 'État EBMS déporté'
+
+    _ebms_state_model = None
+    # Compteurs du tableau de bord (ebms.status.counter) : champ de statut, et champs dont
+    # dépend la clé (société, jour) renvoyée par _ebms_counter_key.
+    _ebms_status_field = None
+    _ebms_counter_key_fields = ()
+
+    @api.model
+    def _ebms_state_fields(self):
+        return [name for name, field in self._fields.items()
+                if field.related and field.related.startswith('ebms_state_ids.')]
+
+    def _ebms_state_needed(self):
+        """Enregistrements qui reçoivent une ligne d'état dès leur création (les autres à la première écriture)."""
+        return self.browse()
+
+    def _ebms_state(self):
+        """Lignes d'état des enregistrements, celles qui manquent étant créées en une fois."""
+        states = self.sudo().ebms_state_ids
+        missing = set(self.ids) - set(states.move_id.ids)
+        if missing:
+            states |= self.env[self._ebms_state_model].sudo().create([{'move_id': record_id} for record_id in sorted(missing)])
+        return states
+
+    def _ebms_counter_key(self):
+        """(société, jour) sous lequel l'enregistrement est compté, ou None s'il n'est pas compté."""
+        return None
+
+    def _ebms_counter_snapshot(self):
+        """Nombre d'enregistrements par (société, modèle, jour, statut) ; sans ligne d'état, le statut est 'draft'."""
+        counts = Counter()
+        for record in self:
+            key = record._ebms_counter_key()
+            if key:
+                counts[(key[0], self._name, key[1], record[self._ebms_status_field] or 'draft')] += 1
+        return counts
+
+    def _ebms_split_vals(self, vals):
+        names = set(self._ebms_state_fields())
+        return ({key: value for key, value in vals.items() if key not in names},
+                {key: value for key, value in vals.items() if key in names})
+
+    @api.model_create_multi
+    def create(self, vals_list):
+        split = [self._ebms_split_vals(vals) for vals in vals_list]
+        records = super().create([vals for vals, _state_vals in split])
+        needed_ids = set(records._ebms_state_needed().ids)
+        to_create = [
+            dict(state_vals, move_id=record.id)
+            for record, (_vals, state_vals) in zip(records, split)
+            if state_vals or record.id in needed_ids
+        ]
+        if to_create:
+            self.env[self._ebms_state_model].sudo().create(to_create)
+        self.env['ebms.status.counter']._add_difference(Counter(), records._ebms_counter_snapshot())
+        return records
+
+    def write(self, vals):
+        vals, state_vals = self._ebms_split_vals(vals)
+        counted = self._ebms_status_field in state_vals or any(name in vals for name in self._ebms_counter_key_fields)
+        before = self._ebms_counter_snapshot() if counted else None
+        if state_vals:
+            self.check_access_rights('write')
+            self.check_access_rule('write')
+            self._ebms_state().write(state_vals)
+        res = super().write(vals) if vals or not state_vals else True
+        if counted:
+            self.env['ebms.status.counter']._add_difference(before, self._ebms_counter_snapshot())
+        return res
+
+    def unlink(self):
+        before = self._ebms_counter_snapshot()
+        res = super().unlink()
+        self.env['ebms.status.counter']._add_difference(before, Counter())
+        return res
+
+
+# ----------------------------------------------------------------------
+# Migration et mesure
+# ----------------------------------------------------------------------
+
+def table_stats(cr, table, scans=3):
+    """
+    Taille et vitesse de parcours d'une table : pages du tas, taille totale (index et TOAST
+    compris), largeur moyenne d'une ligne et meilleur temps de parcours complet sur `scans` essais.
+    """
+    cr.execute("SELECT pg_relation_size(%s::regclass), pg_total_relation_size(%s::regclass)", (table, table))
+    heap_bytes, total_bytes = cr.fetchone()
+    best = None
+    for _i in range(scans):
+        started = time.perf_counter()
+        cr.execute('SELECT count(*), avg(pg_column_size(t.*)) FROM "%s" t' % table)
+        rows, row_bytes = cr.fetchone()
+        elapsed = time.perf_counter() - started
+        best = elapsed if best is None else min(best, elapsed)
+    return {
+        'table': table,
+        'rows': rows,
+        'heap_bytes': heap_bytes,
+        'total_bytes': total_bytes,
+        'avg_row_bytes': float(row_bytes or 0),
+        'scan_ms': round(best * 1000, 2),
+    }
+
+
+def log_table_stats(cr, table, label):
+    stats = table_stats(cr, table)
+    _logger.info(
+        'EBMS %s : %s %s lignes, tas %s octets, total %s octets, ligne moyenne %.0f octets, parcours %.2f ms.',
+        label, table, stats['rows'], stats['heap_bytes'], stats['total_bytes'], stats['avg_row_bytes'], stats['scan_ms'])
+    return stats
+
+
+def move_to_side_table(env, model_name, keep_where):
+    """
+    Recopie en une requête les anciennes colonnes EBMS d'un modèle vers sa table d'état,
+    puis les supprime. Les lignes retenues sont celles qui vérifient `keep_where` (SQL sur
+    l'alias m) ; les autres n'avaient que les valeurs par défaut.
+
+    La place libérée n'est rendue qu'à la réécriture de la table (VACUUM FULL ou pg_repack
+    en fenêtre de maintenance) ; les nouvelles lignes sont étroites immédiatement.
+    """
+    cr = env.cr
+    Model = env[model_name]
+    State = env[Model._ebms_state_model]
+    columns = [name for name in Model._ebms_state_fields() if column_exists(cr, Model._table, name)]
+    if not columns:
+        return 0
+    before = log_table_stats(cr, Model._table, 'avant migration')
+    cr.execute("""
+        INSERT INTO "{state}" (move_id, {columns}, create_uid, create_date, write_uid, write_date)
+        SELECT m.id, {values}, m.create_uid, m.create_date, m.write_uid, m.write_date
+          FROM "{table}" m
+         WHERE {keep_where}
+        ON CONFLICT (move_id) DO NOTHING
+    """.format(
+        state=State._table,
+        table=Model._table,
+        columns=', '.join('"%s"' % name for name in columns),
+        values=', '.join(
+            "COALESCE(m.\"%s\", 'draft')" % name if State._fields[name].required else 'm."%s"' % name
+            for name in columns),
+        keep_where=keep_where,
+    ))
+    moved = cr.rowcount
+    cr.execute('ALTER TABLE "%s" %s' % (Model._table, ', '.join('DROP COLUMN "%s"' % name for name in columns)))
+    after = log_table_stats(cr, Model._table, 'après migration')
+    _logger.info(
+        'EBMS : %s états %s déplacés vers %s (%s colonnes) ; ligne moyenne %.0f -> %.0f octets, parcours %.2f -> %.2f ms.',
+        moved, Model._table, State._table, len(columns),
+        before['avg_row_bytes'], after['avg_row_bytes'], before['scan_ms'], after['scan_ms'])
+    return moved
@@ -0,0 +1,124 @@
+# -*- coding: utf-8 -*-
+"""
+Traçage des soumissions EBMS.
+
+Une facture passe par plusieurs requêtes et crons : validation, mise en file, envoi (en
+trois phases), accusé par webhook, consultation getInvoice, rapprochement par l'import
+historique, annulation. Chaque soumission reçoit un identifiant de corrélation
+(ebms_trace_id), envoyé à l'OBR dans l'en-tête X-Correlation-ID et repris dans le journal
+des échanges ; chaque étape y enregistre une étape tracée (span) datée et chronométrée.
+
+Les spans de l'envoi sont mesurés en mémoire (SpanLog) et écrits en une fois avec les
+résultats, dans la transaction de la phase 3 : le traçage n'ajoute ni transaction ni
+requête par facture. Ils sont consultables sur la facture (onglet « Traçage EBMS ») et
+purgés après ebms.trace_retention_days jours (30 par défaut).
+"""
+import logging
+import time
+import uuid
+from datetime import timedelta
+
+from odoo import api, fields, models
+
+_logger = logging.getLogger(__name__)
+
+HEADER = 'X-Correlation-ID'
+DEFAULT_RETENTION_DAYS = 30
+
+SPAN_NAMES = [
+    ('post', 'Validation'),
+    ('queue_wait', 'Attente en file'),
+    ('claim', 'Réservation'),
+    ('build_payload', 'Construction du payload'),
+    ('obr_call', 'Appel OBR (addInvoice)'),
+    ('persist', 'Enregistrement du résultat'),
+    ('webhook', 'Webhook OBR'),
+    ('get_invoice', 'Consultation OBR (getInvoice)'),
+    ('reconcile', 'Rapprochement (import historique)'),
+    ('cancel', 'Annulation OBR'),
+]
+
+
+def new_trace_id():
+    return uuid.uuid4().hex
+
+
+class SpanLog:
+    """Spans mesurés en mémoire, écrits par lot une fois une transaction disponible."""
+
+    def __init__(self):
+        self.spans = []
+
+    def add(self, move_id, trace_id, name, started_at, duration, status='ok', detail=False):
+        """Ajoute un span ; duration en secondes."""
+        if trace_id:
+            self.spans.append({
+                'trace_id': trace_id,
+                'move_id': move_id,
+                'name': name,
+                'started_at': started_at,
+                'duration_ms': round(duration * 1000, 1),
+                'status': status,
+                'detail': detail and str(detail)[:200],
+            })
+
+    def timed(self, move_id, trace_id, name, func, *args):
+        """Appelle func(*args) et chronomètre l'appel ; une exception est tracée puis propagée."""
+        started_at = fields.Datetime.now()
+        started = time.monotonic()
+        try:
+            result = func(*args)
+        except Exception as e:
+            self.add(move_id, trace_id, name, started_at, time.monotonic() - started, 'error', '%s: %s' % (type(e).__name__, e))
+            raise
+        self.add(move_id, trace_id, name, started_at, time.monotonic() - started)
+        return result
+
+    def add_call(self, move_id, trace_id, name, result):
+        """Span d'un appel du client EBMS, à partir du minutage porté par son résultat."""
+        self.add(
+            move_id, trace_id, name, result.get('started_at') or fields.Datetime.now(), result.get('duration') or 0.0,
+            'ok' if result['success'] else 'error',
+            'HTTP %s' % result['status_code'] if result['success'] else result['msg'],
+        )
+
+    def write(self, env):
+        spans, self.spans = self.spans, []
+        return env['ebms.trace.span']._record(spans)
+
+
+class EBMSTraceSpan(models.Model):
+    _name = 'ebms.trace.span'
+    _description = 'Étape tracée d\'une soumission EBMS'
+    _order = 'started_at desc, id desc'
+    _log_access = False
+
+    trace_id = fields.Char(string='Identifiant de corrélation', required=True, index=True, readonly=True)
+    move_id = fields.Many2one('account.move', string='Facture', index=True, ondelete='cascade', readonly=True)
+    name = fields.Selection(SPAN_NAMES, string='Étape', required=True, readonly=True)
+    started_at = fields.Datetime(string='Début', required=True, readonly=True)
+    duration_ms = fields.Float(string='Durée (ms)', digits=(16, 1), group_operator='sum', readonly=True)
+    status = fields.Selection([('ok', 'OK'), ('error', 'Erreur')], string='Résultat', default='ok', required=True, readonly=True)
+    detail = fields.Char(string='Détail', readonly=True)
+
+    @api.model
+    def _record(self, spans):
+        """Écrit une liste de spans (dicts de SpanLog) en une seule création."""
+        if not spans:
+            return self.browse()
+        return self.sudo().create(spans)
+
+    @api.model
+    def _record_span(self, moves, name, started_at, duration, status='ok', detail=False, trace_id=None):
+        """Trace une même étape pour chaque facture, sous son identifiant de corrélation (ou trace_id)."""
+        spans = SpanLog()
+        for move in moves:
+            spans.add(move.id, trace_id or move.ebms_trace_id, name, started_at, duration, status, detail)
+        return spans.write(self.env)
+
+    @api.model
+    def _cron_purge(self):
+        days = int(self.env['ir.config_parameter'].sudo().get_param('ebms.trace_retention_days') or DEFAULT_RETENTION_DAYS)
+        self.env.cr.execute("DELETE FROM ebms_trace_span WHERE started_at < %s",
+                            (fields.Datetime.now() - timedelta(days=days),))
+        _logger.info('Traces EBMS purgées : %s spans de plus de %s jours.', self.env.cr.rowcount, days)
@@ -2,18 +2,23 @@ import requests
 from odoo import api, _
 from odoo.exceptions import UserError
 import logging
+import time
+
+from .ebms_logging import log_exchange
 
 _logger = logging.getLogger(__name__)
 
-def ebms_login(env):
+def ebms_login(env, company=None):
     """
     Effectue un appel à l'API EBMS /login/ pour obtenir un token Bearer.
-    Les identifiants sont lus dans les paramètres système Odoo.
-    Le token obtenu est stocké dans ebms.api_token (paramètre système).
+    Les identifiants sont ceux de la société si elle en a, sinon les paramètres système Odoo.
+    Le token obtenu est stocké sur la société ou dans ebms.api_token (paramètre système).
     """
+    company = company or env.company
+    credentials = company._get_ebms_credentials()
     url = env['ir.config_parameter'].sudo().get_param('ebms.login_url')
-    username = env['ir.config_parameter'].sudo().get_param('ebms.api_username')
-    password = env['ir.config_parameter'].sudo().get_param('ebms.api_password')
+    username = credentials['username']
+    password = credentials['password']
     if not url or not username or not password:
         raise UserError(_('Paramètres EBMS manquants (login_url, username ou password).'))
     payload = {
@@ -22,13 +27,17 @@ def ebms_login(env):
     }
     headers = {'Content-Type': 'application/json'}
     try:
+        started = time.monotonic()
         response = requests.post(url, json=payload, headers=headers, timeout=30)
+        # Jamais de corps pour le login : la réponse contient le token.
+        log_exchange(url, response.status_code, time.monotonic() - started,
+                     error=None if response.status_code == 200 else 'HTTP', company_id=company.id)
         if response.status_code == 200:
             resp_json = response.json()
             if resp_json.get('success') and resp_json.get('result', {}).get('token'):
                 token = resp_json['result']['token']
-                env['ir.config_parameter'].sudo().set_param('ebms.api_token', token)
-                _logger.info('Nouveau token EBMS obtenu et stocké.')
+                company._set_ebms_token(token)
+                _logger.info('Nouveau token EBMS obtenu et stocké (société %s).', company.name)
                 return token
             else:
                 msg = resp_json.get('msg', 'Erreur lors de l\'authentification EBMS.')
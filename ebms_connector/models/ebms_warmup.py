@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+Préchauffage des workers EBMS (option ebms.warmup).
+
+Après un (re)démarrage de worker, la première action EBMS payait l'import de
+`cryptography`, l'analyse de la clé PEM de l'OBR, un aller-retour /login/ et une
+poignée de main TLS. Le préchauffage fait ce travail à l'avance :
+- au chargement du registre, en arrière-plan, si ebms.warmup est activé ;
+- à la demande depuis les paramètres EBMS.
+En mode multi-processus, la clé et les tokens préparés avant le fork sont hérités
+par les workers ; les connexions sont rouvertes dans chacun (voir ebms_client).
+"""
+import logging
+import threading
+
+from odoo import api, SUPERUSER_ID
+
+from . import ebms_signature
+from .ebms_client import get_client
+
+_logger = logging.getLogger(__name__)
+
+
+def prepare(env):
+    """
+    Étape ORM : charge la clé publique et configure un client par jeu d'identifiants.
+    Retourne les clients à préchauffer.
+    """
+    public_key_pem = env['ir.config_parameter'].sudo().get_param('ebms.public_key')
+    if public_key_pem:
+        try:
+            ebms_signature.load_public_key(public_key_pem)
+        except Exception as e:
+            _logger.warning('Clé publique OBR illisible (ebms.public_key) : %s', e)
+    clients = {}
+    for company in env['res.company'].sudo().search([]):
+        client = get_client(env, company)
+        clients[id(client)] = client
+    return list(clients.values())
+
+
+def warm_up_clients(clients):
+    """Étape réseau, sans ORM. Retourne le nombre de clients prêts."""
+    return sum(1 for client in clients if client.warm_up())
+
+
+def run(clients, env):
+    """Préchauffe les clients puis enregistre les tokens obtenus. Retourne le nombre de clients prêts."""
+    ready = warm_up_clients(clients)
+    for client in clients:
+        client.persist_token(env)
+    return ready
+
+
+def warm_up_in_background(env):
+    """
+    Lance le préchauffage sans bloquer le chargement du registre : la préparation utilise
+    le curseur de chargement, le réseau et l'enregistrement des tokens un thread à part.
+    """
+    clients = prepare(env)
+    registry = env.registry
+
+    def target():
+        ready = warm_up_clients(clients)
+        try:
+            with registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                for client in clients:
+                    client.persist_token(env)
+        except Exception:
+            _logger.exception('Préchauffage EBMS interrompu.')
+            return
+        _logger.info('Préchauffage EBMS terminé : %s/%s client(s) prêt(s).', ready, len(clients))
+
+    thread = threading.Thread(target=target, name='ebms-warmup', daemon=True)
+    thread.start()
+    return thread
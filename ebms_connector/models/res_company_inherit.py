@@ -1,6 +1,14 @@
 # -*- coding: utf-8 -*-
 
-from odoo import models, fields
+import logging
+
+from odoo import api, models, fields, _
+from odoo.exceptions import ValidationError
+from odoo.tools import config
+
+from . import ebms_warmup
+
+_logger = logging.getLogger(__name__)
 
 class ResCompanyInherit(models.Model):
     _inherit = 'res.company'
@@ -8,3 +16,93 @@ class ResCompanyInherit(models.Model):
     x_fiscal_center = fields.Char(string='Centre Fiscal')
     x_activity_sector = fields.Char(string='Secteur d’activité')
     x_legal_form = fields.Char(string='Forme Juridique')
+
+    # --- Identifiants EBMS propres à la société (sinon paramètres système globaux) ---
+    ebms_api_username = fields.Char(string="Nom d'utilisateur EBMS", groups='base.group_system')
+    ebms_api_password = fields.Char(string='Mot de passe EBMS', groups='base.group_system')
+    ebms_api_token = fields.Char(string="Token d'authentification EBMS", copy=False, groups='base.group_system')
+    ebms_system_id = fields.Char(string='ID système EBMS', help="Identifiant du système fourni par l'OBR pour cette société.")
+
+    # En-tête contribuable (tp_*) des factures EBMS, stocké : recalculé seulement quand la société change.
+    ebms_taxpayer_data = fields.Json(string='En-tête contribuable EBMS', compute='_compute_ebms_taxpayer_data', store=True)
+
+    @api.constrains('ebms_api_username')
+    def _check_ebms_relay_credentials(self):
+        """Un relais EBMS d'agence ne sert qu'un compte OBR : celui des paramètres système."""
+        if self.env['ir.config_parameter'].sudo().get_param('ebms.relay_url') \
+                and any(company.sudo().ebms_api_username for company in self):
+            raise ValidationError(_("Un relais EBMS d'agence est configuré : il ne sert que le compte OBR des "
+                                    "paramètres système. Une société ne peut pas avoir ses propres identifiants EBMS."))
+
+    @api.depends('name', 'vat', 'company_registry', 'x_fiscal_center', 'x_activity_sector', 'x_legal_form',
+                 'partner_id.is_company', 'partner_id.zip', 'partner_id.phone', 'partner_id.state_id.name',
+                 'partner_id.city', 'partner_id.street', 'partner_id.street2')
+    def _compute_ebms_taxpayer_data(self):
+        for company in self:
+            partner = company.partner_id
+            company.ebms_taxpayer_data = {
+                'tp_type': '2' if partner.company_type == 'company' else '1',
+                'tp_name': company.name,
+                'tp_TIN': company.vat,
+                'tp_trade_number': company.company_registry or '',
+                'tp_postal_number': partner.zip or '',
+                'tp_phone_number': partner.phone or '',
+                'tp_address_province': partner.state_id.name or '',
+                'tp_address_commune': partner.city or '',
+                'tp_address_quartier': partner.street2 or '',
+                'tp_address_avenue': '',
+                'tp_address_rue': partner.street or '',
+                'tp_address_number': '',
+                'vat_taxpayer': '1' if company.vat else '0',
+                'ct_taxpayer': '1',
+                'tl_taxpayer': '0',
+                'tp_fiscal_center': company.x_fiscal_center or '',
+                'tp_activity_sector': company.x_activity_sector or '',
+                'tp_legal_form': company.x_legal_form or '',
+            }
+
+    def _get_ebms_credentials(self):
+        """
+        Retourne les identifiants EBMS de la société.
+        Une société avec son propre nom d'utilisateur a son propre token (clé = id société) ;
+        sinon on retombe sur les paramètres système globaux (clé = 0).
+        """
+        self.ensure_one()
+        params = self.env['ir.config_parameter'].sudo()
+        company = self.sudo()
+        system_id = company.ebms_system_id or params.get_param('ebms.system_id')
+        if company.ebms_api_username:
+            return {
+                'key': company.id,
+                'username': company.ebms_api_username,
+                'password': company.ebms_api_password,
+                'token': company.ebms_api_token,
+                'system_id': system_id,
+            }
+        return {
+            'key': 0,
+            'username': params.get_param('ebms.api_username'),
+            'password': params.get_param('ebms.api_password'),
+            'token': params.get_param('ebms.api_token'),
+            'system_id': system_id,
+        }
+
+    def _set_ebms_token(self, token):
+        """Stocke le token là où sont les identifiants : sur la société ou dans ebms.api_token."""
+        self.ensure_one()
+        if self.sudo().ebms_api_username:
+            self.sudo().ebms_api_token = token
+        else:
+            self.env['ir.config_parameter'].sudo().set_param('ebms.api_token', token)
+
+    def _register_hook(self):
+        """Préchauffage EBMS optionnel (ebms.warmup) au chargement du registre, hors tests."""
+        super()._register_hook()
+        if config['test_enable'] or self.env.registry.in_test_mode():
+            return
+        if not self.env['ir.config_parameter'].sudo().get_param('ebms.warmup'):
+            return
+        try:
+            ebms_warmup.warm_up_in_background(self.env)
+        except Exception:
+            _logger.exception('Préchauffage EBMS impossible au chargement du registre.')
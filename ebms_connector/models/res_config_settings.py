@@ -1,4 +1,9 @@
-from odoo import fields, models
+from odoo import api, fields, models, _
+from odoo.exceptions import ValidationError
+
+from . import ebms_warmup
+from .ebms_client import GZIP_MIN_BYTES
+from .ebms_health import DEFAULT_MAX_AGE, STATUSES
 
 class ResConfigSettings(models.TransientModel):
     _inherit = 'res.config.settings'
@@ -66,6 +71,150 @@ class ResConfigSettings(models.TransientModel):
         help="Identifiant du système du contribuable fourni par l'OBR."
     )
     
+    ebms_warmup = fields.Boolean(
+        string="Préchauffage EBMS",
+        config_parameter='ebms.warmup',
+        help="Au démarrage des workers : chargement de la clé publique, login et ouverture des connexions vers l'OBR."
+    )
+
+    ebms_ordered_sequence = fields.Boolean(
+        string="Envoi EBMS dans l'ordre des numéros",
+        config_parameter='ebms.ordered_sequence',
+        help="Les factures d'un même système (device) partent une à une dans l'ordre de création. "
+             "Sinon, seuls les avoirs attendent leur facture d'origine et le reste part en parallèle."
+    )
+
+    ebms_ack_slo_minutes = fields.Integer(
+        string="SLO d'accusé EBMS (minutes)",
+        config_parameter='ebms.ack_slo_minutes',
+        default=15,
+        help="Délai maximal entre la validation d'une facture et l'accusé OBR ; au-delà, le cron de contrôle alerte."
+    )
+
+    ebms_getinvoice_cache_ttl = fields.Integer(
+        string="Durée du cache getInvoice (secondes)",
+        config_parameter='ebms.getinvoice_cache_ttl',
+        default=300,
+        help="Une consultation EBMS plus récente est servie sans rappeler l'OBR."
+    )
+
+    ebms_getinvoice_cache_size = fields.Integer(
+        string="Taille du cache getInvoice",
+        config_parameter='ebms.getinvoice_cache_size',
+        default=1000,
+        help="Nombre maximal de factures gardées par worker ; les moins récemment consultées sortent en premier."
+    )
+
+    ebms_trace_retention_days = fields.Integer(
+        string="Conservation des traces EBMS (jours)",
+        config_parameter='ebms.trace_retention_days',
+        default=30,
+        help="Les étapes tracées des soumissions plus anciennes sont purgées chaque jour."
+    )
+
+    ebms_gzip_endpoints = fields.Char(
+        string="Endpoints compressés (gzip)",
+        config_parameter='ebms.gzip_endpoints',
+        help="Fragments d'URL séparés par des virgules (ex. addInvoice) : les requêtes vers ces endpoints "
+             "sont envoyées compressées en gzip. Vide : aucune compression."
+    )
+
+    ebms_gzip_min_bytes = fields.Integer(
+        string="Taille minimale compressée (octets)",
+        config_parameter='ebms.gzip_min_bytes',
+        default=GZIP_MIN_BYTES,
+        help="Les corps plus petits partent non compressés."
+    )
+
+    ebms_relay_url = fields.Char(
+        string="Relais EBMS d'agence",
+        config_parameter='ebms.relay_url',
+        help="Adresse du relais local (ex. http://127.0.0.1:8099). Les accusés OBR qu'il a reçus "
+             "sont relus chaque minute. Pointer aussi l'URL de login et l'URL d'envoi des factures sur le relais. "
+             "Le relais ne sert que le compte OBR des paramètres système."
+    )
+
+    ebms_health_max_age = fields.Integer(
+        string="Validité du contrôle OBR (secondes)",
+        config_parameter='ebms.health_max_age',
+        default=DEFAULT_MAX_AGE,
+        help="Au-delà, le dernier contrôle de disponibilité est ignoré et rien n'est court-circuité."
+    )
+    ebms_obr_status = fields.Selection(STATUSES, string="État de l'OBR", compute='_compute_ebms_obr_health')
+    ebms_obr_latency_ms = fields.Float(string="Latence (ms)", digits=(16, 1), compute='_compute_ebms_obr_health')
+    ebms_obr_checked_at = fields.Datetime(string="Dernier contrôle", compute='_compute_ebms_obr_health')
+    ebms_obr_last_error = fields.Char(string="Dernière erreur", compute='_compute_ebms_obr_health')
+
+    ebms_log_body_sample_rate = fields.Float(
+        string="Échantillonnage des corps journalisés",
+        config_parameter='ebms.log_body_sample_rate',
+        help="Part des échanges EBMS réussis dont les corps (masqués) sont journalisés, entre 0 et 1. "
+             "Les échanges en erreur sont toujours journalisés avec leur corps."
+    )
+
+    @api.constrains('ebms_relay_url')
+    def _check_ebms_relay_url(self):
+        """Un relais EBMS d'agence ne sert qu'un compte OBR : aucune société ne doit avoir ses propres identifiants."""
+        if any(settings.ebms_relay_url for settings in self) \
+                and self.env['res.company'].sudo().search_count([('ebms_api_username', '!=', False)]):
+            raise ValidationError(_("Un relais EBMS d'agence ne sert que le compte OBR des paramètres système : "
+                                    "retirez d'abord les identifiants EBMS propres aux sociétés."))
+
+    def action_ebms_warmup(self):
+        """Préchauffe immédiatement les clients EBMS de ce worker."""
+        ready = ebms_warmup.run(ebms_warmup.prepare(self.env), self.env)
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Préchauffage EBMS'),
+                'message': _('%s client(s) EBMS prêt(s).') % ready,
+                'type': 'success' if ready else 'warning',
+                'sticky': False,
+            }
+        }
+
+    def _compute_ebms_obr_health(self):
+        for settings in self:
+            probe = self.env['ebms.health.probe']._for_company(settings.company_id)
+            settings.ebms_obr_status = probe.status or 'unknown'
+            settings.ebms_obr_latency_ms = probe.latency_ms
+            settings.ebms_obr_checked_at = probe.checked_at
+            settings.ebms_obr_last_error = probe.last_error
+
+    def action_ebms_probe(self):
+        """Contrôle immédiatement la disponibilité de l'OBR pour la société courante."""
+        self.env['ebms.health.probe']._probe_all()
+        probe = self.env['ebms.health.probe']._for_company(self.company_id)
+        ok = probe.status == 'up'
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Disponibilité de l\'OBR'),
+                'message': _('OBR joignable, login valide (%s ms).') % probe.latency_ms if ok
+                else self.env['ebms.health.probe']._down_message(self.company_id),
+                'type': 'success' if ok else 'danger',
+                'sticky': not ok,
+                'next': {'type': 'ir.actions.client', 'tag': 'reload'},
+            }
+        }
+
+    # --- Identifiants EBMS propres à la société courante (prioritaires sur les paramètres globaux) ---
+    ebms_company_api_username = fields.Char(
+        related='company_id.ebms_api_username', readonly=False,
+        string="Nom d'utilisateur EBMS (société)",
+        help="Laisser vide pour utiliser les identifiants globaux ci-dessus."
+    )
+    ebms_company_api_password = fields.Char(
+        related='company_id.ebms_api_password', readonly=False,
+        string="Mot de passe EBMS (société)"
+    )
+    ebms_company_system_id = fields.Char(
+        related='company_id.ebms_system_id', readonly=False,
+        string="ID système EBMS (société)"
+    )
+
     # --- Paramètres société/fiscalité EBMS (préfixe ebms_ pour éviter conflit) ---
     ebms_tp_tin = fields.Char(
         string="NIF du contribuable (tp_TIN)",
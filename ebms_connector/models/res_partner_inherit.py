@@ -0,0 +1,34 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models
+
+
+class ResPartnerInherit(models.Model):
+    _inherit = 'res.partner'
+
+    # --- Bloc client EBMS, stocké : recalculé seulement quand l'adresse ou le NIF change ---
+    ebms_address = fields.Char(string='Adresse EBMS', compute='_compute_ebms_customer', store=True)
+    ebms_tin = fields.Char(string='NIF EBMS', compute='_compute_ebms_customer', store=True)
+    ebms_vat_payer = fields.Boolean(string='Assujetti TVA (EBMS)', compute='_compute_ebms_customer', store=True)
+
+    # Dernière vérification du NIF auprès de l'OBR ; oubliée quand le NIF change.
+    ebms_tin_check = fields.Selection([
+        ('valid', 'Valide'),
+        ('invalid', 'Invalide'),
+    ], string='Vérification NIF EBMS', compute='_compute_ebms_tin_check', store=True, readonly=False, copy=False)
+    ebms_tin_checked_at = fields.Datetime(string='NIF vérifié le', compute='_compute_ebms_tin_check',
+                                          store=True, readonly=False, copy=False)
+
+    @api.depends('street', 'street2', 'city', 'state_id.name', 'country_id.name', 'vat')
+    def _compute_ebms_customer(self):
+        for partner in self:
+            parts = [partner.street, partner.street2, partner.city, partner.state_id.name, partner.country_id.name]
+            partner.ebms_address = ', '.join(part for part in parts if part)
+            partner.ebms_tin = partner.vat or ''
+            partner.ebms_vat_payer = bool(partner.vat)
+
+    @api.depends('vat')
+    def _compute_ebms_tin_check(self):
+        for partner in self:
+            partner.ebms_tin_check = False
+            partner.ebms_tin_checked_at = False
@@ -2,11 +2,18 @@ from odoo import models, fields, api, _
 from odoo.exceptions import UserError
 import requests
 import logging
+import time
+
+from .ebms_dispatcher import dispatch_by_company
+from .ebms_logging import log_exchange
 
 _logger = logging.getLogger(__name__)
 
 class StockMove(models.Model):
-    _inherit = 'stock.move'
+    _inherit = ['stock.move', 'ebms.state.mixin']
+    _ebms_state_model = 'stock.move.ebms'
+    _ebms_status_field = 'ebms_stock_status'
+    _ebms_counter_key_fields = ('state', 'date', 'company_id')
     _description = 'Stock Move (EBMS Extension)'
     _description = 'Stock Move (EBMS Extension)'
 
@@ -24,83 +31,215 @@ class StockMove(models.Model):
             'target': 'current',
         }
 
+    def _ebms_counter_key(self):
+        if self.state == 'cancel' or not self.date:
+            return None
+        return self.company_id.id, self.date.date()
+
     # Champs EBMS spécifiques uniquement
-    ebms_stock_status = fields.Selection([
-        ('draft', 'Brouillon'),
-        ('sent', 'Envoyé à EBMS'),
-        ('error', 'Erreur d\'envoi')
-    ], string='Statut EBMS Stock', default='draft', required=True)
-    ebms_stock_reference = fields.Char(string='Référence EBMS Stock')
-    ebms_stock_error_message = fields.Text(string="Erreur EBMS Stock")
-    ebms_stock_sent_date = fields.Datetime(string="Date d'envoi EBMS Stock")
+    # État stocké dans stock_move_ebms (voir ebms_state), créé au premier échange avec l'OBR.
+    ebms_state_ids = fields.One2many('stock.move.ebms', 'move_id', string='État EBMS', copy=False)
+    ebms_stock_status = fields.Selection(related='ebms_state_ids.ebms_stock_status', readonly=False)
+    ebms_stock_reference = fields.Char(related='ebms_state_ids.ebms_stock_reference', readonly=False)
+    ebms_stock_error_message = fields.Text(related='ebms_state_ids.ebms_stock_error_message', readonly=False)
+    ebms_stock_sent_date = fields.Datetime(related='ebms_state_ids.ebms_stock_sent_date', readonly=False)
+    ebms_error_signature = fields.Char(related='ebms_state_ids.ebms_error_signature')
+    ebms_parked = fields.Boolean(related='ebms_state_ids.ebms_parked')
 
     def action_send_ebms_stock_movement(self):
         """
         Envoie le mouvement de stock à l'API EBMS AddStockMovement selon la spécification OBR.
+        Les payloads du lot sont construits en une fois (voir _ebms_stock_payloads).
         """
+        url, tokens, payloads = self._ebms_stock_prepare()
         for move in self:
-            # Préparer les données strictement selon la spécification EBMS
-            system_id = self.env['ir.config_parameter'].sudo().get_param('ebms.device_id')
-            url = self.env['ir.config_parameter'].sudo().get_param('ebms.stock_url')
-            token = self.env['ir.config_parameter'].sudo().get_param('ebms.api_token')
-            if not (system_id and url and token):
-                raise UserError(_('Paramètres EBMS manquants (device_id, stock_url ou token).'))
-            # Champs obligatoires
-            payload = {
+            move._ebms_send_stock_movement(url, tokens[move.company_id.id], payloads[move.id])
+
+    def _ebms_stock_prepare(self):
+        """URL AddStockMovement, token par société et payloads du lot, lus une fois pour tout le lot."""
+        url = self.env['ir.config_parameter'].sudo().get_param('ebms.stock_url')
+        tokens = {company.id: company._get_ebms_credentials()['token'] for company in self.company_id}
+        return url, tokens, self._ebms_stock_payloads()
+
+    def _ebms_stock_payloads(self):
+        """
+        Payloads AddStockMovement d'un lot de mouvements, strictement selon la spécification EBMS.
+        Produits, unités, devises et coûts sont lus par requêtes groupées pour tout le lot, et non
+        mouvement par mouvement. Retourne {id: payload}.
+        """
+        device_id = self.env['ir.config_parameter'].sudo().get_param('ebms.device_id')
+        companies = {company.id: (company.ebms_system_id or device_id, company.currency_id.name) for company in self.company_id}
+        products = {product['id']: product for product in self.product_id.read(['default_code', 'name'])}
+        uoms = {uom['id']: uom['name'] for uom in self.product_uom.read(['name'])}
+        costs = self._ebms_cost_prices()
+        payloads = {}
+        for move in self:
+            system_id, currency = companies.get(move.company_id.id, (device_id, False))
+            product = products.get(move.product_id.id, {})
+            payloads[move.id] = {
                 "system_or_device_id": system_id,
-                "item_code": move.product_id.default_code or '',
-                "item_designation": move.product_id.name or '',
+                "item_code": product.get('default_code') or '',
+                "item_designation": product.get('name') or '',
                 "item_quantity": str(move.product_uom_qty),
-                "item_measurement_unit": move.product_uom.name or '',
-                "item_cost_price": str(move.price_unit),
-                "item_cost_price_currency": move.company_id.currency_id.name or 'BIF',
+                "item_measurement_unit": uoms.get(move.product_uom.id) or '',
+                "item_cost_price": str(costs[move.id]),
+                "item_cost_price_currency": currency or 'BIF',
                 "item_movement_type": move.ebms_movement_type or '',
                 "item_movement_invoice_ref": move.ebms_movement_invoice_ref or '',
                 "item_movement_description": move.ebms_movement_description or '',
                 "item_movement_date": fields.Datetime.to_string(move.date or fields.Datetime.now()),
             }
-            # Validation des champs obligatoires
-            missing = [k for k, v in payload.items() if not v and k not in ('item_movement_invoice_ref','item_movement_description')]
-            if missing:
-                raise UserError(_('Champs obligatoires manquants pour EBMS: %s') % ', '.join(missing))
-
-            headers = {
-                'Authorization': f'Bearer {token}',
-                'Content-Type': 'application/json',
-            }
-            try:
-                response = requests.post(url, json=payload, headers=headers, timeout=30)
-                if response.status_code == 200:
-                    resp_json = response.json()
-                    if resp_json.get('success'):
-                        move.write({
-                            'ebms_stock_status': 'sent',
-                            'ebms_stock_reference': resp_json.get('reference', ''),
-                            'ebms_stock_error_message': False,
-                            'ebms_stock_sent_date': fields.Datetime.now(),
-                        })
-                        _logger.info('Mouvement de stock envoyé avec succès à EBMS: %s', move.name)
-                    else:
-                        move.write({
-                            'ebms_stock_status': 'error',
-                            'ebms_stock_error_message': resp_json.get('msg', 'Erreur inconnue lors de l’envoi EBMS.')
-                        })
-                        _logger.error('Erreur EBMS Stock: %s', resp_json.get('msg', ''))
-                        raise UserError(_('Erreur EBMS Stock: %s') % resp_json.get('msg', ''))
+        return payloads
+
+    def _ebms_cost_prices(self):
+        """
+        Coût unitaire déclaré de chaque mouvement : celui de ses couches de valorisation
+        (module stock_account installé), sinon son prix unitaire s'il est renseigné, sinon le
+        coût standard du produit dans la société du mouvement. Retourne {id: coût}.
+        """
+        layer_costs = {}
+        if 'stock.valuation.layer' in self.env:
+            for move, quantity, value in self.env['stock.valuation.layer'].sudo()._read_group(
+                    [('stock_move_id', 'in', self.ids)], ['stock_move_id'], ['quantity:sum', 'value:sum']):
+                if quantity:
+                    layer_costs[move.id] = abs(value / quantity)
+        unvalued = self.filtered(lambda m: m.id not in layer_costs and not m.price_unit)
+        standard = {}
+        for company in unvalued.company_id:
+            products = unvalued.filtered(lambda m: m.company_id == company).product_id.with_company(company)
+            for product in products:
+                standard[company.id, product.id] = product.standard_price
+        return {
+            move.id: layer_costs.get(move.id) or abs(move.price_unit) or standard.get((move.company_id.id, move.product_id.id), 0.0)
+            for move in self
+        }
+
+    def _ebms_send_stock_movement(self, url, token, payload):
+        """Envoie le payload AddStockMovement du mouvement et enregistre le résultat ; lève UserError en cas d'échec."""
+        self.ensure_one()
+        move = self
+        if not token:
+            raise UserError(_('Paramètres EBMS manquants (device_id, stock_url ou token).'))
+        error = self._ebms_stock_check(url, payload)
+        if error:
+            raise UserError(error)
+
+        headers = {
+            'Authorization': f'Bearer {token}',
+            'Content-Type': 'application/json',
+        }
+        try:
+            started = time.monotonic()
+            response = requests.post(url, json=payload, headers=headers, timeout=30)
+            resp_json = response.json() if response.status_code == 200 else {}
+            log_exchange(url, response.status_code, time.monotonic() - started, payload=payload,
+                         response=resp_json or response.text,
+                         error=None if resp_json.get('success') else (resp_json.get('msg') or response.text),
+                         ids=move.ids, company_id=move.company_id.id)
+            if response.status_code == 200:
+                if resp_json.get('success'):
+                    move.write({
+                        'ebms_stock_status': 'sent',
+                        'ebms_stock_reference': resp_json.get('reference', ''),
+                        'ebms_stock_error_message': False,
+                        'ebms_stock_sent_date': fields.Datetime.now(),
+                    })
                 else:
                     move.write({
                         'ebms_stock_status': 'error',
-                        'ebms_stock_error_message': f'Erreur HTTP {response.status_code}: {response.text}'
+                        'ebms_stock_error_message': resp_json.get('msg', 'Erreur inconnue lors de l’envoi EBMS.')
                     })
-                    _logger.error('Erreur HTTP EBMS Stock: %s', response.text)
-                    raise UserError(_('Erreur HTTP EBMS Stock: %s') % response.text)
-            except Exception as e:
+                    raise UserError(_('Erreur EBMS Stock: %s') % resp_json.get('msg', ''))
+            else:
                 move.write({
                     'ebms_stock_status': 'error',
-                    'ebms_stock_error_message': str(e)
+                    'ebms_stock_error_message': f'Erreur HTTP {response.status_code}: {response.text}'
                 })
-                _logger.error('Exception lors de l’envoi EBMS Stock: %s', str(e))
-                raise UserError(_('Exception lors de l’envoi EBMS Stock: %s') % str(e))
+                raise UserError(_('Erreur EBMS Stock: Erreur HTTP %s: %s') % (response.status_code, response.text))
+        except Exception as e:
+            move.write({
+                'ebms_stock_status': 'error',
+                'ebms_stock_error_message': str(e) if isinstance(e, UserError) else '%s: %s' % (type(e).__name__, e)
+            })
+            _logger.error('Exception lors de l’envoi EBMS Stock: %s', str(e))
+            raise UserError(_('Exception lors de l’envoi EBMS Stock: %s') % str(e))
+
+    @api.model
+    def _ebms_stock_check(self, url, payload):
+        """Message d'erreur si le payload ne peut pas être envoyé (paramètres ou champs obligatoires manquants), sinon False."""
+        if not (payload['system_or_device_id'] and url):
+            return _('Paramètres EBMS manquants (device_id, stock_url ou token).')
+        missing = [k for k, v in payload.items() if not v and k not in ('item_movement_invoice_ref', 'item_movement_description')]
+        if missing:
+            return _('Champs obligatoires manquants pour EBMS: %s') % ', '.join(missing)
+        return False
+
+    def _ebms_dispatch_key(self):
+        """
+        Clé d'ordre d'envoi (voir ebms_dispatcher) : article et entrepôt touché par le mouvement.
+        Une sortie part après l'entrée du même article dans le même entrepôt, et n'est pas
+        envoyée si celle-ci échoue ; les autres articles et entrepôts partent en parallèle.
+        """
+        self.ensure_one()
+        location = self.location_dest_id if (self.ebms_movement_type or '').startswith('E') else self.location_id
+        return self.product_id.id, location.warehouse_id.id
+
+    def _ebms_send_batch(self):
+        """
+        Envoie un lot de mouvements via le client EBMS partagé, sans s'arrêter à la première
+        erreur : chaque mouvement garde son statut. Les payloads du lot sont construits en une
+        fois ; les appels partent en parallèle, dans l'ordre des dates pour un même article
+        et un même entrepôt (voir _ebms_dispatch_key).
+        Retourne les mouvements envoyés avec succès.
+        """
+        sent = self.browse()
+        to_send = self.filtered(lambda m: m.ebms_stock_status != 'sent').sorted(lambda m: (m.date, m.id))
+        url = self.env['ir.config_parameter'].sudo().get_param('ebms.stock_url')
+        payloads = to_send._ebms_stock_payloads()
+        ready = to_send.browse()
+        for move in to_send:
+            error = self._ebms_stock_check(url, payloads[move.id])
+            if error:
+                move.write({'ebms_stock_status': 'error', 'ebms_stock_error_message': error})
+            else:
+                ready |= move
+        if not ready:
+            return sent
+        for move, _payload, result in dispatch_by_company(ready, url, lambda move: payloads[move.id],
+                                                          dispatch_key=lambda move: move._ebms_dispatch_key()):
+            if move._ebms_apply_stock_result(result):
+                sent |= move
+        return sent
+
+    def _ebms_apply_stock_result(self, result):
+        """Enregistre le résultat normalisé du client pour un mouvement ; retourne vrai si l'OBR l'a accepté."""
+        self.ensure_one()
+        if result['success']:
+            self.write({
+                'ebms_stock_status': 'sent',
+                'ebms_stock_reference': result['data'].get('reference', ''),
+                'ebms_stock_error_message': False,
+                'ebms_stock_sent_date': fields.Datetime.now(),
+            })
+            return True
+        self.write({
+            'ebms_stock_status': 'error',
+            'ebms_stock_error_message': result['msg'] or _('Erreur inconnue lors de l’envoi EBMS.'),
+        })
+        return False
+
+    def _ebms_submit(self):
+        """Interface commune de la file d'envoi : retourne {id: (succès, message)}."""
+        sent = self._ebms_send_batch()
+        return {move.id: (move in sent or move._ebms_is_sent(), move._ebms_last_error()) for move in self}
+
+    def _ebms_is_sent(self):
+        self.ensure_one()
+        return self.ebms_stock_status == 'sent'
+
+    def _ebms_last_error(self):
+        self.ensure_one()
+        return self.ebms_stock_error_message
 
     # Champs EBMS spécifiques au mouvement de stock
     ebms_movement_type = fields.Selection([
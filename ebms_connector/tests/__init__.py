@@ -1,3 +1,28 @@
 # -*- coding: utf-8 -*-
 
 from . import test_ebms_business
+from . import test_ebms_bulk_cancel
+from . import test_ebms_multi_company
+from . import test_ebms_audit_export
+from . import test_ebms_backfill
+from . import test_ebms_queue
+from . import test_ebms_send_phases
+from . import test_ebms_warmup
+from . import test_ebms_logging
+from . import test_ebms_performance
+from . import test_ebms_dataset
+from . import test_ebms_state
+from . import test_ebms_dashboard
+from . import test_ebms_latency
+from . import test_ebms_errors
+from . import test_ebms_invoice_cache
+from . import test_ebms_json
+from . import test_ebms_tracing
+from . import test_ebms_cassette
+from . import test_ebms_stock_payload
+from . import test_ebms_health
+from . import test_ebms_partner_block
+from . import test_ebms_gzip
+from . import test_ebms_relay
+from . import test_ebms_ordered_dispatch
+from . import test_ebms_inventory
@@ -0,0 +1,46 @@
+from unittest.mock import patch
+
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.ebms_connector.models import ebms_client
+
+
+class EBMSTestCase(TransactionCase):
+    """
+    Base des tests EBMS : URL d'envoi et token factices (ebms_api_url, ebms_api_token,
+    surchargeables par classe), cache de clients vidé à chaque test, factures de test.
+    """
+
+    ebms_api_url = 'https://fake.ebms.api/send'
+    ebms_api_token = 'FAKE_TOKEN'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.api_url', cls.ebms_api_url)
+        params.set_param('ebms.api_token', cls.ebms_api_token)
+
+    def setUp(self):
+        super().setUp()
+        # Client neuf : ni token ni échec de login hérités des autres tests.
+        patcher = patch.dict(ebms_client._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    @classmethod
+    def _invoices(cls, count=1, **vals):
+        """Factures client validées, une ligne à 100 ; vals complète ou remplace ces valeurs."""
+        invoices = cls.env['account.move'].create([dict({
+            'move_type': 'out_invoice',
+            'partner_id': cls.env.ref('base.res_partner_1').id,
+            'invoice_date': fields.Date.today(),
+            'invoice_line_ids': [(0, 0, {'name': 'Ligne', 'quantity': 1, 'price_unit': 100})],
+        }, **vals) for _i in range(count)])
+        invoices.action_post()
+        return invoices
+
+    @classmethod
+    def _invoice(cls, **vals):
+        return cls._invoices(1, **vals)
@@ -0,0 +1,61 @@
+import base64
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+
+from odoo import fields
+
+from odoo.addons.ebms_connector.models import ebms_audit_export
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSAuditExport(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.invoices = cls._invoices(3)
+        for i, invoice in enumerate(cls.invoices):
+            invoice.write({
+                'ebms_status': 'sent',
+                'ebms_reference': 'OBR-%s' % i,
+                'ebms_signature': 'SIG-%s' % i,
+                'ebms_result_data': json.dumps({'invoice_registered_number': 'OBR-%s' % i}),
+            })
+        cls.filters = {
+            'date_from': fields.Date.today(),
+            'date_to': fields.Date.today(),
+            'company_ids': [cls.env.company.id],
+            'include_stock': False,
+            'chunk_size': 2,
+        }
+
+    def test_export_jsonl_gzip_to_file(self):
+        fd, path = tempfile.mkstemp(suffix='.jsonl.gz')
+        os.close(fd)
+        try:
+            count = ebms_audit_export.export_to_file(self.env, path, fmt='jsonl', compress=True, **self.filters)
+            with gzip.open(path, 'rt', encoding='utf-8') as f:
+                rows = [json.loads(line) for line in f]
+        finally:
+            os.unlink(path)
+        self.assertEqual(count, 3)
+        by_id = {row['id']: row for row in rows}
+        for invoice in self.invoices:
+            row = by_id[invoice.id]
+            self.assertEqual(row['ebms_reference'], invoice.ebms_reference)
+            self.assertEqual(row['ebms_signature'], invoice.ebms_signature)
+            self.assertEqual(row['ebms_result_data'], json.loads(invoice.ebms_result_data))
+
+    def test_export_csv_attachment(self):
+        attachment, count = ebms_audit_export.export_to_attachment(
+            self.env, 'audit.csv', fmt='csv', **self.filters)
+        self.assertEqual(count, 3)
+        lines = base64.b64decode(attachment.datas).decode('utf-8').splitlines()
+        self.assertEqual(lines[0].split(',')[:2], ['model', 'id'])
+        self.assertEqual(len(lines), 4)
+        if attachment._storage() == 'file':
+            self.assertEqual(attachment.checksum, hashlib.sha1(attachment.raw).hexdigest(), 'Rangée comme par l\'ORM')
+            self.assertEqual(attachment.file_size, len(attachment.raw))
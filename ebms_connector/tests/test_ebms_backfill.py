@@ -0,0 +1,89 @@
+from unittest.mock import patch, MagicMock
+
+from odoo import fields
+
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSBackfill(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['ir.config_parameter'].sudo().set_param('ebms.getinvoice_url', 'https://fake.ebms.api/getInvoice')
+        cls.invoices = cls._invoices(4)
+        # Envoyées sans accusé local ; la dernière avant le suivi de la date d'envoi.
+        cls.invoices[:3].ebms_sent_date = fields.Datetime.now()
+        cls.job = cls.env['ebms.backfill.job'].create({
+            'date_from': fields.Date.today(),
+            'date_to': fields.Date.today(),
+            'chunk_size': 10,
+        })
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_backfill_checkpoint_and_resume(self, mock_post):
+        first, second, third, fourth = self.invoices
+        responses = {
+            first._ebms_backfill_identifier(): MagicMock(status_code=200, json=lambda: {
+                'success': True,
+                'result': {'invoices': [{'invoice_registered_number': 'OBR-1', 'electronic_signature': 'SIG-1'}]},
+            }),
+            second._ebms_backfill_identifier(): MagicMock(status_code=200, json=lambda: {
+                'success': False, 'msg': 'Facture introuvable',
+            }),
+        }
+
+        def fake_post(url, json=None, **kwargs):
+            if json['invoice_identifier'] in responses:
+                return responses[json['invoice_identifier']]
+            raise ConnectionError('Lien coupé')
+        mock_post.side_effect = fake_post
+
+        self.job.action_start()
+        self.job._process_chunk(self.env['account.move'].search(self.job._pending_domain(), order='id'))
+        self.assertEqual(first.ebms_reference, 'OBR-1')
+        self.assertEqual(first.ebms_signature, 'SIG-1')
+        self.assertEqual(first.ebms_status, 'sent')
+        self.assertFalse(second.ebms_reference)
+        self.assertEqual(self.job.last_move_id, second.id)
+        self.assertEqual((self.job.matched_count, self.job.missing_count, self.job.error_count), (1, 1, 1))
+
+        # Reprise : la facture en échec technique est réinterrogée, puis la suivante.
+        mock_post.reset_mock()
+        mock_post.side_effect = None
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {
+            'success': True, 'result': {'invoice_registered_number': 'OBR-3'},
+        })
+        self.job._run(time_budget=60)
+        self.assertEqual([call.kwargs['json']['invoice_identifier'] for call in mock_post.call_args_list],
+                         [third._ebms_backfill_identifier(), fourth._ebms_backfill_identifier()])
+        self.assertEqual((third.ebms_reference, fourth.ebms_reference), ('OBR-3', 'OBR-3'))
+        self.assertFalse(self.job.unresolved_move_ids)
+        self.assertEqual(self.job.state, 'done')
+
+    def test_identifier_fallbacks(self):
+        fourth = self.invoices[3]
+        self.assertTrue(fourth._ebms_backfill_identifier().endswith(
+            '/%s/%s' % (fourth.create_date.strftime('%Y%m%d%H%M%S'), fourth.name)), 'Sans date d\'envoi : date de création')
+
+        self.env.flush_all()
+        self.env.cr.execute("UPDATE account_move SET create_date = NULL WHERE id = %s", (fourth.id,))
+        fourth.invalidate_recordset(['create_date'])
+        self.assertTrue(fourth._ebms_backfill_identifier().endswith(
+            '/%s000000/%s' % (fourth.invoice_date.strftime('%Y%m%d'), fourth.name)), 'À défaut : date de facture')
+
+        self.env.cr.execute("UPDATE account_move SET name = '/' WHERE id = %s", (fourth.id,))
+        fourth.invalidate_recordset(['name'])
+        self.assertFalse(fourth._ebms_backfill_identifier())
+        self.job._process_chunk(fourth)
+        self.assertEqual(self.job.unresolved_move_ids, fourth, 'Rien à reconstituer : signalée, pas interrogée')
+        self.assertEqual(self.job.unresolved_count, 1)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_client_error_is_retried(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=400, json=lambda: {'success': False, 'msg': 'Requête invalide'})
+        self.job.action_start()
+        self.job._process_chunk(self.env['account.move'].search(self.job._pending_domain(), order='id'))
+        self.assertEqual(self.job.last_move_id, 0, 'Une réponse 4xx ne vaut pas « inconnue de l\'OBR »')
+        self.assertEqual((self.job.missing_count, self.job.error_count), (0, 1))
+        self.assertEqual(self.job.state, 'paused')
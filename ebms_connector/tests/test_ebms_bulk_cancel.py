@@ -0,0 +1,65 @@
+from unittest.mock import patch, MagicMock
+
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSBulkCancel(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['ir.config_parameter'].sudo().set_param('ebms.cancel_url', 'https://fake.ebms.api/cancel')
+
+    def _create_sent_invoice(self, name_suffix):
+        invoice = self._invoice()
+        invoice.write({
+            'ebms_status': 'sent',
+            'ebms_reference': 'REF-%s' % name_suffix,
+            'ebms_invoice_identifier': 'TIN/ws1/20240101000000/%s' % invoice.name,
+        })
+        return invoice
+
+    @staticmethod
+    def _response(payload):
+        return MagicMock(status_code=200, json=lambda: payload)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_bulk_cancel_partial_failure_resumes(self, mock_post):
+        """Un second passage n'annule que les factures restées en erreur."""
+        invoices = self._create_sent_invoice('A') | self._create_sent_invoice('B')
+        failing = invoices[1]._get_ebms_invoice_identifier()
+
+        def first_pass(url, json=None, **kwargs):
+            return self._response({'success': json['invoice_identifier'] != failing, 'msg': 'Indisponible'})
+        mock_post.side_effect = first_pass
+        invoices.with_context(ebms_cn_motif='Erreur de prix').action_cancel_ebms()
+        self.assertEqual(invoices.mapped('ebms_status'), ['cancelled', 'sent'])
+
+        mock_post.reset_mock()
+        mock_post.side_effect = None
+        mock_post.return_value = self._response({'success': True})
+        invoices.action_cancel_ebms(cn_motif='Erreur de prix')
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertEqual(mock_post.call_args.kwargs['json']['invoice_identifier'], failing)
+        self.assertEqual(set(invoices.mapped('ebms_status')), {'cancelled'})
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_cancel_and_replace_sends_cancelled_invoice_ref(self, mock_post):
+        """Les remplaçantes sont validées, envoyées et portent cancelled_invoice_ref."""
+        self.env['ir.config_parameter'].sudo().set_param('ebms.api_url', 'https://fake.ebms.api/send')
+        invoice = self._create_sent_invoice('C')
+        mock_post.return_value = self._response({'success': True, 'result': {'invoice_registered_number': 'NEW-REF'}})
+        cancelled, created, sent = invoice._ebms_cancel_and_replace('Erreur de prix', post_replacements=True)
+        self.assertEqual(cancelled, invoice)
+        self.assertEqual(created, invoice.ebms_replacement_id)
+        self.assertEqual(sent, created)
+        self.assertEqual(created.ebms_replaced_invoice_id, invoice)
+        send_payload = mock_post.call_args.kwargs['json']
+        self.assertEqual(send_payload['cancelled_invoice_ref'], invoice.ebms_invoice_identifier)
+        self.assertEqual(created.ebms_status, 'sent')
+
+        # Relancer le pipeline ne ré-annule ni ne recrée rien.
+        mock_post.reset_mock()
+        cancelled, created, sent = invoice._ebms_cancel_and_replace('Erreur de prix', post_replacements=True)
+        self.assertFalse(cancelled or created or sent)
+        mock_post.assert_not_called()
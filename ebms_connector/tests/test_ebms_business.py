@@ -6,6 +6,7 @@ from odoo import fields
 from odoo.exceptions import UserError
 from odoo.tests.common import TransactionCase
 from odoo.addons.base.models.res_users import Users
+from odoo.addons.ebms_connector.models import ebms_client, ebms_invoice_cache
 
 from cryptography.hazmat.primitives import hashes, serialization
 from cryptography.hazmat.primitives.asymmetric import rsa, padding
@@ -33,6 +34,15 @@ class TestEBMSBusiness(TransactionCase):
         Users.notify_danger = MagicMock()
         Users.notify_success = MagicMock()
 
+    def setUp(self):
+        super().setUp()
+        # Le cache getInvoice vit dans le worker : il ne suit pas le rollback des tests.
+        ebms_invoice_cache.clear()
+        # Client neuf : ni token ni échec de login hérités des autres tests.
+        patcher = patch.dict(ebms_client._clients, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
     @classmethod
     def tearDownClass(cls):
         del Users.notify_danger
@@ -117,26 +127,29 @@ class TestEBMSBusiness(TransactionCase):
         self.assertEqual(move.ebms_stock_status, 'sent')
         self.assertEqual(move.ebms_stock_reference, 'STOCK-REF')
 
-    @patch('odoo.addons.ebms_connector.models.ebms_utils.ebms_login')
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
-    def test_action_send_ebms_token_expired_retry(self, mock_post, mock_ebms_login):
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_action_send_ebms_token_expired_retry(self, mock_post):
         """Test envoi de facture EBMS avec token expiré puis succès après retry login."""
-        self.env['ir.config_parameter'].sudo().set_param('ebms.api_token', 'EXPIRED_TOKEN')
+        params = self.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.api_token', 'EXPIRED_TOKEN')
+        params.set_param('ebms.login_url', 'https://fake.ebms.api/login')
+        params.set_param('ebms.api_username', 'user')
+        params.set_param('ebms.api_password', 'secret')
         mock_post.side_effect = [
             MagicMock(status_code=401, json=lambda: {'success': False, 'msg': 'Token expired'}),
-            MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR123_RETRY', 'msg': 'OK'})
+            MagicMock(status_code=200, json=lambda: {'success': True, 'result': {'token': 'NEW_TOKEN'}}),
+            MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR123_RETRY', 'msg': 'OK'}),
         ]
-        mock_ebms_login.return_value = 'NEW_TOKEN'
         invoice = self._create_invoice()
         invoice.action_send_ebms()
         invoice.invalidate_recordset()
         invoice = invoice.browse(invoice.id)
         self.assertEqual(invoice.ebms_status, 'sent')
         self.assertEqual(invoice.ebms_reference, 'OBR123_RETRY')
-        self.assertEqual(mock_ebms_login.call_count, 1)
-        self.assertEqual(self.env['ir.config_parameter'].sudo().get_param('ebms.api_token'), 'NEW_TOKEN')
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertEqual(params.get_param('ebms.api_token'), 'NEW_TOKEN')
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
     def test_action_send_ebms_success(self, mock_post):
         """Test envoi de facture EBMS succès."""
         vals = {
@@ -154,7 +167,7 @@ class TestEBMSBusiness(TransactionCase):
         invoice.action_post()
         return invoice
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
     def test_action_send_ebms_success(self, mock_post):
         mock_post.return_value.status_code = 200
         mock_post.return_value.json.return_value = {'success': True, 'reference': 'OBR123', 'electronic_signature': 'SIGNATURE123', 'msg': 'OK'}
@@ -181,7 +194,7 @@ class TestEBMSBusiness(TransactionCase):
         self.assertEqual(invoice.ebms_reference, 'OBR123')
         self.assertEqual(invoice.ebms_error_message, False)
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
     def test_action_send_ebms_error(self, mock_post):
         mock_post.return_value.json.return_value = {
             'success': False,
@@ -195,7 +208,7 @@ class TestEBMSBusiness(TransactionCase):
         with self.assertRaisesRegex(UserError, 'Erreur OBR'):
             invoice.action_send_ebms()
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
     def test_action_send_ebms_exception(self, mock_post):
         mock_post.side_effect = Exception("Connexion impossible")
         invoice = self._create_invoice()
@@ -203,26 +216,34 @@ class TestEBMSBusiness(TransactionCase):
         with self.assertRaisesRegex(UserError, 'Erreur lors de l’envoi EBMS : Connexion impossible'):
             invoice.action_send_ebms()
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
     def test_action_cancel_ebms_success(self, mock_post):
         mock_post.return_value.json.return_value = {'success': True}
         mock_post.return_value.status_code = 200
         invoice = self._create_invoice()
         invoice.ebms_status = 'sent'
-        invoice.action_cancel_ebms()
-        self.assertEqual(invoice.ebms_status, 'draft')
+        invoice.ebms_invoice_identifier = '4000000000/ws400000000000/20240101120000/INV001'
+        invoice.action_cancel_ebms(cn_motif='Erreur de prix')
+        self.assertEqual(invoice.ebms_status, 'cancelled')
+        self.assertEqual(invoice.ebms_cn_motif, 'Erreur de prix')
         self.assertFalse(invoice.ebms_error_message)
+        payload = mock_post.call_args.kwargs['json']
+        self.assertEqual(payload, {
+            'invoice_identifier': '4000000000/ws400000000000/20240101120000/INV001',
+            'cn_motif': 'Erreur de prix',
+        })
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
     def test_action_cancel_ebms_error(self, mock_post):
         mock_post.return_value.json.return_value = {'success': False, 'msg': 'Annulation refusée'}
         mock_post.return_value.status_code = 200
         invoice = self._create_invoice()
         invoice.ebms_status = 'sent'
         invoice.action_cancel_ebms()
+        self.assertEqual(invoice.ebms_status, 'sent')
         self.assertIn('Annulation refusée', invoice.ebms_error_message or '')
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
     def test_action_cancel_ebms_exception(self, mock_post):
         mock_post.side_effect = Exception("Erreur réseau")
         invoice = self._create_invoice()
@@ -237,6 +258,7 @@ class TestEBMSBusiness(TransactionCase):
         invoice = self._create_invoice()
         invoice.partner_id.vat = '12345678'
         invoice.action_check_nif_ebms()  # Doit notifier succès
+        self.assertEqual(invoice.partner_id.ebms_tin_check, 'valid')
 
     @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
     def test_action_check_nif_ebms_invalid(self, mock_post):
@@ -245,6 +267,7 @@ class TestEBMSBusiness(TransactionCase):
         invoice = self._create_invoice()
         invoice.partner_id.vat = '00000000'
         invoice.action_check_nif_ebms()  # Doit notifier erreur
+        self.assertEqual(invoice.partner_id.ebms_tin_check, 'invalid')
 
     @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
     def test_action_check_nif_ebms_exception(self, mock_post):
@@ -345,7 +368,7 @@ class TestEBMSBusiness(TransactionCase):
         with self.assertRaisesRegex(UserError, 'Signature EBMS INVALIDE'):
             invoice.ebms_manual_signature_check()
 
-    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.serialization.load_pem_public_key')
+    @patch('odoo.addons.ebms_connector.models.ebms_signature.load_public_key')
     def test_ebms_manual_signature_check_valid_signature(self, mock_load_key):
         """Teste la vérification d'une signature RSA valide (mockée)."""
         mock_public_key = MagicMock()
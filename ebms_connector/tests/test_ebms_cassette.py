@@ -0,0 +1,77 @@
+import json
+import os
+import tempfile
+from unittest.mock import patch
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from odoo.addons.ebms_connector.models import ebms_client
+from odoo.addons.ebms_connector.tools import ebms_cassette
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+CASSETTES = os.path.join(os.path.dirname(__file__), 'cassettes')
+
+
+class TestEBMSCassette(EBMSTestCase):
+    """Échanges OBR rejoués depuis tests/cassettes, sans réseau."""
+
+    ebms_api_url = 'https://fake.ebms.api/ebms_api/addInvoice/'
+    ebms_api_token = 'FAKE_EXPIRED_TOKEN'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.login_url', 'https://fake.ebms.api/ebms_api/login/')
+        params.set_param('ebms.api_username', 'wsl400000000000')
+        params.set_param('ebms.api_password', 'FAKE_PASSWORD')
+
+    def test_replay_token_expiry(self):
+        invoice = self._invoices(1)
+        with ebms_cassette.replaying(os.path.join(CASSETTES, 'addinvoice_token_expiry.json'), speed=None) as replay:
+            invoice.action_send_ebms()
+        self.assertEqual(replay.calls, 3, '401, login puis nouvel envoi')
+        self.assertEqual((invoice.ebms_status, invoice.ebms_reference), ('sent', '00042'))
+        self.assertEqual(self.env['ir.config_parameter'].sudo().get_param('ebms.api_token'), ebms_cassette.REDACTED)
+
+    def test_replay_latency_and_throughput(self):
+        self.env['ir.config_parameter'].sudo().set_param('ebms.max_workers', 4)
+        invoices = self._invoices(8)
+        speed = 20
+        with ebms_cassette.replaying(os.path.join(CASSETTES, 'addinvoice_ok.json'), speed=speed, loop=True) as replay:
+            sent = invoices._ebms_send_batch()
+        self.assertEqual((len(sent), replay.calls), (8, 8))
+        calls = invoices.ebms_trace_span_ids.filtered(lambda s: s.name == 'obr_call')
+        self.assertEqual(len(calls), 8)
+        recorded_ms = 412 / speed
+        self.assertTrue(all(call.duration_ms >= recorded_ms for call in calls), 'Latence enregistrée respectée')
+
+    def test_record_redacts_secrets(self):
+        def fake_send(adapter, request, **kwargs):
+            response = requests.Response()
+            response.status_code = 200
+            response.headers['Content-Type'] = 'application/json'
+            response._content = b'{"success": true, "result": {"token": "eyJ.vrai-token-obr"}}'
+            response.request = request
+            return response
+
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'login.json')
+            with patch.object(HTTPAdapter, 'send', autospec=True, side_effect=fake_send), \
+                    ebms_cassette.recording(path):
+                ebms_client._Session().post('https://fake.ebms.api/ebms_api/login/',
+                                            json={'username': 'u', 'password': 'motdepasse'},
+                                            headers={'Authorization': 'Bearer ancien-token'})
+            with open(path, encoding='utf-8') as f:
+                text = f.read()
+            for secret in ('motdepasse', 'eyJ.vrai-token-obr', 'ancien-token'):
+                self.assertNotIn(secret, text)
+            self.assertEqual(json.loads(text)['interactions'][0]['request']['json']['username'], 'u')
+
+            with ebms_cassette.replaying(path, speed=None), \
+                    patch.object(HTTPAdapter, 'send', autospec=True, side_effect=fake_send) as real_send:
+                response = ebms_client._Session().post('https://autre.hote/ebms_api/login/', json={})
+                requests.Session().get('https://autre.hote/ailleurs')
+            self.assertEqual(response.json()['result']['token'], ebms_cassette.REDACTED)
+            self.assertEqual(real_send.call_count, 1, 'Seules les sessions du client EBMS passent par la cassette')
@@ -0,0 +1,89 @@
+from datetime import timedelta
+
+from odoo import fields
+
+from odoo.addons.ebms_connector import post_init_hook
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSDashboard(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Counter = cls.env['ebms.status.counter']
+        cls.Dashboard = cls.env['ebms.status.dashboard']
+        cls.company_id = cls.env.company.id
+        cls.day = fields.Date.today() - timedelta(days=5)
+
+    @classmethod
+    def _invoice(cls, **vals):
+        return super()._invoice(invoice_date=cls.day, **vals)
+
+    def _count(self, status, res_model='account.move', day=None):
+        return self.Counter._totals().get((self.company_id, res_model, day or self.day, status), 0)
+
+    def test_transitions_update_counters(self):
+        self.Counter._rebuild()
+        draft, sent = self._count('draft'), self._count('sent')
+        invoices = self._invoice() | self._invoice()
+        self.assertEqual(self._count('draft'), draft + 2)
+
+        invoices[0].write({'ebms_status': 'sent', 'ebms_reference': 'OBR-DASH'})
+        self.assertEqual(self._count('draft'), draft + 1)
+        self.assertEqual(self._count('sent'), sent + 1)
+
+        invoices[1].button_draft()
+        self.assertEqual(self._count('draft'), draft)
+
+        totals = self.Counter._totals()
+        self.Counter._compact()
+        self.assertEqual(self.Counter._totals(), totals)
+        self.Counter._rebuild()
+        self.assertEqual(self.Counter._totals(), totals, 'Compteurs incrémentaux différents du recalcul complet')
+
+    def test_stock_moves_counted_without_state_row(self):
+        self.Counter._rebuild()
+        today = fields.Date.today()
+        before = self._count('draft', 'stock.move', today)
+        move = self.env['stock.move'].create({
+            'name': 'Mouvement tableau de bord',
+            'product_id': self.env.ref('product.product_product_4').id,
+            'product_uom_qty': 1,
+            'product_uom': self.env.ref('uom.product_uom_unit').id,
+            'location_id': self.env.ref('stock.stock_location_stock').id,
+            'location_dest_id': self.env.ref('stock.stock_location_customers').id,
+            'ebms_movement_type': 'SN',
+            'date': fields.Datetime.now(),
+        })
+        self.assertEqual(self._count('draft', 'stock.move', today), before + 1)
+        move.ebms_stock_status = 'error'
+        self.assertEqual(self._count('draft', 'stock.move', today), before)
+        self.assertEqual(self._count('error', 'stock.move', today), 1)
+        move._action_cancel()
+        self.assertEqual(self._count('error', 'stock.move', today), 0)
+
+    def test_overdue_filter_and_drill_down(self):
+        invoice = self._invoice()
+        invoice.ebms_status = 'error'
+        rows = self.Dashboard.search([('overdue', '=', True), ('company_id', '=', self.company_id), ('day', '=', self.day)])
+        self.assertEqual(rows.mapped('status'), ['error'])
+        self.assertTrue(rows.overdue)
+        action = rows.action_open_records()
+        self.assertIn(invoice, self.env['account.move'].search(action['domain']))
+
+        self.env['ir.config_parameter'].sudo().set_param('ebms.dashboard_overdue_hours', 24 * 30)
+        self.assertFalse(self.Dashboard.search([('overdue', '=', True), ('day', '=', self.day)]))
+
+    def test_install_hook_and_drill_down_without_invoice_date(self):
+        invoice = self._invoice()
+        other_day = self.day - timedelta(days=1)
+        self.env.flush_all()
+        self.env.cr.execute("UPDATE account_move SET invoice_date = NULL, date = %s WHERE id = %s", (other_day, invoice.id))
+        invoice.invalidate_recordset(['invoice_date', 'date'])
+        self.env.cr.execute("DELETE FROM ebms_status_counter")
+        post_init_hook(self.env)
+        self.assertGreaterEqual(self._count('draft', day=other_day), 1, 'Pièces existantes comptées à l\'installation')
+        row = self.Dashboard.search([('company_id', '=', self.company_id), ('day', '=', other_day),
+                                     ('res_model', '=', 'account.move'), ('status', '=', 'draft')])
+        self.assertIn(invoice, self.env['account.move'].search(row.action_open_records()['domain']))
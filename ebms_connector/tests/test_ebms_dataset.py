@@ -0,0 +1,55 @@
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.ebms_connector.tools import ebms_dataset
+
+
+class TestEBMSDataset(TransactionCase):
+
+    def _generate(self, **kwargs):
+        params = dict(invoices=60, partners=8, products=5, seed=7, credit_note_ratio=0.25, cash_ratio=0.4,
+                      tin_ratio=0.5, sent_ratio=0.3, chunk_size=25)
+        params.update(kwargs)
+        return ebms_dataset.generate(self.env, **params)
+
+    def test_generated_invoices_are_consistent(self):
+        result = self._generate()
+        moves = self.env['account.move'].browse(result['invoice_ids'])
+        self.assertEqual(len(moves), 60)
+        self.assertEqual(set(moves.mapped('state')), {'posted'})
+        self.assertEqual(set(moves.mapped('move_type')), {'out_invoice', 'out_refund'})
+        self.assertEqual(set(moves.mapped('ebms_status')), {'draft', 'sent'})
+        self.assertTrue(all(m.ebms_reference for m in moves if m.ebms_status == 'sent'))
+        self.assertEqual(len(set(moves.mapped('name'))), 60)
+
+        self.env.cr.execute("""
+            SELECT move_id FROM account_move_line WHERE move_id IN %s
+             GROUP BY move_id HAVING round(sum(debit) - sum(credit), 2) != 0
+        """, (tuple(moves.ids),))
+        self.assertFalse(self.env.cr.fetchall(), 'Écritures générées déséquilibrées')
+        for move in moves[:10]:
+            receivable = move.line_ids.filtered(lambda l: l.display_type == 'payment_term')
+            self.assertAlmostEqual(abs(sum(receivable.mapped('balance'))), move.amount_total, places=2)
+
+        tax_names = set(moves.line_ids.tax_ids.mapped('name'))
+        self.assertIn('TVA 18% (EBMS)', tax_names)
+        self.assertIn('TC 2% (EBMS)', tax_names)
+        partners = self.env['res.partner'].browse(result['partner_ids'])
+        self.assertTrue(partners.filtered('vat') and partners.filtered(lambda p: not p.vat))
+
+    def test_deterministic_by_seed(self):
+        def fingerprint(result):
+            moves = self.env['account.move'].browse(result['invoice_ids'])
+            return [(m.move_type, m.partner_id.id, m.invoice_date, m.amount_total, m.ebms_status) for m in moves]
+        first = fingerprint(self._generate(invoices=30))
+        second = fingerprint(self._generate(invoices=30))
+        other = fingerprint(self._generate(invoices=30, seed=8))
+        self.assertEqual(first, second)
+        self.assertNotEqual(first, other)
+
+    def test_stock_moves_cover_movement_types(self):
+        result = self._generate(invoices=0, stock_moves=300, chunk_size=100)
+        moves = self.env['stock.move'].browse(result['stock_move_ids'])
+        self.assertEqual(len(moves), 300)
+        movement_types = {value for value, _label in moves._fields['ebms_movement_type'].selection}
+        self.assertEqual(set(moves.mapped('ebms_movement_type')), movement_types)
+        self.assertFalse(moves.ebms_state_ids, 'L\'état EBMS d\'un mouvement n\'est créé qu\'au premier envoi')
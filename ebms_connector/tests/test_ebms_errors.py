@@ -0,0 +1,74 @@
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from odoo.exceptions import UserError
+
+from odoo.addons.ebms_connector.models.ebms_errors import error_signature
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSErrorTriage(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Triage = cls.env['ebms.error.triage']
+        cls.Queue = cls.env['ebms.queue.item']
+
+    def _group(self, signature):
+        self.env.flush_all()
+        self.Triage.invalidate_model()
+        return self.Triage.search([('signature', '=', signature), ('res_model', '=', 'account.move'),
+                                   ('company_id', '=', self.env.company.id)])
+
+    def test_signatures(self):
+        self.assertEqual(error_signature('Erreur HTTP 503: <html>Service Unavailable</html>'), 'HTTP 503')
+        self.assertEqual(error_signature('ConnectTimeout: HTTPSConnectionPool(host=ebms, port=443)'), 'ConnectTimeout')
+        self.assertEqual(error_signature('Exception lors de l’envoi EBMS Stock: Erreur EBMS Stock: Erreur HTTP 500: boom'), 'HTTP 500')
+        self.assertEqual(error_signature("HTTPSConnectionPool(host='ebms', port=443): Max retries exceeded"), 'ConnectionError')
+        self.assertEqual(error_signature('La facture 4000000000/ws400000000000/20240101120000/0001 existe déjà.'),
+                         error_signature('La facture 4000000001/ws400000000000/20240102093000/0002 existe déjà.'))
+        self.assertEqual(error_signature("Le champ d'article est vide"), "Le champ d'article est vide")
+        self.assertFalse(error_signature(False))
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_send_errors_grouped_by_signature(self, mock_post):
+        refused, down = self._invoices(2), self._invoices(1)
+        for i, invoice in enumerate(refused):
+            mock_post.return_value = MagicMock(status_code=200, json=lambda i=i: {
+                'success': False, 'msg': 'Le NIF 40001234%02d du client est invalide' % i})
+            with self.assertRaises(UserError):
+                invoice.action_send_ebms()
+        mock_post.side_effect = requests.exceptions.ConnectTimeout('délai dépassé')
+        with self.assertRaises(UserError):
+            down.action_send_ebms()
+
+        self.assertEqual(down.ebms_error_signature, 'ConnectTimeout')
+        self.assertEqual(set(refused.mapped('ebms_error_signature')), {'Le NIF <n> du client est invalide'})
+        group = self._group('Le NIF <n> du client est invalide')
+        self.assertEqual(group.count, 2)
+        self.assertEqual(self._group('ConnectTimeout').count, 1)
+        self.assertEqual(self.Triage.browse(group.id).signature, group.signature, 'Id stable d\'un affichage à l\'autre')
+
+    def test_bulk_retry_and_park(self):
+        invoices = self._invoices(3)
+        invoices.write({'ebms_status': 'error', 'ebms_error_message': 'Erreur HTTP 502: Bad Gateway'})
+        group = self._group('HTTP 502')
+        self.assertEqual((group.count, group.queued_count), (3, 0))
+        self.assertEqual(set(self.env['account.move'].search(group.action_open_records()['domain']).ids), set(invoices.ids))
+
+        group.action_park()
+        self.assertTrue(all(invoices.mapped('ebms_parked')))
+        self.assertFalse(self._group('HTTP 502').filtered(lambda g: not g.parked))
+        parked = self._group('HTTP 502')
+        self.assertEqual(parked.count, 3)
+
+        parked.action_retry()
+        self.assertFalse(any(invoices.mapped('ebms_parked')))
+        items = self.Queue.search([('res_model', '=', 'account.move'), ('res_id', 'in', invoices.ids), ('state', '=', 'pending')])
+        self.assertEqual(len(items), 3)
+        self.assertEqual(self._group('HTTP 502').queued_count, 3)
+
+        self._group('HTTP 502').action_park()
+        self.assertFalse(self.Queue.search([('res_id', 'in', invoices.ids), ('res_model', '=', 'account.move'), ('state', '=', 'pending')]))
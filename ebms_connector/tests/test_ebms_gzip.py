@@ -0,0 +1,63 @@
+import gzip
+import json
+from unittest.mock import patch, MagicMock
+
+from odoo.tests.common import HttpCase, TransactionCase, tagged
+
+from odoo.addons.ebms_connector.models import ebms_client, ebms_json
+
+URL = 'https://fake.ebms.api/ebms_api/addInvoice/'
+
+
+class TestEBMSGzip(TransactionCase):
+
+    def _client(self, endpoints='addInvoice'):
+        return ebms_client.EBMSClient().configure(token='FAKE_TOKEN_OK', gzip_endpoints=endpoints, gzip_min_bytes=1024)
+
+    @staticmethod
+    def _payload(lines):
+        return {'invoice_number': 'INV/2024/000001',
+                'lines': [{'item_designation': 'Ciment Buceco 50 kg — lot %s' % i, 'item_quantity': 1} for i in range(lines)]}
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_large_body_compressed(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True})
+        payload = self._payload(200)
+        self.assertTrue(self._client().post(URL, payload)['success'])
+        kwargs = mock_post.call_args.kwargs
+        self.assertEqual(kwargs['headers']['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(kwargs['data']), ebms_json.canonical(payload))
+        self.assertLess(len(kwargs['data']), len(ebms_json.canonical(payload)) / 3)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_small_body_or_other_endpoint_not_compressed(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True})
+        self._client().post(URL, self._payload(2))
+        self._client(endpoints='').post(URL, self._payload(200))
+        for call in mock_post.call_args_list:
+            self.assertIn('json', call.kwargs)
+            self.assertNotIn('Content-Encoding', call.kwargs['headers'])
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_refused_gzip_falls_back(self, mock_post):
+        mock_post.side_effect = [
+            MagicMock(status_code=415, text='Unsupported Media Type'),
+            MagicMock(status_code=200, json=lambda: {'success': True}),
+            MagicMock(status_code=200, json=lambda: {'success': True}),
+        ]
+        client = self._client()
+        self.assertTrue(client.post(URL, self._payload(200))['success'])
+        client.post(URL, self._payload(200))
+        self.assertEqual([('data' in call.kwargs) for call in mock_post.call_args_list], [True, False, False],
+                         'Après un refus, l\'endpoint n\'est plus compressé')
+
+
+@tagged('post_install', '-at_install')
+class TestEBMSGzipStandIn(HttpCase):
+
+    def test_demo_endpoint_accepts_gzip(self):
+        body = gzip.compress(json.dumps({'invoice_number': 'INV/1', 'amount_total': 500}).encode('utf-8'))
+        response = self.url_open('/ebms/demo/addInvoice', data=body,
+                                 headers={'Content-Type': 'application/json', 'Content-Encoding': 'gzip'})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.json()['success'])
@@ -0,0 +1,57 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from odoo import fields
+from odoo.exceptions import UserError
+
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSHealth(EBMSTestCase):
+
+    ebms_api_token = 'FAKE_TOKEN_OK'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.cancel_url', 'https://fake.ebms.api/cancel')
+        params.set_param('ebms.login_url', 'https://fake.ebms.api/login')
+        cls.Health = cls.env['ebms.health.probe']
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.head')
+    def test_probe_up(self, mock_head):
+        mock_head.return_value = MagicMock(status_code=405)
+        self.Health._probe_all()
+        probe = self.Health._for_company(self.env.company)
+        self.assertEqual((probe.status, probe.reachable, probe.login_ok, probe.failures), ('up', True, True, 0))
+        self.assertEqual(self._invoice().ebms_obr_status, 'up')
+
+        probe.checked_at = fields.Datetime.now() - timedelta(seconds=3600)
+        self.assertEqual(probe.status, 'unknown', 'Contrôle trop ancien : rien n\'est court-circuité')
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.head')
+    def test_down_fails_fast(self, mock_head, mock_post):
+        mock_head.side_effect = requests.exceptions.ConnectionError('Connexion refusée')
+        self.Health._probe_all()
+        self.Health._probe_all()
+        probe = self.Health._for_company(self.env.company)
+        self.assertEqual((probe.status, probe.failures), ('down', 2))
+        self.assertIn('Connexion refusée', probe.last_error)
+
+        invoice = self._invoice()
+        action = invoice.action_send_ebms()
+        self.assertEqual(action['params']['type'], 'warning')
+        self.assertFalse(mock_post.called, 'Aucun appel OBR quand il est connu injoignable')
+        self.assertTrue(self.env['ebms.queue.item'].search([
+            ('res_model', '=', 'account.move'), ('res_id', '=', invoice.id), ('state', '=', 'pending')]))
+        self.assertEqual(invoice.ebms_status, 'draft')
+
+        invoice.write({'ebms_status': 'sent', 'ebms_reference': 'REF-DOWN',
+                       'ebms_invoice_identifier': 'TIN/ws1/20240101000000/%s' % invoice.name})
+        with self.assertRaises(UserError):
+            invoice.action_cancel_ebms()
+        self.assertFalse(mock_post.called)
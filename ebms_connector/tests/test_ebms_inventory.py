@@ -0,0 +1,103 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from odoo import fields
+
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSInventory(EBMSTestCase):
+
+    ebms_api_token = 'FAKE_TOKEN_OK'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.stock_url', 'https://fake.ebms.api/ebms_api/AddStockMovement/')
+        params.set_param('ebms.device_id', 'TEST_DEVICE')
+        cls.warehouse = cls.env['stock.warehouse'].create({'name': 'Dépôt inventaire EBMS', 'code': 'EBI'})
+        cls.products = cls.env['product.product'].create([{
+            'name': 'Article inventaire %s' % i,
+            'default_code': 'INV-%02d' % i,
+            'type': 'product',
+            'standard_price': 10.0 + i,
+        } for i in range(3)])
+        for product, quantity in zip(cls.products, (10, 5, 2)):
+            cls.env['stock.quant']._update_available_quantity(product, cls.warehouse.lot_stock_id, quantity)
+        cls.job = cls.env['ebms.inventory.job'].create({
+            'name': 'Inventaire annuel',
+            'warehouse_id': cls.warehouse.id,
+            'inventory_date': fields.Datetime.now() - timedelta(hours=1),
+            'chunk_size': 10,
+        })
+
+    def _deliver(self, product, quantity):
+        move = self.env['stock.move'].create({
+            'name': 'Livraison après inventaire',
+            'product_id': product.id,
+            'product_uom': product.uom_id.id,
+            'product_uom_qty': quantity,
+            'location_id': self.warehouse.lot_stock_id.id,
+            'location_dest_id': self.env.ref('stock.stock_location_customers').id,
+            'ebms_movement_type': 'SV',
+        })
+        move._action_confirm()
+        move._action_assign()
+        move.picked = True
+        move._action_done()
+
+    def test_snapshot_as_of_inventory_date(self):
+        self._deliver(self.products[0], 3)
+        self.assertEqual(self.job._snapshot(10), [(product.id, quantity) for product, quantity in zip(self.products, (10, 5, 2))],
+                         'Les sorties postérieures à la date d\'inventaire sont réintégrées')
+        payload = self.job._payloads(self.job._snapshot(1))[0]
+        self.assertEqual(
+            (payload['system_or_device_id'], payload['item_code'], payload['item_quantity'], payload['item_movement_type']),
+            ('TEST_DEVICE', 'INV-00', '10.0', 'EI'))
+        self.assertEqual(payload['item_cost_price'], '10.0')
+        self.assertEqual(payload['item_movement_date'], fields.Datetime.to_string(self.job.inventory_date))
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_checkpoint_and_resume(self, mock_post):
+        first, second, third = self.products
+
+        def fake_post(url, json=None, **kwargs):
+            if json['item_code'] == second.default_code:
+                raise ConnectionError('Lien coupé')
+            return MagicMock(status_code=200, json=lambda: {'success': True, 'msg': 'OK'})
+        mock_post.side_effect = fake_post
+
+        self.job.action_start()
+        self.job._process_chunk(self.job._snapshot(10))
+        self.assertEqual(self.job.last_product_id, first.id)
+        self.assertEqual(self.job.done_ahead_ids, [third.id], 'Article accepté après celui en échec : noté')
+        self.assertEqual((self.job.sent_count, self.job.error_count), (2, 1))
+        sent_codes = [call.kwargs['json']['item_code'] for call in mock_post.call_args_list
+                      if call.kwargs['json']['item_code'] != second.default_code]
+
+        # Reprise : seul l'article en échec est renvoyé.
+        mock_post.reset_mock()
+        mock_post.side_effect = None
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'msg': 'OK'})
+        self.job._run(time_budget=60)
+        sent_codes += [call.kwargs['json']['item_code'] for call in mock_post.call_args_list]
+        self.assertEqual(sorted(sent_codes), sorted(self.products.mapped('default_code')), 'Aucun article envoyé deux fois')
+        self.assertEqual((self.job.state, self.job.processed_count, self.job.sent_count), ('done', 3, 3))
+        self.assertEqual(self.job.last_product_id, third.id)
+        self.assertFalse(self.job.done_ahead_ids)
+
+    def test_query_count_independent_of_chunk_size(self):
+        more = self.env['product.product'].create([{
+            'name': 'Article vrac %s' % i, 'default_code': 'VRAC-%02d' % i, 'type': 'product',
+        } for i in range(20)])
+        for product in more:
+            self.env['stock.quant']._update_available_quantity(product, self.warehouse.lot_stock_id, 1)
+
+        def queries(limit):
+            self.env.flush_all()
+            self.env.invalidate_all()
+            count = self.cr.sql_log_count
+            self.job._payloads(self.job._snapshot(limit))
+            return self.cr.sql_log_count - count
+        self.assertEqual(queries(3), queries(23))
@@ -0,0 +1,72 @@
+from unittest.mock import patch, MagicMock
+
+from odoo.addons.ebms_connector.models import ebms_invoice_cache
+from odoo.addons.ebms_connector.models.ebms_invoice_cache import TTLCache
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSInvoiceCache(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.getinvoice_url', 'https://fake.ebms.api/getInvoice')
+        cls.invoice = cls._invoice()
+        cls.invoice.ebms_reference = 'OBR-CACHE-1'
+
+    def setUp(self):
+        super().setUp()
+        ebms_invoice_cache.clear()
+        self.addCleanup(ebms_invoice_cache.clear)
+
+    def test_ttl_and_size_eviction(self):
+        cache = TTLCache(maxsize=2, ttl=60)
+        cache.put('a', 1)
+        cache.put('b', 2)
+        self.assertEqual(cache.get('a'), 1)
+        cache.put('c', 3)
+        self.assertIsNone(cache.get('b'), 'Entrée la moins récemment lue évincée')
+        self.assertEqual((cache.get('a'), cache.get('c')), (1, 3))
+
+        with patch('odoo.addons.ebms_connector.models.ebms_invoice_cache.time.monotonic', return_value=10 ** 9):
+            self.assertIsNone(cache.get('a'), 'Entrée expirée')
+        self.assertEqual(len(cache), 1)
+
+    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    def test_repeat_lookup_served_from_cache(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'result': {'invoices': []}})
+        messages = len(self.invoice.message_ids)
+        first = self.invoice.action_get_ebms_invoice()
+        first['result']['altered'] = True
+        second = self.invoice.action_get_ebms_invoice()
+        self.assertEqual(mock_post.call_count, 1)
+        self.assertNotIn('altered', second['result'], 'Chaque lecture reçoit sa propre copie')
+        self.assertEqual(len(self.invoice.message_ids), messages + 1, 'Pas de nouveau message pour une lecture en cache')
+
+        self.invoice.action_refresh_ebms_invoice()
+        self.assertEqual(mock_post.call_count, 2)
+
+        self.env['ir.config_parameter'].sudo().set_param('ebms.getinvoice_cache_ttl', 0)
+        self.invoice.action_get_ebms_invoice()
+        self.assertEqual(mock_post.call_count, 3, 'TTL nul : pas de cache')
+
+    @patch('odoo.addons.ebms_connector.models.account_invoice_inherit.requests.post')
+    def test_failures_not_cached(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': False, 'msg': 'Facture introuvable'})
+        for _i in range(2):
+            with self.assertRaises(Exception):
+                self.invoice.action_get_ebms_invoice()
+        self.assertEqual(mock_post.call_count, 2)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_lookup_shared_with_batch_readers(self, mock_post):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'result': {'invoices': []}})
+        results = ebms_invoice_cache.lookup_invoices(self.env, ['OBR-A', 'OBR-B', 'OBR-A'])
+        self.assertEqual(set(results), {'OBR-A', 'OBR-B'})
+        self.assertEqual(mock_post.call_count, 2)
+
+        results = ebms_invoice_cache.lookup_invoices(self.env, ['OBR-A', 'OBR-C'])
+        self.assertTrue(results['OBR-A']['cached'])
+        self.assertEqual(mock_post.call_count, 3)
+        self.assertTrue(ebms_invoice_cache.get_invoice(self.env, 'OBR-C')['success'])
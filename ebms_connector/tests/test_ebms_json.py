@@ -0,0 +1,38 @@
+import json
+import random
+from datetime import datetime
+from unittest.mock import patch
+
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.ebms_connector.cli.ebms_json_bench import build_exchange, canonical_exchange, legacy_exchange
+from odoo.addons.ebms_connector.models import ebms_json
+
+
+class TestEBMSJson(TransactionCase):
+
+    def _std_signed(self, value):
+        return json.dumps(value, sort_keys=True, separators=(',', ':')).encode('utf-8')
+
+    def test_canonical_form(self):
+        value = {'b': 1, 'a': 'Établissements « Nyota » 😀 \x7f\n', 'c': [1.5, 100.0, True, None], 'd': {'z': 1, 'é': 2, 'A': 3}}
+        text = ebms_json.canonical_text(value)
+        self.assertEqual(text, json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False))
+        self.assertEqual(ebms_json.canonical(value), text.encode('utf-8'))
+        self.assertEqual(ebms_json.loads(text), value)
+        self.assertEqual(ebms_json.signed_bytes(text), self._std_signed(value))
+        self.assertEqual(ebms_json.canonical_text({'date': datetime(2024, 3, 1, 10, 0)}), '{"date":"2024-03-01 10:00:00"}')
+
+    def test_standard_library_fallback(self):
+        value = {'big': 2 ** 70, 'name': 'Café'}
+        self.assertEqual(ebms_json.canonical(value), json.dumps(value, sort_keys=True, separators=(',', ':'), ensure_ascii=False).encode('utf-8'))
+        with patch.object(ebms_json, 'orjson', None):
+            self.assertEqual(ebms_json.canonical_text(value), '{"big":1180591620717411303424,"name":"Café"}')
+
+    def test_signature_bytes_match_legacy_path(self):
+        rng = random.Random(7)
+        for _i in range(5):
+            payload, result = build_exchange(rng, 30)
+            self.assertEqual(canonical_exchange(payload, result)[1], legacy_exchange(payload, result)[1])
+        legacy_text = json.dumps({'b': 'é', 'a': 1e16}, ensure_ascii=False, indent=2)
+        self.assertEqual(ebms_json.legacy_signed_bytes(legacy_text), b'{"a":1e+16,"b":"\\u00e9"}')
@@ -0,0 +1,73 @@
+from datetime import datetime, timedelta
+from unittest.mock import patch, MagicMock
+
+from odoo import fields
+from odoo.exceptions import UserError
+
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSLatency(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Report = cls.env['ebms.latency.report']
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_milestones_and_attempts(self, mock_post):
+        invoice = self._invoices()
+        self.assertTrue(invoice.ebms_posted_at)
+        self.assertFalse(invoice.ebms_first_attempt_at)
+
+        mock_post.return_value = MagicMock(status_code=503, text='Indisponible')
+        with self.assertRaises(UserError):
+            invoice.action_send_ebms()
+        self.assertEqual(invoice.ebms_attempts, 1)
+        first_attempt = invoice.ebms_first_attempt_at
+        self.assertTrue(first_attempt)
+        self.assertFalse(invoice.ebms_acknowledged_at)
+
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR-LAT', 'msg': 'OK'})
+        invoice.action_send_ebms()
+        self.assertEqual(invoice.ebms_attempts, 2)
+        self.assertEqual(invoice.ebms_first_attempt_at, first_attempt)
+        self.assertGreaterEqual(invoice.ebms_acknowledged_at, invoice.ebms_posted_at)
+
+    def test_daily_percentiles(self):
+        invoices = self._invoices(10)
+        posted = datetime(2001, 2, 3, 8, 0)
+        for i, invoice in enumerate(invoices, start=1):
+            invoice.write({
+                'ebms_status': 'sent',
+                'ebms_posted_at': posted,
+                'ebms_first_attempt_at': posted + timedelta(seconds=1),
+                'ebms_attempts': 1 + i % 2,
+                'ebms_acknowledged_at': posted + timedelta(seconds=10 * i),
+            })
+        self.env.flush_all()
+        row = self.Report.search([('day', '=', posted.date()), ('company_id', '=', self.env.company.id)])
+        self.assertEqual(len(row), 1)
+        self.assertEqual((row.posted_count, row.acknowledged_count, row.pending_count), (10, 10, 0))
+        self.assertAlmostEqual(row.ack_p50, 55.0)
+        self.assertAlmostEqual(row.ack_p95, 95.5)
+        self.assertAlmostEqual(row.ack_p99, 99.1)
+        self.assertAlmostEqual(row.ack_max, 100.0)
+        self.assertAlmostEqual(row.attempts_avg, 1.5)
+        self.assertEqual(row.attempts_max, 2)
+
+    def test_backlog_slo_alert(self):
+        self.env['ir.config_parameter'].sudo().set_param('ebms.ack_slo_minutes', 30)
+        late, recent = self._invoices(2)
+        late.ebms_posted_at = fields.Datetime.now() - timedelta(hours=2)
+        breaches = self.Report._cron_check_backlog_slo()
+        _count, _oldest, move_id = breaches[self.env.company.id]
+        self.assertEqual(move_id, late.id)
+        self.assertNotIn(recent.id, [move_id])
+        self.assertEqual(len(late.activity_ids), 1)
+
+        self.Report._cron_check_backlog_slo()
+        self.assertEqual(len(late.activity_ids), 1, 'Une seule alerte par facture')
+
+        late.ebms_status = 'sent'
+        self.assertNotIn(late.id, [b[2] for b in self.Report._backlog_breaches().values()])
@@ -0,0 +1,78 @@
+import logging
+from unittest.mock import patch, MagicMock
+
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.ebms_connector.models import ebms_logging
+from odoo.addons.ebms_connector.models.ebms_client import EBMSClient
+
+EXCHANGE_LOGGER = 'odoo.addons.ebms_connector.exchange'
+
+
+class TestEBMSLogging(TransactionCase):
+
+    def setUp(self):
+        super().setUp()
+        ebms_logging.configure(body_sample_rate=0)
+        self.addCleanup(ebms_logging.configure, body_sample_rate=0)
+
+    def test_redact_secrets_and_tins(self):
+        redacted = ebms_logging.redact({
+            'username': 'user',
+            'password': 'secret',
+            'tp_TIN': '4000123456',
+            'customer_TIN': '4000999888',
+            'invoice_identifier': '4000123456/ws400/20240101120000/INV001',
+            'invoice_items': [{'item_designation': 'Ciment', 'token': 'abc'}],
+        })
+        self.assertEqual(redacted['password'], '***')
+        self.assertEqual(redacted['tp_TIN'], '*******456')
+        self.assertEqual(redacted['customer_TIN'], '*******888')
+        self.assertEqual(redacted['invoice_identifier'], '*******456/ws400/20240101120000/INV001')
+        self.assertEqual(redacted['invoice_items'][0], {'item_designation': 'Ciment', 'token': '***'})
+        text = ebms_logging.redact('Authorization: Bearer eyJhbGciOi.abc {"password": "x", "tp_TIN": "4000123456"}')
+        self.assertNotIn('eyJhbGciOi', text)
+        self.assertIn('"password": "***"', text)
+        self.assertIn('"tp_TIN": "*******456"', text)
+
+    def test_one_record_per_exchange_without_body(self):
+        client = EBMSClient().configure(token='VALID_TOKEN_123')
+        payload = {'invoice_number': 'INV001', 'tp_TIN': '4000123456'}
+        with patch.object(client.session, 'post', return_value=MagicMock(
+                status_code=200, json=lambda: {'success': True, 'msg': 'OK'})), \
+                self.assertLogs(EXCHANGE_LOGGER, level='INFO') as logs:
+            client.post('https://fake.ebms.api/send', payload)
+        self.assertEqual(len(logs.records), 1)
+        record = logs.records[0]
+        self.assertEqual(record.levelno, logging.INFO)
+        self.assertEqual(record.ebms['status'], 200)
+        self.assertEqual(record.ebms['invoice_number'], 'INV001')
+        self.assertIsNotNone(record.ebms['latency_ms'])
+        self.assertNotIn('request=', record.getMessage())
+
+    def test_failed_exchange_logs_redacted_body(self):
+        client = EBMSClient().configure(token='VALID_TOKEN_123')
+        with patch.object(client.session, 'post', return_value=MagicMock(
+                status_code=200, json=lambda: {'success': False, 'msg': 'NIF inconnu'})), \
+                self.assertLogs(EXCHANGE_LOGGER, level='INFO') as logs:
+            client.post('https://fake.ebms.api/send', {'invoice_number': 'INV002', 'customer_TIN': '4000999888'})
+        message = logs.records[0].getMessage()
+        self.assertEqual(logs.records[0].levelno, logging.WARNING)
+        self.assertIn('NIF inconnu', message)
+        self.assertIn('*******888', message)
+        self.assertNotIn('4000999888', message)
+
+    def test_body_sampling(self):
+        ebms_logging.configure(body_sample_rate=1)
+        with self.assertLogs(EXCHANGE_LOGGER, level='INFO') as logs:
+            ebms_logging.log_exchange('https://fake.ebms.api/send', 200, 0.05, payload={'invoice_number': 'INV003'})
+        self.assertIn('request={"invoice_number": "INV003"}', logs.records[0].getMessage())
+
+    def test_formatting_is_lazy(self):
+        logger = logging.getLogger(EXCHANGE_LOGGER)
+        with patch.object(logger, 'isEnabledFor', return_value=False), \
+                patch.object(ebms_logging._LazyExchange, '__str__') as mock_str, \
+                patch.object(logger, 'log') as mock_log:
+            ebms_logging.log_exchange('https://fake.ebms.api/send', 200, 0.01, payload={'invoice_number': 'INV004'})
+        mock_log.assert_not_called()
+        mock_str.assert_not_called()
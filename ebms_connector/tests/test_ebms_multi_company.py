@@ -0,0 +1,61 @@
+from unittest.mock import patch, MagicMock
+
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.ebms_connector.models.ebms_client import get_client
+from odoo.addons.ebms_connector.models.ebms_dispatcher import dispatch_by_company
+
+
+class TestEBMSMultiCompany(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.login_url', 'https://fake.ebms.api/login')
+        params.set_param('ebms.api_username', 'global_user')
+        params.set_param('ebms.api_password', 'global_pass')
+        params.set_param('ebms.api_token', 'GLOBAL_TOKEN')
+        params.set_param('ebms.system_id', 'ws_global')
+        cls.company_a = cls.env.company
+        cls.company_b = cls.env['res.company'].create({
+            'name': 'Filiale EBMS',
+            'ebms_api_username': 'filiale_user',
+            'ebms_api_password': 'bad_pass',
+            'ebms_system_id': 'ws_filiale',
+        })
+        cls.partners_a = cls.env['res.partner'].create([
+            {'name': 'Client A%s' % i, 'company_id': cls.company_a.id} for i in range(3)
+        ])
+        cls.partners_b = cls.env['res.partner'].create([
+            {'name': 'Client B%s' % i, 'company_id': cls.company_b.id} for i in range(3)
+        ])
+
+    def test_credentials_fallback(self):
+        creds_a = self.company_a._get_ebms_credentials()
+        creds_b = self.company_b._get_ebms_credentials()
+        self.assertEqual((creds_a['key'], creds_a['token'], creds_a['system_id']), (0, 'GLOBAL_TOKEN', 'ws_global'))
+        self.assertEqual((creds_b['key'], creds_b['username'], creds_b['system_id']), (self.company_b.id, 'filiale_user', 'ws_filiale'))
+        self.assertIsNot(get_client(self.env, self.company_a), get_client(self.env, self.company_b))
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_auth_failure_isolated_per_company(self, mock_post):
+        """L'échec de login d'une filiale n'empêche pas l'envoi des autres sociétés."""
+        def fake_post(url, json=None, headers=None, **kwargs):
+            if url.endswith('/login'):
+                return MagicMock(status_code=200, json=lambda: {'success': False, 'msg': 'Identifiants invalides'})
+            return MagicMock(status_code=200, json=lambda: {'success': True, 'msg': 'OK'})
+        mock_post.side_effect = fake_post
+
+        outcomes = dispatch_by_company(
+            self.partners_a | self.partners_b,
+            'https://fake.ebms.api/send',
+            lambda partner: {'name': partner.name},
+        )
+        by_partner = {record: result for record, _payload, result in outcomes}
+        self.assertTrue(all(by_partner[p]['success'] for p in self.partners_a))
+        self.assertTrue(all('Identifiants invalides' in by_partner[p]['msg'] for p in self.partners_b))
+        # Un seul login tenté pour la filiale : les appels suivants échouent vite.
+        login_calls = [c for c in mock_post.call_args_list if c.args[0].endswith('/login')]
+        self.assertEqual(len(login_calls), 1)
+        self.assertEqual(login_calls[0].kwargs['json']['username'], 'filiale_user')
@@ -0,0 +1,138 @@
+import threading
+import time
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from odoo import fields
+
+from odoo.addons.ebms_connector.models import ebms_client
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+URL = 'https://fake.ebms.api/ebms_api/addInvoice/'
+STOCK_URL = 'https://fake.ebms.api/ebms_api/AddStockMovement/'
+
+
+class StandIn:
+    """OBR simulé : 5 ms par appel, ordre de réception et pic d'appels simultanés notés, refus des payloads listés."""
+
+    def __init__(self, field, refused=()):
+        self.field = field
+        self.refused = set(refused)
+        self.received = []
+        self.in_flight = 0
+        self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, session, url, json=None, **kwargs):
+        with self.lock:
+            self.in_flight += 1
+            self.peak = max(self.peak, self.in_flight)
+        time.sleep(0.005)
+        with self.lock:
+            self.in_flight -= 1
+            self.received.append(json[self.field])
+        ok = json[self.field] not in self.refused
+        return MagicMock(status_code=200, json=lambda: {
+            'success': ok, 'msg': 'OK' if ok else 'Refusé', 'reference': 'REF',
+            'result': {'invoice_registered_number': 'OBR-%s' % json[self.field]}})
+
+
+class TestEBMSOrderedDispatch(EBMSTestCase):
+    """Ordre garanti par clé, clés indépendantes en parallèle."""
+
+    ebms_api_url = URL
+    ebms_api_token = 'FAKE_TOKEN_OK'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.stock_url', STOCK_URL)
+        params.set_param('ebms.device_id', 'TEST_DEVICE')
+        params.set_param('ebms.max_workers', 8)
+
+    def _order(self, received, key):
+        return [int(item.rsplit('-', 1)[1]) for item in received if item.startswith(key + '-')]
+
+    def test_order_per_key_and_throughput(self):
+        stand_in = StandIn('id')
+        payloads = [{'id': 'k%s-%s' % (key, rank)} for rank in range(10) for key in range(40)]
+        keys = [payload['id'].split('-')[0] for payload in payloads]
+        client = ebms_client.EBMSClient(max_workers=8).configure(token='FAKE_TOKEN_OK')
+        with patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post', autospec=True, side_effect=stand_in):
+            results = client.post_many(URL, payloads, keys=keys)
+        self.assertTrue(all(result['success'] for result in results))
+        for key in set(keys):
+            self.assertEqual(self._order(stand_in.received, key), list(range(10)), 'Ordre de la clé %s respecté' % key)
+        self.assertGreater(stand_in.peak, 1, 'Clés indépendantes en parallèle')
+        self.assertLessEqual(stand_in.peak, 8, 'Concurrence bornée par max_workers')
+
+    def test_failure_holds_same_key_only(self):
+        stand_in = StandIn('id', refused={'a-0'})
+        payloads = [{'id': 'a-0'}, {'id': 'b-0'}, {'id': 'a-1'}, {'id': 'b-1'}]
+        client = ebms_client.EBMSClient(max_workers=4).configure(token='FAKE_TOKEN_OK')
+        with patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post', autospec=True, side_effect=stand_in):
+            results = client.post_many(URL, payloads, keys=['a', 'b', 'a', 'b'])
+        self.assertNotIn('a-1', stand_in.received, 'Après un refus, la suite de la clé n\'est pas envoyée')
+        self.assertTrue(results[2]['held'])
+        self.assertIn('Non envoyé', results[2]['msg'])
+        self.assertEqual([result['success'] for result in results], [False, True, False, True])
+
+    def _credit_note(self, invoice):
+        credit_note = invoice._reverse_moves([{'invoice_date': fields.Date.today()}])
+        credit_note.action_post()
+        return credit_note
+
+    def test_credit_note_after_its_invoice(self):
+        invoices = self._invoice() | self._invoice()
+        credit_notes = self._credit_note(invoices[0]) | self._credit_note(invoices[1])
+        stand_in = StandIn('invoice_number', refused={invoices[1].name})
+        with patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post', autospec=True, side_effect=stand_in):
+            sent = (credit_notes | invoices)._ebms_send_batch()
+        received = stand_in.received
+        self.assertLess(received.index(invoices[0].name), received.index(credit_notes[0].name))
+        self.assertNotIn(credit_notes[1].name, received, 'Facture d\'origine refusée : l\'avoir n\'est pas envoyé')
+        self.assertEqual(sent, invoices[0] | credit_notes[0])
+        self.assertEqual(credit_notes[1].ebms_status, 'error')
+        self.assertIn('Non envoyé', credit_notes[1].ebms_error_message)
+
+    def test_ordered_sequence_per_device(self):
+        self.env['ir.config_parameter'].sudo().set_param('ebms.ordered_sequence', True)
+        invoices = self._invoice() | self._invoice() | self._invoice()
+        self.assertEqual(len(set(invoices._ebms_dispatch_keys().values())), 1)
+        stand_in = StandIn('invoice_number')
+        with patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post', autospec=True, side_effect=stand_in):
+            invoices[::-1]._ebms_send_batch()
+        self.assertEqual(stand_in.received, invoices.sorted('id').mapped('name'))
+
+    def test_stock_exit_after_entry(self):
+        products = self.env['product.product'].create([{
+            'name': 'Article %s' % i, 'default_code': 'ART-%s' % i, 'type': 'product', 'standard_price': 10.0,
+        } for i in range(2)])
+        stock = self.env.ref('stock.stock_location_stock')
+        now = fields.Datetime.now()
+
+        def move(product, movement_type, minutes):
+            entry = movement_type.startswith('E')
+            return self.env['stock.move'].create({
+                'name': '%s %s' % (movement_type, product.default_code),
+                'product_id': product.id,
+                'product_uom': product.uom_id.id,
+                'product_uom_qty': 5,
+                'location_id': (self.env.ref('stock.stock_location_suppliers') if entry else stock).id,
+                'location_dest_id': (stock if entry else self.env.ref('stock.stock_location_customers')).id,
+                'ebms_movement_type': movement_type,
+                'date': now + timedelta(minutes=minutes),
+            })
+        # Créées dans le désordre : les sorties d'abord, datées après les entrées.
+        exits = move(products[0], 'SN', 10) | move(products[1], 'SN', 10)
+        entries = move(products[0], 'EN', 0) | move(products[1], 'EN', 0)
+        self.assertEqual(entries[0]._ebms_dispatch_key(), exits[0]._ebms_dispatch_key())
+        self.assertNotEqual(entries[0]._ebms_dispatch_key(), entries[1]._ebms_dispatch_key())
+
+        stand_in = StandIn('item_movement_type')
+        with patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post', autospec=True, side_effect=stand_in):
+            sent = (exits | entries)._ebms_send_batch()
+        self.assertEqual(sent, exits | entries)
+        self.assertEqual(stand_in.received[:2], ['EN', 'EN'], 'Chaque sortie part après l\'entrée de son article')
+        self.assertEqual(set(sent.mapped('ebms_stock_reference')), {'REF'})
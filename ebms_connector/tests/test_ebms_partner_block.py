@@ -0,0 +1,50 @@
+from odoo import fields
+
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSPartnerBlock(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.partner = cls.env['res.partner'].create({
+            'name': 'Établissements Ndayishimiye',
+            'vat': '4000123456',
+            'street': 'Avenue de la Mission',
+            'city': 'Bujumbura',
+            'country_id': cls.env.ref('base.bi').id,
+        })
+
+    @classmethod
+    def _invoice(cls, **vals):
+        return super()._invoice(partner_id=cls.partner.id, **vals)
+
+    def test_customer_block_follows_partner(self):
+        data = self._invoice()._prepare_ebms_data_burundi()
+        self.assertEqual((data['customer_TIN'], data['vat_customer_payer']), ('4000123456', '1'))
+        self.assertEqual(data['customer_address'], 'Avenue de la Mission, Bujumbura, %s' % self.env.ref('base.bi').name)
+
+        self.partner.write({'vat': False, 'street2': 'Rohero'})
+        data = self._invoice()._prepare_ebms_data_burundi()
+        self.assertEqual((data['customer_TIN'], data['vat_customer_payer']), ('', '0'))
+        self.assertIn('Rohero', data['customer_address'])
+
+    def test_taxpayer_header_follows_company(self):
+        company = self.env.company
+        company.write({'vat': '4000000000', 'x_fiscal_center': 'DGC', 'city': 'Gitega'})
+        data = self._invoice()._prepare_ebms_data_burundi()
+        self.assertEqual((data['tp_TIN'], data['vat_taxpayer'], data['tp_fiscal_center'], data['tp_address_commune']),
+                         ('4000000000', '1', 'DGC', 'Gitega'))
+        self.assertEqual(data['tp_name'], company.name)
+
+        company.partner_id.street = 'Boulevard de l\'Uprona'
+        self.assertEqual(company.ebms_taxpayer_data['tp_address_rue'], 'Boulevard de l\'Uprona')
+
+    def test_tin_check_reset_on_change(self):
+        self.partner.write({'ebms_tin_check': 'valid', 'ebms_tin_checked_at': fields.Datetime.now()})
+        self.partner.street = 'Avenue du Large'
+        self.assertEqual(self.partner.ebms_tin_check, 'valid', 'L\'adresse ne touche pas au NIF')
+
+        self.partner.vat = '4000999999'
+        self.assertFalse(self.partner.ebms_tin_check, 'Un nouveau NIF doit être revérifié')
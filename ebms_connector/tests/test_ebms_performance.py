@@ -0,0 +1,186 @@
+import time
+from contextlib import contextmanager
+from unittest.mock import patch, MagicMock
+
+from odoo.tests.common import tagged
+
+from odoo.addons.ebms_connector.controllers.main import EBMSController
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSPerformance(EBMSTestCase):
+    """
+    Garde-fous de performance des points d'entrée EBMS, transport simulé.
+
+    Pour chaque point d'entrée, on mesure le nombre de requêtes SQL et la durée sur des
+    jeux de données de tailles croissantes et on vérifie :
+    - un coût marginal borné par enregistrement (ou par ligne de facture) ;
+    - l'absence de croissance super-linéaire : le coût marginal du dernier palier ne
+      dépasse pas celui du premier de plus de SUPERLINEAR_SLACK.
+    """
+
+    RECORD_SIZES = (1, 10, 40)
+    LINE_SIZES = (1, 20, 80)
+    SUPERLINEAR_SLACK = 1.5
+    SECONDS_PER_RECORD = 0.5
+
+    ebms_api_token = 'PERF_TOKEN_0123456789'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.cancel_url', 'https://fake.ebms.api/cancel')
+        params.set_param('ebms.stock_url', 'https://fake.ebms.api/stock')
+        params.set_param('ebms.device_id', 'ws_perf')
+        cls.partner = cls.env['res.partner'].create({'name': 'Client perf', 'vat': '4000000001'})
+        cls.product = cls.env['product.product'].create({
+            'name': 'Article perf', 'default_code': 'PERF-1', 'type': 'product', 'standard_price': 10,
+        })
+        cls.stock_location = cls.env.ref('stock.stock_location_stock')
+        cls.customer_location = cls.env.ref('stock.stock_location_customers')
+
+    # ------------------------------------------------------------------
+    # Jeux de données
+    # ------------------------------------------------------------------
+
+    @classmethod
+    def _invoices(cls, count=1, lines=1, **vals):
+        return super()._invoices(count, partner_id=cls.partner.id, invoice_line_ids=[(0, 0, {
+            'product_id': cls.product.id, 'name': 'Ligne %s' % j, 'quantity': 1, 'price_unit': 100 + j,
+        }) for j in range(lines)], **vals)
+
+    def _stock_moves(self, count):
+        return self.env['stock.move'].create([{
+            'name': 'Mouvement perf %s' % i,
+            'product_id': self.product.id,
+            'product_uom': self.product.uom_id.id,
+            'product_uom_qty': 1 + i,
+            'price_unit': 10,
+            'location_id': self.stock_location.id,
+            'location_dest_id': self.customer_location.id,
+            'ebms_movement_type': 'SN',
+        } for i in range(count)])
+
+    # ------------------------------------------------------------------
+    # Mesure
+    # ------------------------------------------------------------------
+
+    @contextmanager
+    def _measure(self):
+        """Compte les requêtes SQL et le temps écoulé, écritures en attente comprises."""
+        self.env.flush_all()
+        self.env.invalidate_all()
+        stats = {}
+        queries = self.cr.sql_log_count
+        started = time.perf_counter()
+        yield stats
+        self.env.flush_all()
+        stats['seconds'] = time.perf_counter() - started
+        stats['queries'] = self.cr.sql_log_count - queries
+
+    def _assert_scaling(self, label, run, sizes, queries_per_unit):
+        """
+        :param run: fonction taille -> stats de _measure, le jeu de données étant créé hors mesure
+        :param queries_per_unit: borne du nombre marginal de requêtes par unité
+        """
+        results = [(size, run(size)) for size in sizes]
+        marginals = []
+        for (size_a, stats_a), (size_b, stats_b) in zip(results, results[1:]):
+            marginal = (stats_b['queries'] - stats_a['queries']) / (size_b - size_a)
+            self.assertLessEqual(
+                marginal, queries_per_unit,
+                '%s : %.1f requêtes par unité entre %s et %s (borne %s)' % (label, marginal, size_a, size_b, queries_per_unit))
+            marginals.append(marginal)
+        self.assertLessEqual(
+            marginals[-1], marginals[0] * self.SUPERLINEAR_SLACK + 1,
+            '%s : croissance super-linéaire des requêtes %s' % (label, [(size, stats['queries']) for size, stats in results]))
+        for size, stats in results:
+            self.assertLessEqual(
+                stats['seconds'] / size, self.SECONDS_PER_RECORD,
+                '%s : %.3fs par unité pour %s' % (label, stats['seconds'] / size, size))
+        return results
+
+    @staticmethod
+    def _ok(*args, **kwargs):
+        return MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR-PERF', 'msg': 'OK'})
+
+    # ------------------------------------------------------------------
+    # Points d'entrée
+    # ------------------------------------------------------------------
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_send_invoices_scaling(self, mock_post):
+        mock_post.side_effect = self._ok
+
+        def run(count):
+            invoices = self._invoices(count)
+            with self._measure() as stats:
+                invoices.action_send_ebms()
+            self.assertEqual(set(invoices.mapped('ebms_status')), {'sent'})
+            return stats
+        self._assert_scaling('action_send_ebms (factures)', run, self.RECORD_SIZES, queries_per_unit=80)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_send_invoice_lines_scaling(self, mock_post):
+        """La taille de la facture ne doit pas coûter de requête par ligne."""
+        mock_post.side_effect = self._ok
+
+        def run(lines):
+            invoice = self._invoices(1, lines=lines)
+            with self._measure() as stats:
+                invoice.action_send_ebms()
+            self.assertEqual(len(mock_post.call_args.kwargs['json']['lines']), lines)
+            return stats
+        self._assert_scaling('action_send_ebms (lignes)', run, self.LINE_SIZES, queries_per_unit=1)
+
+    @patch('odoo.addons.ebms_connector.models.stock_move_ebms.requests.post')
+    def test_send_stock_movements_scaling(self, mock_post):
+        mock_post.side_effect = self._ok
+
+        def run(count):
+            moves = self._stock_moves(count)
+            with self._measure() as stats:
+                moves.action_send_ebms_stock_movement()
+            self.assertEqual(set(moves.mapped('ebms_stock_status')), {'sent'})
+            return stats
+        self._assert_scaling('action_send_ebms_stock_movement', run, self.RECORD_SIZES, queries_per_unit=20)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_cancel_invoices_scaling(self, mock_post):
+        mock_post.side_effect = self._ok
+
+        def run(count):
+            invoices = self._invoices(count)
+            invoices.write({'ebms_status': 'sent', 'ebms_reference': 'OBR-PERF'})
+            with self._measure() as stats:
+                invoices.action_cancel_ebms(cn_motif='Test de performance')
+            self.assertEqual(set(invoices.mapped('ebms_status')), {'cancelled'})
+            return stats
+        self._assert_scaling('action_cancel_ebms', run, self.RECORD_SIZES, queries_per_unit=80)
+
+    def test_webhook_scaling(self):
+        controller = EBMSController()
+
+        def run(count):
+            invoices = self._invoices(count)
+            for i, invoice in enumerate(invoices):
+                invoice.ebms_reference = 'OBR-WH-%s-%s' % (count, i)
+            fake_request = MagicMock(env=self.env)
+            fake_request.httprequest.headers = {}
+            with patch('odoo.addons.ebms_connector.controllers.main.request', fake_request), \
+                    self._measure() as stats:
+                for invoice in invoices:
+                    fake_request.jsonrequest = {'invoice_reference': invoice.ebms_reference, 'status': 'validated'}
+                    self.assertEqual(controller.ebms_webhook()['status'], 'success')
+            self.assertEqual(set(invoices.mapped('ebms_status')), {'sent'})
+            return stats
+        self._assert_scaling('/ebms/webhook', run, self.RECORD_SIZES, queries_per_unit=40)
+
+
+@tagged('-standard', 'ebms_perf')
+class TestEBMSPerformanceLarge(TestEBMSPerformance):
+    """Mêmes garde-fous à l'échelle (--test-tags ebms_perf) : jusqu'à 1000 enregistrements et 500 lignes."""
+
+    RECORD_SIZES = (1, 100, 1000)
+    LINE_SIZES = (1, 100, 500)
@@ -0,0 +1,82 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from odoo import fields
+
+from odoo.addons.ebms_connector.models.ebms_queue import weighted_round_robin
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSQueue(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Queue = cls.env['ebms.queue.item']
+
+    def _background_backlog(self, count):
+        return self.Queue.create([{
+            'res_model': 'account.move',
+            'res_id': 10_000_000 + i,
+            'company_id': self.env.company.id,
+            'lane': 'background',
+        } for i in range(count)])
+
+    def test_weighted_round_robin_shares(self):
+        picked = weighted_round_robin(
+            {'interactive': ['i'] * 100, 'background': ['b'] * 100},
+            {'interactive': 8, 'background': 1},
+            limit=90,
+        )
+        self.assertEqual(picked.count('i'), 80)
+        self.assertEqual(picked.count('b'), 10)
+
+    def test_interactive_not_stuck_behind_backlog(self):
+        self._background_backlog(200)
+        receipt = self._invoice()
+        item = self.Queue._enqueue(receipt)
+        self.assertEqual(item.lane, 'interactive')
+        batch = self.Queue._select_batch(5)
+        self.assertIn(item, batch)
+        self.assertEqual(receipt.ebms_queue_position, 1)
+        self.assertTrue(self.Queue._has_urgent_work())
+
+    def test_overdue_lane_served_first(self):
+        backlog = self._background_backlog(1)
+        backlog.enqueued_at = fields.Datetime.now() - timedelta(days=2)
+        for _i in range(5):
+            self.Queue._enqueue(self._invoice())
+        batch = self.Queue._select_batch(1)
+        self.assertEqual(batch, backlog)
+
+    def test_position_query_count_independent_of_size(self):
+        items = self._background_backlog(30)
+
+        def queries(records):
+            self.env.flush_all()
+            count = self.cr.sql_log_count
+            positions = records._position_and_eta()
+            return self.cr.sql_log_count - count, positions
+        few, positions_few = queries(items[:2])
+        many, positions_many = queries(items)
+        self.assertEqual(few, many)
+        self.assertEqual([positions_many[item.id][0] for item in items[:3]], [1, 2, 3])
+        self.assertEqual(positions_few[items[1].id][0], positions_many[items[1].id][0])
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_process_marks_done_and_retries_errors(self, mock_post):
+        ok, ko = self._invoice(), self._invoice(move_type='out_refund')
+        items = self.Queue._enqueue(ok | ko)
+        self.assertEqual(items.mapped('lane'), ['interactive', 'credit_note'])
+
+        def fake_post(url, json=None, **kwargs):
+            success = json['invoice_number'] == ok.name
+            return MagicMock(status_code=200, json=lambda: {'success': success, 'reference': 'R', 'msg': 'Refusée'})
+        mock_post.side_effect = fake_post
+        items._process()
+        ok_item, ko_item = items
+        self.assertEqual(ok_item.state, 'done')
+        self.assertEqual(ok.ebms_status, 'sent')
+        self.assertEqual((ko_item.state, ko_item.attempts), ('pending', 1))
+        self.assertGreater(ko_item.next_attempt_at, fields.Datetime.now())
+        self.assertIn('Refusée', ko_item.error_message)
@@ -0,0 +1,207 @@
+import os
+import tempfile
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+import requests
+
+from odoo.exceptions import ValidationError
+from odoo.tests.common import TransactionCase
+
+from odoo.addons.ebms_connector.models import ebms_client, ebms_json
+from odoo.addons.ebms_connector.tools import ebms_relay
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+OBR_URL = 'https://fake.ebms.api'
+ADD_INVOICE = '/ebms_api/addInvoice/'
+
+
+def obr_ok(self, url, json=None, **kwargs):
+    """OBR simulé : 5 ms par appel, chaque facture acceptée."""
+    time.sleep(0.005)
+    return MagicMock(status_code=200, json=lambda: {'success': True, 'result': {
+        'invoice_registered_number': json['invoice_identifier'].rsplit('/', 1)[-1]}})
+
+
+class InFlight:
+    """Enveloppe d'un OBR simulé qui note le nombre maximal d'appels simultanés."""
+
+    def __init__(self, post):
+        self.post = post
+        self.current = self.peak = 0
+        self.lock = threading.Lock()
+
+    def __call__(self, *args, **kwargs):
+        with self.lock:
+            self.current += 1
+            self.peak = max(self.peak, self.current)
+        try:
+            return self.post(*args, **kwargs)
+        finally:
+            with self.lock:
+                self.current -= 1
+
+
+class TestEBMSRelayStore(TransactionCase):
+    """File durable et transfert du relais, sans Odoo ni réseau."""
+
+    def setUp(self):
+        super().setUp()
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'relay.sqlite')
+        self.store = ebms_relay.RelayStore(self.path)
+        self.addCleanup(self.store.close)
+
+    def _forwarder(self, workers=8, max_attempts=ebms_relay.DEFAULT_MAX_ATTEMPTS):
+        client = ebms_client.EBMSClient(max_workers=workers).configure(token='OBR_TOKEN_OK')
+        return ebms_relay.Forwarder(self.store, client, OBR_URL, batch_size=100, max_attempts=max_attempts)
+
+    def _backlog(self, count):
+        items = [(ADD_INVOICE, 'TIN/ws1/%06d' % i, b'{"invoice_identifier":"TIN/ws1/%06d"}' % i, None)
+                 for i in range(count)]
+        self.store._transaction(self.store._insert, items)
+        return [item[1] for item in items]
+
+    def test_durable_ordered_and_deduplicated(self):
+        def submit(worker):
+            for i in range(20):
+                self.store.submit(ADD_INVOICE, 'TIN/ws1/%s-%02d' % (worker, i), b'{}')
+        threads = [threading.Thread(target=submit, args=(worker,)) for worker in range(10)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        first = self.store.submit(ADD_INVOICE, 'TIN/ws1/0-00', b'{}')
+        self.assertEqual(first['id'], self.store.submit(ADD_INVOICE, 'TIN/ws1/0-00', b'{}')['id'])
+        self.store.close()
+
+        self.store = reopened = ebms_relay.RelayStore(self.path)
+        self.addCleanup(reopened.close)
+        pending = reopened.pending(1000)
+        self.assertEqual(len(pending), 200, 'Les soumissions survivent au redémarrage')
+        self.assertEqual([row['id'] for row in pending], sorted(row['id'] for row in pending))
+
+    def test_drain_backlog(self):
+        identifiers = self._backlog(2000)
+        in_flight = InFlight(obr_ok)
+        with patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post', autospec=True, side_effect=in_flight):
+            self.assertEqual(self._forwarder().drain(), 2000)
+        self.assertGreater(in_flight.peak, 1, 'Soumissions d\'un lot envoyées en parallèle')
+        self.assertLessEqual(in_flight.peak, 8, 'Concurrence bornée par max_workers')
+        acks = self.store.acks(0, 5000)
+        self.assertEqual([ack['identifier'] for ack in acks], identifiers, 'Accusés numérotés dans l\'ordre d\'arrivée')
+        self.assertEqual(self.store.stats()['pending'], 0)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_outage_keeps_submissions(self, mock_post):
+        self._backlog(3)
+        forwarder = self._forwarder(workers=1)
+        mock_post.side_effect = requests.exceptions.ConnectionError('Liaison coupée')
+        self.assertEqual(forwarder.forward_once(), (0, 1), 'Sans réponse à la première soumission, le reste du lot attend')
+        self.assertEqual(self.store.stats()['pending'], 3)
+
+        mock_post.side_effect = lambda url, json=None, **kwargs: obr_ok(None, url, json)
+        self.assertEqual(forwarder.drain(), 3)
+        self.assertEqual([row['attempts'] for row in self.store._rows('SELECT * FROM submission ORDER BY id')], [2, 1, 1])
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_stuck_submission_given_up(self, mock_post):
+        first, second = self._backlog(2)
+
+        def post(url, json=None, **kwargs):
+            if json['invoice_identifier'] == first:
+                return MagicMock(status_code=503, text='Service Unavailable')
+            return obr_ok(None, url, json)
+        mock_post.side_effect = post
+        forwarder = self._forwarder(workers=1, max_attempts=3)
+        self.assertEqual([forwarder.forward_once() for _i in range(2)], [(0, 1), (0, 1)])
+        self.assertEqual(forwarder.forward_once(), (2, 0), 'Abandonnée au 3e essai, la suite de la file repart')
+        stats = self.store.stats()
+        self.assertEqual((stats['pending'], stats['acked'], stats['failed']), (0, 1, 1))
+        acks = self.store.acks(0)
+        self.assertEqual([(ack['identifier'], ack['state']) for ack in acks], [(first, 'failed'), (second, 'acked')])
+        self.assertIn('Abandon', acks[0]['response']['msg'])
+
+    def test_http_endpoints(self):
+        server = ebms_relay.RelayServer(('127.0.0.1', 0), self.store, 'wsl400000000000', 'secret')
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        base = 'http://%s:%s' % server.server_address
+
+        refused = requests.post(base + '/ebms_api/login/', json={'username': 'wsl400000000000', 'password': 'faux'}).json()
+        self.assertFalse(refused['success'])
+        token = requests.post(base + '/ebms_api/login/', json={'username': 'wsl400000000000', 'password': 'secret'}).json()
+        headers = {'Authorization': 'Bearer %s' % token['result']['token']}
+
+        self.assertEqual(requests.post(base + ADD_INVOICE, json={'invoice_identifier': 'X'}).status_code, 401)
+        queued = requests.post(base + ADD_INVOICE, json={'invoice_identifier': 'TIN/ws1/1'}, headers=headers).json()
+        self.assertEqual((queued['success'], queued['relay']['state']), (True, 'pending'))
+
+        self.store.record([(queued['relay']['id'], 200, '{"success":true,"result":{"invoice_registered_number":"1"}}')], [])
+        replayed = requests.post(base + ADD_INVOICE, json={'invoice_identifier': 'TIN/ws1/1'}, headers=headers).json()
+        self.assertEqual(replayed['result']['invoice_registered_number'], '1', 'Soumission déjà transmise : réponse de l\'OBR')
+        acks = requests.post(base + ebms_relay.ACKS_PATH, json={'after': 0}, headers=headers).json()['acks']
+        self.assertEqual([(ack['seq'], ack['identifier']) for ack in acks], [(1, 'TIN/ws1/1')])
+
+        # Facture refusée puis corrigée : la nouvelle soumission remplace le refus.
+        refused = requests.post(base + ADD_INVOICE, json={'invoice_identifier': 'TIN/ws1/2'}, headers=headers).json()
+        self.store.record([(refused['relay']['id'], 200, '{"msg":"NIF invalide","success":false}')], [])
+        corrected = requests.post(base + ADD_INVOICE, json={'invoice_identifier': 'TIN/ws1/2', 'customer_TIN': '4000000000'},
+                                  headers=headers).json()
+        self.assertEqual(corrected['relay']['state'], 'pending')
+        self.assertGreater(corrected['relay']['id'], refused['relay']['id'], 'Remise en fin de file')
+        self.assertEqual(ebms_json.loads(self.store.pending(10)[0]['body'])['customer_TIN'], '4000000000')
+        status = requests.get(base + ebms_relay.STATUS_PATH, headers=headers).json()
+        self.assertEqual((status['pending'], status['last_seq']), (1, 2), 'Les numéros d\'accusé ne sont pas réutilisés')
+
+
+class TestEBMSRelayAcks(EBMSTestCase):
+    """Côté Odoo : facture confiée au relais, puis accusé relu par le cron."""
+
+    ebms_api_url = 'http://127.0.0.1:8099' + ADD_INVOICE
+    ebms_api_token = 'RELAY_TOKEN_OK'
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.relay_url', 'http://127.0.0.1:8099')
+
+    def setUp(self):
+        super().setUp()
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_relayed_then_acknowledged(self, mock_post):
+        invoice = self._invoice()
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {
+            'success': True, 'relay': {'id': 7, 'state': 'pending'}, 'msg': 'Soumission mise en file par le relais EBMS.'})
+        invoice.action_send_ebms()
+        self.assertEqual(invoice.ebms_status, 'relayed')
+        self.assertFalse(invoice.ebms_reference)
+
+        identifier = invoice.ebms_invoice_identifier
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'acks': [
+            {'seq': 12, 'identifier': 'AUTRE/ws1/1', 'status': 200, 'response': {'success': True}},
+            {'seq': 13, 'identifier': identifier, 'status': 200, 'response': {
+                'success': True, 'msg': 'OK', 'electronic_signature': 'SIG',
+                'result': {'invoice_registered_number': 'OBR-RELAY-1'}}},
+        ]})
+        self.env['account.move']._cron_ebms_relay_acks()
+        self.assertEqual(mock_post.call_args.kwargs['json'], {'after': 0, 'limit': ebms_relay.ACKS_LIMIT})
+        self.assertEqual((invoice.ebms_status, invoice.ebms_reference), ('sent', 'OBR-RELAY-1'))
+        self.assertEqual(self.env['ir.config_parameter'].sudo().get_param('ebms.relay_ack_cursor'), '13')
+
+    def test_relay_serves_global_account_only(self):
+        company = self.env['res.company'].create({'name': 'Filiale relais'})
+        with self.assertRaises(ValidationError):
+            company.sudo().ebms_api_username = 'filiale_user'
+
+        self.env['ir.config_parameter'].sudo().set_param('ebms.relay_url', False)
+        company.sudo().ebms_api_username = 'filiale_user'
+        with self.assertRaises(ValidationError):
+            self.env['res.config.settings'].create({'ebms_relay_url': 'http://127.0.0.1:8099'})
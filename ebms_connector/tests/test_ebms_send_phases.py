@@ -0,0 +1,158 @@
+import threading
+import time
+from unittest.mock import patch, MagicMock
+
+from odoo import api, fields, SUPERUSER_ID
+from odoo.exceptions import UserError
+from odoo.tests.common import TransactionCase, tagged
+
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+def _invoice_vals(env):
+    return {
+        'move_type': 'out_invoice',
+        'partner_id': env.ref('base.res_partner_1').id,
+        'invoice_date': fields.Date.today(),
+        'invoice_line_ids': [(0, 0, {'name': 'Ligne', 'quantity': 1, 'price_unit': 100})],
+    }
+
+
+class TestEBMSSendPhases(EBMSTestCase):
+    """Envoi en trois phases : registre en mode test, les transactions courtes partagent la connexion du test."""
+
+    def setUp(self):
+        super().setUp()
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+    def _status_in_db(self, invoice):
+        self.cr.execute("SELECT ebms_status, ebms_invoice_identifier FROM account_move_ebms WHERE move_id = %s", (invoice.id,))
+        return self.cr.fetchone()
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_claim_before_call_and_result_after(self, mock_post):
+        invoice = self._invoice()
+        seen = {}
+
+        def fake_post(url, json=None, **kwargs):
+            seen['db'] = self._status_in_db(invoice)
+            seen['identifier'] = json['invoice_identifier']
+            return MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR-3P', 'msg': 'OK'})
+        mock_post.side_effect = fake_post
+
+        invoice.action_send_ebms()
+        self.assertEqual(seen['db'], ('sending', seen['identifier']))
+        self.assertEqual(invoice.ebms_status, 'sent')
+        self.assertEqual(invoice.ebms_reference, 'OBR-3P')
+        self.assertEqual(invoice.ebms_invoice_identifier, seen['identifier'])
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_retry_reuses_invoice_identifier(self, mock_post):
+        invoice = self._invoice()
+        mock_post.return_value = MagicMock(status_code=503, text='Indisponible')
+        with self.assertRaisesRegex(UserError, '503'):
+            invoice.action_send_ebms()
+        self.assertEqual(invoice.ebms_status, 'error')
+        identifier = invoice.ebms_invoice_identifier
+        self.assertTrue(identifier)
+
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR-R', 'msg': 'OK'})
+        invoice.action_send_ebms()
+        self.assertEqual(invoice.ebms_status, 'sent')
+        self.assertEqual(mock_post.call_args.kwargs['json']['invoice_identifier'], identifier)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_send_in_progress_not_sent_twice(self, mock_post):
+        invoice = self._invoice()
+        invoice.ebms_status = 'sending'
+        with self.assertRaisesRegex(UserError, 'déjà en cours'):
+            invoice.action_send_ebms()
+        mock_post.assert_not_called()
+
+
+@tagged('-standard', 'ebms_lock')
+class TestEBMSSendLocks(TransactionCase):
+    """
+    Attente de verrou sur une facture pendant un appel OBR lent.
+    Test opt-in (--test-tags ebms_lock) : il committe de vraies transactions dans la base de test.
+    """
+
+    LATENCIES = (0.2, 0.8)
+
+    def setUp(self):
+        super().setUp()
+        if self.registry.in_test_mode():
+            self.skipTest('Nécessite des transactions réelles (registre hors mode test).')
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            params = env['ir.config_parameter']
+            params.set_param('ebms.api_url', 'https://fake.ebms.api/send')
+            params.set_param('ebms.api_token', 'FAKE_TOKEN')
+        self.invoice_ids = []
+        self.addCleanup(self._drop_invoices)
+
+    def _drop_invoices(self):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            invoices = env['account.move'].browse(self.invoice_ids).exists()
+            invoices.button_draft()
+            invoices.with_context(force_delete=True).unlink()
+
+    def _new_invoice(self):
+        with self.registry.cursor() as cr:
+            env = api.Environment(cr, SUPERUSER_ID, {})
+            invoice = env['account.move'].create(_invoice_vals(env))
+            invoice.action_post()
+            self.invoice_ids.append(invoice.id)
+            return invoice.id
+
+    def _lock_wait_during_send(self, invoice_id, latency):
+        """Durée d'un UPDATE concurrent de la facture pendant que l'appel OBR est en cours."""
+        in_call = threading.Event()
+
+        def slow_post(url, json=None, **kwargs):
+            in_call.set()
+            time.sleep(latency)
+            return MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR-L', 'msg': 'OK'})
+
+        def send():
+            with self.registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                env['account.move'].browse(invoice_id).action_send_ebms()
+
+        with patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post', side_effect=slow_post):
+            sender = threading.Thread(target=send)
+            sender.start()
+            self.assertTrue(in_call.wait(10))
+            with self.registry.cursor() as cr:
+                start = time.monotonic()
+                cr.execute("UPDATE account_move SET ref = ref WHERE id = %s", (invoice_id,))
+                waited = time.monotonic() - start
+            sender.join(10)
+        with self.registry.cursor() as cr:
+            cr.execute("SELECT ebms_status FROM account_move_ebms WHERE move_id = %s", (invoice_id,))
+            self.assertEqual(cr.fetchone()[0], 'sent')
+        return waited
+
+    def test_lock_wait_independent_of_obr_latency(self):
+        waits = [self._lock_wait_during_send(self._new_invoice(), latency) for latency in self.LATENCIES]
+        for latency, waited in zip(self.LATENCIES, waits):
+            self.assertLess(waited, 0.1, 'UPDATE bloqué %.3fs pendant un appel OBR de %.1fs' % (waited, latency))
+        self.assertLess(waits[-1] - waits[0], 0.1)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_lock_held_elsewhere_not_sent(self, mock_post):
+        invoice_id = self._new_invoice()
+        with self.registry.cursor() as holder:
+            # Un autre worker tient l'état EBMS de la facture (phase 1 d'un envoi en cours).
+            holder.execute("SELECT move_id FROM account_move_ebms WHERE move_id = %s FOR UPDATE", (invoice_id,))
+            with self.registry.cursor() as cr:
+                env = api.Environment(cr, SUPERUSER_ID, {})
+                outcomes = env['account.move'].browse(invoice_id)._ebms_submit()
+            holder.rollback()
+        mock_post.assert_not_called()
+        self.assertEqual(outcomes, {invoice_id: (False, 'Envoi EBMS déjà en cours.')})
+        with self.registry.cursor() as cr:
+            cr.execute("SELECT ebms_status FROM account_move_ebms WHERE move_id = %s", (invoice_id,))
+            self.assertEqual(cr.fetchone()[0], 'draft')
@@ -0,0 +1,82 @@
+from odoo import fields
+from odoo.tools.sql import column_exists
+
+from odoo.addons.ebms_connector.models import ebms_state
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSState(EBMSTestCase):
+
+    def _ctid(self, invoice):
+        self.env.flush_all()
+        self.cr.execute("SELECT ctid FROM account_move WHERE id = %s", (invoice.id,))
+        return self.cr.fetchone()[0]
+
+    def test_account_move_has_no_ebms_columns(self):
+        for name in self.env['account.move']._ebms_state_fields():
+            self.assertFalse(column_exists(self.cr, 'account_move', name), name)
+        for name in self.env['stock.move']._ebms_state_fields():
+            self.assertFalse(column_exists(self.cr, 'stock_move', name), name)
+
+    def test_customer_invoice_gets_one_state_row(self):
+        invoice = self._invoice(ebms_reference='OBR-CREATE')
+        entry = self.env['account.move'].create({'move_type': 'entry'})
+        self.assertEqual(len(invoice.ebms_state_ids), 1)
+        self.assertEqual(invoice.ebms_status, 'draft')
+        self.assertEqual(invoice.ebms_reference, 'OBR-CREATE')
+        self.assertFalse(entry.ebms_state_ids)
+
+    def test_write_updates_state_row_only(self):
+        invoice = self._invoice()
+        before = self._ctid(invoice)
+        invoice.write({'ebms_status': 'sent', 'ebms_reference': 'OBR-W', 'ebms_sent_date': fields.Datetime.now()})
+        self.assertEqual(self._ctid(invoice), before, 'La ligne account_move ne doit pas être réécrite')
+        self.cr.execute("SELECT ebms_status, ebms_reference FROM account_move_ebms WHERE move_id = %s", (invoice.id,))
+        self.assertEqual(self.cr.fetchone(), ('sent', 'OBR-W'))
+
+        invoice.write({'ebms_error_message': 'Erreur', 'ref': 'Mixte'})
+        self.assertEqual((invoice.ebms_error_message, invoice.ref), ('Erreur', 'Mixte'))
+
+    def test_search_and_copy(self):
+        invoice = self._invoice()
+        invoice.ebms_reference = 'OBR-SEARCH'
+        Move = self.env['account.move']
+        self.assertEqual(Move.search([('ebms_reference', '=', 'OBR-SEARCH')]), invoice)
+        self.assertIn(invoice, Move.search([('ebms_status', '=', 'draft')]))
+        copy = invoice.copy({'ebms_status': 'cancelled'})
+        self.assertEqual(copy.ebms_status, 'cancelled')
+        self.assertFalse(copy.ebms_reference)
+        self.assertEqual(invoice.ebms_reference, 'OBR-SEARCH')
+
+    def test_stock_state_created_on_first_write(self):
+        move = self.env['stock.move'].create({
+            'name': 'Mouvement état',
+            'product_id': self.env.ref('product.product_product_4').id,
+            'product_uom_qty': 1,
+            'product_uom': self.env.ref('uom.product_uom_unit').id,
+            'location_id': self.env.ref('stock.stock_location_stock').id,
+            'location_dest_id': self.env.ref('stock.stock_location_customers').id,
+            'ebms_movement_type': 'SN',
+        })
+        self.assertFalse(move.ebms_state_ids)
+        move.write({'ebms_stock_status': 'error', 'ebms_stock_error_message': 'HTTP 503'})
+        self.assertEqual(len(move.ebms_state_ids), 1)
+        self.assertEqual(move.ebms_stock_status, 'error')
+
+    def test_migration_moves_legacy_columns(self):
+        invoice = self._invoice()
+        invoice.ebms_state_ids.unlink()
+        self.env.flush_all()
+        self.cr.execute("ALTER TABLE account_move ADD COLUMN ebms_status varchar, ADD COLUMN ebms_reference varchar")
+        self.cr.execute("UPDATE account_move SET ebms_status = 'sent', ebms_reference = 'OBR-LEGACY' WHERE id = %s", (invoice.id,))
+        moved = ebms_state.move_to_side_table(self.env, 'account.move', "m.id = %s" % invoice.id)
+        self.assertEqual(moved, 1)
+        self.assertFalse(column_exists(self.cr, 'account_move', 'ebms_status'))
+        self.env.invalidate_all()
+        self.assertEqual((invoice.ebms_status, invoice.ebms_reference), ('sent', 'OBR-LEGACY'))
+
+    def test_table_stats(self):
+        stats = ebms_state.table_stats(self.cr, 'account_move', scans=1)
+        self.assertGreater(stats['rows'], 0)
+        self.assertGreater(stats['avg_row_bytes'], 0)
+        self.assertGreaterEqual(stats['scan_ms'], 0)
@@ -0,0 +1,50 @@
+from odoo import fields
+from odoo.tests.common import TransactionCase
+
+
+class TestEBMSStockPayload(TransactionCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.env['ir.config_parameter'].sudo().set_param('ebms.device_id', 'TEST_DEVICE')
+        cls.product = cls.env['product.product'].create({
+            'name': 'Ciment Buceco 50 kg',
+            'default_code': 'CIM-50',
+            'type': 'product',
+            'standard_price': 42.0,
+        })
+
+    def _moves(self, count, price_unit=0.0):
+        return self.env['stock.move'].create([{
+            'name': 'Mouvement %s' % i,
+            'product_id': self.product.id,
+            'product_uom': self.product.uom_id.id,
+            'product_uom_qty': 1 + i,
+            'price_unit': price_unit,
+            'location_id': self.env.ref('stock.stock_location_stock').id,
+            'location_dest_id': self.env.ref('stock.stock_location_customers').id,
+            'ebms_movement_type': 'SN',
+            'date': fields.Datetime.now(),
+        } for i in range(count)])
+
+    def _queries(self, moves):
+        self.env.flush_all()
+        self.env.invalidate_all()
+        queries = self.cr.sql_log_count
+        moves._ebms_stock_payloads()
+        return self.cr.sql_log_count - queries
+
+    def test_payload_fields_and_cost(self):
+        unvalued, priced = self._moves(1), self._moves(1, price_unit=-15.5)
+        payloads = (unvalued | priced)._ebms_stock_payloads()
+        payload = payloads[unvalued.id]
+        self.assertEqual(
+            (payload['system_or_device_id'], payload['item_code'], payload['item_designation'], payload['item_measurement_unit']),
+            ('TEST_DEVICE', 'CIM-50', 'Ciment Buceco 50 kg', self.product.uom_id.name))
+        self.assertEqual(payload['item_cost_price'], '42.0', 'Sans prix unitaire : coût standard du produit')
+        self.assertEqual(payload['item_cost_price_currency'], self.env.company.currency_id.name)
+        self.assertEqual(payloads[priced.id]['item_cost_price'], '15.5')
+
+    def test_query_count_independent_of_batch_size(self):
+        self.assertEqual(self._queries(self._moves(5)), self._queries(self._moves(50)))
@@ -0,0 +1,74 @@
+from datetime import timedelta
+from unittest.mock import patch, MagicMock
+
+from odoo import fields
+
+from odoo.addons.ebms_connector.controllers.main import EBMSController
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSTracing(EBMSTestCase):
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.Span = cls.env['ebms.trace.span']
+
+    def setUp(self):
+        super().setUp()
+        # Envoi en trois phases : les transactions courtes partagent la connexion du test.
+        self.registry.enter_test_mode(self.cr)
+        self.addCleanup(self.registry.leave_test_mode)
+
+    def _steps(self, invoice):
+        self.env.flush_all()
+        invoice.invalidate_recordset(['ebms_trace_span_ids'])
+        return set(invoice.ebms_trace_span_ids.filtered(lambda s: s.trace_id == invoice.ebms_trace_id).mapped('name'))
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_submission_traced_end_to_end(self, mock_post):
+        invoice = self._invoice()
+        trace_id = invoice.ebms_trace_id
+        self.assertEqual(len(trace_id), 32)
+        self.assertEqual(self._steps(invoice), {'post'})
+
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'reference': 'OBR-TRACE', 'msg': 'OK'})
+        invoice.action_send_ebms()
+        self.assertEqual(mock_post.call_args.kwargs['headers']['X-Correlation-ID'], trace_id)
+        self.assertEqual(invoice.ebms_trace_id, trace_id, 'Même identifiant de la validation à l\'accusé')
+        self.assertEqual(self._steps(invoice), {'post', 'claim', 'build_payload', 'obr_call', 'persist'})
+
+        controller = EBMSController()
+        fake_request = MagicMock(env=self.env)
+        fake_request.jsonrequest = {'invoice_reference': 'OBR-TRACE', 'status': 'validated'}
+        fake_request.httprequest.headers = {}
+        with patch('odoo.addons.ebms_connector.controllers.main.request', fake_request):
+            self.assertEqual(controller.ebms_webhook()['status'], 'success')
+        self.assertIn('webhook', self._steps(invoice), 'Sans en-tête, le webhook est rattaché à la trace de la facture')
+
+        fake_request.httprequest.headers = {'X-Correlation-ID': 'obr-side-id'}
+        with patch('odoo.addons.ebms_connector.controllers.main.request', fake_request):
+            controller.ebms_webhook()
+        self.assertEqual(self.Span.search([('trace_id', '=', 'obr-side-id')]).move_id, invoice)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_failed_call_traced_and_reset_starts_new_trace(self, mock_post):
+        invoice = self._invoice()
+        mock_post.return_value = MagicMock(status_code=503, text='Service Unavailable')
+        invoice._ebms_submit()
+        call = invoice.ebms_trace_span_ids.filtered(lambda s: s.name == 'obr_call')
+        self.assertEqual((call.status, call.detail), ('error', 'Erreur HTTP 503: Service Unavailable'))
+
+        old_trace = invoice.ebms_trace_id
+        invoice.action_reset_ebms_status()
+        self.assertFalse(invoice.ebms_trace_id)
+        invoice._ebms_submit()
+        self.assertNotEqual(invoice.ebms_trace_id, old_trace)
+        self.assertEqual(mock_post.call_args.kwargs['headers']['X-Correlation-ID'], invoice.ebms_trace_id)
+
+    def test_purge(self):
+        invoice = self._invoice()
+        old = self.Span._record_span(invoice, 'webhook', fields.Datetime.now() - timedelta(days=40), 0.1)
+        self.Span._cron_purge()
+        self.assertFalse(old.exists())
+        self.assertTrue(invoice.ebms_trace_span_ids, 'Les traces récentes sont gardées')
@@ -0,0 +1,62 @@
+from unittest.mock import patch, MagicMock
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import rsa
+
+from odoo.addons.ebms_connector.models import ebms_signature, ebms_warmup
+from odoo.addons.ebms_connector.models.ebms_client import get_client
+from odoo.addons.ebms_connector.tests.common import EBMSTestCase
+
+
+class TestEBMSWarmup(EBMSTestCase):
+
+    ebms_api_token = ''
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        params = cls.env['ir.config_parameter'].sudo()
+        params.set_param('ebms.login_url', 'https://fake.ebms.api/login')
+        params.set_param('ebms.api_username', 'warmup-user')
+        params.set_param('ebms.api_password', 'secret')
+        key = rsa.generate_private_key(public_exponent=65537, key_size=2048).public_key()
+        cls.public_key_pem = key.public_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PublicFormat.SubjectPublicKeyInfo,
+        ).decode('utf-8')
+        params.set_param('ebms.public_key', cls.public_key_pem)
+
+    def test_public_key_parsed_once(self):
+        ebms_signature.load_public_key.cache_clear()
+        first = ebms_signature.load_public_key(self.public_key_pem)
+        self.assertIs(ebms_signature.load_public_key(self.public_key_pem), first)
+        self.assertEqual(ebms_signature.load_public_key.cache_info().misses, 1)
+
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.head')
+    @patch('odoo.addons.ebms_connector.models.ebms_client.requests.Session.post')
+    def test_warm_up_logs_in_and_opens_connection(self, mock_post, mock_head):
+        mock_post.return_value = MagicMock(status_code=200, json=lambda: {'success': True, 'result': {'token': 'WARM_TOKEN_123'}})
+        ebms_signature.load_public_key.cache_clear()
+
+        ready = ebms_warmup.run(ebms_warmup.prepare(self.env), self.env)
+
+        self.assertGreaterEqual(ready, 1)
+        self.assertEqual(ebms_signature.load_public_key.cache_info().currsize, 1)
+        self.assertEqual(mock_post.call_count, 1)
+        mock_head.assert_called_with('https://fake.ebms.api/login', timeout=30, allow_redirects=False)
+        self.assertEqual(self.env['ir.config_parameter'].sudo().get_param('ebms.api_token'), 'WARM_TOKEN_123')
+        self.assertTrue(get_client(self.env).warmed)
+
+    def test_reset_connections_keeps_token(self):
+        client = get_client(self.env)
+        client.token = 'TOKEN_AFTER_FORK'
+        session = client.session
+        client.reset_connections()
+        self.assertIsNot(client.session, session)
+        self.assertEqual(client.token, 'TOKEN_AFTER_FORK')
+
+    @patch('odoo.addons.ebms_connector.models.ebms_warmup.warm_up_in_background')
+    def test_no_warm_up_on_registry_load_in_tests(self, mock_warm_up):
+        self.env['ir.config_parameter'].sudo().set_param('ebms.warmup', True)
+        self.env['res.company']._register_hook()
+        mock_warm_up.assert_not_called()
@@ -0,0 +1,6 @@
+# -*- coding: utf-8 -*-
+# Outillage hors ORM : jeux de données de charge, cassettes OBR, relais d'agence.
+
+from . import ebms_dataset
+from . import ebms_cassette
+from . import ebms_relay
@@ -0,0 +1,225 @@
+# -*- coding: utf-8 -*-
+"""
+Enregistrement et rejeu des échanges HTTP avec l'OBR (cassettes).
+
+    with ebms_cassette.recording('/tmp/obr_addinvoice.json'):
+        invoices.action_send_ebms()
+
+    with ebms_cassette.replaying('tests/cassettes/addinvoice_token_expiry.json', speed=10):
+        invoices.action_send_ebms()
+
+Pendant le bloc, les appels des sessions du client EBMS (ebms_client._Session) passent
+par l'adaptateur de la cassette ; les autres sessions requests du processus ne sont pas
+touchées. En enregistrement, chaque paire
+requête/réponse réelle est gardée avec sa durée ; mots de passe, tokens et en-têtes
+Authorization sont remplacés par REDACTED. Le fichier est écrit à la sortie du bloc.
+
+En rejeu, aucune connexion n'est ouverte : chaque requête reçoit la réponse suivante
+enregistrée pour la même méthode et le même chemin d'URL (l'hôte peut différer), dans
+l'ordre d'enregistrement. Ainsi, un 401 de token expiré est suivi du login puis de la
+réponse acceptée, comme sur le serveur réel. La réponse arrive après la durée enregistrée
+divisée par speed (speed=None : sans attente). Avec loop=True, une cassette épuisée
+recommence au début, ce qui permet de mesurer le débit sur plus d'échanges qu'enregistrés.
+"""
+import gzip
+import json
+import threading
+import time
+from collections import defaultdict, deque
+from contextlib import contextmanager
+from datetime import timedelta
+from urllib.parse import urlsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from ..models.ebms_client import _Session
+
+VERSION = 1
+# Assez long pour passer le contrôle de longueur du token du client EBMS.
+REDACTED = '***REDACTED***'
+SECRET_KEYS = {'password', 'token', 'api_token', 'access_token', 'authorization'}
+SECRET_HEADERS = {'authorization', 'cookie', 'set-cookie'}
+# Le corps est stocké décodé : ces en-têtes ne le décriraient plus.
+TRANSPORT_HEADERS = {'content-length', 'content-encoding', 'transfer-encoding'}
+
+
+class CassetteError(Exception):
+    """Requête sans réponse enregistrée, ou cassette illisible."""
+
+
+def scrub(value):
+    """Copie de `value` (dict ou liste JSON) sans identifiants ni tokens."""
+    if isinstance(value, dict):
+        return {key: REDACTED if str(key).lower() in SECRET_KEYS and value[key] else scrub(value[key]) for key in value}
+    if isinstance(value, list):
+        return [scrub(item) for item in value]
+    return value
+
+
+def _headers(headers):
+    return {
+        key: REDACTED if key.lower() in SECRET_HEADERS else value
+        for key, value in (headers or {}).items()
+        if key.lower() not in TRANSPORT_HEADERS
+    }
+
+
+def _body(content, headers=None):
+    """Corps stocké (décompressé) : {'json': ...} si c'est du JSON, {'text': ...} sinon."""
+    if content is None:
+        return {}
+    if isinstance(content, bytes) and (headers or {}).get('Content-Encoding') == 'gzip':
+        content = gzip.decompress(content)
+    if isinstance(content, bytes):
+        content = content.decode('utf-8', 'replace')
+    try:
+        return {'json': scrub(json.loads(content))}
+    except ValueError:
+        return {'text': content}
+
+
+def _key(method, url):
+    return '%s %s' % (method.upper(), urlsplit(url).path or '/')
+
+
+class Cassette:
+    """Liste ordonnée d'échanges enregistrés."""
+
+    def __init__(self, interactions=None):
+        self.interactions = list(interactions or [])
+        self._lock = threading.Lock()
+
+    @classmethod
+    def load(cls, path):
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CassetteError('Cassette %s illisible : %s' % (path, e))
+        if data.get('version') != VERSION:
+            raise CassetteError('Version de cassette %s non prise en charge.' % data.get('version'))
+        return cls(data['interactions'])
+
+    def save(self, path):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'version': VERSION, 'interactions': self.interactions}, f,
+                      ensure_ascii=False, indent=1, sort_keys=True)
+            f.write('\n')
+
+    def append(self, request, response, elapsed):
+        with self._lock:
+            self.interactions.append({
+                'request': dict(method=request.method, url=request.url, headers=_headers(request.headers),
+                                **_body(request.body, request.headers)),
+                'response': dict(status=response.status_code, reason=response.reason,
+                                 headers=_headers(response.headers), **_body(response.content)),
+                'elapsed': round(elapsed, 4),
+            })
+
+
+class RecordingAdapter(BaseAdapter):
+    """Envoie réellement la requête (HTTPAdapter) et l'ajoute à la cassette."""
+
+    def __init__(self, cassette, adapter=None):
+        super().__init__()
+        self.cassette = cassette
+        self.adapter = adapter or HTTPAdapter()
+
+    def send(self, request, **kwargs):
+        started = time.monotonic()
+        response = self.adapter.send(request, **kwargs)
+        self.cassette.append(request, response, time.monotonic() - started)
+        return response
+
+    def close(self):
+        self.adapter.close()
+
+
+class ReplayAdapter(BaseAdapter):
+    """Répond depuis la cassette, sans réseau, après la durée enregistrée / speed."""
+
+    def __init__(self, cassette, speed=1.0, loop=False):
+        super().__init__()
+        self.speed = speed
+        self.loop = loop
+        self.calls = 0
+        self._lock = threading.Lock()
+        self._all = defaultdict(list)
+        for interaction in cassette.interactions:
+            request = interaction['request']
+            self._all[_key(request['method'], request['url'])].append(interaction)
+        self._pending = {key: deque(items) for key, items in self._all.items()}
+
+    def _next(self, key):
+        with self._lock:
+            pending = self._pending.get(key)
+            if not pending and self.loop and self._all.get(key):
+                pending = self._pending[key] = deque(self._all[key])
+            if not pending:
+                raise CassetteError('Aucun échange enregistré pour %s' % key)
+            self.calls += 1
+            return pending.popleft()
+
+    def send(self, request, **kwargs):
+        interaction = self._next(_key(request.method, request.url))
+        if self.speed:
+            time.sleep(interaction['elapsed'] / self.speed)
+        recorded = interaction['response']
+        response = requests.Response()
+        response.status_code = recorded['status']
+        response.reason = recorded.get('reason')
+        response.headers = CaseInsensitiveDict(recorded.get('headers') or {})
+        if 'json' in recorded:
+            response._content = json.dumps(recorded['json'], ensure_ascii=False).encode('utf-8')
+        else:
+            response._content = (recorded.get('text') or '').encode('utf-8')
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.elapsed = timedelta(seconds=interaction['elapsed'])
+        return response
+
+    def close(self):
+        pass
+
+
+@contextmanager
+def _mounted(adapter):
+    """Les sessions du client EBMS utilisent `adapter` pendant le bloc (URLs http et https)."""
+    own = _Session.__dict__.get('get_adapter')
+    get_adapter = _Session.get_adapter
+
+    def cassette_adapter(session, url):
+        if url.lower().startswith(('http://', 'https://')):
+            return adapter
+        return get_adapter(session, url)
+    _Session.get_adapter = cassette_adapter
+    try:
+        yield adapter
+    finally:
+        if own is None:
+            del _Session.get_adapter
+        else:
+            _Session.get_adapter = own
+
+
+@contextmanager
+def recording(path):
+    """Enregistre les échanges du bloc dans la cassette `path` ; cède la Cassette."""
+    cassette = Cassette()
+    adapter = RecordingAdapter(cassette)
+    try:
+        with _mounted(adapter):
+            yield cassette
+    finally:
+        adapter.close()
+        cassette.save(path)
+
+
+@contextmanager
+def replaying(path, speed=1.0, loop=False):
+    """Rejoue la cassette `path` pendant le bloc ; cède le ReplayAdapter (compteur d'appels)."""
+    with _mounted(ReplayAdapter(Cassette.load(path), speed=speed, loop=loop)) as adapter:
+        yield adapter
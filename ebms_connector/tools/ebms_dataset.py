@@ -0,0 +1,390 @@
+# -*- coding: utf-8 -*-
+"""
+Générateur de jeux de données EBMS volumineux (benchmarks, reproduction d'une fin de mois).
+
+Quelques dizaines de factures et mouvements « modèles » sont créés par l'ORM (taxes,
+lignes, écritures cohérentes), puis recopiés en masse en SQL (INSERT ... SELECT sur
+des tableaux), par paquets : factures et avoirs FN/FA/RC avec TVA et TC, clients avec
+et sans NIF, mouvements de stock de chaque type EBMS. Les montants des copies sont
+multipliés par un facteur entier, ce qui garde les écritures équilibrées.
+
+Le résultat ne dépend que de la graine et des paramètres.
+"""
+import logging
+import random
+import time
+from datetime import timedelta
+
+from odoo import fields
+
+_logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 5000
+TEMPLATE_LINE_COUNTS = (1, 3, 10)
+MAX_FACTOR = 20
+
+_MOVE_AMOUNTS = (
+    'amount_untaxed', 'amount_tax', 'amount_total', 'amount_residual',
+    'amount_untaxed_signed', 'amount_tax_signed', 'amount_total_signed',
+    'amount_total_in_currency_signed', 'amount_residual_signed', 'amount_untaxed_in_currency_signed',
+)
+_LINE_AMOUNTS = (
+    'debit', 'credit', 'balance', 'amount_currency', 'amount_residual', 'amount_residual_currency',
+    'price_subtotal', 'price_total', 'tax_base_amount',
+)
+_MOVE_RESET = (
+    'access_token', 'inalterable_hash', 'secure_sequence_number', 'message_main_attachment_id',
+    'invoice_origin', 'ref',
+)
+
+
+def _table_columns(cr, table):
+    cr.execute("""
+        SELECT column_name FROM information_schema.columns
+         WHERE table_schema = current_schema() AND table_name = %s
+    """, (table,))
+    return [row[0] for row in cr.fetchall()]
+
+
+def clone_records(env, model_name, template_ids, values, overrides):
+    """
+    Copie en masse d'enregistrements modèles, sans passer par l'ORM.
+
+    :param template_ids: un id de modèle par copie
+    :param values: nom -> (type SQL, liste alignée sur template_ids), exposés sous src.<nom>
+    :param overrides: colonne -> expression SQL (t = ligne modèle, src = valeurs) ;
+                      les colonnes absentes de la table sont ignorées
+    :return: ids des copies, dans l'ordre de template_ids
+    """
+    if not template_ids:
+        return []
+    cr = env.cr
+    Model = env[model_name]
+    table = Model._table
+    cr.execute("SELECT nextval(%s) FROM generate_series(1, %s)", ('%s_id_seq' % table, len(template_ids)))
+    new_ids = [row[0] for row in cr.fetchall()]
+
+    columns = _table_columns(cr, table)
+    exprs = {column: 't."%s"' % column for column in columns}
+    exprs.update({column: expr for column, expr in overrides.items() if column in exprs})
+    exprs['id'] = 'src.new_id'
+    names = ['new_id', 'template_id'] + list(values)
+    types = ['int4', 'int4'] + [sql_type for sql_type, _values in values.values()]
+    arrays = [new_ids, list(template_ids)] + [list(array) for _sql_type, array in values.values()]
+    cr.execute("""
+        INSERT INTO "{table}" ({columns})
+        SELECT {exprs}
+          FROM unnest({arrays}) AS src({names})
+          JOIN "{table}" t ON t.id = src.template_id
+    """.format(
+        table=table,
+        columns=', '.join('"%s"' % column for column in columns),
+        exprs=', '.join(exprs[column] for column in columns),
+        arrays=', '.join('%%s::%s[]' % sql_type for sql_type in types),
+        names=', '.join(names),
+    ), arrays)
+
+    for field in Model._fields.values():
+        if field.type == 'many2many' and field.store and field.relation:
+            cr.execute("""
+                INSERT INTO "{rel}" ("{col1}", "{col2}")
+                SELECT src.new_id, r."{col2}"
+                  FROM unnest(%s::int4[], %s::int4[]) AS src(new_id, template_id)
+                  JOIN "{rel}" r ON r."{col1}" = src.template_id
+            """.format(rel=field.relation, col1=field.column1, col2=field.column2), [new_ids, list(template_ids)])
+    return new_ids
+
+
+# ----------------------------------------------------------------------
+# Données de référence (ORM, en petit nombre)
+# ----------------------------------------------------------------------
+
+def _taxes(env, company):
+    Tax = env['account.tax'].with_company(company)
+    taxes = {}
+    for key, name, amount in (('vat', 'TVA 18% (EBMS)', 18), ('ct', 'TC 2% (EBMS)', 2)):
+        tax = Tax.search([('name', '=', name), ('company_id', '=', company.id), ('type_tax_use', '=', 'sale')], limit=1)
+        taxes[key] = tax or Tax.create({'name': name, 'amount': amount, 'type_tax_use': 'sale', 'company_id': company.id})
+    return taxes
+
+
+def _partners(env, company, count, tin_ratio, rng):
+    Partner = env['res.partner']
+    prefix = 'Client EBMS généré'
+    existing = Partner.search([('name', '=like', prefix + ' %'), ('company_id', 'in', (False, company.id))], order='id')
+    missing = count - len(existing)
+    if missing > 0:
+        start = len(existing)
+        existing |= Partner.create([{
+            'name': '%s %05d' % (prefix, start + i),
+            'is_company': rng.random() < 0.5,
+            'vat': '4%09d' % rng.randrange(10 ** 9) if rng.random() < tin_ratio else False,
+            'city': rng.choice(('Bujumbura', 'Gitega', 'Ngozi', 'Rumonge')),
+        } for i in range(missing)])
+    return existing[:count].ids
+
+
+def _products(env, count):
+    Product = env['product.product']
+    existing = Product.search([('default_code', '=like', 'EBMS-GEN-%')], order='id')
+    missing = count - len(existing)
+    if missing > 0:
+        start = len(existing)
+        existing |= Product.create([{
+            'name': 'Article EBMS généré %04d' % (start + i),
+            'default_code': 'EBMS-GEN-%04d' % (start + i),
+            'type': 'product',
+            'list_price': 1000 + 250 * ((start + i) % 40),
+            'standard_price': 700 + 150 * ((start + i) % 40),
+        } for i in range(missing)])
+    return existing[:count]
+
+
+def _invoice_templates(env, company, partner_id, products, taxes):
+    """Une facture modèle par (type, conditions de paiement, taxes, nombre de lignes)."""
+    terms = {
+        'cash': env.ref('account.account_payment_term_immediate'),
+        'credit': env.ref('account.account_payment_term_30days'),
+    }
+    tax_sets = {'vat': taxes['vat'], 'vat_ct': taxes['vat'] | taxes['ct'], 'none': env['account.tax']}
+    vals_list, keys = [], []
+    for move_type in ('out_invoice', 'out_refund'):
+        for term_key, term in terms.items():
+            for tax_key, tax_set in tax_sets.items():
+                for line_count in TEMPLATE_LINE_COUNTS:
+                    keys.append((move_type, term_key))
+                    vals_list.append({
+                        'move_type': move_type,
+                        'company_id': company.id,
+                        'partner_id': partner_id,
+                        'invoice_date': fields.Date.context_today(env.user),
+                        'invoice_payment_term_id': term.id,
+                        'ref': 'Modèle EBMS généré',
+                        'invoice_line_ids': [(0, 0, {
+                            'product_id': products[i % len(products)].id,
+                            'quantity': 1 + i % 3,
+                            'price_unit': products[i % len(products)].list_price,
+                            'tax_ids': [(6, 0, tax_set.ids)],
+                        }) for i in range(line_count)],
+                    })
+    moves = env['account.move'].with_company(company).create(vals_list)
+    moves.action_post()
+    templates = {}
+    for key, move in zip(keys, moves):
+        templates.setdefault(key, []).append(move.id)
+    return templates
+
+
+def _stock_templates(env, company, product):
+    Move = env['stock.move'].with_company(company)
+    movement_types = [value for value, _label in Move._fields['ebms_movement_type'].selection]
+    stock = env.ref('stock.stock_location_stock')
+    customers = env.ref('stock.stock_location_customers')
+    moves = Move.create([{
+        'name': 'Modèle EBMS généré %s' % movement_type,
+        'company_id': company.id,
+        'product_id': product.id,
+        'product_uom': product.uom_id.id,
+        'product_uom_qty': 1,
+        'price_unit': product.standard_price,
+        'location_id': customers.id if movement_type.startswith('E') else stock.id,
+        'location_dest_id': stock.id if movement_type.startswith('E') else customers.id,
+        'ebms_movement_type': movement_type,
+    } for movement_type in movement_types])
+    return moves.ids
+
+
+def _next_sequence(cr, prefix):
+    cr.execute("SELECT COALESCE(MAX(sequence_number), 0) FROM account_move WHERE sequence_prefix = %s", (prefix,))
+    return cr.fetchone()[0] + 1
+
+
+# ----------------------------------------------------------------------
+# Génération
+# ----------------------------------------------------------------------
+
+def generate(env, invoices=1000, stock_moves=0, partners=100, products=20, seed=42,
+             credit_note_ratio=0.1, cash_ratio=0.3, tin_ratio=0.6, sent_ratio=0.0,
+             date_from=None, date_to=None, chunk_size=DEFAULT_CHUNK_SIZE, company=None, label='GEN', commit=False):
+    """
+    Génère `invoices` factures/avoirs comptabilisés et `stock_moves` mouvements de stock.
+
+    :param credit_note_ratio: part d'avoirs (FA)
+    :param cash_ratio: part de factures au comptant (RC), le reste à 30 jours (FN)
+    :param tin_ratio: part des clients générés ayant un NIF
+    :param sent_ratio: part de factures déjà « envoyées » à EBMS (référence et date d'envoi)
+    :param date_from, date_to: période des dates de facture (par défaut les 30 derniers jours)
+    :param commit: committer après chaque paquet (commande en ligne ; jamais dans les tests)
+    :return: dict des ids générés et de la durée
+    """
+    started = time.monotonic()
+    # Générateurs séparés : les factures ne dépendent pas du nombre de clients déjà présents.
+    rng = random.Random(seed)
+    partner_rng = random.Random('%s-partners' % seed)
+    company = company or env.company
+    env = env(context=dict(env.context, tracking_disable=True, mail_create_nolog=True, mail_notrack=True))
+    date_to = fields.Date.to_date(date_to) if date_to else fields.Date.context_today(env.user)
+    date_from = fields.Date.to_date(date_from) if date_from else date_to - timedelta(days=30)
+    span = (date_to - date_from).days
+
+    partner_ids = _partners(env, company, partners, tin_ratio, partner_rng)
+    product_records = _products(env, max(products, 1))
+    result = {'partner_ids': partner_ids, 'product_ids': product_records.ids, 'invoice_ids': [], 'stock_move_ids': []}
+
+    if invoices:
+        templates = _invoice_templates(env, company, partner_ids[0], product_records, _taxes(env, company))
+        system_id = company._get_ebms_credentials()['system_id'] or 'ws00000000000000'
+        prefixes = {move_type: '%s%s/%s/' % (label, seed, code) for move_type, code in (('out_invoice', 'FN'), ('out_refund', 'FA'))}
+        numbers = {move_type: _next_sequence(env.cr, prefix) for move_type, prefix in prefixes.items()}
+        for offset in range(0, invoices, chunk_size):
+            result['invoice_ids'] += _generate_invoice_chunk(
+                env, rng, min(chunk_size, invoices - offset), templates, partner_ids, prefixes, numbers,
+                credit_note_ratio, cash_ratio, sent_ratio, date_from, span, company, system_id)
+            if commit:
+                env.cr.commit()
+            _logger.info('Génération EBMS : %s/%s factures.', len(result['invoice_ids']), invoices)
+
+    if stock_moves:
+        templates = _stock_templates(env, company, product_records[0])
+        for offset in range(0, stock_moves, chunk_size):
+            result['stock_move_ids'] += _generate_stock_chunk(
+                env, rng, min(chunk_size, stock_moves - offset), templates, product_records.ids, date_from, span, offset)
+            if commit:
+                env.cr.commit()
+            _logger.info('Génération EBMS : %s/%s mouvements de stock.', len(result['stock_move_ids']), stock_moves)
+
+    # Les copies SQL ne passent pas par les compteurs du tableau de bord.
+    env['ebms.status.counter']._rebuild()
+    env.invalidate_all()
+    result['seconds'] = time.monotonic() - started
+    return result
+
+
+def _generate_invoice_chunk(env, rng, count, templates, partner_ids, prefixes, numbers,
+                            credit_note_ratio, cash_ratio, sent_ratio, date_from, span, company, system_id):
+    cols = {key: [] for key in ('template', 'partner', 'date', 'name', 'prefix', 'seq', 'factor', 'status', 'reference',
+                                'identifier', 'posted', 'latency')}
+    for _i in range(count):
+        move_type = 'out_refund' if rng.random() < credit_note_ratio else 'out_invoice'
+        term = 'cash' if rng.random() < cash_ratio else 'credit'
+        invoice_date = date_from + timedelta(days=rng.randint(0, span))
+        number = numbers[move_type]
+        numbers[move_type] += 1
+        name = '%s%07d' % (prefixes[move_type], number)
+        sent = rng.random() < sent_ratio
+        cols['template'].append(rng.choice(templates[(move_type, term)]))
+        cols['partner'].append(rng.choice(partner_ids))
+        cols['date'].append(invoice_date)
+        cols['name'].append(name)
+        cols['prefix'].append(prefixes[move_type])
+        cols['seq'].append(number)
+        cols['factor'].append(rng.randint(1, MAX_FACTOR))
+        cols['status'].append('sent' if sent else 'draft')
+        cols['reference'].append('OBR-%s' % name if sent else None)
+        cols['identifier'].append('%s/%s/%s/%s' % (company.vat or '', system_id, invoice_date.strftime('%Y%m%d000000'), name) if sent else None)
+        cols['posted'].append(fields.Datetime.to_datetime(invoice_date) + timedelta(hours=8, minutes=rng.randint(0, 599)))
+        # Délai d'accusé : quelques secondes en général, une queue de plusieurs minutes.
+        cols['latency'].append(int(rng.expovariate(1 / 20.0)) + 1 if sent else None)
+
+    overrides = {
+        'name': 'src.name',
+        'payment_reference': 'src.name',
+        'sequence_prefix': 'src.prefix',
+        'sequence_number': 'src.seq',
+        'date': 'src.date',
+        'invoice_date': 'src.date',
+        'invoice_date_due': 'src.date + (t.invoice_date_due - t.invoice_date)',
+        'partner_id': 'src.partner_id',
+        'commercial_partner_id': 'src.partner_id',
+        'partner_shipping_id': 'src.partner_id',
+        'create_date': "now() at time zone 'UTC'",
+        'write_date': "now() at time zone 'UTC'",
+    }
+    overrides.update({column: 'NULL' for column in _MOVE_RESET})
+    overrides.update({column: 't.%s * src.factor' % column for column in _MOVE_AMOUNTS})
+    move_ids = clone_records(env, 'account.move', cols['template'], {
+        'partner_id': ('int4', cols['partner']),
+        'date': ('date', cols['date']),
+        'name': ('varchar', cols['name']),
+        'prefix': ('varchar', cols['prefix']),
+        'seq': ('int4', cols['seq']),
+        'factor': ('numeric', cols['factor']),
+    }, overrides)
+
+    # État EBMS : une ligne par facture dans account_move_ebms.
+    env.cr.execute("""
+        INSERT INTO account_move_ebms (move_id, ebms_status, ebms_reference, ebms_invoice_identifier, ebms_sent_date,
+                                       ebms_posted_at, ebms_first_attempt_at, ebms_attempts, ebms_acknowledged_at,
+                                       create_uid, create_date, write_uid, write_date)
+        SELECT src.move_id, src.status, src.reference, src.identifier, src.acknowledged,
+               src.posted, src.posted + CASE WHEN src.latency IS NOT NULL THEN interval '1 second' END,
+               CASE WHEN src.latency IS NOT NULL THEN 1 ELSE 0 END, src.acknowledged,
+               %s, now() at time zone 'UTC', %s, now() at time zone 'UTC'
+          FROM (SELECT *, posted + latency * interval '1 second' AS acknowledged
+                  FROM unnest(%s::int4[], %s::varchar[], %s::varchar[], %s::varchar[], %s::timestamp[], %s::int4[])
+                       AS t(move_id, status, reference, identifier, posted, latency)) AS src
+    """, (env.uid, env.uid, move_ids, cols['status'], cols['reference'], cols['identifier'], cols['posted'], cols['latency']))
+
+    # Lignes : une copie de chaque ligne du modèle, rattachée à la nouvelle facture.
+    env.cr.execute("SELECT move_id, id FROM account_move_line WHERE move_id IN %s ORDER BY id", (tuple(set(cols['template'])),))
+    template_lines = {}
+    for move_id, line_id in env.cr.fetchall():
+        template_lines.setdefault(move_id, []).append(line_id)
+    line_cols = {key: [] for key in ('template', 'move', 'partner', 'date', 'name', 'factor')}
+    for move_id, template_id, partner_id, invoice_date, name, factor in zip(
+            move_ids, cols['template'], cols['partner'], cols['date'], cols['name'], cols['factor']):
+        for line_id in template_lines[template_id]:
+            line_cols['template'].append(line_id)
+            line_cols['move'].append(move_id)
+            line_cols['partner'].append(partner_id)
+            line_cols['date'].append(invoice_date)
+            line_cols['name'].append(name)
+            line_cols['factor'].append(factor)
+    line_overrides = {
+        'move_id': 'src.move_id',
+        'move_name': 'src.move_name',
+        'partner_id': 'src.partner_id',
+        'date': 'src.date',
+        'invoice_date': 'src.date',
+        'date_maturity': 't.date_maturity + (src.date - t.date)',
+        'quantity': "CASE WHEN t.display_type = 'product' THEN t.quantity * src.factor ELSE t.quantity END",
+        'matching_number': 'NULL',
+        'full_reconcile_id': 'NULL',
+        'reconciled': 'false',
+        'create_date': "now() at time zone 'UTC'",
+        'write_date': "now() at time zone 'UTC'",
+    }
+    line_overrides.update({column: 't.%s * src.factor' % column for column in _LINE_AMOUNTS})
+    clone_records(env, 'account.move.line', line_cols['template'], {
+        'move_id': ('int4', line_cols['move']),
+        'partner_id': ('int4', line_cols['partner']),
+        'date': ('date', line_cols['date']),
+        'move_name': ('varchar', line_cols['name']),
+        'factor': ('numeric', line_cols['factor']),
+    }, line_overrides)
+    return move_ids
+
+
+def _generate_stock_chunk(env, rng, count, templates, product_ids, date_from, span, offset):
+    cols = {key: [] for key in ('template', 'product', 'qty', 'date', 'name')}
+    for i in range(count):
+        cols['template'].append(rng.choice(templates))
+        cols['product'].append(rng.choice(product_ids))
+        cols['qty'].append(rng.randint(1, 50 * MAX_FACTOR))
+        cols['date'].append(fields.Datetime.to_datetime(date_from) + timedelta(days=rng.randint(0, span), minutes=rng.randint(0, 1439)))
+        cols['name'].append('Mouvement EBMS généré %07d' % (offset + i + 1))
+    return clone_records(env, 'stock.move', cols['template'], {
+        'product_id': ('int4', cols['product']),
+        'qty': ('numeric', cols['qty']),
+        'date': ('timestamp', cols['date']),
+        'name': ('varchar', cols['name']),
+    }, {
+        'product_id': 'src.product_id',
+        'product_uom_qty': 'src.qty',
+        'product_qty': 'src.qty',
+        'date': 'src.date',
+        'name': 'src.name',
+        'reference': 'src.name',
+        'create_date': "now() at time zone 'UTC'",
+        'write_date': "now() at time zone 'UTC'",
+    })
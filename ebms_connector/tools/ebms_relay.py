@@ -0,0 +1,462 @@
+# -*- coding: utf-8 -*-
+"""
+Relais EBMS d'agence : file durable locale pour les sites à connexion intermittente.
+
+Le relais tourne à côté de l'Odoo de l'agence (`odoo-bin ebms_relay`, voir cli/ebms_relay.py).
+Odoo y pointe ebms.login_url et ebms.api_url, avec les mêmes chemins que l'OBR :
+
+    ebms.login_url = http://127.0.0.1:8099/ebms_api/login/
+    ebms.api_url   = http://127.0.0.1:8099/ebms_api/addInvoice/
+    ebms.relay_url = http://127.0.0.1:8099
+
+- Le login est servi localement : avec les identifiants OBR de l'agence, le relais rend son
+  propre token, même sans liaison.
+- Une soumission est d'abord écrite dans une base SQLite (WAL, synchronous=FULL) puis
+  acquittée par « mise en file » ({'success': true, 'relay': {...}}). Les écritures
+  concurrentes partagent un même commit, donc un seul fsync (validation groupée).
+- Une même soumission (même chemin, même invoice_identifier) n'est gardée qu'une fois tant
+  qu'elle est en file ou acceptée par l'OBR ; une fois acceptée, c'est la réponse de l'OBR qui
+  est rendue. Une soumission refusée (ou abandonnée) est remplacée par la nouvelle, qui
+  repart en fin de file : une facture corrigée peut être renvoyée.
+- Le transfert vers l'OBR se fait dans l'ordre d'arrivée, par lots de batch_size, avec
+  jusqu'à max_workers envois simultanés dans un lot (max_workers=1 : ordre strict). Dans un
+  lot, un avoir (cancelled_invoice_ref) part toujours après la facture qu'il annule, et
+  attend le lot suivant si elle a échoué. Une
+  erreur de transport, un 5xx, un 401 persistant ou un 429 laissent la soumission en file.
+  Les lots suivants attendent alors, avec une attente exponentielle. Toute autre réponse de
+  l'OBR, acceptation ou refus, est un accusé. Une soumission à laquelle l'OBR répond encore
+  par un 5xx, un 408 ou un 429 après max_attempts essais est abandonnée : elle reçoit un
+  accusé d'échec (état 'failed', compté dans /relay/status) et ne bloque plus la file. Une
+  erreur de transport ou un 401 (OBR injoignable, login refusé) ne compte pas pour l'abandon.
+- Les accusés sont numérotés (seq). Odoo les relit par POST /relay/acks
+  {"after": seq, "limit": n} (voir _cron_ebms_relay_acks) et les applique aux factures.
+  Les accusés sont purgés après retention_days jours.
+"""
+import gzip
+import hashlib
+import json
+import logging
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit
+
+from ..models import ebms_json
+from ..models.ebms_client import EBMSClient
+from ..models.ebms_tracing import HEADER as TRACE_HEADER
+
+_logger = logging.getLogger(__name__)
+
+ACKS_PATH = '/relay/acks'
+STATUS_PATH = '/relay/status'
+LOGIN_PATH = '/ebms_api/login/'
+DEFAULT_BATCH_SIZE = 50
+DEFAULT_RETENTION_DAYS = 7
+DEFAULT_MAX_ATTEMPTS = 20
+ACKS_LIMIT = 500
+BACKOFF_MIN = 5
+BACKOFF_MAX = 300
+IDLE_WAIT = 1.0
+PURGE_INTERVAL = 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submission (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    path TEXT NOT NULL,
+    identifier TEXT NOT NULL,
+    body BLOB NOT NULL,
+    trace_id TEXT,
+    received_at REAL NOT NULL,
+    state TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    last_error TEXT,
+    status INTEGER,
+    response TEXT,
+    seq INTEGER,
+    acked_at REAL,
+    UNIQUE (path, identifier)
+);
+CREATE INDEX IF NOT EXISTS submission_state_id ON submission (state, id);
+CREATE UNIQUE INDEX IF NOT EXISTS submission_seq ON submission (seq);
+-- Dernier numéro d'accusé attribué : il survit à la purge et au remplacement des soumissions.
+CREATE TABLE IF NOT EXISTS counter (name TEXT PRIMARY KEY, value INTEGER NOT NULL);
+"""
+COLUMNS = ('id', 'path', 'identifier', 'body', 'trace_id', 'received_at', 'state', 'attempts',
+           'last_error', 'status', 'response', 'seq', 'acked_at')
+
+
+def is_transient(result):
+    """Réponse qui n'est pas un accusé de l'OBR : la soumission reste en file."""
+    status = result['status_code']
+    return status is None or status in (401, 408, 429) or status >= 500
+
+
+def is_unreachable(result):
+    """L'OBR n'a pas répondu pour cette soumission (transport, login refusé) : l'essai ne compte pas pour l'abandon."""
+    return result['status_code'] in (None, 401)
+
+
+def is_refused(row):
+    """Soumission refusée par l'OBR ou abandonnée : une nouvelle soumission peut la remplacer."""
+    if row['state'] == 'failed':
+        return True
+    return row['state'] == 'acked' and not json.loads(row['response'] or '{}').get('success')
+
+
+class RelayStore:
+    """
+    File SQLite du relais. Une seule connexion, protégée par un verrou ; les soumissions
+    passent par un fil d'écriture qui regroupe dans un même commit celles qui arrivent
+    pendant l'écriture précédente.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.commits = 0
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute('PRAGMA journal_mode=WAL')
+        self._db.execute('PRAGMA synchronous=FULL')
+        self._db.executescript(SCHEMA)
+        self._inbox = queue.Queue()
+        self.received = threading.Event()
+        self._writer = threading.Thread(target=self._write_loop, name='ebms-relay-writer', daemon=True)
+        self._writer.start()
+
+    def _rows(self, sql, params=()):
+        return [dict(zip(COLUMNS, row)) for row in self._db.execute(sql, params).fetchall()]
+
+    def _transaction(self, func, *args):
+        with self._lock:
+            self._db.execute('BEGIN IMMEDIATE')
+            try:
+                result = func(*args)
+            except Exception:
+                self._db.execute('ROLLBACK')
+                raise
+            self._db.execute('COMMIT')
+            self.commits += 1
+            return result
+
+    def submit(self, path, identifier, body, trace_id=None):
+        """Enregistre durablement une soumission (ou retrouve la même) et la retourne, une fois commitée."""
+        done = threading.Event()
+        slot = {'item': (path, identifier, body, trace_id), 'done': done}
+        self._inbox.put(slot)
+        done.wait()
+        if 'error' in slot:
+            raise slot['error']
+        return slot['row']
+
+    def _write_loop(self):
+        while True:
+            batch = [self._inbox.get()]
+            while True:
+                try:
+                    batch.append(self._inbox.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                rows = self._transaction(self._insert, [slot['item'] for slot in batch])
+                for slot, row in zip(batch, rows):
+                    slot['row'] = row
+            except Exception as e:
+                _logger.exception('Relais EBMS : écriture de %s soumission(s) impossible.', len(batch))
+                for slot in batch:
+                    slot['error'] = e
+            for slot in batch:
+                slot['done'].set()
+            self.received.set()
+
+    def _insert(self, items):
+        now = time.time()
+        rows = []
+        select = 'SELECT %s FROM submission WHERE path = ? AND identifier = ?' % ', '.join(COLUMNS)
+        for path, identifier, body, trace_id in items:
+            existing = self._rows(select, (path, identifier))
+            if existing and is_refused(existing[0]):
+                self._db.execute('DELETE FROM submission WHERE id = ?', (existing[0]['id'],))
+            self._db.execute(
+                'INSERT OR IGNORE INTO submission (path, identifier, body, trace_id, received_at) VALUES (?, ?, ?, ?, ?)',
+                (path, identifier, body, trace_id, now))
+            rows += self._rows(select, (path, identifier))
+        return rows
+
+    def pending(self, limit):
+        """Soumissions en attente, dans l'ordre d'arrivée."""
+        with self._lock:
+            return self._rows("SELECT %s FROM submission WHERE state = 'pending' ORDER BY id LIMIT ?" % ', '.join(COLUMNS),
+                              (limit,))
+
+    def _last_seq(self):
+        counter = self._db.execute("SELECT value FROM counter WHERE name = 'seq'").fetchone()
+        return max(counter[0] if counter else 0, self._db.execute('SELECT COALESCE(MAX(seq), 0) FROM submission').fetchone()[0])
+
+    def record(self, acked, failed):
+        """
+        En une transaction : accusés [(id, status, réponse JSON[, état])] numérotés dans l'ordre
+        donné, et échecs de transport [(id, erreur)]. L'état d'un accusé est 'acked' par défaut,
+        'failed' pour une soumission abandonnée : elle est numérotée pour qu'Odoo reçoive l'échec.
+        """
+        def write():
+            seq = self._last_seq()
+            now = time.time()
+            for submission_id, status, response, *state in acked:
+                seq += 1
+                self._db.execute(
+                    "UPDATE submission SET state = ?, status = ?, response = ?, seq = ?, acked_at = ?, "
+                    "attempts = attempts + 1, last_error = NULL WHERE id = ?",
+                    (state[0] if state else 'acked', status, response, seq, now, submission_id))
+            for submission_id, error in failed:
+                self._db.execute('UPDATE submission SET attempts = attempts + 1, last_error = ? WHERE id = ?',
+                                 (error, submission_id))
+            self._db.execute("INSERT OR REPLACE INTO counter (name, value) VALUES ('seq', ?)", (seq,))
+        self._transaction(write)
+
+    def acks(self, after=0, limit=ACKS_LIMIT):
+        """Accusés de numéro supérieur à `after`, dans l'ordre des numéros."""
+        with self._lock:
+            rows = self._rows("SELECT %s FROM submission WHERE seq > ? ORDER BY seq LIMIT ?" % ', '.join(COLUMNS),
+                              (after, limit))
+        return [{
+            'seq': row['seq'],
+            'path': row['path'],
+            'identifier': row['identifier'],
+            'trace_id': row['trace_id'],
+            'state': row['state'],
+            'status': row['status'],
+            'response': json.loads(row['response']),
+            'received_at': row['received_at'],
+            'acked_at': row['acked_at'],
+        } for row in rows]
+
+    def stats(self):
+        with self._lock:
+            pending, oldest = self._db.execute(
+                "SELECT COUNT(*), MIN(received_at) FROM submission WHERE state = 'pending'").fetchone()
+            acked = self._db.execute("SELECT COUNT(*) FROM submission WHERE state = 'acked'").fetchone()[0]
+            failed = self._db.execute("SELECT COUNT(*) FROM submission WHERE state = 'failed'").fetchone()[0]
+            last_seq = self._last_seq()
+        return {'pending': pending, 'oldest_pending_at': oldest, 'acked': acked, 'failed': failed, 'last_seq': last_seq}
+
+    def purge(self, retention_days=DEFAULT_RETENTION_DAYS):
+        """Supprime les accusés et abandons plus anciens que retention_days jours."""
+        before = time.time() - retention_days * 86400
+        return self._transaction(lambda: self._db.execute(
+            "DELETE FROM submission WHERE state IN ('acked', 'failed') AND acked_at < ?", (before,)).rowcount)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class Forwarder:
+    """Transfère les soumissions en file vers l'OBR, dans l'ordre, par lots."""
+
+    def __init__(self, store, client, obr_url, batch_size=DEFAULT_BATCH_SIZE, retention_days=DEFAULT_RETENTION_DAYS,
+                 max_attempts=DEFAULT_MAX_ATTEMPTS):
+        self.store = store
+        self.client = client
+        self.obr_url = obr_url.rstrip('/')
+        self.batch_size = batch_size
+        self.retention_days = retention_days
+        self.max_attempts = max_attempts
+        self.backoff = 0
+        self._stop = threading.Event()
+
+    def forward_once(self):
+        """Envoie le prochain lot ; retourne (accusés, abandons compris ; échecs de transport)."""
+        rows = self.store.pending(self.batch_size)
+        acked, failed = [], []
+        for chunk in self._chunks(rows):
+            payloads = [ebms_json.loads(row['body']) for row in chunk]
+            results = self.client.post_many(self.obr_url + chunk[0]['path'], payloads,
+                                            [row['trace_id'] for row in chunk],
+                                            [self._key(payload) for payload in payloads])
+            for row, result in zip(chunk, results):
+                if result.get('held'):
+                    # Facture d'origine refusée dans ce lot : l'avoir reste en file, sans compter d'essai.
+                    continue
+                if is_transient(result) and not is_unreachable(result) and row['attempts'] + 1 >= self.max_attempts:
+                    # L'OBR répond, mais toujours en erreur pour cette soumission : elle ne bloque plus la file.
+                    _logger.warning('Relais EBMS : soumission %s abandonnée après %s essais : %s',
+                                    row['id'], row['attempts'] + 1, result['msg'])
+                    acked.append((row['id'], result['status_code'], ebms_json.canonical_text({
+                        'success': False,
+                        'msg': 'Abandon par le relais après %s essais : %s' % (row['attempts'] + 1, result['msg']),
+                    }), 'failed'))
+                elif is_transient(result):
+                    failed.append((row['id'], result['msg']))
+                else:
+                    response = result['data'] if result['status_code'] == 200 else {'success': False, 'msg': result['msg']}
+                    acked.append((row['id'], result['status_code'], ebms_json.canonical_text(response)))
+            if failed:
+                # L'OBR ne répond plus : la suite du lot attend, pour garder l'ordre.
+                break
+        if acked or failed:
+            self.store.record(acked, failed)
+        return len(acked), len(failed)
+
+    @staticmethod
+    def _key(payload):
+        """Clé d'ordre d'une soumission (voir EBMSClient.post_many) : la facture d'origine pour un avoir."""
+        if isinstance(payload, dict):
+            return payload.get('cancelled_invoice_ref') or payload.get('invoice_identifier')
+        return None
+
+    @staticmethod
+    def _chunks(rows):
+        """
+        Découpe du lot : la première soumission part seule (si l'OBR ne répond pas, le reste du
+        lot n'est pas tenté), puis les soumissions consécutives vers un même endpoint ensemble.
+        """
+        chunks = [rows[:1]] if rows else []
+        for row in rows[1:]:
+            if len(chunks) > 1 and chunks[-1][0]['path'] == row['path']:
+                chunks[-1].append(row)
+            else:
+                chunks.append([row])
+        return chunks
+
+    def drain(self):
+        """Transfère tant qu'il reste des soumissions et que l'OBR répond ; retourne le nombre d'accusés."""
+        total = 0
+        while True:
+            acked, failed = self.forward_once()
+            total += acked
+            if failed or not acked:
+                return total
+
+    def run(self):
+        """Boucle du fil de transfert, jusqu'à stop()."""
+        last_purge = 0.0
+        while not self._stop.is_set():
+            try:
+                acked, failed = self.forward_once()
+            except Exception:
+                _logger.exception('Relais EBMS : transfert impossible.')
+                acked, failed = 0, 1
+            if failed:
+                self.backoff = min(BACKOFF_MAX, max(BACKOFF_MIN, self.backoff * 2))
+                _logger.warning('Relais EBMS : OBR injoignable, nouvel essai dans %s s.', self.backoff)
+                self._stop.wait(self.backoff)
+            elif not acked:
+                self.backoff = 0
+                self.store.received.wait(IDLE_WAIT)
+                self.store.received.clear()
+            else:
+                self.backoff = 0
+            if time.monotonic() - last_purge > PURGE_INTERVAL:
+                self.store.purge(self.retention_days)
+                last_purge = time.monotonic()
+
+    def stop(self):
+        self._stop.set()
+        self.store.received.set()
+
+
+class RelayHandler(BaseHTTPRequestHandler):
+    """Endpoints du relais : login local, soumissions (tout autre chemin), accusés et état."""
+
+    def log_message(self, format, *args):
+        _logger.debug('Relais EBMS %s - %s', self.address_string(), format % args)
+
+    def _reply(self, status, data):
+        body = data if isinstance(data, bytes) else ebms_json.canonical(data)
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _authorized(self):
+        return secrets.compare_digest(self.headers.get('Authorization') or '', 'Bearer %s' % self.server.token)
+
+    def do_GET(self):
+        if urlsplit(self.path).path != STATUS_PATH:
+            return self._reply(404, {'success': False, 'msg': 'Chemin inconnu.'})
+        if not self._authorized():
+            return self._reply(401, {'success': False, 'msg': 'Token invalide.'})
+        return self._reply(200, dict(self.server.store.stats(), success=True))
+
+    def do_POST(self):
+        path = urlsplit(self.path).path
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        try:
+            if self.headers.get('Content-Encoding') == 'gzip':
+                body = gzip.decompress(body)
+            data = json.loads(body or b'{}')
+        except (OSError, ValueError) as e:
+            return self._reply(400, {'success': False, 'msg': 'Corps illisible : %s' % e})
+        if path.rstrip('/').endswith('/login'):
+            return self._login(data)
+        if not self._authorized():
+            return self._reply(401, {'success': False, 'msg': 'Token invalide.'})
+        if path == ACKS_PATH:
+            return self._reply(200, {
+                'success': True,
+                'acks': self.server.store.acks(int(data.get('after') or 0), min(int(data.get('limit') or ACKS_LIMIT), ACKS_LIMIT)),
+            })
+        canonical = ebms_json.canonical(data)
+        identifier = data.get('invoice_identifier') or hashlib.sha1(canonical).hexdigest()
+        row = self.server.store.submit(path, identifier, canonical, self.headers.get(TRACE_HEADER))
+        if row['state'] == 'acked':
+            return self._reply(row['status'], row['response'].encode('utf-8'))
+        return self._reply(200, {
+            'success': True,
+            'relay': {'id': row['id'], 'state': row['state'], 'received_at': row['received_at']},
+            'msg': 'Soumission mise en file par le relais EBMS.',
+        })
+
+    def _login(self, data):
+        server = self.server
+        if not (secrets.compare_digest(str(data.get('username') or ''), server.username or '')
+                and secrets.compare_digest(str(data.get('password') or ''), server.password or '')):
+            return self._reply(200, {'success': False, 'msg': 'Identifiants invalides.'})
+        return self._reply(200, {'success': True, 'result': {'token': server.token}})
+
+
+class RelayServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # Plusieurs workers Odoo peuvent soumettre en même temps (5 par défaut : connexions refusées).
+    request_queue_size = 128
+
+    def __init__(self, address, store, username, password):
+        super().__init__(address, RelayHandler)
+        self.store = store
+        self.username = username
+        self.password = password
+        # Token du relais, renouvelé à chaque démarrage : Odoo se reconnecte sur le 401.
+        self.token = secrets.token_urlsafe(32)
+
+
+def build(store_path, listen, obr_url, username, password, login_path=LOGIN_PATH, max_workers=4,
+          batch_size=DEFAULT_BATCH_SIZE, retention_days=DEFAULT_RETENTION_DAYS, max_attempts=DEFAULT_MAX_ATTEMPTS):
+    """Assemble la file, le fil de transfert et le serveur HTTP du relais, sans les démarrer."""
+    store = RelayStore(store_path)
+    client = EBMSClient(max_workers=max_workers).configure(
+        login_url=obr_url.rstrip('/') + login_path, username=username, password=password)
+    forwarder = Forwarder(store, client, obr_url, batch_size=batch_size, retention_days=retention_days,
+                          max_attempts=max_attempts)
+    host, _sep, port = listen.rpartition(':')
+    server = RelayServer((host or '127.0.0.1', int(port)), store, username, password)
+    return store, forwarder, server
+
+
+def serve(*args, **kwargs):
+    """Démarre le relais et sert jusqu'à interruption."""
+    store, forwarder, server = build(*args, **kwargs)
+    thread = threading.Thread(target=forwarder.run, name='ebms-relay-forwarder', daemon=True)
+    thread.start()
+    _logger.info('Relais EBMS à l\'écoute sur %s:%s (file %s, %s en attente).',
+                 *server.server_address, store.path, store.stats()['pending'])
+    try:
+        server.serve_forever()
+    finally:
+        forwarder.stop()
+        thread.join(timeout=10)
+        server.server_close()
+        store.close()
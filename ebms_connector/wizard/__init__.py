@@ -0,0 +1,2 @@
+from . import ebms_cancel_wizard
+from . import ebms_audit_export_wizard
@@ -0,0 +1,52 @@
+# -*- coding: utf-8 -*-
+
+from odoo import fields, models, _
+from odoo.exceptions import UserError
+
+from ..models import ebms_audit_export
+
+
+class EBMSAuditExportWizard(models.TransientModel):
+    _name = 'ebms.audit.export.wizard'
+    _description = 'Export de la piste d\'audit EBMS'
+
+    date_from = fields.Date(string='Du', required=True)
+    date_to = fields.Date(string='Au', required=True)
+    company_ids = fields.Many2many(
+        'res.company', string='Sociétés', required=True,
+        default=lambda self: self.env.companies,
+    )
+    export_format = fields.Selection([
+        ('jsonl', 'JSON Lines'),
+        ('csv', 'CSV'),
+    ], string='Format', default='jsonl', required=True)
+    compress = fields.Boolean(string='Compresser (gzip)', default=True)
+    include_stock = fields.Boolean(string='Inclure les mouvements de stock', default=True)
+    include_errors = fields.Boolean(string='Inclure les envois en erreur', default=False)
+    attachment_id = fields.Many2one('ir.attachment', string='Fichier exporté', readonly=True)
+    line_count = fields.Integer(string='Lignes exportées', readonly=True)
+
+    def action_export(self):
+        self.ensure_one()
+        if self.date_from > self.date_to:
+            raise UserError(_('La date de début doit précéder la date de fin.'))
+        states = ('sent', 'cancelled', 'error') if self.include_errors else ('sent', 'cancelled')
+        extension = self.export_format + ('.gz' if self.compress else '')
+        name = 'ebms_audit_%s_%s.%s' % (self.date_from, self.date_to, extension)
+        attachment, count = ebms_audit_export.export_to_attachment(
+            self.env, name,
+            fmt=self.export_format,
+            compress=self.compress,
+            date_from=self.date_from,
+            date_to=self.date_to,
+            company_ids=self.company_ids.ids,
+            states=states,
+            include_stock=self.include_stock,
+        )
+        attachment.write({'res_model': self._name, 'res_id': self.id})
+        self.write({'attachment_id': attachment.id, 'line_count': count})
+        return {
+            'type': 'ir.actions.act_url',
+            'url': '/web/content/%s?download=true' % attachment.id,
+            'target': 'self',
+        }
@@ -0,0 +1,64 @@
+# -*- coding: utf-8 -*-
+
+from odoo import api, fields, models, _
+from odoo.exceptions import UserError
+
+
+class EBMSCancelWizard(models.TransientModel):
+    _name = 'ebms.cancel.wizard'
+    _description = 'Assistant d\'annulation EBMS en masse'
+
+    move_ids = fields.Many2many('account.move', string='Factures')
+    cn_motif = fields.Char(string='Motif d\'annulation (cn_motif)', required=True)
+    replace = fields.Boolean(
+        string='Créer des factures de remplacement',
+        default=True,
+        help="Crée pour chaque facture annulée une copie portant cancelled_invoice_ref.",
+    )
+    post_replacements = fields.Boolean(
+        string='Valider et envoyer les remplaçantes',
+        default=False,
+        help="Si décoché, les remplaçantes restent en brouillon pour correction avant envoi.",
+    )
+    reverse_original = fields.Boolean(
+        string='Extourner les factures originales',
+        default=True,
+        help="Crée l'avoir comptable d'extourne des factures annulées (non transmis à l'OBR).",
+    )
+
+    @api.model
+    def default_get(self, fields_list):
+        res = super().default_get(fields_list)
+        if self.env.context.get('active_model') == 'account.move' and self.env.context.get('active_ids'):
+            res['move_ids'] = [(6, 0, self.env.context['active_ids'])]
+        return res
+
+    def action_confirm(self):
+        self.ensure_one()
+        moves = self.move_ids.filtered(lambda m: m.ebms_status in ('sent', 'cancelled'))
+        if not moves:
+            raise UserError(_('Aucune facture envoyée ou annulée côté EBMS dans la sélection.'))
+        if self.replace:
+            cancelled, created, sent = moves._ebms_cancel_and_replace(
+                self.cn_motif,
+                reverse_original=self.reverse_original,
+                post_replacements=self.post_replacements,
+            )
+        else:
+            cancelled, created, sent = moves._ebms_cancel_batch(self.cn_motif), moves.browse(), moves.browse()
+        failed = moves.filtered(lambda m: m.ebms_status == 'sent')
+        message = _(
+            '%(cancelled)s annulée(s), %(created)s remplaçante(s) créée(s), %(sent)s envoyée(s), %(failed)s en erreur.',
+            cancelled=len(cancelled), created=len(created), sent=len(sent), failed=len(failed),
+        )
+        return {
+            'type': 'ir.actions.client',
+            'tag': 'display_notification',
+            'params': {
+                'title': _('Annulation EBMS en masse'),
+                'message': message,
+                'type': 'warning' if failed else 'success',
+                'sticky': bool(failed),
+                'next': {'type': 'ir.actions.act_window_close'},
+            }
+        }